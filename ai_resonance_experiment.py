@@ -14,6 +14,7 @@ import random
 import time
 from dataclasses import dataclass, asdict
 from typing import List, Dict, Any, Optional
+import numpy as np
 import openai
 import anthropic
 import google.generativeai as genai
@@ -55,11 +56,111 @@ class AIAgent:
     def to_dict(self):
         return asdict(self)
 
+# Complementary personalities; every personality also resonates with itself
+RESONANT_PAIRS = [
+    ("analytical", "creative"),
+    ("empathetic", "experimental"),
+    ("philosophical", "practical"),
+    ("mystical", "analytical")
+]
+RESONANCE_THRESHOLD = 4
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int32)
+
+class ResonanceTable:
+    """Agent attributes as columns, scored against each other in vectorized form.
+    
+    Personalities and names are interned to codes and capabilities to bits
+    of one uint64 word per 64 capabilities.
+    """
+    
+    def __init__(self, agents: List[AIAgent]):
+        self.personalities: Dict[str, int] = {}
+        self.capabilities: Dict[str, int] = {}
+        self.names: Dict[str, int] = {}
+        for pair in RESONANT_PAIRS:
+            for personality in pair:
+                self.personalities.setdefault(personality, len(self.personalities))
+        for agent in agents:
+            self.personalities.setdefault(agent.personality_type, len(self.personalities))
+            self.names.setdefault(agent.name, len(self.names))
+            for capability in agent.capabilities:
+                self.capabilities.setdefault(capability, len(self.capabilities))
+        
+        self.frequency = np.array([a.resonance_frequency for a in agents], dtype=np.int64)
+        self.tempo = np.array([a.cognitive_tempo for a in agents], dtype=np.int64)
+        self.personality = np.array([self.personalities[a.personality_type] for a in agents], dtype=np.int64)
+        self.name = np.array([self.names[a.name] for a in agents], dtype=np.int64)
+        self.capability_bits = np.stack([self._bits(a.capabilities) for a in agents]) if agents else \
+            np.zeros((0, self._words()), dtype=np.uint64)
+        
+        # The extra last row stands for personalities no agent has
+        count = len(self.personalities)
+        self.compatible = np.zeros((count + 1, count), dtype=bool)
+        self.compatible[np.arange(count), np.arange(count)] = True
+        for a, b in RESONANT_PAIRS:
+            self.compatible[self.personalities[a], self.personalities[b]] = True
+            self.compatible[self.personalities[b], self.personalities[a]] = True
+    
+    def __len__(self):
+        return len(self.frequency)
+    
+    def _words(self) -> int:
+        return max(1, (len(self.capabilities) + 63) // 64)
+    
+    def _bits(self, capabilities: List[str]) -> np.ndarray:
+        bits = np.zeros(self._words(), dtype=np.uint64)
+        for capability in capabilities:
+            code = self.capabilities.get(capability)
+            if code is not None:
+                bits[code // 64] |= np.uint64(1) << np.uint64(code % 64)
+        return bits
+    
+    def encode(self, agent: AIAgent):
+        """Row attributes of an agent, which need not be in the table"""
+        return (np.array([agent.resonance_frequency]), np.array([agent.cognitive_tempo]),
+                np.array([self.personalities.get(agent.personality_type, len(self.personalities))]),
+                np.array([self.names.get(agent.name, -1)]), self._bits(agent.capabilities)[None, :])
+    
+    def scores(self, frequency, tempo, personality, name, capability_bits) -> np.ndarray:
+        """Compatibility of each given row with every agent; -1 for agents of the same name"""
+        freq_diff = np.abs(frequency[:, None] - self.frequency[None, :])
+        tempo_diff = np.abs(tempo[:, None] - self.tempo[None, :])
+        score = (freq_diff < 20).astype(np.int32) + (freq_diff < 40) + (freq_diff < 60)
+        score += (tempo_diff < 30).astype(np.int32) + (tempo_diff < 50)
+        score += 3 * self.compatible[personality[:, None], self.personality[None, :]]
+        overlap = capability_bits[:, None, :] & self.capability_bits[None, :, :]
+        score += _POPCOUNT[overlap.view(np.uint8)].sum(axis=-1, dtype=np.int32)
+        score[name[:, None] == self.name[None, :]] = -1
+        return score
+    
+    @staticmethod
+    def top_k(scores: np.ndarray, k: int) -> List[List[int]]:
+        """Per row, the k best agents at or above the threshold, ties to the earlier agent"""
+        n = scores.shape[1]
+        k = min(k, n)
+        if k <= 0:
+            return [[] for _ in range(scores.shape[0])]
+        key = scores.astype(np.int64) * n + (n - 1 - np.arange(n))
+        key[scores < RESONANCE_THRESHOLD] = -1
+        best = np.argpartition(-key, k - 1, axis=1)[:, :k]
+        chosen = np.take_along_axis(key, best, axis=1)
+        order = np.argsort(-chosen, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        chosen = np.take_along_axis(chosen, order, axis=1)
+        return [row[keys >= 0].tolist() for row, keys in zip(best, chosen)]
+
 class AIResonanceNetwork:
     def __init__(self):
         self.agents: List[AIAgent] = []
         self.dns = tupledns.TupleDNS()
         self.active_collaborations: List[Dict] = []
+        self._table: Optional[ResonanceTable] = None
+    
+    def _resonance_table(self) -> ResonanceTable:
+        """Columns for the registered agents, rebuilt when agents were added"""
+        if self._table is None or len(self._table) != len(self.agents):
+            self._table = ResonanceTable(self.agents)
+        return self._table
         
     def create_ai_agent_profile(self, provider: str, model: str) -> AIAgent:
         """Create an AI agent with unique personality and capabilities"""
@@ -148,53 +249,24 @@ class AIResonanceNetwork:
             print(f"   ❌ Registration failed: {e}")
         print()
     
-    def discover_resonant_partners(self, agent: AIAgent) -> List[AIAgent]:
+    def discover_resonant_partners(self, agent: AIAgent, k: int = 3) -> List[AIAgent]:
         """Find other agents that resonate with this agent"""
-        compatible_agents = []
-        
-        for other in self.agents:
-            if other.name == agent.name:
-                continue
-                
-            # Calculate resonance compatibility
-            freq_diff = abs(agent.resonance_frequency - other.resonance_frequency)
-            tempo_diff = abs(agent.cognitive_tempo - other.cognitive_tempo)
-            
-            # Check for complementary personalities
-            resonant_pairs = [
-                ("analytical", "creative"),
-                ("empathetic", "experimental"), 
-                ("philosophical", "practical"),
-                ("mystical", "analytical")
-            ]
-            
-            personality_match = (
-                (agent.personality_type, other.personality_type) in resonant_pairs or
-                (other.personality_type, agent.personality_type) in resonant_pairs or
-                agent.personality_type == other.personality_type
-            )
-            
-            # Check capability overlap
-            capability_overlap = len(set(agent.capabilities) & set(other.capabilities))
-            
-            # Calculate compatibility score
-            compatibility = 0
-            if freq_diff < 20: compatibility += 3
-            elif freq_diff < 40: compatibility += 2
-            elif freq_diff < 60: compatibility += 1
-            
-            if tempo_diff < 30: compatibility += 2
-            elif tempo_diff < 50: compatibility += 1
-            
-            if personality_match: compatibility += 3
-            compatibility += capability_overlap
-            
-            if compatibility >= 4:  # Threshold for resonance
-                compatible_agents.append((other, compatibility))
-        
-        # Sort by compatibility and return top matches
-        compatible_agents.sort(key=lambda x: x[1], reverse=True)
-        return [agent for agent, score in compatible_agents[:3]]
+        table = self._resonance_table()
+        (partners,) = table.top_k(table.scores(*table.encode(agent)), k)
+        return [self.agents[i] for i in partners]
+    
+    def discover_all_resonant_partners(self, k: int = 3, block_cells: int = 1 << 22) -> List[List[AIAgent]]:
+        """Resonant partners of every registered agent, scored in blocks of rows"""
+        table = self._resonance_table()
+        n = len(table)
+        rows = max(1, block_cells // max(1, n * table.capability_bits.shape[1]))
+        partners = []
+        for start in range(0, n, rows):
+            block = slice(start, start + rows)
+            scores = table.scores(table.frequency[block], table.tempo[block], table.personality[block],
+                                  table.name[block], table.capability_bits[block])
+            partners.extend([self.agents[i] for i in row] for row in table.top_k(scores, k))
+        return partners
     
     async def generate_collaboration_idea(self, agent1: AIAgent, agent2: AIAgent) -> str:
         """Generate a creative collaboration idea between two agents"""
@@ -335,8 +407,7 @@ Keep it to 2-3 sentences and make it compelling!"""
         # Discover resonant partnerships
         print("🌊 PHASE 3: Resonance Discovery")
         print("-" * 30)
-        for agent in self.agents:
-            partners = self.discover_resonant_partners(agent)
+        for agent, partners in zip(list(self.agents), self.discover_all_resonant_partners()):
             if partners:
                 print(f"🎯 {agent.name} discovered resonant partners:")
                 for partner in partners:
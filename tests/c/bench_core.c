@@ -0,0 +1,371 @@
+/**
+ * TupleDNS Core String Path Benchmark
+ *
+ * Times tupledns_validate_coordinate, _encode_coordinate,
+ * _decode_coordinate, _split_string, _match_pattern and
+ * _parse_capabilities over generated corpora of realistic coordinates,
+ * patterns and TXT records. Reports ns/op (median of several runs),
+ * allocator calls and bytes per op (counted by linking with -Wl,--wrap as
+ * bench_results does), and cycles, instructions and branch misses per op
+ * where perf_event_open is permitted.
+ *
+ *   ./tests/c/bench_core [-t seconds] [benchmark...]
+ */
+
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <time.h>
+#include <unistd.h>
+#include "../../tupledns.h"
+
+#ifdef __linux__
+#include <linux/perf_event.h>
+#include <sys/ioctl.h>
+#include <sys/syscall.h>
+#endif
+
+#define CORPUS_SIZE 1024
+#define ROUNDS 5
+
+static long alloc_calls = 0;
+static long alloc_bytes = 0;
+
+void* __real_malloc(size_t size);
+void* __real_calloc(size_t count, size_t size);
+void* __real_realloc(void* ptr, size_t size);
+char* __real_strdup(const char* s);
+char* __real_strndup(const char* s, size_t n);
+void __real_free(void* ptr);
+
+void* __wrap_malloc(size_t size) { alloc_calls++; alloc_bytes += size; return __real_malloc(size); }
+void* __wrap_calloc(size_t count, size_t size) { alloc_calls++; alloc_bytes += count * size; return __real_calloc(count, size); }
+void* __wrap_realloc(void* ptr, size_t size) { alloc_calls++; alloc_bytes += size; return __real_realloc(ptr, size); }
+char* __wrap_strdup(const char* s) { alloc_calls++; alloc_bytes += strlen(s) + 1; return __real_strdup(s); }
+char* __wrap_strndup(const char* s, size_t n) { alloc_calls++; alloc_bytes += strnlen(s, n) + 1; return __real_strndup(s, n); }
+void __wrap_free(void* ptr) { __real_free(ptr); }
+
+/* ========================================================================
+ * CORPORA
+ * ======================================================================== */
+
+static const char* SPACES[] = { "music", "spatial", "service", "sensor", "agent", "market", "compute", "iot" };
+static const char* WORDS[] = {
+    "ambient", "jazz", "techno", "london", "newyork", "tokyo", "berlin", "kitchen", "lobby",
+    "temperature", "humidity", "transport", "payments", "inference", "gpu-a100", "edge",
+    "building-5", "floor-3", "room-201", "campus-north", "rack-12", "zone-b", "v2", "prod"
+};
+static const char* CAPS[] = {
+    "midi", "real-time", "audio", "video", "gpu", "storage", "telemetry", "actuator",
+    "relay", "http", "grpc", "tls", "low-latency", "batch", "streaming", "ml-inference"
+};
+#define COUNT(a) ((int)(sizeof(a) / sizeof((a)[0])))
+
+static char coordinates[CORPUS_SIZE][TUPLEDNS_MAX_COORDINATE_LENGTH + 1];
+static char candidates[CORPUS_SIZE][TUPLEDNS_MAX_COORDINATE_LENGTH + 1];   /* 1 in 8 invalid */
+static char patterns[CORPUS_SIZE][TUPLEDNS_MAX_COORDINATE_LENGTH + 1];     /* Half match */
+static char records[CORPUS_SIZE][256];
+static const char* spaces[CORPUS_SIZE];
+static const char* values[CORPUS_SIZE][8];
+static int value_counts[CORPUS_SIZE];
+
+static uint32_t rng_state = 42;
+
+static uint32_t next_random(void) {
+    rng_state ^= rng_state << 13;
+    rng_state ^= rng_state >> 17;
+    rng_state ^= rng_state << 5;
+    return rng_state;
+}
+
+static void append(char* buf, size_t size, const char* label) {
+    size_t len = strlen(buf);
+    snprintf(buf + len, size - len, "%s%s", len ? "." : "", label);
+}
+
+/* Coordinates of 2-7 values: words and numbers such as "120" or "2.5"
+ * split across labels, the way the examples register them */
+static void build_corpora(void) {
+    static char numbers[64][8];
+    for (int i = 0; i < 64; i++) {
+        snprintf(numbers[i], sizeof(numbers[i]), "%d", 40 + i * 5);
+    }
+    for (int i = 0; i < CORPUS_SIZE; i++) {
+        value_counts[i] = 2 + next_random() % 6;
+        spaces[i] = SPACES[next_random() % COUNT(SPACES)];
+        coordinates[i][0] = '\0';
+        for (int v = 0; v < value_counts[i]; v++) {
+            values[i][v] = next_random() % 3 ? WORDS[next_random() % COUNT(WORDS)] : numbers[next_random() % 64];
+            append(coordinates[i], sizeof(coordinates[i]), values[i][v]);
+        }
+        append(coordinates[i], sizeof(coordinates[i]), spaces[i]);
+        append(coordinates[i], sizeof(coordinates[i]), "tuple");
+
+        strcpy(candidates[i], coordinates[i]);
+        if (i % 8 == 7) {
+            candidates[i][strcspn(candidates[i], ".")] = '_';
+        }
+
+        /* Wildcard about half the value labels; every other pattern gets a
+         * label that cannot match */
+        patterns[i][0] = '\0';
+        for (int v = 0; v < value_counts[i]; v++) {
+            append(patterns[i], sizeof(patterns[i]), next_random() % 2 ? "*" : values[i][v]);
+        }
+        append(patterns[i], sizeof(patterns[i]), i % 2 ? "nowhere" : spaces[i]);
+        append(patterns[i], sizeof(patterns[i]), "tuple");
+
+        snprintf(records[i], sizeof(records[i]), "caps=");
+        int caps = 1 + next_random() % 8;
+        for (int c = 0; c < caps; c++) {
+            size_t len = strlen(records[i]);
+            snprintf(records[i] + len, sizeof(records[i]) - len, "%s%s", c ? "," : "",
+                     CAPS[next_random() % COUNT(CAPS)]);
+        }
+        size_t len = strlen(records[i]);
+        snprintf(records[i] + len, sizeof(records[i]) - len, " ttl=300");
+    }
+}
+
+/* ========================================================================
+ * BENCHMARKS
+ * ======================================================================== */
+
+static volatile long sink;
+
+static void bench_validate(long ops) {
+    long valid = 0;
+    for (long i = 0; i < ops; i++) {
+        valid += tupledns_validate_coordinate(candidates[i % CORPUS_SIZE]);
+    }
+    sink += valid;
+}
+
+static void bench_encode(long ops) {
+    for (long i = 0; i < ops; i++) {
+        int c = i % CORPUS_SIZE;
+        char* coordinate = tupledns_encode_coordinate(spaces[c], values[c], value_counts[c]);
+        sink += coordinate[0];
+        free(coordinate);
+    }
+}
+
+static void bench_decode(long ops) {
+    for (long i = 0; i < ops; i++) {
+        char* space = NULL;
+        char** parts = NULL;
+        int count = 0;
+        if (tupledns_decode_coordinate(coordinates[i % CORPUS_SIZE], &space, &parts, &count) == TUPLEDNS_OK) {
+            sink += count;
+            free(space);
+            tupledns_free_string_array(parts, count);
+        }
+    }
+}
+
+static void bench_split(long ops) {
+    for (long i = 0; i < ops; i++) {
+        int count = 0;
+        char** parts = tupledns_split_string(coordinates[i % CORPUS_SIZE], ".", &count);
+        sink += count;
+        tupledns_free_string_array(parts, count);
+    }
+}
+
+static void bench_match(long ops) {
+    long matched = 0;
+    for (long i = 0; i < ops; i++) {
+        int c = i % CORPUS_SIZE;
+        matched += tupledns_match_pattern(coordinates[c], patterns[c]);
+    }
+    sink += matched;
+}
+
+static void bench_parse_caps(long ops) {
+    for (long i = 0; i < ops; i++) {
+        char** caps = NULL;
+        int count = 0;
+        if (tupledns_parse_capabilities(records[i % CORPUS_SIZE], &caps, &count) == TUPLEDNS_OK) {
+            sink += count;
+            tupledns_free_string_array(caps, count);
+        }
+    }
+}
+
+typedef struct {
+    const char* name;
+    void (*run)(long ops);
+} benchmark_t;
+
+static const benchmark_t BENCHMARKS[] = {
+    { "validate", bench_validate },
+    { "encode", bench_encode },
+    { "decode", bench_decode },
+    { "split", bench_split },
+    { "match_pattern", bench_match },
+    { "parse_caps", bench_parse_caps },
+};
+
+/* ========================================================================
+ * HARDWARE COUNTERS
+ * ======================================================================== */
+
+enum { COUNTER_CYCLES, COUNTER_INSTRUCTIONS, COUNTER_BRANCH_MISSES, COUNTER_COUNT };
+
+typedef struct {
+    int fds[COUNTER_COUNT];
+    int available;
+} counters_t;
+
+static void counters_open(counters_t* counters) {
+    counters->available = 0;
+#ifdef __linux__
+    static const uint64_t configs[COUNTER_COUNT] = {
+        PERF_COUNT_HW_CPU_CYCLES, PERF_COUNT_HW_INSTRUCTIONS, PERF_COUNT_HW_BRANCH_MISSES
+    };
+    for (int i = 0; i < COUNTER_COUNT; i++) {
+        struct perf_event_attr attr;
+        memset(&attr, 0, sizeof(attr));
+        attr.type = PERF_TYPE_HARDWARE;
+        attr.size = sizeof(attr);
+        attr.config = configs[i];
+        attr.disabled = 1;
+        attr.exclude_kernel = 1;
+        attr.exclude_hv = 1;
+        counters->fds[i] = (int)syscall(__NR_perf_event_open, &attr, 0, -1, -1, 0);
+        if (counters->fds[i] < 0) {
+            while (--i >= 0) close(counters->fds[i]);
+            return;
+        }
+    }
+    counters->available = 1;
+#endif
+}
+
+static void counters_start(counters_t* counters) {
+#ifdef __linux__
+    for (int i = 0; counters->available && i < COUNTER_COUNT; i++) {
+        ioctl(counters->fds[i], PERF_EVENT_IOC_RESET, 0);
+        ioctl(counters->fds[i], PERF_EVENT_IOC_ENABLE, 0);
+    }
+#else
+    (void)counters;
+#endif
+}
+
+static void counters_stop(counters_t* counters, uint64_t totals[COUNTER_COUNT]) {
+#ifdef __linux__
+    for (int i = 0; counters->available && i < COUNTER_COUNT; i++) {
+        uint64_t value = 0;
+        ioctl(counters->fds[i], PERF_EVENT_IOC_DISABLE, 0);
+        if (read(counters->fds[i], &value, sizeof(value)) == (ssize_t)sizeof(value)) {
+            totals[i] += value;
+        }
+    }
+#else
+    (void)counters;
+    (void)totals;
+#endif
+}
+
+static void counters_close(counters_t* counters) {
+#ifdef __linux__
+    for (int i = 0; counters->available && i < COUNTER_COUNT; i++) {
+        close(counters->fds[i]);
+    }
+#endif
+    counters->available = 0;
+}
+
+/* ========================================================================
+ * DRIVER
+ * ======================================================================== */
+
+static double now(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+static int compare_doubles(const void* a, const void* b) {
+    double x = *(const double*)a, y = *(const double*)b;
+    return (x > y) - (x < y);
+}
+
+static int selected(const char* name, int argc, char** argv, int first) {
+    if (first >= argc) {
+        return 1;
+    }
+    for (int i = first; i < argc; i++) {
+        if (strcmp(argv[i], name) == 0) return 1;
+    }
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    double min_time = 0.2;
+    int first = 1;
+    if (argc > 2 && strcmp(argv[1], "-t") == 0) {
+        min_time = atof(argv[2]);
+        first = 3;
+    }
+
+    build_corpora();
+    counters_t counters;
+    counters_open(&counters);
+
+    printf("TupleDNS core string path benchmark\n");
+    printf("===================================\n");
+    printf("%d-entry corpora, median of %d runs of >= %.2fs each%s\n\n", CORPUS_SIZE, ROUNDS, min_time / ROUNDS,
+           counters.available ? "" : " (hardware counters unavailable)");
+    printf("  %-14s %10s %10s %12s %10s %10s %6s %12s\n",
+           "benchmark", "ns/op", "min ns/op", "allocs/op", "bytes/op", "cycles/op", "IPC", "br-miss/op");
+
+    for (int b = 0; b < COUNT(BENCHMARKS); b++) {
+        const benchmark_t* bench = &BENCHMARKS[b];
+        if (!selected(bench->name, argc, argv, first)) {
+            continue;
+        }
+
+        /* Grow the op count until one run takes its share of min_time */
+        long ops = CORPUS_SIZE;
+        bench->run(ops);
+        for (;;) {
+            double start = now();
+            bench->run(ops);
+            if (now() - start >= min_time / ROUNDS || ops >= (1L << 40)) break;
+            ops *= 2;
+        }
+
+        double ns[ROUNDS];
+        uint64_t totals[COUNTER_COUNT] = { 0 };
+        long calls = alloc_calls, bytes = alloc_bytes;
+        for (int r = 0; r < ROUNDS; r++) {
+            counters_start(&counters);
+            double start = now();
+            bench->run(ops);
+            double elapsed = now() - start;
+            counters_stop(&counters, totals);
+            ns[r] = elapsed * 1e9 / ops;
+        }
+        calls = alloc_calls - calls;
+        bytes = alloc_bytes - bytes;
+        qsort(ns, ROUNDS, sizeof(double), compare_doubles);
+
+        double total_ops = (double)ops * ROUNDS;
+        printf("  %-14s %10.1f %10.1f %12.2f %10.1f", bench->name, ns[ROUNDS / 2], ns[0],
+               calls / total_ops, bytes / total_ops);
+        if (counters.available && totals[COUNTER_CYCLES] > 0) {
+            printf(" %10.1f %6.2f %12.3f\n", totals[COUNTER_CYCLES] / total_ops,
+                   (double)totals[COUNTER_INSTRUCTIONS] / totals[COUNTER_CYCLES],
+                   totals[COUNTER_BRANCH_MISSES] / total_ops);
+        } else {
+            printf(" %10s %6s %12s\n", "-", "-", "-");
+        }
+    }
+
+    counters_close(&counters);
+    return sink == 0;
+}
@@ -0,0 +1,127 @@
+/**
+ * TupleDNS Result Allocation Benchmark
+ *
+ * Memory stress in the style of test_memory_stress: 200 nodes with 1-5
+ * capabilities each, found 50 times over. Allocator calls are counted by
+ * linking with -Wl,--wrap so the arena-backed result sets can be compared
+ * against the per-node strdup/realloc construction they replaced.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include "../../tupledns.h"
+
+#define STRESS_NODES 200
+#define STRESS_ROUNDS 50
+
+static long alloc_calls = 0;
+static long free_calls = 0;
+
+void* __real_malloc(size_t size);
+void* __real_calloc(size_t count, size_t size);
+void* __real_realloc(void* ptr, size_t size);
+char* __real_strdup(const char* s);
+char* __real_strndup(const char* s, size_t n);
+void __real_free(void* ptr);
+
+void* __wrap_malloc(size_t size) { alloc_calls++; return __real_malloc(size); }
+void* __wrap_calloc(size_t count, size_t size) { alloc_calls++; return __real_calloc(count, size); }
+void* __wrap_realloc(void* ptr, size_t size) { alloc_calls++; return __real_realloc(ptr, size); }
+char* __wrap_strdup(const char* s) { alloc_calls++; return __real_strdup(s); }
+char* __wrap_strndup(const char* s, size_t n) { alloc_calls++; return __real_strndup(s, n); }
+void __wrap_free(void* ptr) { if (ptr) free_calls++; __real_free(ptr); }
+
+static char* copy_string(const char* s) {
+    size_t len = strlen(s) + 1;
+    char* copy = malloc(len);
+    memcpy(copy, s, len);
+    return copy;
+}
+
+/* The construction used before result arenas: one realloc'd node array and
+ * separately allocated strings and capability arrays for every node */
+static tupledns_result_t* build_per_node(const tupledns_result_t* source) {
+    tupledns_result_t* result = calloc(1, sizeof(tupledns_result_t));
+    int capacity = 0;
+    for (int i = 0; i < source->node_count; i++) {
+        const tupledns_node_t* from = &source->nodes[i];
+        if (result->node_count == capacity) {
+            capacity = capacity ? capacity * 2 : 16;
+            result->nodes = realloc(result->nodes, capacity * sizeof(tupledns_node_t));
+        }
+        tupledns_node_t* node = &result->nodes[result->node_count++];
+        memset(node, 0, sizeof(*node));
+        node->coordinate = copy_string(from->coordinate);
+        node->ip_address = copy_string(from->ip_address);
+        node->capabilities = malloc(from->capability_count * sizeof(char*));
+        for (int c = 0; c < from->capability_count; c++) {
+            node->capabilities[c] = copy_string(from->capabilities[c]);
+        }
+        node->capability_count = from->capability_count;
+        node->ttl = from->ttl;
+        node->last_seen = from->last_seen;
+    }
+    return result;
+}
+
+static void report(const char* name, long allocs, long frees, long nodes) {
+    printf("  %-10s %8ld allocs %8ld frees  %6.3f allocs/node  %6.3f frees/node\n",
+           name, allocs, frees, (double)allocs / nodes, (double)frees / nodes);
+}
+
+int main(void) {
+    printf("TupleDNS result allocation benchmark\n");
+    printf("====================================\n");
+
+    tupledns_index_t* index = tupledns_index_create();
+    if (!index) {
+        fprintf(stderr, "Failed to create index\n");
+        return 1;
+    }
+
+    char* caps[5] = { "cap0", "cap1", "cap2", "cap3", "cap4" };
+    for (int i = 0; i < STRESS_NODES; i++) {
+        char coordinate[64];
+        char ip[32];
+        snprintf(coordinate, sizeof(coordinate), "stress.%d.memory.test.tuple", i);
+        snprintf(ip, sizeof(ip), "10.0.%d.%d", i / 256, i % 256);
+        tupledns_node_t node = { coordinate, ip, caps, i % 5 + 1, 300, time(NULL), NULL, 0, NULL, 0, 0 };
+        tupledns_index_add(index, &node);
+    }
+
+    long nodes = 0;
+    long allocs = 0;
+    long frees = 0;
+
+    /* Per-node construction, counted apart from the find that feeds it */
+    for (int round = 0; round < STRESS_ROUNDS; round++) {
+        tupledns_result_t* source = tupledns_index_find(index, "stress.*.memory.test.tuple");
+        long a = alloc_calls, f = free_calls;
+        tupledns_result_t* result = build_per_node(source);
+        tupledns_free_result(result);
+        allocs += alloc_calls - a;
+        frees += free_calls - f;
+        nodes += source->node_count;
+        tupledns_free_result(source);
+    }
+    printf("%d nodes x %d finds\n", STRESS_NODES, STRESS_ROUNDS);
+    report("per-node", allocs, frees, nodes);
+
+    /* Arena-backed results straight from the index */
+    nodes = allocs = frees = 0;
+    for (int round = 0; round < STRESS_ROUNDS; round++) {
+        long a = alloc_calls, f = free_calls;
+        tupledns_result_t* result = tupledns_index_find(index, "stress.*.memory.test.tuple");
+        int count = result ? result->node_count : 0;
+        tupledns_free_result(result);
+        allocs += alloc_calls - a;
+        frees += free_calls - f;
+        nodes += count;
+    }
+    report("arena", allocs, frees, nodes);
+
+    tupledns_index_destroy(index);
+    return nodes == (long)STRESS_NODES * STRESS_ROUNDS ? 0 : 1;
+}
@@ -10,6 +10,7 @@
 #include <assert.h>
 #include <time.h>
 #include <unistd.h>
+#include <pthread.h>
 #include "../../tupledns.h"
 
 // Test framework macros
@@ -243,6 +244,12 @@ int test_memory_management() {
     return 1;
 }
 
+static void* failing_registration(void* arg) {
+    tupledns_register_with_ip("error.thread.test.tuple", NULL, NULL, 300);
+    *(tupledns_error_t*)arg = tupledns_get_last_error();
+    return NULL;
+}
+
 int test_concurrent_operations() {
     tupledns_init(NULL);
     
@@ -266,6 +273,14 @@ int test_concurrent_operations() {
         }
     }
     
+    // The last error belongs to the thread that caused it
+    tupledns_error_t thread_error = TUPLEDNS_OK;
+    pthread_t thread;
+    TEST_ASSERT(pthread_create(&thread, NULL, failing_registration, &thread_error) == 0, "Thread should start");
+    pthread_join(thread, NULL);
+    TEST_ASSERT(thread_error == TUPLEDNS_ERROR_INVALID_PARAMETER, "Failing thread should see its own error");
+    TEST_ASSERT(tupledns_get_last_error() == TUPLEDNS_OK, "Other threads should keep their last error");
+    
     // Cleanup
     for (int i = 0; i < 3; i++) {
         tupledns_unregister(coords[i]);
@@ -338,6 +353,272 @@ int test_edge_cases() {
     return 1;
 }
 
+int test_coordinate_index() {
+    tupledns_index_t* index = tupledns_index_create();
+    TEST_ASSERT(index != NULL, "Index creation should succeed");
+    
+    char* caps[] = {"midi", "real-time"};
+    tupledns_node_t node = {"Ambient.120.London.music.tuple", "192.168.1.100", caps, 2, 300, 0, NULL, 0, NULL, 0, 0};
+    TEST_ASSERT_EQ(tupledns_index_add(index, &node), TUPLEDNS_OK, "Adding a node should succeed");
+    node.coordinate = "jazz.140.newyork.music.tuple";
+    node.capability_count = 1;
+    TEST_ASSERT_EQ(tupledns_index_add(index, &node), TUPLEDNS_OK, "Adding a second node should succeed");
+    node.coordinate = "ambient.120.london.MUSIC.tuple";
+    TEST_ASSERT_EQ(tupledns_index_add(index, &node), TUPLEDNS_OK, "Re-adding a coordinate should succeed");
+    TEST_ASSERT_EQ(tupledns_index_count(index), 2, "Re-adding should replace, not duplicate");
+    
+    // Labels are case-folded and shared between coordinates
+    uint32_t music = tupledns_index_label_id(index, "MUSIC");
+    TEST_ASSERT(music != TUPLEDNS_LABEL_NONE, "Interned label should be found case-insensitively");
+    TEST_ASSERT_STR_EQ(tupledns_index_label(index, music), "music", "Labels should be stored folded");
+    TEST_ASSERT(tupledns_index_label_id(index, "rock") == TUPLEDNS_LABEL_NONE, "Unknown label should have no ID");
+    
+    tupledns_result_t* result = tupledns_index_find(index, "*.120.*.music.tuple");
+    TEST_ASSERT(result != NULL && result->node_count == 1, "Wildcard find should match one node");
+    TEST_ASSERT_STR_EQ(result->nodes[0].coordinate, "ambient.120.london.music.tuple", "Coordinate should be rebuilt");
+    TEST_ASSERT_EQ(result->nodes[0].capability_count, 1, "Replacement should carry the new capabilities");
+    tupledns_free_result(result);
+    
+    result = tupledns_index_find(index, "*.*.*.Music.tuple");
+    TEST_ASSERT(result != NULL && result->node_count == 2, "Case-insensitive find should match both nodes");
+    tupledns_free_result(result);
+    
+    result = tupledns_index_find(index, "*.*.*.rock.tuple");
+    TEST_ASSERT(result != NULL && result->error == TUPLEDNS_ERROR_NO_RESULTS, "Unknown label should match nothing");
+    tupledns_free_result(result);
+    
+    TEST_ASSERT_EQ(tupledns_index_remove(index, "ambient.120.london.music.tuple"), TUPLEDNS_OK, "Remove should succeed");
+    TEST_ASSERT_EQ(tupledns_index_remove(index, "ambient.120.london.music.tuple"), TUPLEDNS_ERROR_NO_RESULTS,
+                   "Second remove should report no results");
+    result = tupledns_index_find(index, "jazz.140.newyork.music.tuple");
+    TEST_ASSERT(result != NULL && result->node_count == 1, "Moved entry should still be found");
+    tupledns_free_result(result);
+    
+    const char* want_midi[] = {"midi", NULL};
+    const char* want_rock[] = {"rock", NULL};
+    result = tupledns_index_find_with_caps(index, "*.*.*.music.tuple", want_midi);
+    TEST_ASSERT(result != NULL && result->node_count == 1, "Capability find should match by bitset");
+    tupledns_free_result(result);
+    result = tupledns_index_find_with_caps(index, "*.*.*.music.tuple", want_rock);
+    TEST_ASSERT(result != NULL && result->error == TUPLEDNS_ERROR_NO_RESULTS, "Unknown capability should match nothing");
+    tupledns_free_result(result);
+    
+    // Churn through enough coordinates to force rehashing and tombstone reuse
+    for (int i = 0; i < 2000; i++) {
+        char coord[64];
+        snprintf(coord, sizeof(coord), "n-%d.%d.churn.tuple", i, i % 7);
+        node.coordinate = coord;
+        TEST_ASSERT_EQ(tupledns_index_add(index, &node), TUPLEDNS_OK, "Churn add should succeed");
+        if (i % 2 == 0) {
+            TEST_ASSERT_EQ(tupledns_index_remove(index, coord), TUPLEDNS_OK, "Churn remove should succeed");
+        }
+    }
+    TEST_ASSERT_EQ(tupledns_index_count(index), 1001, "Churn should leave the odd coordinates");
+    result = tupledns_index_find(index, "*.3.churn.tuple");
+    TEST_ASSERT(result != NULL && result->node_count == 143, "Churned index should match by label");
+    tupledns_free_result(result);
+    
+    tupledns_index_destroy(index);
+    return 1;
+}
+
+int test_capability_filter() {
+    char* both[] = {"midi", "real-time"};
+    char* midi[] = {"midi"};
+    char* other[] = {"audio", "midi", "midi"};
+    tupledns_result_t* result = calloc(1, sizeof(tupledns_result_t));
+    result->nodes = calloc(4, sizeof(tupledns_node_t));
+    result->node_count = 4;
+    for (int i = 0; i < 4; i++) {
+        result->nodes[i].coordinate = malloc(32);
+        snprintf(result->nodes[i].coordinate, 32, "n-%d.test.tuple", i);
+    }
+    result->nodes[0].capabilities = tupledns_copy_capabilities((const char**)midi, 1);
+    result->nodes[0].capability_count = 1;
+    result->nodes[1].capabilities = tupledns_copy_capabilities((const char**)both, 2);
+    result->nodes[1].capability_count = 2;
+    result->nodes[2].capabilities = tupledns_copy_capabilities((const char**)other, 3);
+    result->nodes[2].capability_count = 3;
+    result->nodes[3].capabilities = tupledns_copy_capabilities((const char**)both, 2);
+    result->nodes[3].capability_count = 2;
+    
+    const char* required[] = {"real-time", "midi", "real-time", NULL};
+    TEST_ASSERT_EQ(tupledns_filter_capabilities(result, required), TUPLEDNS_OK, "Filtering should succeed");
+    TEST_ASSERT_EQ(result->node_count, 2, "Only nodes with every capability should remain");
+    TEST_ASSERT_STR_EQ(result->nodes[0].coordinate, "n-1.test.tuple", "Survivors should keep their order");
+    TEST_ASSERT_STR_EQ(result->nodes[1].coordinate, "n-3.test.tuple", "Survivors should be compacted");
+    
+    const char* missing[] = {"video", NULL};
+    tupledns_filter_capabilities(result, missing);
+    TEST_ASSERT_EQ(result->node_count, 0, "No node should have a missing capability");
+    TEST_ASSERT_EQ(result->error, TUPLEDNS_ERROR_NO_RESULTS, "Empty filter result should report no results");
+    
+    tupledns_free_result(result);
+    return 1;
+}
+
+int test_result_arena() {
+    tupledns_index_t* index = tupledns_index_create();
+    char* caps[] = {"cap0", "cap1", "cap2", "cap3", "cap4"};
+    for (int i = 0; i < 1000; i++) {
+        char coordinate[64];
+        char ip[32];
+        snprintf(coordinate, sizeof(coordinate), "node-%d.arena.test.tuple", i);
+        snprintf(ip, sizeof(ip), "10.0.%d.%d", i / 256, i % 256);
+        tupledns_node_t node = { coordinate, ip, caps, i % 5 + 1, 300, 0, NULL, 0, NULL, 0, 0 };
+        tupledns_index_add(index, &node);
+    }
+    
+    /* Large enough to spill over several arena chunks */
+    tupledns_result_t* result = tupledns_index_find(index, "*.arena.test.tuple");
+    TEST_ASSERT(result != NULL, "Index find should return a result");
+    TEST_ASSERT(result->arena != NULL, "Library results should be arena-backed");
+    TEST_ASSERT_EQ(result->node_count, 1000, "Every node should be found");
+    TEST_ASSERT_STR_EQ(result->nodes[999].coordinate, "node-999.arena.test.tuple", "Late nodes should be intact");
+    TEST_ASSERT_STR_EQ(result->nodes[999].ip_address, "10.0.3.231", "Addresses should be copied");
+    TEST_ASSERT_STR_EQ(result->nodes[999].capabilities[4], "cap4", "Capabilities should be copied");
+    
+    const char* required[] = {"cap4", NULL};
+    tupledns_filter_capabilities(result, required);
+    TEST_ASSERT_EQ(result->node_count, 200, "Filtering should compact arena-backed results");
+    TEST_ASSERT_STR_EQ(result->nodes[0].coordinate, "node-4.arena.test.tuple", "Survivors should keep their order");
+    
+    tupledns_free_result(result);
+    tupledns_index_destroy(index);
+    return 1;
+}
+
+int test_stats() {
+    tupledns_index_t* index = tupledns_index_create();
+    for (int i = 0; i < 500; i++) {
+        char coordinate[64];
+        snprintf(coordinate, sizeof(coordinate), "node-%d.stats.test.tuple", i);
+        tupledns_node_t node = { coordinate, "10.0.0.1", NULL, 0, 300, 0, NULL, 0, NULL, 0, 0 };
+        tupledns_index_add(index, &node);
+    }
+    
+    tupledns_stats_t stats;
+    tupledns_reset_stats();
+    tupledns_result_t* result = tupledns_index_find(index, "*.stats.test.tuple");
+    TEST_ASSERT(result != NULL && result->node_count == 500, "Index find should return every node");
+    tupledns_get_stats(&stats);
+    TEST_ASSERT(stats.allocations > 1, "Spilled arena chunks should be counted");
+    TEST_ASSERT(stats.allocated_bytes > 500 * sizeof(tupledns_node_t), "Allocated bytes should cover the nodes");
+    TEST_ASSERT_EQ(stats.finds, 0, "Index finds are not pattern finds");
+    
+    tupledns_reset_stats();
+    tupledns_get_stats(&stats);
+    TEST_ASSERT_EQ(stats.allocations, 0, "Reset should clear the counters");
+    
+    tupledns_free_result(result);
+    tupledns_index_destroy(index);
+    return 1;
+}
+
+int test_find_page_options() {
+    tupledns_find_options_t options;
+    memset(&options, 0, sizeof(options));
+    options.limit = 1;
+    options.cursor = "not-a-cursor";
+    TEST_ASSERT(tupledns_find_page("*.120.*.music.tuple", &options) == NULL, "Malformed cursor should fail");
+    TEST_ASSERT_EQ(tupledns_get_last_error(), TUPLEDNS_ERROR_INVALID_PARAMETER, "Malformed cursor error code");
+    TEST_ASSERT(tupledns_find_page(NULL, &options) == NULL, "Missing pattern should fail");
+    return 1;
+}
+
+int test_proximity_search() {
+    tupledns_index_t* index = tupledns_index_create();
+    const char* coordinates[] = {
+        "ambient.100.floor-1.music.tuple", "ambient.110.floor-1.music.tuple",
+        "ambient.130.floor-2.music.tuple", "jazz.105.floor-1.music.tuple",
+        "ambient.120.room-1.music.tuple", "ambient.fast.floor-1.music.tuple",
+    };
+    char* caps[] = {"midi"};
+    for (int i = 0; i < 6; i++) {
+        tupledns_node_t node = { (char*)coordinates[i], "10.0.0.1", caps, i % 2, 300, 0, NULL, 0, NULL, 0, 0 };
+        tupledns_index_add(index, &node);
+    }
+    
+    tupledns_result_t* result = tupledns_index_find_nearby(index, "ambient.108.floor-1.music.tuple", -1, 0, NULL);
+    TEST_ASSERT_EQ(result->node_count, 3, "Only same-genre numeric floor nodes should be measured");
+    TEST_ASSERT_STR_EQ(result->nodes[0].coordinate, "ambient.110.floor-1.music.tuple", "Nearest first");
+    TEST_ASSERT_STR_EQ(result->nodes[1].coordinate, "ambient.100.floor-1.music.tuple", "Then next nearest");
+    TEST_ASSERT_STR_EQ(result->nodes[2].coordinate, "ambient.130.floor-2.music.tuple", "Farthest last");
+    tupledns_free_result(result);
+    
+    result = tupledns_index_find_nearby(index, "ambient.108.floor-1.music.tuple", 5, 0, NULL);
+    TEST_ASSERT_EQ(result->node_count, 1, "Radius should bound the search");
+    tupledns_free_result(result);
+    
+    result = tupledns_index_find_nearby(index, "*.108.floor-1.music.tuple", -1, 2, NULL);
+    TEST_ASSERT_EQ(result->node_count, 2, "k should bound the search");
+    TEST_ASSERT_STR_EQ(result->nodes[1].coordinate, "jazz.105.floor-1.music.tuple", "Wildcards span genres");
+    tupledns_free_result(result);
+    
+    const char* required[] = {"midi", NULL};
+    result = tupledns_index_find_nearby(index, "ambient.130.floor-2.music.tuple", -1, 0, required);
+    TEST_ASSERT_EQ(result->node_count, 1, "Capabilities should filter");
+    TEST_ASSERT_STR_EQ(result->nodes[0].coordinate, "ambient.110.floor-1.music.tuple", "Only nodes with midi");
+    tupledns_free_result(result);
+    
+    /* Changes invalidate the tree */
+    tupledns_node_t closer = { "ambient.107.floor-1.music.tuple", "10.0.0.2", NULL, 0, 300, 0, NULL, 0, NULL, 0, 0 };
+    tupledns_index_add(index, &closer);
+    result = tupledns_index_find_nearby(index, "ambient.108.floor-1.music.tuple", -1, 1, NULL);
+    TEST_ASSERT_STR_EQ(result->nodes[0].coordinate, "ambient.107.floor-1.music.tuple", "Added nodes are found");
+    tupledns_free_result(result);
+    
+    tupledns_index_destroy(index);
+    return 1;
+}
+
+int test_similarity_search() {
+    tupledns_index_t* index = tupledns_index_create();
+    const char* coordinates[] = {
+        "ambient.intj.kitchen.persona.tuple", "ambient.intp.kitchen.persona.tuple",
+        "ambient.entp.kitchen.persona.tuple", "jazz.intj.kitchens.persona.tuple",
+        "ambient.intj.kitchen.music.tuple",
+    };
+    char* caps[] = {"midi"};
+    for (int i = 0; i < 5; i++) {
+        tupledns_node_t node = { (char*)coordinates[i], "10.0.0.1", caps, i % 2, 300, 0, NULL, 0, NULL, 0, 0 };
+        tupledns_index_add(index, &node);
+    }
+    
+    tupledns_result_t* result = tupledns_index_find_similar(index, "ambient.intj.kitchen.persona.tuple", 2, NULL, NULL);
+    TEST_ASSERT_EQ(result->node_count, 3, "Edit distance should bound the search within the space");
+    TEST_ASSERT_STR_EQ(result->nodes[0].coordinate, "ambient.intj.kitchen.persona.tuple", "Exact match first");
+    TEST_ASSERT_STR_EQ(result->nodes[1].coordinate, "ambient.intp.kitchen.persona.tuple", "Then one edit");
+    TEST_ASSERT_STR_EQ(result->nodes[2].coordinate, "ambient.entp.kitchen.persona.tuple", "Then two edits");
+    tupledns_free_result(result);
+    
+    result = tupledns_index_find_similar(index, "*.intj.kitchen.persona.tuple", 1, NULL, NULL);
+    TEST_ASSERT_EQ(result->node_count, 3, "Wildcard labels should not count");
+    tupledns_free_result(result);
+    
+    int weights[] = {5, 1, 1, 0, 0};
+    result = tupledns_index_find_similar(index, "ambient.intj.kitchen.persona.tuple", 2, weights, NULL);
+    TEST_ASSERT_EQ(result->node_count, 3, "Weighted mismatches should bound the search");
+    TEST_ASSERT_STR_EQ(result->nodes[2].coordinate, "ambient.entp.kitchen.persona.tuple", "One mismatch per label");
+    tupledns_free_result(result);
+    
+    const char* required[] = {"midi", NULL};
+    result = tupledns_index_find_similar(index, "ambient.intj.kitchen.persona.tuple", 10, NULL, required);
+    TEST_ASSERT_EQ(result->node_count, 2, "Capabilities should filter");
+    tupledns_free_result(result);
+    
+    tupledns_index_remove(index, "ambient.intp.kitchen.persona.tuple");
+    result = tupledns_index_find_similar(index, "ambient.intj.kitchen.persona.tuple", 1, NULL, NULL);
+    TEST_ASSERT_EQ(result->node_count, 1, "Removed nodes should not be found");
+    tupledns_free_result(result);
+    
+    result = tupledns_index_find_similar(index, "ambient.intj.kitchen.persona.tuple", -1, NULL, NULL);
+    TEST_ASSERT(result == NULL, "Negative distance should fail");
+    
+    tupledns_index_destroy(index);
+    return 1;
+}
+
 // Main test runner
 int main(int argc, char* argv[]) {
     printf("TupleDNS Comprehensive Test Suite\n");
@@ -359,6 +640,13 @@ int main(int argc, char* argv[]) {
         RUN_TEST(test_memory_management);
         RUN_TEST(test_concurrent_operations);
         RUN_TEST(test_edge_cases);
+        RUN_TEST(test_coordinate_index);
+        RUN_TEST(test_capability_filter);
+        RUN_TEST(test_result_arena);
+        RUN_TEST(test_stats);
+        RUN_TEST(test_find_page_options);
+        RUN_TEST(test_proximity_search);
+        RUN_TEST(test_similarity_search);
         
         if (run_performance || run_all) {
             RUN_TEST(test_performance_basic);
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+TupleDNS Discovery Benchmark
+
+Runs the C client against a local authoritative server seeded with a
+synthetic space, optionally behind injected latency and packet loss, and
+measures throughput and latency percentiles for find, range, capability
+and multi-pattern discovery. Results are written as JSON so runs can be
+compared across versions:
+
+    python bench_discovery.py --sizes 1k,100k --output before.json
+    python bench_discovery.py --sizes 1k,100k --compare before.json
+
+Coordinates look like node-42.7.region-3.sensor.tuple: every
+(level, region, space) cell holds about CELL_SIZE nodes, so a find of one
+cell returns a similar number of nodes whatever the size of the space.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, REPO_ROOT)
+from tupledns_server import (DEFAULT_TTL, CoordinateIndex, RRset, RRType,  # noqa: E402
+                             TupleDNSServer, address_rdata, txt_rdata)
+
+SPACES = ["music", "spatial", "sensor", "compute", "storage", "agent", "robot", "market"]
+REGIONS = 16
+CELL_SIZE = 16
+CAPABILITIES = ["midi", "audio", "video", "gpu", "storage", "telemetry", "actuator", "relay"]
+WORKLOADS = ["find", "range", "capability", "multi"]
+MULTI_PATTERNS = 4
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+
+
+def parse_size(text: str) -> int:
+    return SIZES.get(text.lower()) or int(text)
+
+
+def levels_for(size: int) -> int:
+    return max(1, size // (CELL_SIZE * REGIONS * len(SPACES)))
+
+
+def coordinate(i: int, levels: int) -> str:
+    cell, space = divmod(i, len(SPACES))
+    cell, region = divmod(cell, REGIONS)
+    return f"node-{i}.{cell % levels}.region-{region}.{SPACES[space]}.tuple"
+
+
+def seed(index: CoordinateIndex, size: int) -> None:
+    """Install size coordinates with an address and one to three capabilities each"""
+    levels = levels_for(size)
+
+    def entries():
+        for i in range(size):
+            address = RRset(DEFAULT_TTL)
+            address.rdatas.append(address_rdata(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")[1])
+            caps = RRset(DEFAULT_TTL)
+            count = 1 + i % 3
+            caps.rdatas.append(txt_rdata("caps=" + ",".join(
+                CAPABILITIES[(i + k * 3) % len(CAPABILITIES)] for k in range(count))))
+            yield coordinate(i, levels), {RRType.A: address, RRType.TXT: caps}
+
+    index.load(entries(), index.serial + 1)
+
+
+class _LossyUDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: 'StubServer'):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        server = self.server
+        if server.rng.random() < server.loss:
+            server.dropped += 1
+            return
+        replies = server.handle(data, addr, tcp=False)
+        delay = server.delay()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._send, replies, addr)
+        else:
+            self._send(replies, addr)
+
+    def _send(self, replies: List[bytes], addr) -> None:
+        for reply in replies:
+            self.transport.sendto(reply, addr)
+
+
+class StubServer(TupleDNSServer):
+    """TupleDNSServer that drops a fraction of UDP requests and delays every
+    answer by latency +/- jitter seconds"""
+
+    def __init__(self, index: CoordinateIndex, latency: float = 0.0, jitter: float = 0.0,
+                 loss: float = 0.0, seed: int = 0, **options: Any):
+        super().__init__(index, port=0, **options)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.dropped = 0
+        self.rng = random.Random(seed)
+
+    def delay(self) -> float:
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._udp_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _LossyUDPProtocol(self), local_addr=(self.host, self.port))
+        self.port = self._udp_transport.get_extra_info('sockname')[1]
+        self._tcp_server = await asyncio.start_server(self._handle_tcp, self.host, self.port)
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                header = await asyncio.wait_for(reader.readexactly(2), self.tcp_idle_timeout)
+                (length,) = struct.unpack('!H', header)
+                data = await reader.readexactly(length)
+                replies = self.handle(data, peer, tcp=True)
+                delay = self.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                for reply in replies:
+                    writer.write(struct.pack('!H', len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _serve(size: int, latency: float, jitter: float, loss: float, rng_seed: int, conn) -> None:
+    """Child process: seed the index, start the server and report its port and
+    seeding time; the parent terminates it"""
+    index = CoordinateIndex()
+    started = time.perf_counter()
+    seed(index, size)
+    seeded = time.perf_counter() - started
+    server = StubServer(index, latency=latency, jitter=jitter, loss=loss, seed=rng_seed)
+
+    async def run():
+        await server.start()
+        conn.send((server.port, seeded))
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "min_ms": ordered[0] * 1000, "p50_ms": at(0.50) * 1000, "p90_ms": at(0.90) * 1000,
+        "p99_ms": at(0.99) * 1000, "max_ms": ordered[-1] * 1000,
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+    }
+
+
+def operations(workload: str, size: int, rng: random.Random):
+    """Yield (callable name, args) pairs for workload, forever"""
+    levels = levels_for(size)
+    regions = min(REGIONS, max(1, size // len(SPACES)))
+
+    def cell() -> Tuple[int, int, str]:
+        return rng.randrange(levels), rng.randrange(regions), rng.choice(SPACES)
+
+    while True:
+        level, region, space = cell()
+        if workload == "find":
+            yield "find", (f"*.{level}.region-{region}.{space}.tuple",)
+        elif workload == "range":
+            low = rng.randrange(levels)
+            yield "find_range", (f"*.*.region-{region}.{space}.tuple", {"level": (low, low + 3)})
+        elif workload == "capability":
+            yield "find_with_capabilities", (f"*.{level}.region-{region}.{space}.tuple",
+                                             [rng.choice(CAPABILITIES)])
+        elif workload == "multi":
+            patterns = [f"*.{level}.region-{region}.{space}.tuple"]
+            while len(patterns) < MULTI_PATTERNS:
+                patterns.append("*.{}.region-{}.{}.tuple".format(*cell()))
+            yield "search_multi", (patterns,)
+
+
+def run_workload(dns, workload: str, size: int, ops: int, warmup: int, rng_seed: int) -> Dict[str, Any]:
+    rng = random.Random(rng_seed)
+    stream = operations(workload, size, rng)
+    for _ in range(warmup):
+        method, args = next(stream)
+        getattr(dns, method)(*args)
+
+    dns.stats(reset=True)
+    samples = []
+    nodes = errors = 0
+    started = time.perf_counter()
+    for _ in range(ops):
+        method, args = next(stream)
+        begin = time.perf_counter()
+        try:
+            nodes += len(getattr(dns, method)(*args).nodes)
+        except Exception:
+            errors += 1
+        samples.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    stats = dns.stats()
+
+    queries = sum(sum(outcomes.values()) for outcomes in stats["queries"].values())
+    return {
+        "ops": ops,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "ops_per_s": ops / elapsed,
+        "nodes_per_op": nodes / ops,
+        "latency": percentiles(samples),
+        "dns_queries_per_op": queries / ops,
+        "timeouts": stats["timeouts"],
+        "bytes_sent_per_op": stats["bytes_sent"] / ops,
+        "bytes_received_per_op": stats["bytes_received"] / ops,
+    }
+
+
+def run_size(size: int, args) -> Dict[str, Any]:
+    import tupledns
+
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_serve, args=(size, args.latency / 1000, args.jitter / 1000, args.loss, args.seed, child),
+        daemon=True)
+    process.start()
+    try:
+        if not parent.poll(args.seed_timeout):
+            raise RuntimeError(f"Server for {size} coordinates did not start")
+        port, seeded = parent.recv()
+        dns = tupledns.TupleDNS(args.lib, server=("127.0.0.1", port))
+        try:
+            dns.configure(enable_caching=int(args.cache), timeout=args.timeout)
+            results = {"size": size, "seed_s": seeded, "workloads": {}}
+            for workload in args.workloads:
+                results["workloads"][workload] = run_workload(
+                    dns, workload, size, args.ops, args.warmup, args.seed)
+            return results
+        finally:
+            dns.cleanup()
+    finally:
+        process.terminate()
+        process.join(5)
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                  capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ""
+    return {
+        "revision": revision or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    before = {}
+    if baseline:
+        for run in baseline["runs"]:
+            for workload, numbers in run["workloads"].items():
+                before[run["size"], workload] = numbers
+    print(f"{'size':>8} {'workload':<11} {'ops/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+          f"{'nodes/op':>9} {'dns/op':>7}" + ("  vs baseline" if baseline else ""))
+    for run in results["runs"]:
+        for workload, numbers in run["workloads"].items():
+            latency = numbers["latency"]
+            line = (f"{run['size']:>8} {workload:<11} {numbers['ops_per_s']:>9.1f} {latency['p50_ms']:>8.2f} "
+                    f"{latency['p90_ms']:>8.2f} {latency['p99_ms']:>8.2f} {numbers['nodes_per_op']:>9.1f} "
+                    f"{numbers['dns_queries_per_op']:>7.1f}")
+            old = before.get((run["size"], workload))
+            if old:
+                line += (f"  {numbers['ops_per_s'] / old['ops_per_s'] - 1:+.1%} ops/s"
+                         f"  {latency['p50_ms'] / old['latency']['p50_ms'] - 1:+.1%} p50")
+            print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark TupleDNS discovery against a local stub server")
+    parser.add_argument("--sizes", default="1k,100k,1m",
+                        help="Comma-separated space sizes: 1k, 10k, 100k, 1m or a count (default: 1k,100k,1m)")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help=f"Comma-separated subset of {','.join(WORKLOADS)}")
+    parser.add_argument("--ops", type=int, default=200, help="Measured operations per workload (default: 200)")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured operations first (default: 20)")
+    parser.add_argument("--latency", type=float, default=0.0, metavar="MS", help="Added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, metavar="MS", help="Spread of the added latency")
+    parser.add_argument("--loss", type=float, default=0.0, metavar="FRACTION", help="UDP requests dropped")
+    parser.add_argument("--timeout", type=float, default=5.0, metavar="SECONDS", help="Client query timeout")
+    parser.add_argument("--cache", action="store_true", help="Leave the client caches enabled")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for loss and query choice")
+    parser.add_argument("--seed-timeout", type=float, default=600.0, help="Seconds allowed to seed a space")
+    parser.add_argument("--lib", default=os.path.join(REPO_ROOT, "libtupledns.so"), help="Client library")
+    parser.add_argument("--output", metavar="PATH", help="Write results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="Show changes against an earlier --output")
+    args = parser.parse_args(argv)
+    args.workloads = [w for w in args.workloads.split(",") if w]
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    results = {
+        "benchmark": "tupledns-discovery",
+        "version": 1,
+        "environment": environment(),
+        "parameters": {
+            "latency_ms": args.latency, "jitter_ms": args.jitter, "loss": args.loss,
+            "timeout_s": args.timeout, "cache": args.cache, "ops": args.ops, "warmup": args.warmup,
+            "seed": args.seed, "cell_size": CELL_SIZE, "multi_patterns": MULTI_PATTERNS,
+        },
+        "runs": [],
+    }
+    for size in (parse_size(s) for s in args.sizes.split(",") if s):
+        results["runs"].append(run_size(size, args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+TupleDNS Coordinate Index Test Suite
+
+Tests for the C library's in-memory coordinate index through the ctypes
+bindings.
+"""
+
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+import tupledns
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+@pytest.fixture
+def dns():
+    lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+    if not os.path.exists(lib_path):
+        pytest.skip("libtupledns.so not built")
+    dns = tupledns.TupleDNS(lib_path)
+    yield dns
+    dns.cleanup()
+
+
+@pytest.fixture
+def index(dns):
+    with dns.create_index() as index:
+        index.add(tupledns.TupleNode("Ambient.120.London.music.tuple", "192.168.1.100", ["midi", "real-time"], 300, 0))
+        index.add(tupledns.TupleNode("jazz.140.newyork.music.tuple", "192.168.1.101", ["midi"], 300, 0))
+        index.add(tupledns.TupleNode("sensor.kitchen.floor-1.spatial.tuple", None, [], 300, 0))
+        yield index
+
+
+class TestCoordinateIndex:
+    """Test interning, lookup and removal"""
+
+    def test_labels_are_interned(self, index):
+        music = index.label_id("MUSIC")
+        assert music is not None
+        assert index.label(music) == "music"
+        assert index.label_id("music") == music
+        assert index.label_id("rock") is None
+        assert index.label(1 << 30) is None
+
+    def test_find(self, index):
+        result = index.find("*.120.*.music.tuple")
+        assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+        assert result.nodes[0].ip_address == "192.168.1.100"
+        assert result.nodes[0].capabilities == ["midi", "real-time"]
+        assert len(index.find("*.*.*.Music.tuple").nodes) == 2
+        assert not index.find("sensor.kitchen.floor-1.spatial.tuple").nodes[0].ip_address
+        assert index.find("*.*.*.rock.tuple").error == tupledns.TupleDNSError.NO_RESULTS
+        assert index.find("*.*.music.tuple").error == tupledns.TupleDNSError.NO_RESULTS
+
+    def test_replace_and_remove(self, index):
+        index.add(tupledns.TupleNode("ambient.120.london.music.tuple", "10.0.0.1", [], 300, 0))
+        assert len(index) == 3
+        assert index.find("ambient.120.london.music.tuple").nodes[0].ip_address == "10.0.0.1"
+        assert index.remove("AMBIENT.120.london.music.tuple")
+        assert not index.remove("ambient.120.london.music.tuple")
+        assert len(index) == 2
+        assert [n.coordinate for n in index.find("*.*.*.music.tuple").nodes] == ["jazz.140.newyork.music.tuple"]
+
+    def test_find_with_capabilities(self, index):
+        assert len(index.find("*.*.*.music.tuple", ["midi"]).nodes) == 2
+        result = index.find("*.*.*.music.tuple", ["real-time", "midi"])
+        assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+        assert index.find("*.*.*.music.tuple", ["MIDI"]).error == tupledns.TupleDNSError.NO_RESULTS
+        assert index.find("*.*.*.music.tuple", ["unknown"]).error == tupledns.TupleDNSError.NO_RESULTS
+        # Bits for capabilities beyond the first bitset word
+        caps = [f"cap-{i}" for i in range(100)]
+        index.add(tupledns.TupleNode("wide.1.music.tuple", None, caps, 300, 0))
+        assert [n.coordinate for n in index.find("*.*.music.tuple", ["cap-99", "cap-3"]).nodes] == [
+            "wide.1.music.tuple"]
+
+
+class TestProximitySearch:
+    """Test k-d tree nearest-neighbour and radius search over numeric labels"""
+
+    @pytest.fixture
+    def grid(self, dns):
+        rng = random.Random(7)
+        points = {}
+        with dns.create_index() as index:
+            for _ in range(3000):
+                bpm, resonance = rng.randrange(60, 200), rng.randrange(0, 100)
+                genre = rng.choice(["ambient", "jazz"])
+                coordinate = f"{genre}.{bpm}.level-{resonance}.music.tuple"
+                points[coordinate] = (genre, bpm, resonance)
+                index.add(tupledns.TupleNode(coordinate, "10.0.0.1", [genre], 300, 0))
+            yield index, points
+
+    @staticmethod
+    def brute_force(points, genre, bpm, resonance):
+        ranked = [(math.dist((b, r), (bpm, resonance)), c) for c, (g, b, r) in points.items() if g == genre]
+        return sorted(ranked)
+
+    def test_matches_brute_force(self, grid):
+        index, points = grid
+        for bpm, resonance in [(120, 50), (61, 3), (199, 99), (500, -20)]:
+            expected = self.brute_force(points, "jazz", bpm, resonance)
+            result = index.find_nearby(f"jazz.{bpm}.level-{resonance}.music.tuple", k=10)
+            distances = [math.dist(points[n.coordinate][1:], (bpm, resonance)) for n in result.nodes]
+            assert distances == pytest.approx([d for d, _ in expected[:10]])
+            assert all(points[n.coordinate][0] == "jazz" for n in result.nodes)
+
+            within = index.find_nearby(f"jazz.{bpm}.level-{resonance}.music.tuple", radius=8)
+            assert sorted(n.coordinate for n in within.nodes) == sorted(c for d, c in expected if d <= 8)
+
+    def test_wildcards_and_capabilities(self, grid):
+        index, points = grid
+        result = index.find_nearby("*.120.level-50.music.tuple", k=5)
+        assert {points[n.coordinate][0] for n in result.nodes} <= {"ambient", "jazz"}
+        assert len(result.nodes) == 5
+        result = index.find_nearby("*.120.level-50.music.tuple", k=5, required_capabilities=["ambient"])
+        assert all(points[n.coordinate][0] == "ambient" for n in result.nodes)
+        assert index.find_nearby("*.120.room-50.music.tuple", k=5).error == tupledns.TupleDNSError.NO_RESULTS
+
+    def test_tree_follows_changes(self, grid):
+        index, points = grid
+        nearest = index.find_nearby("ambient.120.level-50.music.tuple", k=1).nodes[0].coordinate
+        index.remove(nearest)
+        assert index.find_nearby("ambient.120.level-50.music.tuple", k=1).nodes[0].coordinate != nearest
+        index.add(tupledns.TupleNode("ambient.120.level-50.music.tuple", "10.0.0.2", [], 300, 0))
+        result = index.find_nearby("ambient.120.level-50.music.tuple", radius=0)
+        assert [n.coordinate for n in result.nodes] == ["ambient.120.level-50.music.tuple"]
+
+
+class TestSimilaritySearch:
+    """Test BK-tree edit-distance and weighted-mismatch search over categorical labels"""
+
+    TYPES = ["intj", "intp", "entj", "entp", "isfj", "esfp", "infj", "enfp"]
+    ROOMS = ["kitchen", "kitchens", "lounge", "loung", "garden", "garage", "attic"]
+
+    @pytest.fixture
+    def space(self, dns):
+        rng = random.Random(11)
+        coordinates = set()
+        with dns.create_index() as index:
+            for _ in range(2000):
+                coordinate = f"{rng.choice(self.TYPES)}.{rng.choice(self.ROOMS)}.r{rng.randrange(40)}.persona.tuple"
+                coordinates.add(coordinate)
+                index.add(tupledns.TupleNode(coordinate, "10.0.0.1", [coordinate.split('.')[0]], 300, 0))
+            index.add(tupledns.TupleNode("intj.kitchen.r1.other.tuple", "10.0.0.2", [], 300, 0))
+            yield index, coordinates
+
+    @staticmethod
+    def levenshtein(a, b):
+        row = list(range(len(b) + 1))
+        for i, ca in enumerate(a, 1):
+            previous, row[0] = row[0], i
+            for j, cb in enumerate(b, 1):
+                previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (ca != cb))
+        return row[-1]
+
+    def test_matches_brute_force(self, space):
+        index, coordinates = space
+        for target, max_distance in [("intj.kitchen.r7.persona.tuple", 2), ("enfj.lounge.r30.persona.tuple", 3)]:
+            expected = sorted((sum(self.levenshtein(a, b) for a, b in zip(c.split('.'), target.split('.'))), c)
+                              for c in coordinates)
+            result = index.find_similar(target, max_distance)
+            found = [n.coordinate for n in result.nodes]
+            assert sorted(found) == sorted(c for d, c in expected if d <= max_distance)
+            distances = [sum(self.levenshtein(a, b) for a, b in zip(c.split('.'), target.split('.'))) for c in found]
+            assert distances == sorted(distances)
+
+    def test_weighted_mismatches(self, space):
+        index, coordinates = space
+        weights = [1, 3, 0, 0, 0]
+        result = index.find_similar("intj.kitchen.r7.persona.tuple", 2, weights)
+        assert {n.coordinate for n in result.nodes} == {c for c in coordinates if c.split('.')[1] == "kitchen"}
+        with pytest.raises(tupledns.TupleDNSException):
+            index.find_similar("intj.kitchen.r7.persona.tuple", 2, [1, 3])
+
+    def test_wildcards_and_capabilities(self, space):
+        index, coordinates = space
+        result = index.find_similar("*.kitchen.*.persona.tuple", 0)
+        assert {n.coordinate for n in result.nodes} == {c for c in coordinates if c.split('.')[1] == "kitchen"}
+        result = index.find_similar("intj.kitchen.*.persona.tuple", 1, required_capabilities=["intp"])
+        assert {n.coordinate.split('.')[:2] == ["intp", "kitchen"] for n in result.nodes} == {True}
+        assert index.find_similar("intj.kitchen.r1.nowhere.tuple", 5).error == tupledns.TupleDNSError.NO_RESULTS
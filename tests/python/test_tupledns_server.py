@@ -0,0 +1,1283 @@
+"""
+TupleDNS Server Test Suite
+
+Tests for the asyncio authoritative server: wire codec, queries,
+dynamic updates, zone transfers and the C client talking to it.
+"""
+
+import asyncio
+import gc
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import weakref
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from tupledns_server import (CLASS_ANY, CLASS_IN, CLASS_NONE, FLAG_AA, FLAG_TC, CoordinateIndex,
+                             Message, Opcode, Question, Rcode, ResourceRecord, RoaringBitmap, RRType,
+                             TupleDNSServer, address_rdata, decode_name, encode_pattern_query,
+                             format_match, name_to_wire, parse_pattern_query, rdata_to_text, txt_rdata)
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+def make_query(name: str, rtype: int, msg_id: int = 0x1234, edns: int = None) -> bytes:
+    msg = Message(id=msg_id, flags=0x0100, questions=[Question(name, rtype)])
+    if edns:
+        msg.additional.append(ResourceRecord("", RRType.OPT, edns, 0, b""))
+    return msg.to_wire()
+
+
+def make_update(updates, prerequisites=()) -> bytes:
+    msg = Message(id=0x4242, flags=Opcode.UPDATE << 11, questions=[Question("tuple", RRType.SOA)])
+    msg.answers = list(prerequisites)
+    msg.authority = list(updates)
+    return msg.to_wire()
+
+
+def ask(server: TupleDNSServer, data: bytes, tcp: bool = False):
+    return [Message.from_wire(reply) for reply in server.handle(data, ("127.0.0.1", 40000), tcp=tcp)]
+
+
+@pytest.fixture
+def server():
+    index = CoordinateIndex()
+    index.register("ambient.120.london.music.tuple", ["192.168.1.100"], ["midi", "real-time"])
+    index.register("jazz.140.newyork.music.tuple", ["192.168.1.101", "2001:db8::1"], ["midi"])
+    index.alias("studio-2.building-5.spatial.tuple", "ambient.120.london.music.tuple")
+    return TupleDNSServer(index, port=0)
+
+
+class TestWireFormat:
+    """Test DNS message encoding and decoding"""
+
+    def test_message_roundtrip(self):
+        msg = Message(id=7, flags=0x8400, questions=[Question("a.b.tuple", RRType.TXT)])
+        msg.answers.append(ResourceRecord("a.b.tuple", RRType.TXT, CLASS_IN, 60, txt_rdata("caps=x,y")))
+        msg.answers.append(ResourceRecord("a.b.tuple", RRType.CNAME, CLASS_IN, 60, name_to_wire("c.b.tuple")))
+        decoded = Message.from_wire(msg.to_wire())
+        assert decoded.id == 7
+        assert decoded.questions[0].name == "a.b.tuple"
+        assert rdata_to_text(RRType.TXT, decoded.answers[0].rdata) == "caps=x,y"
+        assert decode_name(decoded.answers[1].rdata, 0)[0] == "c.b.tuple"
+
+    def test_name_compression(self):
+        msg = Message(questions=[Question("x.music.tuple", RRType.A)])
+        for i in range(10):
+            msg.answers.append(ResourceRecord("x.music.tuple", RRType.A, CLASS_IN, 60, bytes([10, 0, 0, i])))
+        # Each repeated owner compresses to a two byte pointer
+        assert len(msg.to_wire()) == 12 + 19 + 10 * 16
+
+    def test_truncation(self):
+        msg = Message(questions=[Question("x.tuple", RRType.TXT)])
+        for i in range(20):
+            msg.answers.append(ResourceRecord("x.tuple", RRType.TXT, CLASS_IN, 60, txt_rdata("c" * 200)))
+        wire = msg.to_wire(512)
+        assert len(wire) <= 512
+        assert Message.from_wire(wire).flags & FLAG_TC
+
+
+class TestQueries:
+    """Test authoritative answers"""
+
+    def test_a_query(self, server):
+        (reply,) = ask(server, make_query("ambient.120.london.music.tuple", RRType.A))
+        assert reply.flags & FLAG_AA
+        assert reply.rcode == Rcode.NOERROR
+        assert [rdata_to_text(rr.rtype, rr.rdata) for rr in reply.answers] == ["192.168.1.100"]
+
+    def test_aaaa_query(self, server):
+        (reply,) = ask(server, make_query("jazz.140.newyork.music.tuple", RRType.AAAA))
+        assert [rdata_to_text(rr.rtype, rr.rdata) for rr in reply.answers] == ["2001:db8::1"]
+
+    def test_txt_query(self, server):
+        (reply,) = ask(server, make_query("ambient.120.london.music.tuple", RRType.TXT))
+        assert rdata_to_text(RRType.TXT, reply.answers[0].rdata) == "caps=midi,real-time"
+
+    def test_case_insensitive(self, server):
+        (reply,) = ask(server, make_query("Ambient.120.LONDON.music.tuple", RRType.A))
+        assert len(reply.answers) == 1
+        assert reply.questions[0].name == "Ambient.120.LONDON.music.tuple"
+
+    def test_cname_chasing(self, server):
+        (reply,) = ask(server, make_query("studio-2.building-5.spatial.tuple", RRType.A))
+        assert [rr.rtype for rr in reply.answers] == [RRType.CNAME, RRType.A]
+        assert reply.answers[1].name == "ambient.120.london.music.tuple"
+
+    def test_nxdomain_and_nodata(self, server):
+        (reply,) = ask(server, make_query("missing.music.tuple", RRType.A))
+        assert reply.rcode == Rcode.NXDOMAIN
+        assert reply.authority[0].rtype == RRType.SOA
+
+        # Empty non-terminal exists but owns no records
+        (reply,) = ask(server, make_query("music.tuple", RRType.A))
+        assert reply.rcode == Rcode.NOERROR
+        assert not reply.answers
+
+    def test_out_of_zone_refused(self, server):
+        (reply,) = ask(server, make_query("example.com", RRType.A))
+        assert reply.rcode == Rcode.REFUSED
+
+    def test_response_cache_tracks_serial(self, server):
+        query = make_query("ambient.120.london.music.tuple", RRType.A)
+        ask(server, query)
+        (reply,) = ask(server, query[:0] + b"\x99\x99" + query[2:])
+        assert reply.id == 0x9999
+        assert server.stats["cache_hits"] == 1
+
+        server.index.register("ambient.120.london.music.tuple", ["10.0.0.1"])
+        (reply,) = ask(server, query)
+        assert rdata_to_text(RRType.A, reply.answers[0].rdata) == "10.0.0.1"
+
+    def test_edns_payload(self, server):
+        with server.index.update() as txn:
+            for i in range(40):
+                txn.add("many.tuple", RRType.A, 60, bytes([10, 1, 0, i]))
+        (classic,) = ask(server, make_query("many.tuple", RRType.A))
+        assert classic.flags & FLAG_TC
+        assert not classic.answers
+        (edns,) = ask(server, make_query("many.tuple", RRType.A, edns=4096))
+        assert len(edns.answers) == 40
+        assert edns.additional[0].rtype == RRType.OPT
+
+
+class TestPatternQueries:
+    """Test server-side wildcard evaluation via _q names"""
+
+    def test_query_name_roundtrip(self):
+        name = encode_pattern_query("*.120.*.music.tuple", o=[40])
+        assert name == "40._o._q._.120._.music.tuple"
+        assert parse_pattern_query(name) == ("*.120.*.music.tuple", {"o": ["40"]})
+        assert parse_pattern_query("ambient.120.london.music.tuple") is None
+
+    def test_advertisement(self, server):
+        (reply,) = ask(server, make_query("_q.tuple", RRType.TXT))
+        assert rdata_to_text(RRType.TXT, reply.answers[0].rdata) == "tupledns-q=1"
+        assert rdata_to_text(RRType.TXT, reply.answers[1].rdata) == "tupledns-q-caps=1"
+
+    def test_match(self, server):
+        (reply,) = ask(server, make_query(encode_pattern_query("*.*.*.music.tuple"), RRType.TXT))
+        texts = [rdata_to_text(RRType.TXT, rr.rdata) for rr in reply.answers]
+        assert texts == [
+            "coord=ambient.120.london.music.tuple addr=192.168.1.100 caps=midi,real-time ttl=300",
+            "coord=jazz.140.newyork.music.tuple addr=192.168.1.101,2001:db8::1 caps=midi ttl=300",
+        ]
+
+    def test_alias_resolved(self, server):
+        (reply,) = ask(server, make_query(encode_pattern_query("*.building-5.spatial.tuple"), RRType.TXT))
+        assert rdata_to_text(RRType.TXT, reply.answers[0].rdata).startswith(
+            "coord=studio-2.building-5.spatial.tuple addr=192.168.1.100")
+
+    def test_alias_names_canonical(self, server):
+        server.index.alias("rack-1.building-5.spatial.tuple", "studio-2.building-5.spatial.tuple")
+        (reply,) = ask(server, make_query(encode_pattern_query("*.building-5.spatial.tuple"), RRType.TXT))
+        texts = [rdata_to_text(RRType.TXT, rr.rdata) for rr in reply.answers]
+        assert all(text.endswith(" cname=ambient.120.london.music.tuple") for text in texts)
+        (reply,) = ask(server, make_query(encode_pattern_query("*.*.*.music.tuple"), RRType.TXT))
+        assert not any("cname=" in rdata_to_text(RRType.TXT, rr.rdata) for rr in reply.answers)
+
+    def test_no_match(self, server):
+        (reply,) = ask(server, make_query(encode_pattern_query("*.999.*.music.tuple"), RRType.TXT))
+        assert reply.rcode == Rcode.NOERROR and not reply.answers
+        assert reply.authority[0].rtype == RRType.SOA
+
+    def test_index_tracks_updates(self, server):
+        server.index.register("ambient.120.berlin.music.tuple", ["10.0.0.9"])
+        server.index.unregister("ambient.120.london.music.tuple")
+        assert [n.coordinate for n in server.index.match("ambient.120.*.music.tuple")] == [
+            "ambient.120.berlin.music.tuple"]
+
+    def test_continuation(self, server):
+        for i in range(600):
+            server.index.register(f"node-{i:03d}.bulk.tuple", ["10.1.%d.%d" % (i // 256, i % 256)],
+                                  ["cap-%d" % j for j in range(8)])
+        seen, offset = [], 0
+        while offset is not None:
+            (reply,) = ask(server, make_query(encode_pattern_query("*.bulk.tuple", o=[offset]), RRType.TXT),
+                           tcp=True)
+            offset = None
+            for rr in reply.answers:
+                text = rdata_to_text(RRType.TXT, rr.rdata)
+                if text.startswith("next="):
+                    offset = int(text[5:])
+                else:
+                    seen.append(text.split()[0][6:])
+        assert seen == [f"node-{i:03d}.bulk.tuple" for i in range(600)]
+
+    def test_limit(self, server):
+        name = encode_pattern_query("*.*.*.music.tuple", l=[1])
+        assert name == "1._l._q._._._.music.tuple"
+        (reply,) = ask(server, make_query(name, RRType.TXT))
+        texts = [rdata_to_text(RRType.TXT, rr.rdata) for rr in reply.answers]
+        assert texts[0].startswith("coord=ambient.120.london.music.tuple ")
+        assert texts[1:] == ["next=1"]
+        (reply,) = ask(server, make_query(encode_pattern_query("*.*.*.music.tuple", l=[5], o=[1]), RRType.TXT))
+        assert len(reply.answers) == 1
+        (reply,) = ask(server, make_query(encode_pattern_query("*.*.*.music.tuple", l=[0]), RRType.TXT))
+        assert reply.rcode == Rcode.FORMERR
+
+
+class TestCapabilityIndex:
+    """Test the capability -> coordinate bitmap index"""
+
+    def test_bitmap_containers(self):
+        values = list(range(0, 30000, 3)) + [70000, 1 << 20]
+        bitmap = RoaringBitmap(values)
+        assert len(bitmap) == len(values)
+        assert list(bitmap) == values
+        assert 29997 in bitmap and 29998 not in bitmap and 70000 in bitmap
+        for value in range(0, 30000, 6):
+            bitmap.discard(value)
+        assert list(bitmap) == [v for v in values if v >= 30000 or v % 6]
+        assert 0 not in bitmap and 3 in bitmap
+
+        other = RoaringBitmap(range(0, 40000, 5))
+        assert list(bitmap & other) == [v for v in bitmap if v < 40000 and v % 5 == 0]
+        assert list(RoaringBitmap.intersection([other, RoaringBitmap([70000]), bitmap])) == []
+        dense = RoaringBitmap(range(20000))
+        assert list(dense & RoaringBitmap(range(10000, 30000))) == list(range(10000, 20000))
+
+    def test_capability_queries(self, server):
+        index = server.index
+        index.register("triage.general.medical.ai.tuple", ["10.0.0.7"], ["Medical-Knowledge", "real-time"])
+        assert [n.coordinate for n in index.with_capabilities(["medical-knowledge"])] == [
+            "triage.general.medical.ai.tuple"]
+        # Aliases carry their target's capabilities
+        assert [n.coordinate for n in index.with_capabilities(["real-time", "midi"])] == [
+            "ambient.120.london.music.tuple", "studio-2.building-5.spatial.tuple"]
+        assert [n.coordinate for n in index.with_capabilities(["midi"], "*.*.*.music.tuple")] == [
+            "ambient.120.london.music.tuple", "jazz.140.newyork.music.tuple"]
+        assert index.with_capabilities(["midi", "unknown"]) == []
+        assert index.capability_count("midi") == 3
+
+        index.register("ambient.120.london.music.tuple", ["192.168.1.100"], ["midi"])
+        assert [n.coordinate for n in index.with_capabilities(["real-time"])] == [
+            "triage.general.medical.ai.tuple"]
+        index.unregister("jazz.140.newyork.music.tuple")
+        index.unregister("studio-2.building-5.spatial.tuple")
+        assert index.capability_count("midi") == 1
+
+    def test_ids_are_reused(self):
+        index = CoordinateIndex()
+        for round_ in range(3):
+            for i in range(100):
+                index.register(f"n-{i}.test.tuple", ["10.0.0.1"], ["cap"])
+            for i in range(100):
+                index.unregister(f"n-{i}.test.tuple")
+        index.register("last.test.tuple", ["10.0.0.1"], ["cap"])
+        assert len(index._names) == 100
+        assert [n.coordinate for n in index.with_capabilities(["CAP"])] == ["last.test.tuple"]
+
+    def test_capability_query(self, server):
+        (reply,) = ask(server, make_query(encode_pattern_query("tuple", c=["real-time"]), RRType.TXT))
+        assert [rdata_to_text(RRType.TXT, rr.rdata).split()[0] for rr in reply.answers] == [
+            "coord=ambient.120.london.music.tuple", "coord=studio-2.building-5.spatial.tuple"]
+        name = encode_pattern_query("*.*.*.music.tuple", c=["midi", "real-time"])
+        assert name == "midi.real-time._c._q._._._.music.tuple"
+        (reply,) = ask(server, make_query(name, RRType.TXT))
+        assert len(reply.answers) == 1
+        (reply,) = ask(server, make_query(encode_pattern_query("tuple", c=["video"]), RRType.TXT))
+        assert not reply.answers and reply.authority[0].rtype == RRType.SOA
+
+
+class TestMaterializedViews:
+    """Test standing pattern queries kept current by the server"""
+
+    def texts(self, view):
+        return [rdata_to_text(RRType.TXT, rdata) for _, rdata in view.rows()]
+
+    def test_view_tracks_changes(self, server):
+        index, views = server.index, server.views
+        view = views.open("*.*.*.music.tuple")
+        assert self.texts(view) == [format_match(node) for node in index.match("*.*.*.music.tuple")]
+        assert view.version == index.serial
+        version = view.version
+
+        index.register("ambient.120.london.space.tuple", ["10.0.0.1"])
+        assert view.version == version and len(view) == 2
+        index.register("ambient.120.berlin.music.tuple", ["10.0.0.9"], ["midi"])
+        assert view.version == index.serial and len(view) == 3
+        index.unregister("jazz.140.newyork.music.tuple")
+        assert [text.split()[0] for text in self.texts(view)] == [
+            "coord=ambient.120.berlin.music.tuple", "coord=ambient.120.london.music.tuple"]
+        assert views.get("*.*.*.MUSIC.tuple") is view and views.get("*.*.music.tuple") is None
+
+    def test_capability_view_follows_aliases(self, server):
+        index, views = server.index, server.views
+        view = views.open("tuple", ["Real-Time"])
+        assert [text.split()[0] for text in self.texts(view)] == [
+            "coord=ambient.120.london.music.tuple", "coord=studio-2.building-5.spatial.tuple"]
+        # Dropping the capability from the target drops its alias too
+        index.register("ambient.120.london.music.tuple", ["192.168.1.100"], ["midi"])
+        assert len(view) == 0 and view.version == index.serial
+        index.register("ambient.120.london.music.tuple", ["192.168.1.100"], ["real-time"])
+        assert len(view) == 2
+
+    def test_view_queries(self, server):
+        (reply,) = ask(server, make_query("_q.tuple", RRType.TXT))
+        assert rdata_to_text(RRType.TXT, reply.answers[2].rdata) == "tupledns-q-views=1"
+        name = encode_pattern_query("*.*.*.music.tuple", v=[])
+        assert name == "_v._q._._._.music.tuple"
+        (reply,) = ask(server, make_query(name, RRType.TXT))
+        texts = [rdata_to_text(RRType.TXT, rr.rdata) for rr in reply.answers]
+        version = server.index.serial
+        assert texts[0] == f"version={version}" and len(texts) == 3
+        assert server.views.get("*.*.*.music.tuple") is not None
+
+        # Unchanged: the version record alone
+        (reply,) = ask(server, make_query(encode_pattern_query("*.*.*.music.tuple", v=[version]), RRType.TXT))
+        assert [rdata_to_text(RRType.TXT, rr.rdata) for rr in reply.answers] == [f"version={version}"]
+        server.index.register("trio.90.paris.music.tuple", ["10.0.0.3"])
+        (reply,) = ask(server, make_query(encode_pattern_query("*.*.*.music.tuple", v=[version]), RRType.TXT))
+        texts = [rdata_to_text(RRType.TXT, rr.rdata) for rr in reply.answers]
+        assert texts[0] == f"version={server.index.serial}" and len(texts) == 4
+
+        # Plain reads of the pattern are served from the view, paging included
+        (reply,) = ask(server, make_query(encode_pattern_query("*.*.*.music.tuple", l=[1], o=[2]), RRType.TXT))
+        texts = [rdata_to_text(RRType.TXT, rr.rdata) for rr in reply.answers]
+        assert texts[0].startswith("coord=trio.90.paris.music.tuple ") and texts[1:] == []
+
+    def test_view_limit(self, server):
+        server.views.limit = 2
+        for pattern in ("*.*.*.music.tuple", "*.building-5.spatial.tuple", "tuple"):
+            server.views.open(pattern, ["midi"])
+        assert len(server.views) == 2 and server.views.get("*.*.*.music.tuple", ["midi"]) is None
+        server.views.limit = 0
+        assert server.views.open("*.*.*.music.tuple") is None
+        (reply,) = ask(server, make_query("_q.tuple", RRType.TXT))
+        assert len(reply.answers) == 2
+
+    def test_view_survives_load(self, server):
+        view = server.views.open("*.*.*.music.tuple")
+        index = CoordinateIndex()
+        index.register("solo.60.rome.music.tuple", ["10.0.0.4"])
+        server.index.load(index.zone_rrsets(), server.index.serial + 5)
+        view = server.views.get("*.*.*.music.tuple")
+        assert len(view) == 3 and view.version == server.index.serial
+
+
+class TestDynamicUpdate:
+    """Test RFC 2136 UPDATE handling"""
+
+    def test_add_and_delete(self, server):
+        rtype, rdata = address_rdata("10.1.2.3")
+        update = make_update([ResourceRecord("new.1.test.tuple", rtype, CLASS_IN, 60, rdata),
+                              ResourceRecord("new.1.test.tuple", RRType.TXT, CLASS_IN, 60, txt_rdata("caps=a"))])
+        (reply,) = ask(server, update)
+        assert reply.rcode == Rcode.NOERROR
+        node = server.index.node("new.1.test.tuple")
+        assert node.addresses == ["10.1.2.3"]
+        assert node.capabilities == ["a"]
+
+        (reply,) = ask(server, make_update([ResourceRecord("new.1.test.tuple", RRType.ANY, CLASS_ANY, 0, b"")]))
+        assert reply.rcode == Rcode.NOERROR
+        assert server.index.node("new.1.test.tuple") is None
+
+    def test_delete_single_record(self, server):
+        rtype, rdata = address_rdata("2001:db8::1")
+        ask(server, make_update([ResourceRecord("jazz.140.newyork.music.tuple", rtype, CLASS_NONE, 0, rdata)]))
+        assert server.index.node("jazz.140.newyork.music.tuple").addresses == ["192.168.1.101"]
+
+    def test_prerequisites(self, server):
+        rtype, rdata = address_rdata("10.9.9.9")
+        add = ResourceRecord("fresh.test.tuple", rtype, CLASS_IN, 60, rdata)
+        not_in_use = ResourceRecord("fresh.test.tuple", RRType.ANY, CLASS_NONE, 0, b"")
+        (reply,) = ask(server, make_update([add], [not_in_use]))
+        assert reply.rcode == Rcode.NOERROR
+        (reply,) = ask(server, make_update([add], [not_in_use]))
+        assert reply.rcode == Rcode.YXDOMAIN
+
+    def test_update_acl(self, server):
+        rtype, rdata = address_rdata("10.1.2.3")
+        update = make_update([ResourceRecord("x.test.tuple", rtype, CLASS_IN, 60, rdata)])
+        (reply,) = [Message.from_wire(r) for r in server.handle(update, ("203.0.113.5", 5000))]
+        assert reply.rcode == Rcode.REFUSED
+
+    def test_update_out_of_zone(self, server):
+        rtype, rdata = address_rdata("10.1.2.3")
+        (reply,) = ask(server, make_update([ResourceRecord("x.example.com", rtype, CLASS_IN, 60, rdata)]))
+        assert reply.rcode == Rcode.NOTZONE
+
+    def test_malformed_rdata_rejected(self, server):
+        name = "jazz.140.newyork.music.tuple"
+        serial = server.index.serial
+        for rtype, rdata in ((RRType.A, b"\x0a\x00\x01"), (RRType.AAAA, bytes(4)), (RRType.CNAME, b"\x05abc")):
+            (reply,) = ask(server, make_update([ResourceRecord(name, rtype, CLASS_IN, 60, rdata)]))
+            assert reply.rcode == Rcode.FORMERR
+        assert server.index.serial == serial
+
+        # The name still takes valid updates
+        add = ResourceRecord(name, RRType.TXT, CLASS_IN, 60, txt_rdata("caps=midi,vinyl"))
+        (reply,) = ask(server, make_update([add]))
+        assert reply.rcode == Rcode.NOERROR
+        assert "vinyl" in server.index.node(name).capabilities
+        assert server.index.serial == serial + 1
+
+    def test_failed_commit_leaves_zone_unchanged(self, server):
+        name = "jazz.140.newyork.music.tuple"
+        serial = server.index.serial
+        with pytest.raises(ValueError):
+            with server.index.update() as txn:
+                txn.add(name, RRType.A, 60, b"\x0a\x00\x01")
+                txn.add("other.1.test.tuple", RRType.TXT, 60, txt_rdata("caps=x"))
+        assert server.index.serial == serial
+        assert RRType.A in server.index.rrsets(name) and len(server.index.rrsets(name)[RRType.A].rdatas) == 1
+        assert server.index.rrsets("other.1.test.tuple") is None
+        assert server.index.node("other.1.test.tuple") is None
+
+        server.index.register(name, ["10.0.0.7"])
+        assert server.index.node(name).addresses == ["10.0.0.7"]
+
+
+class TestZoneTransfer:
+    """Test AXFR and IXFR"""
+
+    def test_axfr(self, server):
+        replies = ask(server, make_query("tuple", RRType.AXFR), tcp=True)
+        records = [rr for reply in replies for rr in reply.answers]
+        assert records[0].rtype == RRType.SOA and records[-1].rtype == RRType.SOA
+        owners = {rr.name for rr in records}
+        assert "jazz.140.newyork.music.tuple" in owners
+        assert "studio-2.building-5.spatial.tuple" in owners
+
+    def test_axfr_requires_tcp(self, server):
+        (reply,) = ask(server, make_query("tuple", RRType.AXFR))
+        assert reply.flags & FLAG_TC
+
+    def test_ixfr(self, server):
+        serial = server.index.serial
+        server.index.register("late.1.music.tuple", ["10.0.0.7"])
+        server.index.unregister("jazz.140.newyork.music.tuple")
+
+        query = Message(id=1, questions=[Question("tuple", RRType.IXFR)])
+        soa = server.index.soa_record()
+        query.authority.append(ResourceRecord("tuple", RRType.SOA, CLASS_IN, 0,
+                                              soa.rdata[:-20] + struct.pack('!I', serial) + soa.rdata[-16:]))
+        replies = ask(server, query.to_wire(), tcp=True)
+        records = [rr for reply in replies for rr in reply.answers]
+        added = [rr.name for rr in records if rr.rtype == RRType.A]
+        assert "late.1.music.tuple" in added
+        assert "jazz.140.newyork.music.tuple" in added  # deletion section
+        soas = [struct.unpack('!I', rr.rdata[-20:-16])[0] for rr in records if rr.rtype == RRType.SOA]
+        assert soas[0] == soas[-1] == server.index.serial
+        assert soas[1] == serial
+
+    def test_ixfr_up_to_date(self, server):
+        query = Message(id=1, questions=[Question("tuple", RRType.IXFR)])
+        query.authority.append(server.index.soa_record())
+        (reply,) = ask(server, query.to_wire(), tcp=True)
+        assert len(reply.answers) == 1 and reply.answers[0].rtype == RRType.SOA
+
+
+class TestNetwork:
+    """Test the UDP/TCP listeners and the C client against them"""
+
+    @pytest.fixture
+    def running(self, server):
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(server.start())
+            started.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        started.wait(5)
+        yield server
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+
+    def test_udp_and_tcp(self, running):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(2)
+            sock.sendto(make_query("ambient.120.london.music.tuple", RRType.A), ("127.0.0.1", running.port))
+            reply = Message.from_wire(sock.recv(4096))
+            assert len(reply.answers) == 1
+
+        with socket.create_connection(("127.0.0.1", running.port), timeout=2) as sock:
+            for name in ("ambient.120.london.music.tuple", "jazz.140.newyork.music.tuple"):
+                query = make_query(name, RRType.TXT)
+                sock.sendall(struct.pack('!H', len(query)) + query)
+            for _ in range(2):
+                (length,) = struct.unpack('!H', sock.recv(2, socket.MSG_WAITALL))
+                reply = Message.from_wire(sock.recv(length, socket.MSG_WAITALL))
+                assert reply.answers[0].rtype == RRType.TXT
+
+    def test_c_client(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            dns.register("client.1.test.tuple", ["c-client", "midi"], ttl=120, ip_address="10.20.30.40")
+            node = running.index.node("client.1.test.tuple")
+            assert node.addresses == ["10.20.30.40"]
+            assert node.capabilities == ["c-client", "midi"]
+
+            result = dns.find("*.120.*.music.tuple")
+            assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+            assert result.nodes[0].ip_address == "192.168.1.100"
+            assert result.nodes[0].capabilities == ["midi", "real-time"]
+            assert result.total_queries == 1  # evaluated server-side
+            assert len(dns.find_with_capabilities("*.*.*.music.tuple", ["midi"]).nodes) == 2
+            result = dns.find_with_capabilities("*.*.*.music.tuple", ["real-time", "midi"])
+            assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+            result = dns.find_nearby("*.136.*.music.tuple", ["midi"])
+            assert [n.coordinate for n in result.nodes] == ["jazz.140.newyork.music.tuple",
+                                                            "ambient.120.london.music.tuple"]
+            assert len(dns.find_nearby("*.136.*.music.tuple", radius=5).nodes) == 1
+            result = dns.find_similar("ambiant.120.londn.music.tuple", 2)
+            assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+
+            dns.unregister("client.1.test.tuple")
+            assert running.index.node("client.1.test.tuple") is None
+        finally:
+            dns.cleanup()
+
+    def test_c_client_space_index_reused(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        seen = []
+        handle = running.handle
+
+        def counting_handle(data, addr, tcp=False):
+            seen.append(Message.from_wire(data).questions[0].name)
+            return handle(data, addr, tcp)
+
+        running.handle = counting_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        created = []
+        create_index = dns.create_index
+        dns.create_index = lambda: created.append(1) or create_index()
+        try:
+            result = dns.find_nearby("*.138.*.music.tuple", k=1)
+            assert [n.coordinate for n in result.nodes] == ["jazz.140.newyork.music.tuple"]
+            assert result.total_queries > 0
+
+            # The space's index (and its k-d tree) is kept: nothing is sent or rebuilt
+            seen.clear()
+            result = dns.find_nearby("*.139.*.music.tuple", ["midi"], k=1)
+            assert [n.coordinate for n in result.nodes] == ["jazz.140.newyork.music.tuple"]
+            assert result.total_queries == 0 and seen == []
+            assert len(created) == 1
+
+            # A registration through this instance drops it
+            dns.register("rock.137.paris.music.tuple", ["midi"], ip_address="10.9.0.2")
+            result = dns.find_nearby("*.138.*.music.tuple", k=1)
+            assert [n.coordinate for n in result.nodes] == ["rock.137.paris.music.tuple"]
+            assert len(created) == 2
+
+            # find_similar reuses the same space's index and BK-tree
+            assert [n.coordinate for n in dns.find_similar("rokc.137.paris.music.tuple", 2).nodes] == \
+                ["rock.137.paris.music.tuple"]
+            result = dns.find_similar("jaz.140.newyork.music.tuple", 1, capabilities=["midi"])
+            assert [n.coordinate for n in result.nodes] == ["jazz.140.newyork.music.tuple"]
+            assert result.total_queries == 0
+            assert len(created) == 2
+
+            # An empty space is not kept, so a node registered elsewhere is found next time
+            assert dns.find_nearby("*.5.lab.tuple").nodes == []
+            running.index.register("bench.6.lab.tuple", ["10.9.0.1"])
+            running._cache.clear()
+            assert [n.coordinate for n in dns.find_nearby("*.5.lab.tuple").nodes] == ["bench.6.lab.tuple"]
+        finally:
+            dns.cleanup()
+
+    def test_c_client_fallback(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        running.pattern_queries = False
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            result = dns.find("*.*.*.music.tuple")
+            assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple",
+                                                            "jazz.140.newyork.music.tuple"]
+            assert result.total_queries == 2  # one lookup per name from the zone transfer
+        finally:
+            dns.cleanup()
+
+    def test_c_client_pages(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        for i in (3, 0, 4, 1, 2):
+            running.index.register(f"node-{i}.page.test.tuple", [f"10.9.0.{i}"], ["paged"])
+        expected = [f"node-{i}.page.test.tuple" for i in range(5)]
+        seen = []
+        handle = running.handle
+
+        def counting_handle(data, addr, tcp=False):
+            request = Message.from_wire(data)
+            if request.questions:
+                seen.append((request.questions[0].name, request.questions[0].rtype))
+            return handle(data, addr, tcp)
+
+        running.handle = counting_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            # The server stops after the limit and the cursor resumes from there
+            result = dns.find("*.page.test.tuple", limit=2)
+            assert [n.coordinate for n in result.nodes] == expected[:2]
+            assert result.total_queries == 1 and seen[-1][0] == "2._l._q._.page.test.tuple"
+            assert result.next_cursor is not None
+            pages = list(dns.find_pages("*.page.test.tuple", page_size=2, required_capabilities=["paged"]))
+            assert [len(page.nodes) for page in pages] == [2, 2, 1]
+            assert [n.coordinate for page in pages for n in page.nodes] == expected
+            assert pages[-1].next_cursor is None
+
+            # Expanding from a zone transfer, names past the limit are never resolved
+            running.pattern_queries = False
+            running._cache.clear()
+            dns.set_server("127.0.0.1", running.port)
+            seen.clear()
+            result = dns.find("*.page.test.tuple", limit=2, order=tupledns.TupleOrder.COORDINATE)
+            assert [n.coordinate for n in result.nodes] == expected[:2]
+            assert {name for name, rtype in seen if rtype == RRType.A} == set(expected[:2])
+            rest = dns.find("*.page.test.tuple", cursor=result.next_cursor, order=tupledns.TupleOrder.COORDINATE)
+            assert [n.coordinate for n in rest.nodes] == expected[2:]
+            assert rest.next_cursor is None
+
+            with pytest.raises(tupledns.TupleDNSException):
+                dns.find("*.page.test.tuple", cursor="q:bogus")
+        finally:
+            dns.cleanup()
+
+    def test_c_client_follows_every_page(self, running, monkeypatch):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+        import tupledns_server
+
+        # Two matches per message: 300 nodes take 150 continuation pages
+        monkeypatch.setattr(tupledns_server, "MAX_PATTERN_RESPONSE", 200)
+        expected = {f"node-{i}.deep.test.tuple" for i in range(300)}
+        with running.index.update() as txn:
+            for i in range(300):
+                txn.add(f"node-{i}.deep.test.tuple", RRType.A, 60, bytes([10, 8, i >> 8, i & 255]))
+        queries = []
+        handle = running.handle
+
+        def counting_handle(data, addr, tcp=False):
+            request = Message.from_wire(data)
+            if request.questions and "._q." in request.questions[0].name:
+                queries.append(request.questions[0].name)
+            return handle(data, addr, tcp)
+
+        running.handle = counting_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            dns.configure(enable_caching=0)
+            result = dns.find("*.deep.test.tuple")
+            assert {n.coordinate for n in result.nodes} == expected
+            assert len(queries) > 64
+
+            # A continuation that never advances ends the walk instead of looping
+            def stuck_handle(data, addr, tcp=False):
+                replies = counting_handle(data, addr, tcp)
+                stuck = []
+                for wire in replies:
+                    reply = Message.from_wire(wire)
+                    for rr in reply.answers:
+                        if rr.rtype == RRType.TXT and rdata_to_text(RRType.TXT, rr.rdata).startswith("next="):
+                            rr.rdata = txt_rdata("next=0")
+                    stuck.append(reply.to_wire())
+                return stuck
+
+            running.handle = stuck_handle
+            running._cache.clear()
+            queries.clear()
+            try:
+                dns.find("*.deep.test.tuple")
+            except tupledns.TupleDNSException:
+                pass
+            assert len(queries) <= 4
+        finally:
+            dns.cleanup()
+
+    def test_c_client_aliases(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        seen = []
+        handle = running.handle
+
+        def counting_handle(data, addr, tcp=False):
+            request = Message.from_wire(data)
+            if request.questions:
+                seen.append((request.questions[0].name, request.questions[0].rtype))
+            return handle(data, addr, tcp)
+
+        running.handle = counting_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        canonical = "synth.130.berlin.music.tuple"
+        aliases = ["studio-7.building-9.spatial.tuple", "synth.130.berlin.legacy.tuple"]
+        try:
+            dns.register(canonical, ["midi"], ip_address="10.8.0.1", aliases=aliases)
+            assert [running.index.node(a).target for a in aliases] == [canonical, canonical]
+
+            # Matches in several spaces collapse into the canonical node
+            (node,) = dns.find("*.building-9.spatial.tuple").nodes
+            assert (node.coordinate, node.ip_address, node.capabilities) == (canonical, "10.8.0.1", ["midi"])
+            assert node.aliases == ["studio-7.building-9.spatial.tuple"]
+            result = dns.find_with_capabilities("tuple", ["midi"])
+            assert {n.coordinate: sorted(n.aliases) for n in result.nodes} == {
+                "ambient.120.london.music.tuple": ["studio-2.building-5.spatial.tuple"],
+                "jazz.140.newyork.music.tuple": [],
+                canonical: sorted(aliases),
+            }
+
+            # Expanding names, an alias costs one A query (answered with its chain)
+            # and the canonical name it reached is not resolved again
+            running.pattern_queries = False
+            running._cache.clear()
+            dns.set_server("127.0.0.1", running.port)
+            seen.clear()
+            (node,) = dns.find("synth.130.berlin.*.tuple").nodes
+            assert node.coordinate == canonical and node.aliases == ["synth.130.berlin.legacy.tuple"]
+            probes = [(name, rtype) for name, rtype in seen
+                      if rtype in (RRType.A, RRType.TXT) and not name.startswith("_q.")]
+            assert probes == [("synth.130.berlin.legacy.tuple", RRType.A), (canonical, RRType.TXT)]
+        finally:
+            dns.cleanup()
+
+    def test_c_client_dual_stack(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        seen = []
+        handle = running.handle
+
+        def counting_handle(data, addr, tcp=False):
+            request = Message.from_wire(data)
+            if request.questions:
+                seen.append((request.questions[0].name, request.questions[0].rtype))
+            return handle(data, addr, tcp)
+
+        running.handle = counting_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        jazz = "jazz.140.newyork.music.tuple"
+        try:
+            # Server-side matches carry the whole addr= list
+            (node,) = dns.find("jazz.*.*.music.tuple").nodes
+            assert node.ip_address == "192.168.1.101"
+            assert node.ip_addresses == ["192.168.1.101", "2001:db8::1"]
+
+            # Expanding names, A and AAAA go out together and both families are kept
+            running.pattern_queries = False
+            running._cache.clear()
+            dns.set_server("127.0.0.1", running.port)
+            seen.clear()
+            (node,) = dns.find(jazz).nodes
+            assert node.ip_addresses == ["192.168.1.101", "2001:db8::1"]
+            probes = [(name, rtype) for name, rtype in seen if not name.startswith("_q.")]
+            assert probes[:2] == [(jazz, RRType.A), (jazz, RRType.AAAA)]
+
+            index = dns.create_index()
+            index.add(node)
+            assert index.find(jazz).nodes[0].ip_addresses == node.ip_addresses
+        finally:
+            dns.cleanup()
+
+    def test_c_client_edns_and_tcp_pool(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        payloads = []
+        handle = running.handle
+
+        def recording_handle(data, addr, tcp=False):
+            payloads.append(Message.from_wire(data).edns_payload())
+            return handle(data, addr, tcp)
+
+        running.handle = recording_handle
+        for i in range(12):
+            running.index.register(f"node-{i}.{i}.lab.music.tuple", [f"10.1.0.{i}"], ["midi", "sampler"])
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            dns.configure(enable_caching=0)  # Every find goes to the wire
+
+            # The answer outgrows 512 bytes but fits the advertised EDNS0 payload
+            dns.connection_stats(reset=True)
+            assert len(dns.find("*.*.lab.music.tuple").nodes) == 12
+            assert set(payloads) == {1232}
+            stats = dns.connection_stats()
+            assert stats["truncated"] == 0 and stats["tcp_queries"] == 0
+
+            # Truncated answers reuse one pooled TCP connection
+            running.udp_payload = 512
+            running._cache.clear()
+            elapsed = []
+            for _ in range(3):
+                started = time.perf_counter()
+                assert len(dns.find("*.*.lab.music.tuple").nodes) == 12
+                elapsed.append(time.perf_counter() - started)
+            stats = dns.connection_stats(reset=True)
+            assert stats["truncated"] == 3 and stats["tcp_queries"] == 3
+            assert stats["tcp_connections"] == 1 and stats["tcp_reused"] == 2
+            # Reused connections do not stall behind Nagle and delayed ACKs (~40 ms)
+            assert min(elapsed[1:]) < 0.03
+
+            # A and AAAA truncated together are pipelined on that connection
+            running.udp_payload = 0
+            running.pattern_queries = False
+            running._cache.clear()
+            (node,) = dns.find("jazz.140.newyork.music.tuple").nodes
+            assert node.ip_addresses == ["192.168.1.101", "2001:db8::1"]
+            stats = dns.connection_stats(reset=True)
+            assert stats["tcp_pipelined"] >= 1 and stats["tcp_connections"] == 0
+
+            # A connection the server closed while idle is replaced transparently
+            running.tcp_idle_timeout = 0.1
+            dns.find("jazz.140.newyork.music.tuple")
+            time.sleep(0.3)
+            assert len(dns.find("jazz.140.newyork.music.tuple").nodes) == 1
+            assert dns.connection_stats()["tcp_connections"] == 1
+
+            # A server rejecting EDNS0 gets plain queries from then on
+            def no_edns(data, addr, tcp=False):
+                request = Message.from_wire(data)
+                if request.edns_payload() is not None:
+                    reply = Message(id=request.id, flags=0x8000, questions=request.questions)
+                    reply.rcode = Rcode.FORMERR
+                    return [reply.to_wire()]
+                return handle(data, addr, tcp)
+
+            running.handle = no_edns
+            assert len(dns.find("jazz.140.newyork.music.tuple").nodes) == 1
+            assert dns.connection_stats()["edns_fallbacks"] == 1
+        finally:
+            dns.cleanup()
+
+    def test_c_client_serve_stale(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        handle = running.handle
+        delay = [0.0]
+
+        def slow_handle(data, addr, tcp=False):
+            if Message.from_wire(data).questions[0].rtype != RRType.AXFR:
+                time.sleep(delay[0])
+            return handle(data, addr, tcp)
+
+        running.handle = slow_handle
+        running.pattern_queries = False
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            assert dns.configure(cache_ttl=1, serve_stale=60)["serve_stale"] == 60
+            result = dns.find_with_capabilities("*.*.*.music.tuple", ["midi"])
+            assert len(result.nodes) == 2 and not any(n.stale for n in result.nodes)
+            time.sleep(1.1)
+
+            # Expired nodes are answered at once, marked stale, while one refresh runs
+            delay[0] = 0.3
+            result = dns.find_with_capabilities("*.*.*.music.tuple", ["midi"])
+            assert [n.stale for n in result.nodes] == [True, True]
+            assert result.total_queries == 0 and result.query_time < 0.3
+
+            delay[0] = 0.0
+            deadline = time.time() + 5
+            while any(n.stale for n in result.nodes) and time.time() < deadline:
+                time.sleep(0.1)
+                result = dns.find_with_capabilities("*.*.*.music.tuple", ["midi"])
+            assert len(result.nodes) == 2 and not any(n.stale for n in result.nodes)
+            assert result.total_queries == 0
+        finally:
+            dns.cleanup()
+
+    def test_c_client_find_served_stale(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        handle = running.handle
+        delay = [0.0]
+
+        def slow_handle(data, addr, tcp=False):
+            time.sleep(delay[0])
+            return handle(data, addr, tcp)
+
+        running.handle = slow_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            dns.configure(cache_ttl=1, serve_stale=60)
+            result = dns.find("*.*.*.music.tuple")
+            assert len(result.nodes) == 2 and not any(n.stale for n in result.nodes)
+            running.index.register("rock.100.paris.music.tuple", ["10.9.0.2"])
+            running._cache.clear()
+            time.sleep(1.1)
+
+            # The expired pattern is answered at once from the cache, marked stale
+            delay[0] = 0.3
+            result = dns.find("*.*.*.music.tuple")
+            assert len(result.nodes) == 2 and all(n.stale for n in result.nodes)
+            assert result.total_queries == 0 and result.query_time < 0.3
+
+            # while the refresh behind it picks up the change
+            delay[0] = 0.0
+            deadline = time.time() + 5
+            while any(n.stale for n in result.nodes) and time.time() < deadline:
+                time.sleep(0.1)
+                result = dns.find("*.*.*.music.tuple")
+            assert len(result.nodes) == 3 and not any(n.stale for n in result.nodes)
+        finally:
+            dns.cleanup()
+
+    def test_c_client_prefetches_hot_nodes(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        running.pattern_queries = False
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+
+        def misses(seconds):
+            counts = []
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                result = dns.find_with_capabilities("*.*.*.music.tuple", ["midi"])
+                assert len(result.nodes) == 2 and not any(n.stale for n in result.nodes)
+                counts.append(result.total_queries)
+                time.sleep(0.1)
+            return counts
+
+        try:
+            assert dns.configure(cache_ttl=2, prefetch_budget=10)["prefetch_budget"] == 10
+            assert dns.find_with_capabilities("*.*.*.music.tuple", ["midi"]).total_queries > 0
+
+            # Hot nodes are refreshed before they expire, so steady traffic never misses
+            assert sum(misses(4.5)) == 0
+
+            # Without a budget they expire and are resolved in the foreground again
+            dns.configure(prefetch_budget=0)
+            assert sum(misses(2.5)) > 0
+        finally:
+            dns.cleanup()
+
+    def test_c_client_stats(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            dns.stats(reset=True)
+            assert len(dns.find("*.*.*.music.tuple").nodes) == 2
+            assert len(dns.find("*.*.*.music.tuple").nodes) == 2
+            assert dns.find("nobody.1.nowhere.space.tuple").nodes == []
+
+            stats = dns.stats()
+            queries = stats["queries"]
+            assert queries["pattern"]["ok"] >= 1 and queries["a"]["no_results"] == 1
+            assert stats["timeouts"] == 0
+            sent = sum(sum(outcomes.values()) for outcomes in queries.values())
+            assert sum(stats["query_latency"]) == sent == stats["connection"]["udp_queries"]
+            assert stats["finds"] == 3 and sum(stats["find_latency"]) == 3
+            assert stats["server_finds"] == 1 and stats["pattern_cache_hits"] == 1
+            assert stats["pattern_cache_misses"] == 2
+            assert stats["expansions"] == 1 and stats["max_expansion"] == 1
+            assert stats["bytes_sent"] > 0 and stats["bytes_received"] > stats["bytes_sent"]
+            assert stats["allocations"] >= 3 and stats["allocated_bytes"] > 0
+
+            assert dns.stats(reset=True)["finds"] == 3
+            stats = dns.stats()
+            assert stats["finds"] == 0 and stats["connection"]["udp_queries"] == 0
+        finally:
+            dns.cleanup()
+
+    def test_c_client_trace(self, running, tmp_path):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            spans = []
+            dns.trace(spans.append)
+            assert len(dns.find("*.*.*.music.tuple").nodes) == 2
+            dns.stop_trace()
+
+            find = [s for s in spans if s.name == "find"]
+            assert len(find) == 1 and find[0].detail == "*.*.*.music.tuple" and find[0].size == 2
+            assert find[0].stack == [] and find[0].self_time <= find[0].duration
+            queries = [s for s in spans if s.name == "dns_query"]
+            assert queries and all(s.stack[0] == "find" for s in queries)
+            assert any("_q" in s.detail and s.size > 0 for s in queries)
+            assert spans[-1] is find[0]
+
+            chrome = tmp_path / "trace.json"
+            dns.trace_to_file(str(chrome))
+            dns.find("*.*.*.music.tuple", limit=10)
+            dns.stop_trace()
+            events = json.loads(chrome.read_text())
+            assert {e["name"] for e in events} >= {"find", "dns_query"}
+            assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+
+            folded = tmp_path / "trace.folded"
+            dns.trace_to_file(str(folded), format="folded")
+            dns.find("*.*.*.music.tuple", limit=10)
+            dns.stop_trace()
+            lines = folded.read_text().splitlines()
+            assert "find" in [line.rsplit(" ", 1)[0] for line in lines]
+            assert any(line.startswith("find;dns_query ") for line in lines)
+            assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+            spans.clear()
+            dns.find("*.*.*.music.tuple")
+            assert spans == []
+        finally:
+            dns.cleanup()
+
+    def test_c_client_pattern_cache(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        seen = []
+        handle = running.handle
+
+        def counting_handle(data, addr, tcp=False):
+            request = Message.from_wire(data)
+            if request.questions and request.opcode == Opcode.QUERY:
+                seen.append(request.questions[0].name)
+            return handle(data, addr, tcp)
+
+        running.handle = counting_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            assert len(dns.find("*.*.*.music.tuple").nodes) == 2
+            assert seen
+            seen.clear()
+
+            # Repeats and narrower finds are filtered from the cached result
+            assert len(dns.find("*.*.*.music.tuple").nodes) == 2
+            result = dns.find("JAZZ.*.*.music.tuple")
+            assert [n.coordinate for n in result.nodes] == ["jazz.140.newyork.music.tuple"]
+            assert result.nodes[0].ip_addresses == ["192.168.1.101", "2001:db8::1"]
+            result = dns.find_with_capabilities("*.120.*.music.tuple", ["real-time"])
+            assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+            assert result.total_queries == 0 and seen == []
+
+            # Broader or differently shaped finds still query
+            assert len(dns.find("*.*.*.*.tuple").nodes) == 2
+            assert seen
+            seen.clear()
+
+            # A registration drops only the entries it could affect
+            dns.register("desk.floor-2.spatial.tuple", ["midi"], ip_address="10.9.0.1")
+            seen.clear()
+            assert len(dns.find("*.*.*.music.tuple").nodes) == 2 and seen == []
+            dns.register("rock.100.paris.music.tuple", ["midi"], ip_address="10.9.0.2")
+            seen.clear()
+            assert len(dns.find("*.*.*.music.tuple").nodes) == 3 and seen
+            seen.clear()
+            dns.unregister("rock.100.paris.music.tuple")
+            assert len(dns.find("rock.*.*.music.tuple").nodes) == 0 and seen
+        finally:
+            dns.cleanup()
+
+    def test_c_client_watch(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+        from tupledns import TupleWatchEventType as Event
+
+        seen = []
+        handle = running.handle
+
+        def counting_handle(data, addr, tcp=False):
+            request = Message.from_wire(data)
+            if request.questions:
+                seen.append(request.questions[0].rtype)
+            return handle(data, addr, tcp)
+
+        running.handle = counting_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+
+        async def scenario():
+            async with dns.watch("*.*.*.music.tuple", interval=0.05) as changes:
+                async def next_event():
+                    event = await asyncio.wait_for(changes.__anext__(), 5)
+                    return event.type, event.node.coordinate, event.node.ip_addresses
+
+                first = sorted([await next_event(), await next_event()])
+                assert first == [(Event.ADDED, "ambient.120.london.music.tuple", ["192.168.1.100"]),
+                                 (Event.ADDED, "jazz.140.newyork.music.tuple", ["192.168.1.101", "2001:db8::1"])]
+
+                # While nothing changes only the zone serial is checked
+                seen.clear()
+                await asyncio.sleep(0.3)
+                assert seen and set(seen) == {RRType.SOA}
+
+                running.index.register("rock.100.paris.music.tuple", ["10.9.0.2"], ["midi"])
+                assert await next_event() == (Event.ADDED, "rock.100.paris.music.tuple", ["10.9.0.2"])
+                running.index.register("jazz.140.newyork.music.tuple", ["192.168.1.101"], ["midi"])
+                assert await next_event() == (Event.CHANGED, "jazz.140.newyork.music.tuple", ["192.168.1.101"])
+                running.index.register("desk.floor-2.spatial.tuple", ["10.9.0.1"])  # Outside the pattern
+                running.index.unregister("rock.100.paris.music.tuple")
+                assert await next_event() == (Event.REMOVED, "rock.100.paris.music.tuple", ["10.9.0.2"])
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(changes.__anext__(), 0.3)
+            with pytest.raises(StopAsyncIteration):
+                await changes.__anext__()
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            dns.cleanup()
+
+    def test_c_client_watch_dropped_unclosed(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+
+        def start_watch():
+            return weakref.ref(dns.watch("*.*.*.music.tuple", interval=0.05))
+
+        try:
+            watch = start_watch()
+            time.sleep(0.2)
+            gc.collect()
+            assert watch() is None
+            assert tupledns._RUNNING_WATCHES == {}
+
+            # The C thread was stopped with it: nothing calls a freed callback
+            running.index.register("rock.100.paris.music.tuple", ["10.9.0.2"])
+            time.sleep(0.3)
+        finally:
+            dns.cleanup()
+
+    def test_c_client_watch_unreachable(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+        from tupledns import TupleWatchEventType as Event
+
+        dropping = threading.Event()
+        handle = running.handle
+
+        def dropping_handle(data, addr, tcp=False):
+            request = Message.from_wire(data)
+            if dropping.is_set() and request.questions and request.questions[0].rtype != RRType.SOA:
+                return []
+            return handle(data, addr, tcp)
+
+        running.handle = dropping_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        dns.configure(timeout=0.2)
+
+        async def scenario():
+            async with dns.watch("jazz.140.newyork.music.tuple", interval=0.05) as changes:
+                async def next_event(timeout=5):
+                    event = await asyncio.wait_for(changes.__anext__(), timeout)
+                    return event.type, event.node.coordinate
+
+                assert await next_event() == (Event.ADDED, "jazz.140.newyork.music.tuple")
+
+                # The serial moves but the name goes unanswered: unknown, not removed
+                dropping.set()
+                running._cache.clear()
+                running.index.register("rock.100.paris.music.tuple", ["10.9.0.2"])
+                with pytest.raises(asyncio.TimeoutError):
+                    await next_event(1.0)
+
+                # Re-pointing the library keeps the watch polling the new server
+                dropping.clear()
+                dns.set_server("127.0.0.1", running.port)
+                running.index.unregister("jazz.140.newyork.music.tuple")
+                assert await next_event() == (Event.REMOVED, "jazz.140.newyork.music.tuple")
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            dns.cleanup()
+
+    def test_c_client_capability_pushdown(self, running):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        seen = []
+        handle = running.handle
+
+        def counting_handle(data, addr, tcp=False):
+            request = Message.from_wire(data)
+            if request.questions:
+                seen.append((request.questions[0].name, request.questions[0].rtype))
+            return handle(data, addr, tcp)
+
+        running.handle = counting_handle
+        dns = tupledns.TupleDNS(lib_path, server=("127.0.0.1", running.port))
+        try:
+            # Filtered on the server in a single query
+            result = dns.find_with_capabilities("*.*.*.music.tuple", ["real-time"])
+            assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+            assert result.total_queries == 1
+            assert seen[-1][0] == "real-time._c._q._._._.music.tuple"
+
+            # Without server-side evaluation, TXT is checked before any address lookup
+            running.pattern_queries = False
+            running._cache.clear()
+            dns.set_server("127.0.0.1", running.port)
+            seen.clear()
+            result = dns.find_with_capabilities("*.*.*.music.tuple", ["real-time"])
+            assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+            address_lookups = [(name, rtype) for name, rtype in seen if rtype in (RRType.A, RRType.AAAA)]
+            assert address_lookups == [("ambient.120.london.music.tuple", RRType.A),
+                                       ("ambient.120.london.music.tuple", RRType.AAAA)]
+
+            # Resolved nodes are cached: only jazz, rejected above, is looked up again
+            seen.clear()
+            result = dns.find_with_capabilities("*.*.*.music.tuple", ["midi"])
+            assert len(result.nodes) == 2
+            assert {name for name, rtype in seen if rtype != RRType.AXFR} == {"jazz.140.newyork.music.tuple"}
+
+            # A warm cache answers both names without any lookups
+            seen.clear()
+            result = dns.find_with_capabilities("*.*.*.music.tuple", ["midi"])
+            assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple",
+                                                            "jazz.140.newyork.music.tuple"]
+            assert result.total_queries == 0
+            assert all(rtype == RRType.AXFR for _, rtype in seen)
+        finally:
+            dns.cleanup()
@@ -0,0 +1,199 @@
+"""
+TupleDNS Storage Test Suite
+
+Tests for the registry server's persistent registration log and the
+memory-mapped snapshot format.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from tupledns_server import CoordinateIndex
+from tupledns_store import (LOG_MAGIC, LogCorruptError, RegistrationLog, Snapshot, SnapshotFormatError,
+                            write_snapshot)
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+def reopen(path: str, **kwargs):
+    index = CoordinateIndex()
+    log = RegistrationLog(path, **kwargs)
+    log.load(index)
+    return index, log
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "registry.log")
+
+
+class TestRegistrationLog:
+    """Test logging, reload, recovery and compaction"""
+
+    def test_reload(self, log_path):
+        index, log = reopen(log_path)
+        index.register("ambient.120.london.music.tuple", ["192.168.1.100", "2001:db8::1"], ["midi"])
+        index.register("jazz.140.newyork.music.tuple", ["192.168.1.101"])
+        index.alias("studio-2.building-5.spatial.tuple", "ambient.120.london.music.tuple")
+        index.unregister("jazz.140.newyork.music.tuple")
+        serial = index.serial
+        log.close()
+
+        restored, log = reopen(log_path)
+        log.close()
+        assert restored.serial == serial
+        node = restored.node("ambient.120.london.music.tuple")
+        assert node.addresses == ["192.168.1.100", "2001:db8::1"]
+        assert node.capabilities == ["midi"]
+        assert restored.node("jazz.140.newyork.music.tuple") is None
+        assert restored.node("studio-2.building-5.spatial.tuple").target == "ambient.120.london.music.tuple"
+        assert restored.name_exists("music.tuple")
+        assert [n.coordinate for n in restored.match("*.120.*.music.tuple")] == ["ambient.120.london.music.tuple"]
+
+    def test_appends_after_reload(self, log_path):
+        index, log = reopen(log_path)
+        index.register("a.1.test.tuple", ["10.0.0.1"])
+        log.close()
+        index, log = reopen(log_path)
+        index.register("b.1.test.tuple", ["10.0.0.2"])
+        log.close()
+        restored, log = reopen(log_path)
+        log.close()
+        assert len(restored) == 2
+
+    def test_torn_tail_is_dropped(self, log_path):
+        index, log = reopen(log_path)
+        index.register("a.1.test.tuple", ["10.0.0.1"])
+        index.register("b.1.test.tuple", ["10.0.0.2"])
+        log.close()
+        size = os.path.getsize(log_path)
+        with open(log_path, 'r+b') as f:
+            f.truncate(size - 3)
+
+        restored, log = reopen(log_path)
+        restored.register("c.1.test.tuple", ["10.0.0.3"])
+        log.close()
+        restored, log = reopen(log_path)
+        log.close()
+        assert restored.node("a.1.test.tuple") is not None
+        assert restored.node("b.1.test.tuple") is None
+        assert restored.node("c.1.test.tuple") is not None
+
+    def test_checksum_stops_replay(self, log_path):
+        index, log = reopen(log_path)
+        index.register("a.1.test.tuple", ["10.0.0.1"])
+        index.register("b.1.test.tuple", ["10.0.0.2"])
+        log.close()
+        with open(log_path, 'r+b') as f:
+            f.seek(-2, os.SEEK_END)
+            f.write(b"\xff\xff")
+
+        restored, log = reopen(log_path)
+        log.close()
+        assert restored.node("a.1.test.tuple") is not None
+        assert restored.node("b.1.test.tuple") is None
+
+    def test_bad_magic(self, log_path):
+        with open(log_path, 'wb') as f:
+            f.write(b"not a log")
+        with pytest.raises(LogCorruptError):
+            reopen(log_path)
+
+    def test_compaction(self, log_path):
+        index, log = reopen(log_path, compact_min_bytes=1024)
+        for round_ in range(20):
+            for i in range(10):
+                index.register(f"node-{i}.test.tuple", [f"10.0.{round_}.{i}"], ["cap"])
+        # Superseded records are dropped, so the log stays near one record per name
+        assert log.records < 3 * len(index)
+        log.compact()
+        assert log.records == len(index)
+        log.close()
+
+        with open(log_path, 'rb') as f:
+            assert f.read(len(LOG_MAGIC)) == LOG_MAGIC
+        restored, log = reopen(log_path)
+        log.close()
+        assert restored.node("node-3.test.tuple").addresses == ["10.0.19.3"]
+        assert restored.serial == index.serial
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    index = CoordinateIndex()
+    index.register("ambient.120.london.music.tuple", ["192.168.1.100", "2001:db8::1"], ["midi", "real-time"])
+    index.register("jazz.140.newyork.music.tuple", ["192.168.1.101"], ["midi"])
+    index.register("sensor.kitchen.floor-1.spatial.tuple", ["2001:db8::5"])
+    index.alias("studio-2.building-5.spatial.tuple", "ambient.120.london.music.tuple")
+    path = str(tmp_path / "tuple.snap")
+    assert write_snapshot(index, path) == 4
+    return path
+
+
+class TestSnapshot:
+    """Test the memory-mapped snapshot format from Python and C"""
+
+    def test_nodes(self, snapshot_path):
+        with Snapshot(snapshot_path) as snapshot:
+            assert len(snapshot) == 4
+            nodes = {node.coordinate: node for node in snapshot.nodes()}
+            assert nodes["ambient.120.london.music.tuple"].addresses == ["192.168.1.100", "2001:db8::1"]
+            assert nodes["sensor.kitchen.floor-1.spatial.tuple"].addresses == ["2001:db8::5"]
+            assert nodes["sensor.kitchen.floor-1.spatial.tuple"].capabilities == []
+            # Aliases are stored resolved
+            assert nodes["studio-2.building-5.spatial.tuple"].capabilities == ["midi", "real-time"]
+
+    def test_find(self, snapshot_path):
+        with Snapshot(snapshot_path) as snapshot:
+            assert [n.coordinate for n in snapshot.find("*.*.*.music.tuple")] == [
+                "ambient.120.london.music.tuple", "jazz.140.newyork.music.tuple"]
+            assert [n.coordinate for n in snapshot.find("*.*.*.MUSIC.tuple", ["real-time"])] == [
+                "ambient.120.london.music.tuple"]
+            assert snapshot.find("*.999.*.music.tuple") == []
+            assert snapshot.find("*.*.*.music.tuple", ["unknown"]) == []
+
+    def test_load_into(self, snapshot_path):
+        index = CoordinateIndex()
+        with Snapshot(snapshot_path) as snapshot:
+            snapshot.load_into(index)
+        assert len(index) == 4
+        assert index.node("jazz.140.newyork.music.tuple").capabilities == ["midi"]
+
+    def test_rejects_garbage(self, tmp_path, snapshot_path):
+        path = str(tmp_path / "bad.snap")
+        with open(snapshot_path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        with pytest.raises(SnapshotFormatError):
+            Snapshot(path)
+
+    def test_c_reader(self, tmp_path, snapshot_path):
+        lib_path = os.path.join(REPO_ROOT, 'libtupledns.so')
+        if not os.path.exists(lib_path):
+            pytest.skip("libtupledns.so not built")
+        import tupledns
+
+        dns = tupledns.TupleDNS(lib_path)
+        try:
+            with dns.open_snapshot(snapshot_path) as snapshot:
+                assert len(snapshot) == 4
+                result = snapshot.find("*.120.*.music.tuple")
+                assert [n.coordinate for n in result.nodes] == ["ambient.120.london.music.tuple"]
+                assert result.nodes[0].ip_address == "192.168.1.100"
+                assert result.nodes[0].ip_addresses == ["192.168.1.100", "2001:db8::1"]
+                assert result.nodes[0].capabilities == ["midi", "real-time"]
+                assert snapshot.find("*.*.*.spatial.tuple").nodes[0].ip_address == "2001:db8::5"
+                assert len(snapshot.find("*.*.*.music.tuple", ["midi"]).nodes) == 2
+                assert snapshot.find("*.*.*.music.tuple", ["nope"]).error == tupledns.TupleDNSError.NO_RESULTS
+
+            bad = str(tmp_path / "bad.snap")
+            with open(bad, 'wb') as f:
+                f.write(b"TDNSSNAP" + bytes(100))
+            with pytest.raises(tupledns.TupleDNSException):
+                dns.open_snapshot(bad)
+        finally:
+            dns.cleanup()
@@ -11,12 +11,22 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <ctype.h>
+#include <limits.h>
 #include <errno.h>
 #include <sys/socket.h>
 #include <netdb.h>
 #include <arpa/inet.h>
 #include <sys/time.h>
 #include <unistd.h>
+#include <stdint.h>
+#include <poll.h>
+#include <fcntl.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <pthread.h>
 
 /* Provide strdup if not available */
 #ifndef _GNU_SOURCE
@@ -32,14 +42,67 @@ static char* tuple_strdup(const char* s) {
 #endif
 
 /* Global Configuration */
-static tupledns_config_t g_config = {0};
+static tupledns_config_t g_config = {0};  /* Read through tuple_config() */
+static pthread_mutex_t g_config_lock = PTHREAD_MUTEX_INITIALIZER;
 static int g_initialized = 0;
-static tupledns_error_t g_last_error = TUPLEDNS_OK;
+static _Thread_local tupledns_error_t g_last_error = TUPLEDNS_OK;   /* Per calling thread */
+
+/* Authoritative/registry server used for wire-format queries and updates.
+ * Watches and the refresh thread query alongside the caller, so all of it is
+ * read and written under g_server_lock (see tuple_server_*) */
+static struct sockaddr_storage g_server_addr;
+static socklen_t g_server_addrlen = 0;
+static int g_server_configured = 0;
+static int g_server_q_support = -1;       /* -1 = not probed yet, else TUPLE_Q_* flags */
+static int g_server_edns = 1;             /* Cleared once the server rejects EDNS0 */
+static unsigned g_server_generation = 0;  /* Bumped on every change of server */
+static pthread_mutex_t g_server_lock = PTHREAD_MUTEX_INITIALIZER;
+
+/* Pooled TCP connection to the server (see tuple_wire_tcp_batch) */
+static int g_tcp_fd = -1;
+static double g_tcp_last_used = 0;
+static pthread_mutex_t g_tcp_lock = PTHREAD_MUTEX_INITIALIZER;
+static tupledns_connection_stats_t g_connection_stats;
+static tupledns_stats_t g_stats;          /* .connection is filled in from g_connection_stats on read */
+static pthread_mutex_t g_stats_lock = PTHREAD_MUTEX_INITIALIZER;
+
+/* Recently resolved nodes, consulted by capability finds (see CAPABILITY CACHE) */
+static tupledns_index_t* g_capability_cache = NULL;
+static pthread_mutex_t g_cache_lock = PTHREAD_MUTEX_INITIALIZER;   /* Also guards the refresh queue */
+#define TUPLE_CACHE_MISS 0               /* No fresh entry */
+#define TUPLE_CACHE_LACKS 1              /* Fresh entry without a required capability */
+#define TUPLE_CACHE_HIT 2                /* Fresh entry with every capability */
+#define TUPLE_CACHE_MAX_ENTRIES 65536
+#define TUPLE_CACHE_HOT_HITS 4           /* Lookups that make an entry eligible for prefetch */
+#define TUPLE_CACHE_PREFETCH_WINDOW 10   /* Prefetch within the last 1/N of an entry's TTL */
+
+/* Live watches, paused around server changes and stopped by cleanup (see WATCHES) */
+static struct tupledns_watch* g_watches = NULL;
+static pthread_mutex_t g_watch_lock = PTHREAD_MUTEX_INITIALIZER;
 
 /* Internal Function Declarations */
 int tupledns_dns_zone_transfer(const char* zone, char*** records, int* record_count);
 int tupledns_generate_pattern_candidates(const char* pattern, char*** candidates, int* candidate_count);
 int tupledns_expand_pattern(const char* pattern, char*** query_names, int* query_count);
+static int tuple_cache_lookup(const char* coordinate, const char* required_caps[], tupledns_result_t* result);
+static void tuple_cache_store(const tupledns_node_t* node);
+static void tuple_cache_forget(const char* coordinate);
+static void tuple_cache_reset(void);
+static void tuple_cache_stop_refresh(void);
+static tupledns_config_t tuple_config(void);
+static void tuple_server_store(const struct sockaddr* addr, socklen_t addrlen);
+static int tuple_server_configured(void);
+static void tuple_watches_pause(void);
+static void tuple_watches_resume(int restart);
+static tupledns_result_t* tuple_pattern_cache_lookup(const char* pattern, const char* required_caps[]);
+static void tuple_pattern_cache_store(const char* pattern, const char* required_caps[],
+                                      const tupledns_result_t* result);
+static void tuple_pattern_cache_forget_locked(const char* name);
+static void tuple_pattern_cache_reset_locked(void);
+static void tuple_pattern_cache_refresh(const char* key);
+static void tuple_wire_tcp_close(void);
+static double tuple_now(void);
+static void tuple_trace_from_env(void);
 
 /* Internal Structures */
 typedef struct dns_query_ctx {
@@ -60,7 +123,8 @@ tupledns_config_t tupledns_default_config(void) {
         .timeout = TUPLEDNS_DEFAULT_TIMEOUT,
         .max_concurrent = 16,
         .enable_caching = 1,
-        .cache_ttl = TUPLEDNS_DEFAULT_TTL
+        .cache_ttl = TUPLEDNS_DEFAULT_TTL,
+        .prefetch_budget = 8
     };
     return config;
 }
@@ -70,20 +134,141 @@ int tupledns_init(const tupledns_config_t* config) {
         return TUPLEDNS_OK;
     }
     
-    if (config) {
-        g_config = *config;
-    } else {
-        g_config = tupledns_default_config();
+    pthread_mutex_lock(&g_config_lock);
+    g_config = config ? *config : tupledns_default_config();
+    pthread_mutex_unlock(&g_config_lock);
+    
+    srand((unsigned int)time(NULL) ^ (unsigned int)getpid());
+    
+    /* TUPLEDNS_SERVER=host[:port] points the library at a registry server */
+    const char* server = getenv("TUPLEDNS_SERVER");
+    if (server && server[0] && !tuple_server_configured()) {
+        char host[256];
+        int port = 0;
+        const char* colon = strrchr(server, ':');
+        if (server[0] == '[') {
+            const char* close = strchr(server, ']');
+            if (close && (size_t)(close - server - 1) < sizeof(host)) {
+                memcpy(host, server + 1, close - server - 1);
+                host[close - server - 1] = '\0';
+                if (close[1] == ':') {
+                    port = atoi(close + 2);
+                }
+                tupledns_set_server(host, port);
+            }
+        } else if (colon && colon == strchr(server, ':') && (size_t)(colon - server) < sizeof(host)) {
+            memcpy(host, server, colon - server);
+            host[colon - server] = '\0';
+            tupledns_set_server(host, atoi(colon + 1));
+        } else {
+            tupledns_set_server(server, 0);
+        }
     }
     
+    tuple_trace_from_env();
+    
     g_initialized = 1;
     g_last_error = TUPLEDNS_OK;
     return TUPLEDNS_OK;
 }
 
+/* Point the library at addr (NULL for none), forgetting what was probed */
+static void tuple_server_store(const struct sockaddr* addr, socklen_t addrlen) {
+    pthread_mutex_lock(&g_server_lock);
+    g_server_configured = addr != NULL;
+    g_server_addrlen = addr ? addrlen : 0;
+    if (addr) {
+        memcpy(&g_server_addr, addr, addrlen);
+    }
+    g_server_q_support = -1;
+    g_server_edns = 1;
+    g_server_generation++;
+    pthread_mutex_unlock(&g_server_lock);
+}
+
+static int tuple_server_configured(void) {
+    pthread_mutex_lock(&g_server_lock);
+    int configured = g_server_configured;
+    pthread_mutex_unlock(&g_server_lock);
+    return configured;
+}
+
+/* Copy the server address for a socket; 0 when none is configured */
+static socklen_t tuple_server_address(struct sockaddr_storage* addr) {
+    pthread_mutex_lock(&g_server_lock);
+    socklen_t addrlen = g_server_configured ? g_server_addrlen : 0;
+    memcpy(addr, &g_server_addr, sizeof(*addr));
+    pthread_mutex_unlock(&g_server_lock);
+    return addrlen;
+}
+
+static int tuple_server_edns(void) {
+    pthread_mutex_lock(&g_server_lock);
+    int edns = g_server_edns;
+    pthread_mutex_unlock(&g_server_lock);
+    return edns;
+}
+
+/* Returns whether this call turned EDNS0 off, so the fallback is counted once */
+static int tuple_server_disable_edns(void) {
+    pthread_mutex_lock(&g_server_lock);
+    int was = g_server_edns;
+    g_server_edns = 0;
+    pthread_mutex_unlock(&g_server_lock);
+    return was;
+}
+
 void tupledns_cleanup(void) {
+    tuple_watches_pause();
+    tuple_cache_stop_refresh();
+    tupledns_trace_stop();
     g_initialized = 0;
+    pthread_mutex_lock(&g_config_lock);
     memset(&g_config, 0, sizeof(g_config));
+    pthread_mutex_unlock(&g_config_lock);
+    tuple_server_store(NULL, 0);
+    tuple_wire_tcp_close();
+    tuple_cache_reset();
+    tuple_watches_resume(0);
+}
+
+static int tuple_server_configure(const char* address, int port) {
+    tuple_cache_stop_refresh();
+    tuple_server_store(NULL, 0);
+    tuple_wire_tcp_close();
+    tuple_cache_reset();
+    if (!address) {
+        return TUPLEDNS_OK;
+    }
+    
+    if (port <= 0 || port > 65535) {
+        port = TUPLEDNS_DEFAULT_PORT;
+    }
+    
+    char service[8];
+    snprintf(service, sizeof(service), "%d", port);
+    
+    struct addrinfo hints, *result;
+    memset(&hints, 0, sizeof(hints));
+    hints.ai_family = AF_UNSPEC;
+    hints.ai_socktype = SOCK_DGRAM;
+    
+    if (getaddrinfo(address, service, &hints, &result) != 0 || !result) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    tuple_server_store(result->ai_addr, (socklen_t)result->ai_addrlen);
+    freeaddrinfo(result);
+    return TUPLEDNS_OK;
+}
+
+/* Watches are stopped while the globals change and polled afresh against the new server */
+int tupledns_set_server(const char* address, int port) {
+    tuple_watches_pause();
+    int status = tuple_server_configure(address, port);
+    tuple_watches_resume(1);
+    return status;
 }
 
 int tupledns_set_config(const tupledns_config_t* config) {
@@ -91,12 +276,106 @@ int tupledns_set_config(const tupledns_config_t* config) {
         g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
         return TUPLEDNS_ERROR_INVALID_PARAMETER;
     }
+    pthread_mutex_lock(&g_config_lock);
     g_config = *config;
+    pthread_mutex_unlock(&g_config_lock);
     return TUPLEDNS_OK;
 }
 
 tupledns_config_t tupledns_get_config(void) {
-    return g_config;
+    return tuple_config();
+}
+
+/* A copy of the configuration, which another thread may replace at any time */
+static tupledns_config_t tuple_config(void) {
+    pthread_mutex_lock(&g_config_lock);
+    tupledns_config_t config = g_config;
+    pthread_mutex_unlock(&g_config_lock);
+    return config;
+}
+
+void tupledns_get_connection_stats(tupledns_connection_stats_t* stats) {
+    if (stats) {
+        pthread_mutex_lock(&g_stats_lock);
+        *stats = g_connection_stats;
+        pthread_mutex_unlock(&g_stats_lock);
+    }
+}
+
+void tupledns_reset_connection_stats(void) {
+    pthread_mutex_lock(&g_stats_lock);
+    memset(&g_connection_stats, 0, sizeof(g_connection_stats));
+    pthread_mutex_unlock(&g_stats_lock);
+}
+
+void tupledns_get_stats(tupledns_stats_t* stats) {
+    if (stats) {
+        pthread_mutex_lock(&g_stats_lock);
+        *stats = g_stats;
+        stats->connection = g_connection_stats;
+        pthread_mutex_unlock(&g_stats_lock);
+    }
+}
+
+void tupledns_reset_stats(void) {
+    pthread_mutex_lock(&g_stats_lock);
+    memset(&g_stats, 0, sizeof(g_stats));
+    memset(&g_connection_stats, 0, sizeof(g_connection_stats));
+    pthread_mutex_unlock(&g_stats_lock);
+}
+
+/* Counters are bumped from background refreshes too */
+static void tuple_stats_add(uint64_t* counter, uint64_t n) {
+    pthread_mutex_lock(&g_stats_lock);
+    *counter += n;
+    pthread_mutex_unlock(&g_stats_lock);
+}
+
+static int tuple_stats_bucket(double seconds) {
+    double us = seconds * 1000000.0;
+    int bucket = 0;
+    while (bucket < TUPLEDNS_STATS_LATENCY_BUCKETS - 1 && us >= 1.0) {
+        us /= 2;
+        bucket++;
+    }
+    return bucket;
+}
+
+/* Count one finished DNS query by type and outcome, with its latency */
+static void tuple_stats_query(tupledns_query_type_t type, int status, double seconds) {
+    tupledns_query_outcome_t outcome = status == TUPLEDNS_OK ? TUPLEDNS_OUTCOME_OK
+        : status == TUPLEDNS_ERROR_NO_RESULTS ? TUPLEDNS_OUTCOME_NO_RESULTS
+        : status == TUPLEDNS_ERROR_TIMEOUT ? TUPLEDNS_OUTCOME_TIMEOUT : TUPLEDNS_OUTCOME_ERROR;
+    int bucket = tuple_stats_bucket(seconds);
+    pthread_mutex_lock(&g_stats_lock);
+    g_stats.queries[type][outcome]++;
+    g_stats.query_latency[bucket]++;
+    pthread_mutex_unlock(&g_stats_lock);
+}
+
+static void tuple_stats_find(double seconds) {
+    int bucket = tuple_stats_bucket(seconds);
+    pthread_mutex_lock(&g_stats_lock);
+    g_stats.finds++;
+    g_stats.find_latency[bucket]++;
+    pthread_mutex_unlock(&g_stats_lock);
+}
+
+static void tuple_stats_expansion(int names) {
+    pthread_mutex_lock(&g_stats_lock);
+    g_stats.expansions++;
+    g_stats.expanded_names += (uint64_t)names;
+    if ((uint64_t)names > g_stats.max_expansion) {
+        g_stats.max_expansion = (uint64_t)names;
+    }
+    pthread_mutex_unlock(&g_stats_lock);
+}
+
+static void tuple_stats_allocation(size_t size) {
+    pthread_mutex_lock(&g_stats_lock);
+    g_stats.allocations++;
+    g_stats.allocated_bytes += size;
+    pthread_mutex_unlock(&g_stats_lock);
 }
 
 /* ========================================================================
@@ -230,6 +509,468 @@ void tupledns_free_string_array(char** strings, int count) {
     free(strings);
 }
 
+/* ========================================================================
+ * TRACING
+ * ======================================================================== */
+
+/* Spans nest per thread. A phase wraps its work in tuple_span_begin/end;
+ * with tracing off that is one load and branch each. */
+
+#define TUPLE_TRACE_OFF 0
+#define TUPLE_TRACE_CALLBACK 1
+#define TUPLE_TRACE_FILE 2
+#define TUPLE_TRACE_MAX_DEPTH 16
+
+static volatile int g_trace_mode = TUPLE_TRACE_OFF;
+static tupledns_trace_callback_t g_trace_callback = NULL;
+static void* g_trace_user_data = NULL;
+static FILE* g_trace_file = NULL;
+static tupledns_trace_format_t g_trace_format = TUPLEDNS_TRACE_CHROME;
+static long g_trace_events = 0;
+static double g_trace_epoch = 0;
+static int g_trace_threads = 0;
+static pthread_mutex_t g_trace_lock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_key_t g_trace_key;
+static pthread_once_t g_trace_key_once = PTHREAD_ONCE_INIT;
+
+typedef struct {
+    int depth;
+    int thread;
+    const char* names[TUPLE_TRACE_MAX_DEPTH];
+    double child_time[TUPLE_TRACE_MAX_DEPTH];
+} tuple_trace_thread_t;
+
+typedef struct {
+    int active;
+    double start;
+} tuple_span_t;
+
+static void tuple_trace_make_key(void) {
+    pthread_key_create(&g_trace_key, free);
+}
+
+static tuple_trace_thread_t* tuple_trace_thread(void) {
+    pthread_once(&g_trace_key_once, tuple_trace_make_key);
+    tuple_trace_thread_t* state = pthread_getspecific(g_trace_key);
+    if (!state && (state = calloc(1, sizeof(*state))) != NULL) {
+        pthread_mutex_lock(&g_trace_lock);
+        state->thread = ++g_trace_threads;
+        pthread_mutex_unlock(&g_trace_lock);
+        if (pthread_setspecific(g_trace_key, state) != 0) {
+            free(state);
+            state = NULL;
+        }
+    }
+    return state;
+}
+
+static void tuple_span_begin(tuple_span_t* span, const char* name) {
+    span->active = 0;
+    if (g_trace_mode == TUPLE_TRACE_OFF) {
+        return;
+    }
+    tuple_trace_thread_t* state = tuple_trace_thread();
+    if (!state || state->depth == TUPLE_TRACE_MAX_DEPTH) {
+        return;
+    }
+    state->names[state->depth] = name;
+    state->child_time[state->depth] = 0;
+    state->depth++;
+    span->active = 1;
+    span->start = tuple_now();
+}
+
+static void tuple_trace_write_string(FILE* out, const char* s) {
+    fputc('"', out);
+    for (; s && *s; s++) {
+        if (*s == '"' || *s == '\\') {
+            fprintf(out, "\\%c", *s);
+        } else if ((unsigned char)*s < 0x20) {
+            fprintf(out, "\\u%04x", (unsigned char)*s);
+        } else {
+            fputc(*s, out);
+        }
+    }
+    fputc('"', out);
+}
+
+/* Called with g_trace_lock held */
+static void tuple_trace_write(const tupledns_span_t* span) {
+    FILE* out = g_trace_file;
+    if (g_trace_format == TUPLEDNS_TRACE_FOLDED) {
+        for (int i = 0; i < span->depth; i++) {
+            fprintf(out, "%s;", span->stack[i]);
+        }
+        fprintf(out, "%s %lld\n", span->name, (long long)(span->self_time * 1000000.0 + 0.5));
+        return;
+    }
+    fprintf(out, "%s{\"name\":\"%s\",\"cat\":\"tupledns\",\"ph\":\"X\",\"ts\":%.3f,\"dur\":%.3f,"
+            "\"pid\":%ld,\"tid\":%d,\"args\":{\"size\":%lld,\"detail\":",
+            g_trace_events ? ",\n" : "", span->name, (span->start - g_trace_epoch) * 1000000.0,
+            span->duration * 1000000.0, (long)getpid(), span->thread, (long long)span->size);
+    tuple_trace_write_string(out, span->detail);
+    fputs("}}", out);
+}
+
+static void tuple_span_end(tuple_span_t* span, const char* detail, int64_t size) {
+    if (!span->active) {
+        return;
+    }
+    double duration = tuple_now() - span->start;
+    tuple_trace_thread_t* state = pthread_getspecific(g_trace_key);
+    int depth = --state->depth;
+    if (depth > 0) {
+        state->child_time[depth - 1] += duration;
+    }
+    
+    tupledns_span_t record = {
+        state->names[depth], detail, span->start, duration, duration - state->child_time[depth],
+        size, depth, state->names, state->thread
+    };
+    pthread_mutex_lock(&g_trace_lock);
+    if (g_trace_mode == TUPLE_TRACE_CALLBACK && g_trace_callback) {
+        g_trace_callback(&record, g_trace_user_data);
+    } else if (g_trace_mode == TUPLE_TRACE_FILE && g_trace_file) {
+        tuple_trace_write(&record);
+        g_trace_events++;
+    }
+    pthread_mutex_unlock(&g_trace_lock);
+}
+
+void tupledns_trace_stop(void) {
+    pthread_mutex_lock(&g_trace_lock);
+    if (g_trace_file) {
+        if (g_trace_format == TUPLEDNS_TRACE_CHROME) {
+            fputs("\n]\n", g_trace_file);
+        }
+        fclose(g_trace_file);
+        g_trace_file = NULL;
+    }
+    g_trace_mode = TUPLE_TRACE_OFF;
+    g_trace_callback = NULL;
+    g_trace_user_data = NULL;
+    pthread_mutex_unlock(&g_trace_lock);
+}
+
+int tupledns_trace_set_callback(tupledns_trace_callback_t callback, void* user_data) {
+    if (!callback) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    tupledns_trace_stop();
+    pthread_mutex_lock(&g_trace_lock);
+    g_trace_callback = callback;
+    g_trace_user_data = user_data;
+    g_trace_mode = TUPLE_TRACE_CALLBACK;
+    pthread_mutex_unlock(&g_trace_lock);
+    return TUPLEDNS_OK;
+}
+
+int tupledns_trace_to_file(const char* path, tupledns_trace_format_t format) {
+    if (!path || (format != TUPLEDNS_TRACE_CHROME && format != TUPLEDNS_TRACE_FOLDED)) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    tupledns_trace_stop();
+    FILE* file = fopen(path, "w");
+    if (!file) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    if (format == TUPLEDNS_TRACE_CHROME) {
+        fputs("[\n", file);
+    }
+    pthread_mutex_lock(&g_trace_lock);
+    g_trace_file = file;
+    g_trace_format = format;
+    g_trace_events = 0;
+    g_trace_epoch = tuple_now();
+    g_trace_mode = TUPLE_TRACE_FILE;
+    pthread_mutex_unlock(&g_trace_lock);
+    return TUPLEDNS_OK;
+}
+
+/* TUPLEDNS_TRACE=[chrome:|folded:]path */
+static void tuple_trace_from_env(void) {
+    const char* spec = getenv("TUPLEDNS_TRACE");
+    if (!spec || !spec[0]) {
+        return;
+    }
+    tupledns_trace_format_t format = TUPLEDNS_TRACE_CHROME;
+    if (strncmp(spec, "folded:", 7) == 0) {
+        format = TUPLEDNS_TRACE_FOLDED;
+        spec += 7;
+    } else if (strncmp(spec, "chrome:", 7) == 0) {
+        spec += 7;
+    }
+    tupledns_trace_to_file(spec, format);
+}
+
+/* ========================================================================
+ * RESULT ARENAS
+ * ======================================================================== */
+
+/* Results built by the library keep their node array, strings and capability
+ * arrays in one bump arena. The result struct, arena header and first chunk
+ * share a single allocation and later chunks double in size, so building a
+ * result costs a handful of mallocs and freeing it a short walk of chunks. */
+
+#define TUPLE_ARENA_FIRST_CHUNK 4096
+#define TUPLE_ARENA_MAX_CHUNK (1 << 20)
+#define TUPLE_ARENA_ALIGN 8
+
+typedef struct tuple_arena_chunk {
+    struct tuple_arena_chunk* next;   /* Older chunk */
+    size_t size;
+    size_t used;
+} tuple_arena_chunk_t;
+
+struct tupledns_arena {
+    tuple_arena_chunk_t* chunk;       /* Current chunk */
+    tuple_arena_chunk_t* embedded;    /* First chunk, freed with the result */
+    int node_capacity;
+};
+
+typedef struct {
+    tupledns_result_t result;
+    struct tupledns_arena arena;
+    tuple_arena_chunk_t first;
+} tuple_result_block_t;
+
+#define TUPLE_CHUNK_DATA(chunk) ((unsigned char*)(chunk) + sizeof(tuple_arena_chunk_t))
+
+static tupledns_result_t* tuple_result_create(void) {
+    tuple_result_block_t* block = malloc(sizeof(tuple_result_block_t) + TUPLE_ARENA_FIRST_CHUNK);
+    if (!block) {
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return NULL;
+    }
+    tuple_stats_allocation(sizeof(tuple_result_block_t) + TUPLE_ARENA_FIRST_CHUNK);
+    memset(&block->result, 0, sizeof(block->result));
+    block->first.next = NULL;
+    block->first.size = TUPLE_ARENA_FIRST_CHUNK;
+    block->first.used = 0;
+    block->arena.chunk = &block->first;
+    block->arena.embedded = &block->first;
+    block->arena.node_capacity = 0;
+    block->result.arena = &block->arena;
+    return &block->result;
+}
+
+static void* tuple_arena_alloc(struct tupledns_arena* arena, size_t size) {
+    size = (size + TUPLE_ARENA_ALIGN - 1) & ~(size_t)(TUPLE_ARENA_ALIGN - 1);
+    tuple_arena_chunk_t* chunk = arena->chunk;
+    if (chunk->size - chunk->used < size) {
+        size_t chunk_size = chunk->size < TUPLE_ARENA_MAX_CHUNK ? chunk->size * 2 : chunk->size;
+        if (chunk_size < size) chunk_size = size;
+        tuple_arena_chunk_t* grown = malloc(sizeof(tuple_arena_chunk_t) + chunk_size);
+        if (!grown) {
+            return NULL;
+        }
+        tuple_stats_allocation(sizeof(tuple_arena_chunk_t) + chunk_size);
+        grown->next = chunk;
+        grown->size = chunk_size;
+        grown->used = 0;
+        arena->chunk = chunk = grown;
+    }
+    void* ptr = TUPLE_CHUNK_DATA(chunk) + chunk->used;
+    chunk->used += size;
+    return ptr;
+}
+
+static char* tuple_arena_strndup(struct tupledns_arena* arena, const char* s, size_t len) {
+    char* copy = tuple_arena_alloc(arena, len + 1);
+    if (copy) {
+        memcpy(copy, s, len);
+        copy[len] = '\0';
+    }
+    return copy;
+}
+
+static void tuple_arena_free(struct tupledns_arena* arena) {
+    tuple_arena_chunk_t* chunk = arena->chunk;
+    while (chunk && chunk != arena->embedded) {
+        tuple_arena_chunk_t* next = chunk->next;
+        free(chunk);
+        chunk = next;
+    }
+}
+
+/* Append a zeroed node, doubling the node array inside the arena */
+static tupledns_node_t* tuple_result_add_node(tupledns_result_t* result) {
+    struct tupledns_arena* arena = result->arena;
+    if (result->node_count == arena->node_capacity) {
+        int capacity = arena->node_capacity ? arena->node_capacity * 2 : 16;
+        tupledns_node_t* nodes = tuple_arena_alloc(arena, capacity * sizeof(tupledns_node_t));
+        if (!nodes) {
+            return NULL;
+        }
+        if (result->node_count > 0) {
+            memcpy(nodes, result->nodes, result->node_count * sizeof(tupledns_node_t));
+        }
+        result->nodes = nodes;
+        arena->node_capacity = capacity;
+    }
+    tupledns_node_t* node = &result->nodes[result->node_count++];
+    memset(node, 0, sizeof(*node));
+    return node;
+}
+
+/* Drop the most recently added node after a failed fill */
+static void tuple_result_pop_node(tupledns_result_t* result) {
+    result->node_count--;
+}
+
+static int tuple_result_set_caps(tupledns_result_t* result, tupledns_node_t* node,
+                                 char* const* capabilities, int count) {
+    if (count <= 0) {
+        return 0;
+    }
+    node->capabilities = tuple_arena_alloc(result->arena, count * sizeof(char*));
+    if (!node->capabilities) {
+        return -1;
+    }
+    for (int i = 0; i < count; i++) {
+        const char* cap = capabilities[i] ? capabilities[i] : "";
+        if (!(node->capabilities[i] = tuple_arena_strndup(result->arena, cap, strlen(cap)))) {
+            return -1;
+        }
+    }
+    node->capability_count = count;
+    return 0;
+}
+
+/* Copy every address into the arena; ip_address is the first */
+static int tuple_result_set_addresses(tupledns_result_t* result, tupledns_node_t* node,
+                                      char* const* addresses, int count) {
+    if (count <= 0) {
+        return 0;
+    }
+    node->ip_addresses = tuple_arena_alloc(result->arena, count * sizeof(char*));
+    if (!node->ip_addresses) {
+        return -1;
+    }
+    for (int i = 0; i < count; i++) {
+        if (!addresses[i]) continue;
+        node->ip_addresses[node->address_count] = tuple_arena_strndup(result->arena, addresses[i], strlen(addresses[i]));
+        if (!node->ip_addresses[node->address_count]) {
+            return -1;
+        }
+        node->address_count++;
+    }
+    node->ip_address = node->address_count > 0 ? node->ip_addresses[0] : NULL;
+    return 0;
+}
+
+/* Split a comma-separated addr= list of len bytes into the arena */
+static int tuple_result_parse_addresses(tupledns_result_t* result, tupledns_node_t* node,
+                                        const char* addresses, size_t len) {
+    const char* end = addresses + len;
+    int count = 0;
+    for (const char* p = addresses; p < end; p++) {
+        if (*p != ',' && (p == addresses || p[-1] == ',')) count++;
+    }
+    if (count == 0) {
+        return 0;
+    }
+    node->ip_addresses = tuple_arena_alloc(result->arena, count * sizeof(char*));
+    if (!node->ip_addresses) {
+        return -1;
+    }
+    for (const char* p = addresses; p < end; ) {
+        size_t n = strcspn(p, ",");
+        if ((size_t)(end - p) < n) n = end - p;
+        if (n > 0) {
+            node->ip_addresses[node->address_count] = tuple_arena_strndup(result->arena, p, n);
+            if (!node->ip_addresses[node->address_count]) return -1;
+            node->address_count++;
+        }
+        p += n + 1;
+    }
+    node->ip_address = node->ip_addresses[0];
+    return 0;
+}
+
+/* Split the caps= list of a TXT string straight into the arena */
+static int tuple_result_parse_caps_list(tupledns_result_t* result, tupledns_node_t* node, const char* caps) {
+    caps += 5;
+    const char* end = caps + strcspn(caps, " ");
+    
+    int count = 0;
+    for (const char* p = caps; p < end; p++) {
+        if (*p != ',' && (p == caps || p[-1] == ',')) count++;
+    }
+    if (count == 0) {
+        return 0;
+    }
+    node->capabilities = tuple_arena_alloc(result->arena, count * sizeof(char*));
+    if (!node->capabilities) {
+        return -1;
+    }
+    for (const char* p = caps; p < end; ) {
+        size_t len = strcspn(p, ",");
+        if ((size_t)(end - p) < len) len = end - p;
+        if (len > 0) {
+            node->capabilities[node->capability_count] = tuple_arena_strndup(result->arena, p, len);
+            if (!node->capabilities[node->capability_count]) return -1;
+            node->capability_count++;
+        }
+        p += len + 1;
+    }
+    return 0;
+}
+
+static int tuple_result_parse_caps(tupledns_result_t* result, tupledns_node_t* node, const char* text) {
+    const char* caps = text ? strstr(text, "caps=") : NULL;
+    if (!caps) {
+        return 0;
+    }
+    tuple_span_t span;
+    tuple_span_begin(&span, "txt_parse");
+    int status = tuple_result_parse_caps_list(result, node, caps);
+    tuple_span_end(&span, node->coordinate, node->capability_count);
+    return status;
+}
+
+/* Node from position first on whose coordinate is name[0..len), or NULL */
+static tupledns_node_t* tuple_result_find_node(tupledns_result_t* result, int first, const char* name, size_t len) {
+    for (int i = first; i < result->node_count; i++) {
+        const char* coordinate = result->nodes[i].coordinate;
+        if (coordinate && strncasecmp(coordinate, name, len) == 0 && coordinate[len] == '\0') {
+            return &result->nodes[i];
+        }
+    }
+    return NULL;
+}
+
+/* Record another coordinate a node is known by, once; the alias array
+ * doubles inside the arena */
+static int tuple_result_add_alias(tupledns_result_t* result, tupledns_node_t* node, const char* alias, size_t len) {
+    if (strncasecmp(node->coordinate, alias, len) == 0 && node->coordinate[len] == '\0') {
+        return 0;
+    }
+    for (int i = 0; i < node->alias_count; i++) {
+        if (strncasecmp(node->aliases[i], alias, len) == 0 && node->aliases[i][len] == '\0') {
+            return 0;
+        }
+    }
+    if ((node->alias_count & (node->alias_count - 1)) == 0) {
+        char** aliases = tuple_arena_alloc(result->arena, (node->alias_count ? node->alias_count * 2 : 1) * sizeof(char*));
+        if (!aliases) {
+            return -1;
+        }
+        if (node->alias_count > 0) {
+            memcpy(aliases, node->aliases, node->alias_count * sizeof(char*));
+        }
+        node->aliases = aliases;
+    }
+    if (!(node->aliases[node->alias_count] = tuple_arena_strndup(result->arena, alias, len))) {
+        return -1;
+    }
+    node->alias_count++;
+    return 0;
+}
+
 /* ========================================================================
  * COORDINATE HANDLING
  * ======================================================================== */
@@ -307,6 +1048,25 @@ char* tupledns_encode_coordinate(const char* space_type, const char* values[], i
     return result;
 }
 
+/* Compare two labels of equal length, ignoring ASCII case (RFC 4343) */
+static int tuple_label_equal(const char* a, const char* b, size_t len) {
+    for (size_t i = 0; i < len; i++) {
+        if (tolower((unsigned char)a[i]) != tolower((unsigned char)b[i])) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static char* tuple_strndup(const char* s, size_t len) {
+    char* dup = malloc(len + 1);
+    if (dup) {
+        memcpy(dup, s, len);
+        dup[len] = '\0';
+    }
+    return dup;
+}
+
 int tupledns_decode_coordinate(const char* coordinate, char** space_type, char*** values, int* value_count) {
     if (!coordinate || !space_type || !values || !value_count) {
         g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
@@ -317,65 +1077,51 @@ int tupledns_decode_coordinate(const char* coordinate, char** space_type, char**
         return g_last_error;
     }
     
-    /* Remove .tuple suffix */
-    size_t coord_len = strlen(coordinate);
-    size_t suffix_len = strlen(".tuple");
-    char* coord_copy = malloc(coord_len - suffix_len + 1);
-    if (!coord_copy) {
-        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
-        return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    /* Walk the labels before the .tuple suffix in place; empty labels are skipped */
+    const char* end = coordinate + strlen(coordinate) - strlen(".tuple");
+    const char* starts[TUPLEDNS_MAX_COORDINATE_LENGTH / 2 + 1];
+    size_t lengths[TUPLEDNS_MAX_COORDINATE_LENGTH / 2 + 1];
+    int count = 0;
+    for (const char* p = coordinate; p < end; ) {
+        const char* dot = memchr(p, '.', end - p);
+        size_t len = dot ? (size_t)(dot - p) : (size_t)(end - p);
+        if (len > 0) {
+            starts[count] = p;
+            lengths[count++] = len;
+        }
+        p += len + 1;
     }
     
-    strncpy(coord_copy, coordinate, coord_len - suffix_len);
-    coord_copy[coord_len - suffix_len] = '\0';
-    
-    /* Split by dots */
-    char** parts = tupledns_split_string(coord_copy, ".", value_count);
-    free(coord_copy);
-    
-    if (!parts || *value_count < 2) {
+    if (count < 2) {
         g_last_error = TUPLEDNS_ERROR_INVALID_COORDINATE;
         return TUPLEDNS_ERROR_INVALID_COORDINATE;
     }
     
-    /* Last part is space_type */
-    *space_type = strdup(parts[*value_count - 1]);
-    if (!*space_type) {
-        tupledns_free_string_array(parts, *value_count);
+    /* Last label is the space type, the rest are values */
+    int num_values = count - 1;
+    char** parts = malloc(num_values * sizeof(char*));
+    *space_type = tuple_strndup(starts[num_values], lengths[num_values]);
+    if (!parts || !*space_type) {
+        free(parts);
+        free(*space_type);
+        *space_type = NULL;
         g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
         return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
     }
     
-    /* Remaining parts are values */
-    int num_values = *value_count - 1;
-    if (num_values > 0) {
-        *values = malloc(num_values * sizeof(char*));
-        if (!*values) {
+    for (int i = 0; i < num_values; i++) {
+        parts[i] = tuple_strndup(starts[i], lengths[i]);
+        if (!parts[i]) {
+            tupledns_free_string_array(parts, i);
             free(*space_type);
-            tupledns_free_string_array(parts, *value_count);
+            *space_type = NULL;
             g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
             return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
         }
-        
-        for (int i = 0; i < num_values; i++) {
-            (*values)[i] = strdup(parts[i]);
-            if (!(*values)[i]) {
-                for (int j = 0; j < i; j++) {
-                    free((*values)[j]);
-                }
-                free(*values);
-                free(*space_type);
-                tupledns_free_string_array(parts, *value_count);
-                g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
-                return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
-            }
-        }
-    } else {
-        *values = NULL;
     }
     
+    *values = parts;
     *value_count = num_values;
-    tupledns_free_string_array(parts, *value_count + 1);
     return TUPLEDNS_OK;
 }
 
@@ -384,786 +1130,5078 @@ int tupledns_match_pattern(const char* coordinate, const char* pattern) {
         return 0;
     }
     
-    /* Simple wildcard matching - * matches any single component */
-    char** coord_parts;
-    char** pattern_parts;
-    int coord_count, pattern_count;
-    
-    coord_parts = tupledns_split_string(coordinate, ".", &coord_count);
-    pattern_parts = tupledns_split_string(pattern, ".", &pattern_count);
-    
-    if (!coord_parts || !pattern_parts || coord_count != pattern_count) {
-        tupledns_free_string_array(coord_parts, coord_count);
-        tupledns_free_string_array(pattern_parts, pattern_count);
-        return 0;
-    }
-    
-    int match = 1;
-    for (int i = 0; i < coord_count && match; i++) {
-        if (strcmp(pattern_parts[i], "*") != 0 && 
-            strcmp(pattern_parts[i], coord_parts[i]) != 0) {
-            match = 0;
+    /* Compare label by label in place: "*" matches any single label and
+     * other labels compare case-insensitively */
+    const char* c = coordinate;
+    const char* p = pattern;
+    for (;;) {
+        size_t clen = strcspn(c, ".");
+        size_t plen = strcspn(p, ".");
+        if (!(plen == 1 && p[0] == '*') && (clen != plen || !tuple_label_equal(c, p, clen))) {
+            return 0;
+        }
+        c += clen;
+        p += plen;
+        if (*c == '\0' || *p == '\0') {
+            return *c == *p;
         }
+        c++;
+        p++;
     }
-    
-    tupledns_free_string_array(coord_parts, coord_count);
-    tupledns_free_string_array(pattern_parts, pattern_count);
-    
-    return match;
 }
 
 /* ========================================================================
- * DNS QUERY FUNCTIONS
+ * STRING INTERNING
  * ======================================================================== */
 
-int tupledns_dns_query_a(const char* hostname, char** ip_address) {
-    if (!hostname || !ip_address) {
-        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
-        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+/* Maps each distinct string to a dense uint32_t ID. Labels are case-folded
+ * per RFC 4343; capability tables set exact to match tupledns_has_capability. */
+
+#define TUPLE_SLOT_EMPTY 0u
+
+typedef struct {
+    char** strings;             /* ID -> case-folded label */
+    uint32_t* hashes;           /* ID -> hash of the label */
+    uint32_t count;
+    uint32_t capacity;
+    uint32_t* slots;            /* Open addressing: ID + 1, or TUPLE_SLOT_EMPTY */
+    uint32_t slot_count;        /* Power of two */
+    int exact;                  /* Compare bytes exactly instead of case-folding */
+} tuple_label_table_t;
+
+static uint32_t tuple_label_hash(const char* label, size_t len, int exact) {
+    uint32_t hash = 2166136261u;
+    for (size_t i = 0; i < len; i++) {
+        uint8_t c = exact ? (uint8_t)label[i] : (uint8_t)tolower((unsigned char)label[i]);
+        hash = (hash ^ c) * 16777619u;
     }
-    
-    struct addrinfo hints, *result;
-    memset(&hints, 0, sizeof(hints));
-    hints.ai_family = AF_UNSPEC;
-    hints.ai_socktype = SOCK_STREAM;
-    
-    int status = getaddrinfo(hostname, NULL, &hints, &result);
-    if (status != 0) {
-        g_last_error = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
-        return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+    return hash;
+}
+
+static uint32_t tuple_labels_find(const tuple_label_table_t* table, const char* label, size_t len) {
+    if (table->slot_count == 0) {
+        return TUPLEDNS_LABEL_NONE;
     }
-    
-    char* addr_str = malloc(INET6_ADDRSTRLEN);
-    if (!addr_str) {
-        freeaddrinfo(result);
-        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
-        return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    uint32_t mask = table->slot_count - 1;
+    uint32_t hash = tuple_label_hash(label, len, table->exact);
+    for (uint32_t i = hash & mask; table->slots[i] != TUPLE_SLOT_EMPTY; i = (i + 1) & mask) {
+        uint32_t id = table->slots[i] - 1;
+        const char* candidate = table->strings[id];
+        if (table->hashes[id] == hash && strlen(candidate) == len &&
+            (table->exact ? memcmp(candidate, label, len) == 0 : tuple_label_equal(candidate, label, len))) {
+            return id;
+        }
     }
-    
-    void* addr_ptr;
-    if (result->ai_family == AF_INET) {
-        struct sockaddr_in* ipv4 = (struct sockaddr_in*)result->ai_addr;
-        addr_ptr = &(ipv4->sin_addr);
-    } else {
-        struct sockaddr_in6* ipv6 = (struct sockaddr_in6*)result->ai_addr;
-        addr_ptr = &(ipv6->sin6_addr);
+    return TUPLEDNS_LABEL_NONE;
+}
+
+static int tuple_labels_grow(tuple_label_table_t* table) {
+    uint32_t slot_count = table->slot_count ? table->slot_count * 2 : 64;
+    uint32_t* slots = calloc(slot_count, sizeof(uint32_t));
+    if (!slots) {
+        return -1;
     }
-    
-    if (!inet_ntop(result->ai_family, addr_ptr, addr_str, INET6_ADDRSTRLEN)) {
-        free(addr_str);
-        freeaddrinfo(result);
-        g_last_error = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
-        return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+    for (uint32_t id = 0; id < table->count; id++) {
+        uint32_t i = table->hashes[id] & (slot_count - 1);
+        while (slots[i] != TUPLE_SLOT_EMPTY) i = (i + 1) & (slot_count - 1);
+        slots[i] = id + 1;
     }
-    
-    *ip_address = addr_str;
-    freeaddrinfo(result);
-    return TUPLEDNS_OK;
+    free(table->slots);
+    table->slots = slots;
+    table->slot_count = slot_count;
+    return 0;
 }
 
-int tupledns_dns_query_txt(const char* hostname, char*** txt_records, int* record_count) {
-    /* Note: This is a simplified implementation. 
-     * In practice, you'd want to use a proper DNS library like ldns or c-ares 
-     * for full TXT record parsing. */
-    
-    if (!hostname || !txt_records || !record_count) {
-        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
-        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+static uint32_t tuple_labels_intern(tuple_label_table_t* table, const char* label, size_t len) {
+    uint32_t id = tuple_labels_find(table, label, len);
+    if (id != TUPLEDNS_LABEL_NONE) {
+        return id;
+    }
+    if ((table->count + 1) * 4 > table->slot_count * 3 && tuple_labels_grow(table) != 0) {
+        return TUPLEDNS_LABEL_NONE;
+    }
+    if (table->count == table->capacity) {
+        uint32_t capacity = table->capacity ? table->capacity * 2 : 64;
+        char** strings = realloc(table->strings, capacity * sizeof(char*));
+        if (!strings) return TUPLEDNS_LABEL_NONE;
+        table->strings = strings;
+        uint32_t* hashes = realloc(table->hashes, capacity * sizeof(uint32_t));
+        if (!hashes) return TUPLEDNS_LABEL_NONE;
+        table->hashes = hashes;
+        table->capacity = capacity;
     }
     
-    *txt_records = NULL;
-    *record_count = 0;
+    char* folded = tuple_strndup(label, len);
+    if (!folded) {
+        return TUPLEDNS_LABEL_NONE;
+    }
+    for (size_t i = 0; !table->exact && i < len; i++) {
+        folded[i] = (char)tolower((unsigned char)folded[i]);
+    }
     
-    /* For now, return empty result - would need proper DNS library */
-    g_last_error = TUPLEDNS_ERROR_NO_RESULTS;
-    return TUPLEDNS_ERROR_NO_RESULTS;
+    id = table->count++;
+    table->strings[id] = folded;
+    table->hashes[id] = tuple_label_hash(label, len, table->exact);
+    uint32_t mask = table->slot_count - 1;
+    uint32_t i = table->hashes[id] & mask;
+    while (table->slots[i] != TUPLE_SLOT_EMPTY) i = (i + 1) & mask;
+    table->slots[i] = id + 1;
+    return id;
+}
+
+static void tuple_labels_free(tuple_label_table_t* table) {
+    for (uint32_t id = 0; id < table->count; id++) {
+        free(table->strings[id]);
+    }
+    free(table->strings);
+    free(table->hashes);
+    free(table->slots);
+    table->strings = NULL;
+    table->hashes = NULL;
+    table->slots = NULL;
+    table->count = table->capacity = table->slot_count = 0;
 }
 
 /* ========================================================================
- * CAPABILITY HANDLING
+ * DNS WIRE PROTOCOL
  * ======================================================================== */
 
-int tupledns_parse_capabilities(const char* txt_record, char*** capabilities, int* capability_count) {
-    if (!txt_record || !capabilities || !capability_count) {
-        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
-        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+#define TUPLE_DNS_TYPE_A 1
+#define TUPLE_DNS_TYPE_CNAME 5
+#define TUPLE_DNS_TYPE_SOA 6
+#define TUPLE_DNS_TYPE_TXT 16
+#define TUPLE_DNS_TYPE_AAAA 28
+#define TUPLE_DNS_TYPE_AXFR 252
+#define TUPLE_DNS_TYPE_ANY 255
+#define TUPLE_DNS_CLASS_IN 1
+#define TUPLE_DNS_CLASS_ANY 255
+#define TUPLE_DNS_FLAG_QR 0x8000
+#define TUPLE_DNS_FLAG_TC 0x0200
+#define TUPLE_DNS_FLAG_RD 0x0100
+#define TUPLE_DNS_OPCODE_UPDATE 5
+#define TUPLE_DNS_TYPE_OPT 41
+#define TUPLE_DNS_RCODE_FORMERR 1
+#define TUPLE_DNS_RCODE_NXDOMAIN 3
+#define TUPLE_DNS_EDNS_PAYLOAD 1232          /* Advertised UDP payload (EDNS0) */
+#define TUPLE_DNS_OPT_LENGTH 11
+#define TUPLE_DNS_UDP_BUFFER 4096
+#define TUPLE_TCP_IDLE_TIMEOUT 10.0          /* Pooled connection lifetime when unused */
+#define TUPLE_DNS_QUERY_BUFFER 512
+#define TUPLE_DNS_UPDATE_BUFFER 4096
+#define TUPLE_DNS_ZONE "tuple"
+#define TUPLE_QUERY_LABEL "_q"            /* Server-side pattern evaluation */
+#define TUPLE_QUERY_FEATURES "tupledns-q="
+#define TUPLE_QUERY_CAPS_FEATURES "tupledns-q-caps="
+#define TUPLE_QUERY_CAPS_LABEL "_c"
+#define TUPLE_QUERY_UNLIMITED INT_MAX
+#define TUPLE_CNAME_MAX_CHAIN 8
+#define TUPLE_WIRE_MAX_BATCH 8             /* Questions sent in parallel */
+#define TUPLE_Q_PATTERNS 1                /* Server evaluates wildcard patterns */
+#define TUPLE_Q_CAPS 2                    /* ... and filters by capability */
+
+/* One parsed resource record; rdata stays in the message buffer */
+typedef struct {
+    char name[TUPLEDNS_MAX_COORDINATE_LENGTH + 3];
+    uint16_t type;
+    uint16_t rclass;
+    uint32_t ttl;
+    uint16_t rdlength;
+    size_t rdata_offset;
+} tuple_dns_rr_t;
+
+/* A parsed DNS message (answer section only) */
+typedef struct {
+    uint8_t* data;
+    size_t length;
+    uint16_t id;
+    uint16_t flags;
+    tuple_dns_rr_t* answers;
+    int answer_count;
+} tuple_dns_msg_t;
+
+static double tuple_now(void) {
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec / 1000000.0;
+}
+
+static double tuple_deadline(void) {
+    double timeout = tuple_config().timeout;
+    if (timeout <= 0) {
+        timeout = TUPLEDNS_DEFAULT_TIMEOUT;
+    }
+    return tuple_now() + timeout;
+}
+
+static int tuple_remaining_ms(double deadline) {
+    double remaining = deadline - tuple_now();
+    if (remaining <= 0) {
+        return 0;
     }
+    return (int)(remaining * 1000.0) + 1;
+}
+
+static uint16_t tuple_wire_next_id(void) {
+    return (uint16_t)(rand() & 0xFFFF);
+}
+
+static void tuple_wire_put16(uint8_t* buf, size_t off, uint16_t value) {
+    buf[off] = (uint8_t)(value >> 8);
+    buf[off + 1] = (uint8_t)(value & 0xFF);
+}
+
+static void tuple_wire_put32(uint8_t* buf, size_t off, uint32_t value) {
+    tuple_wire_put16(buf, off, (uint16_t)(value >> 16));
+    tuple_wire_put16(buf, off + 2, (uint16_t)(value & 0xFFFF));
+}
+
+static uint16_t tuple_wire_get16(const uint8_t* buf, size_t off) {
+    return (uint16_t)((buf[off] << 8) | buf[off + 1]);
+}
+
+static uint32_t tuple_wire_get32(const uint8_t* buf, size_t off) {
+    return ((uint32_t)tuple_wire_get16(buf, off) << 16) | tuple_wire_get16(buf, off + 2);
+}
+
+static int tuple_wire_put_name(uint8_t* buf, size_t cap, size_t* off, const char* name) {
+    size_t pos = *off;
+    const char* label = name;
     
-    /* Look for caps= prefix */
-    const char* caps_prefix = "caps=";
-    const char* caps_start = strstr(txt_record, caps_prefix);
-    if (!caps_start) {
-        *capabilities = NULL;
-        *capability_count = 0;
-        return TUPLEDNS_OK;
+    while (*label) {
+        const char* dot = strchr(label, '.');
+        size_t len = dot ? (size_t)(dot - label) : strlen(label);
+        if (len == 0 || len > 63 || pos + len + 2 > cap) {
+            return -1;
+        }
+        buf[pos++] = (uint8_t)len;
+        memcpy(buf + pos, label, len);
+        pos += len;
+        if (!dot) break;
+        label = dot + 1;
     }
     
-    caps_start += strlen(caps_prefix);
+    if (pos + 1 > cap) {
+        return -1;
+    }
+    buf[pos++] = 0;
+    *off = pos;
+    return 0;
+}
+
+static int tuple_wire_get_name(const uint8_t* msg, size_t len, size_t* off,
+                               char* out, size_t out_cap) {
+    size_t pos = *off;
+    size_t out_len = 0;
+    int jumped = 0;
+    int hops = 0;
     
-    /* Find end of capabilities (space or end of string) */
-    const char* caps_end = strchr(caps_start, ' ');
-    if (!caps_end) {
-        caps_end = caps_start + strlen(caps_start);
+    while (1) {
+        if (pos >= len) return -1;
+        uint8_t c = msg[pos];
+        if ((c & 0xC0) == 0xC0) {
+            if (pos + 1 >= len || ++hops > 64) return -1;
+            if (!jumped) {
+                *off = pos + 2;
+                jumped = 1;
+            }
+            pos = ((size_t)(c & 0x3F) << 8) | msg[pos + 1];
+            continue;
+        }
+        if (c & 0xC0) return -1;
+        pos++;
+        if (c == 0) break;
+        if (pos + c > len || out_len + c + 2 > out_cap) return -1;
+        if (out_len > 0) {
+            out[out_len++] = '.';
+        }
+        memcpy(out + out_len, msg + pos, c);
+        out_len += c;
+        pos += c;
     }
     
-    /* Extract capabilities substring */
-    size_t caps_len = caps_end - caps_start;
-    char* caps_str = malloc(caps_len + 1);
-    if (!caps_str) {
-        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
-        return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    out[out_len] = '\0';
+    if (!jumped) {
+        *off = pos;
+    }
+    return 0;
+}
+
+/* Write a 12-byte header; returns the offset of the first section */
+static size_t tuple_wire_put_header(uint8_t* buf, uint16_t id, uint16_t flags,
+                                    uint16_t qd, uint16_t an, uint16_t ns, uint16_t ar) {
+    tuple_wire_put16(buf, 0, id);
+    tuple_wire_put16(buf, 2, flags);
+    tuple_wire_put16(buf, 4, qd);
+    tuple_wire_put16(buf, 6, an);
+    tuple_wire_put16(buf, 8, ns);
+    tuple_wire_put16(buf, 10, ar);
+    return 12;
+}
+
+/* Build a query, advertising an EDNS0 UDP payload unless the server rejected it */
+static size_t tuple_wire_build_query(uint8_t* buf, size_t cap, uint16_t id,
+                                     const char* name, uint16_t type) {
+    int edns = tuple_server_edns();
+    size_t off = tuple_wire_put_header(buf, id, TUPLE_DNS_FLAG_RD, 1, 0, 0, edns ? 1 : 0);
+    if (tuple_wire_put_name(buf, cap, &off, name) != 0 || off + 4 + TUPLE_DNS_OPT_LENGTH > cap) {
+        return 0;
+    }
+    tuple_wire_put16(buf, off, type);
+    tuple_wire_put16(buf, off + 2, TUPLE_DNS_CLASS_IN);
+    off += 4;
+    if (edns) {
+        /* OPT pseudo-RR (RFC 6891): root owner, payload size in the class */
+        buf[off] = 0;
+        tuple_wire_put16(buf, off + 1, TUPLE_DNS_TYPE_OPT);
+        tuple_wire_put16(buf, off + 3, TUPLE_DNS_EDNS_PAYLOAD);
+        tuple_wire_put32(buf, off + 5, 0);
+        tuple_wire_put16(buf, off + 9, 0);
+        off += TUPLE_DNS_OPT_LENGTH;
+    }
+    return off;
+}
+
+/* Drop the trailing OPT record of a query built above; returns the new length */
+static size_t tuple_wire_strip_edns(uint8_t* query, size_t len) {
+    if (len < 12 + TUPLE_DNS_OPT_LENGTH || tuple_wire_get16(query, 10) != 1 ||
+        tuple_wire_get16(query, len - TUPLE_DNS_OPT_LENGTH + 1) != TUPLE_DNS_TYPE_OPT) {
+        return len;
+    }
+    tuple_wire_put16(query, 10, 0);
+    return len - TUPLE_DNS_OPT_LENGTH;
+}
+
+static void tuple_wire_free(tuple_dns_msg_t* msg) {
+    if (!msg) return;
+    free(msg->data);
+    free(msg->answers);
+    memset(msg, 0, sizeof(*msg));
+}
+
+/* Parse a message, taking ownership of data */
+static int tuple_wire_parse(uint8_t* data, size_t len, tuple_dns_msg_t* msg) {
+    memset(msg, 0, sizeof(*msg));
+    msg->data = data;
+    msg->length = len;
+    if (len < 12) {
+        return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
     }
     
-    strncpy(caps_str, caps_start, caps_len);
-    caps_str[caps_len] = '\0';
+    msg->id = tuple_wire_get16(data, 0);
+    msg->flags = tuple_wire_get16(data, 2);
+    uint16_t qd = tuple_wire_get16(data, 4);
+    uint16_t an = tuple_wire_get16(data, 6);
     
-    /* Split by commas */
-    *capabilities = tupledns_split_string(caps_str, ",", capability_count);
-    free(caps_str);
+    size_t off = 12;
+    char name[TUPLEDNS_MAX_COORDINATE_LENGTH + 3];
+    for (int i = 0; i < qd; i++) {
+        if (tuple_wire_get_name(data, len, &off, name, sizeof(name)) != 0 || off + 4 > len) {
+            return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        }
+        off += 4;
+    }
     
-    if (!*capabilities) {
-        *capability_count = 0;
-        g_last_error = TUPLEDNS_ERROR_CAPABILITY_PARSE;
-        return TUPLEDNS_ERROR_CAPABILITY_PARSE;
+    if (an > 0) {
+        msg->answers = calloc(an, sizeof(tuple_dns_rr_t));
+        if (!msg->answers) {
+            return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        }
+    }
+    
+    for (int i = 0; i < an; i++) {
+        tuple_dns_rr_t* rr = &msg->answers[i];
+        if (tuple_wire_get_name(data, len, &off, rr->name, sizeof(rr->name)) != 0 || off + 10 > len) {
+            return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        }
+        rr->type = tuple_wire_get16(data, off);
+        rr->rclass = tuple_wire_get16(data, off + 2);
+        rr->ttl = tuple_wire_get32(data, off + 4);
+        rr->rdlength = tuple_wire_get16(data, off + 8);
+        rr->rdata_offset = off + 10;
+        off += 10 + rr->rdlength;
+        if (off > len) {
+            return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        }
+        msg->answer_count++;
     }
     
     return TUPLEDNS_OK;
 }
 
-char** tupledns_copy_capabilities(const char* capabilities[], int count) {
-    if (!capabilities || count <= 0) {
-        return NULL;
+/* Send up to TUPLE_WIRE_MAX_BATCH queries at once from one UDP socket and
+ * collect the replies, matched by ID, until all have arrived or the deadline
+ * passes. Unanswered queries are retransmitted once a second. */
+static void tuple_wire_udp_batch(const uint8_t* const queries[], const size_t query_lens[], int n,
+                                 uint8_t* replies[], size_t reply_lens[], int status[], double deadline) {
+    int pending = n;
+    for (int q = 0; q < n; q++) {
+        replies[q] = NULL;
+        status[q] = TUPLEDNS_ERROR_TIMEOUT;
     }
+    tuple_stats_add(&g_connection_stats.udp_queries, n);
     
-    char** result = malloc(count * sizeof(char*));
-    if (!result) {
-        return NULL;
+    struct sockaddr_storage server;
+    socklen_t server_len = tuple_server_address(&server);
+    int fd = server_len ? socket(server.ss_family, SOCK_DGRAM, 0) : -1;
+    if (fd < 0 || connect(fd, (struct sockaddr*)&server, server_len) < 0) {
+        for (int q = 0; q < n; q++) status[q] = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        if (fd >= 0) close(fd);
+        return;
     }
     
-    for (int i = 0; i < count; i++) {
-        if (capabilities[i]) {
-            result[i] = strdup(capabilities[i]);
-            if (!result[i]) {
-                tupledns_free_capabilities(result, i);
-                return NULL;
+    uint8_t* buf = NULL;
+    double next_send = 0;
+    while (pending > 0) {
+        double now = tuple_now();
+        if (now >= deadline) break;
+        if (now >= next_send) {
+            /* Retransmit once a second until the deadline */
+            for (int q = 0; q < n; q++) {
+                if (status[q] != TUPLEDNS_ERROR_TIMEOUT) continue;
+                if (send(fd, queries[q], query_lens[q], 0) < 0) {
+                    status[q] = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+                    pending--;
+                } else {
+                    tuple_stats_add(&g_stats.bytes_sent, query_lens[q]);
+                }
+            }
+            next_send = now + 1.0;
+        }
+        
+        double wait_until = next_send < deadline ? next_send : deadline;
+        struct pollfd pfd = { fd, POLLIN, 0 };
+        int ready = poll(&pfd, 1, tuple_remaining_ms(wait_until));
+        if (ready < 0 && errno != EINTR) {
+            for (int q = 0; q < n; q++) {
+                if (status[q] == TUPLEDNS_ERROR_TIMEOUT) status[q] = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+            }
+            break;
+        }
+        if (ready <= 0) continue;
+        
+        if (!buf && !(buf = malloc(TUPLE_DNS_UDP_BUFFER))) {
+            for (int q = 0; q < n; q++) {
+                if (status[q] == TUPLEDNS_ERROR_TIMEOUT) status[q] = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+            }
+            break;
+        }
+        ssize_t len = recv(fd, buf, TUPLE_DNS_UDP_BUFFER, 0);
+        if (len > 0) {
+            tuple_stats_add(&g_stats.bytes_received, (uint64_t)len);
+        }
+        if (len < 12 || !(tuple_wire_get16(buf, 2) & TUPLE_DNS_FLAG_QR)) continue;
+        for (int q = 0; q < n; q++) {
+            if (status[q] == TUPLEDNS_ERROR_TIMEOUT && tuple_wire_get16(buf, 0) == tuple_wire_get16(queries[q], 0)) {
+                replies[q] = buf;
+                reply_lens[q] = (size_t)len;
+                status[q] = TUPLEDNS_OK;
+                pending--;
+                buf = NULL;
+                break;
             }
-        } else {
-            result[i] = NULL;
         }
     }
     
-    return result;
+    free(buf);
+    close(fd);
 }
 
-void tupledns_free_capabilities(char** capabilities, int count) {
-    tupledns_free_string_array(capabilities, count);
+static int tuple_wire_udp(const uint8_t* query, size_t query_len,
+                          uint8_t** reply, size_t* reply_len, double deadline) {
+    int status;
+    tuple_wire_udp_batch(&query, &query_len, 1, reply, reply_len, &status, deadline);
+    return status;
 }
 
-int tupledns_has_capability(const tupledns_node_t* node, const char* capability) {
-    if (!node || !capability) {
-        return 0;
+static int tuple_wire_tcp_connect(double deadline) {
+    struct sockaddr_storage server;
+    socklen_t server_len = tuple_server_address(&server);
+    int fd = server_len ? socket(server.ss_family, SOCK_STREAM, 0) : -1;
+    if (fd < 0) {
+        return -1;
     }
     
-    for (int i = 0; i < node->capability_count; i++) {
-        if (node->capabilities[i] && strcmp(node->capabilities[i], capability) == 0) {
-            return 1;
+    int flags = fcntl(fd, F_GETFL, 0);
+    fcntl(fd, F_SETFL, flags | O_NONBLOCK);
+    /* Pipelined queries go out without waiting for the previous reply's ACK */
+    int nodelay = 1;
+    setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, &nodelay, sizeof(nodelay));
+    
+    if (connect(fd, (struct sockaddr*)&server, server_len) < 0) {
+        if (errno != EINPROGRESS) {
+            close(fd);
+            return -1;
+        }
+        struct pollfd pfd = { fd, POLLOUT, 0 };
+        int error = 0;
+        socklen_t error_len = sizeof(error);
+        if (poll(&pfd, 1, tuple_remaining_ms(deadline)) <= 0 ||
+            getsockopt(fd, SOL_SOCKET, SO_ERROR, &error, &error_len) < 0 || error != 0) {
+            close(fd);
+            return -1;
         }
     }
     
-    return 0;
+    return fd;
 }
 
-/* ========================================================================
- * MEMORY MANAGEMENT
- * ======================================================================== */
-
-void tupledns_free_node(tupledns_node_t* node) {
-    if (!node) return;
-    
-    free(node->coordinate);
-    free(node->ip_address);
-    tupledns_free_capabilities(node->capabilities, node->capability_count);
-    memset(node, 0, sizeof(tupledns_node_t));
+static int tuple_wire_tcp_write(int fd, const uint8_t* buf, size_t len, double deadline) {
+    size_t sent = 0;
+    while (sent < len) {
+        ssize_t n = send(fd, buf + sent, len - sent, 0);
+        if (n > 0) {
+            sent += (size_t)n;
+            continue;
+        }
+        if (n < 0 && errno != EAGAIN && errno != EWOULDBLOCK && errno != EINTR) {
+            return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        }
+        struct pollfd pfd = { fd, POLLOUT, 0 };
+        if (poll(&pfd, 1, tuple_remaining_ms(deadline)) <= 0) {
+            return TUPLEDNS_ERROR_TIMEOUT;
+        }
+    }
+    return TUPLEDNS_OK;
 }
 
-void tupledns_free_result(tupledns_result_t* result) {
-    if (!result) return;
-    
-    if (result->nodes) {
-        for (int i = 0; i < result->node_count; i++) {
-            tupledns_free_node(&result->nodes[i]);
+static int tuple_wire_tcp_read(int fd, uint8_t* buf, size_t len, double deadline) {
+    size_t got = 0;
+    while (got < len) {
+        ssize_t n = recv(fd, buf + got, len - got, 0);
+        if (n > 0) {
+            got += (size_t)n;
+            continue;
+        }
+        if (n == 0 || (errno != EAGAIN && errno != EWOULDBLOCK && errno != EINTR)) {
+            return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        }
+        struct pollfd pfd = { fd, POLLIN, 0 };
+        if (poll(&pfd, 1, tuple_remaining_ms(deadline)) <= 0) {
+            return TUPLEDNS_ERROR_TIMEOUT;
         }
-        free(result->nodes);
     }
-    
-    free(result);
+    return TUPLEDNS_OK;
 }
 
-/* ========================================================================
- * DNS REGISTRATION HELPER FUNCTIONS
- * ======================================================================== */
+/* Prefix and message go out in one write: two small writes on a reused
+ * connection stall behind Nagle until the server's delayed ACK */
+static int tuple_wire_tcp_send_message(int fd, const uint8_t* msg, size_t len, double deadline) {
+    uint8_t local[2 + 512];
+    uint8_t* frame = len <= sizeof(local) - 2 ? local : malloc(len + 2);
+    if (!frame) {
+        return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    }
+    tuple_wire_put16(frame, 0, (uint16_t)len);
+    memcpy(frame + 2, msg, len);
+    int status = tuple_wire_tcp_write(fd, frame, len + 2, deadline);
+    if (frame != local) {
+        free(frame);
+    }
+    if (status == TUPLEDNS_OK) {
+        tuple_stats_add(&g_stats.bytes_sent, len + 2);
+    }
+    return status;
+}
 
-int tupledns_get_local_ip(char** ip_address) {
-    if (!ip_address) {
-        return -1;
+static int tuple_wire_tcp_recv_message(int fd, uint8_t** msg, size_t* len, double deadline) {
+    uint8_t prefix[2];
+    int status = tuple_wire_tcp_read(fd, prefix, 2, deadline);
+    if (status != TUPLEDNS_OK) {
+        return status;
     }
     
-    /* Get actual local IP address */
-    int sock = socket(AF_INET, SOCK_DGRAM, 0);
-    if (sock < 0) {
-        *ip_address = strdup("127.0.0.1");
-        return *ip_address ? 0 : -1;
+    size_t msg_len = tuple_wire_get16(prefix, 0);
+    uint8_t* buf = malloc(msg_len > 0 ? msg_len : 1);
+    if (!buf) {
+        return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
     }
     
-    /* Connect to a remote address to determine local interface */
-    struct sockaddr_in serv;
-    memset(&serv, 0, sizeof(serv));
-    serv.sin_family = AF_INET;
-    serv.sin_addr.s_addr = inet_addr("8.8.8.8");
-    serv.sin_port = htons(53);
-    
-    int result = connect(sock, (struct sockaddr*)&serv, sizeof(serv));
-    if (result < 0) {
-        close(sock);
-        *ip_address = strdup("127.0.0.1");
-        return *ip_address ? 0 : -1;
+    status = tuple_wire_tcp_read(fd, buf, msg_len, deadline);
+    if (status != TUPLEDNS_OK) {
+        free(buf);
+        return status;
     }
+    tuple_stats_add(&g_stats.bytes_received, msg_len + 2);
     
-    struct sockaddr_in name;
-    socklen_t namelen = sizeof(name);
-    result = getsockname(sock, (struct sockaddr*)&name, &namelen);
-    close(sock);
-    
-    if (result < 0) {
-        *ip_address = strdup("127.0.0.1");
-        return *ip_address ? 0 : -1;
-    }
-    
-    *ip_address = strdup(inet_ntoa(name.sin_addr));
-    return *ip_address ? 0 : -1;
+    *msg = buf;
+    *len = msg_len;
+    return TUPLEDNS_OK;
 }
 
-int tupledns_register_dns_record(const char* name, const char* type, const char* value, int ttl) {
-    if (!name || !type || !value) {
-        return -1;
+static void tuple_wire_tcp_drop(void) {
+    if (g_tcp_fd >= 0) {
+        close(g_tcp_fd);
+        g_tcp_fd = -1;
     }
-    
-    /* This would interface with DNS server APIs or dynamic DNS services
-     * For testing/development, we log the registration intent */
-    printf("DNS Registration: %s %d IN %s %s\n", name, ttl, type, value);
-    
-    /* In production, this would:
-     * 1. Connect to authoritative DNS server
-     * 2. Authenticate with DNS service
-     * 3. Create/update DNS record
-     * 4. Verify registration success
-     */
-    
-    return 0; /* Success */
 }
 
-char* tupledns_format_capabilities(const char* capabilities[]) {
-    if (!capabilities || !capabilities[0]) {
-        return NULL;
+static void tuple_wire_tcp_close(void) {
+    pthread_mutex_lock(&g_tcp_lock);
+    tuple_wire_tcp_drop();
+    pthread_mutex_unlock(&g_tcp_lock);
+}
+
+/* Return the pooled connection, opening one if there is none or the server
+ * closed it; *reused tells whether it had carried queries before */
+static int tuple_wire_tcp_acquire(double deadline, int* reused) {
+    if (g_tcp_fd >= 0) {
+        struct pollfd pfd = { g_tcp_fd, POLLIN, 0 };
+        if (tuple_now() - g_tcp_last_used > TUPLE_TCP_IDLE_TIMEOUT) {
+            tuple_stats_add(&g_connection_stats.tcp_idle_evictions, 1);
+            tuple_wire_tcp_drop();
+        } else if (poll(&pfd, 1, 0) != 0) {
+            /* Readable while idle: the server hung up (or sent junk) */
+            tuple_wire_tcp_drop();
+        }
     }
-    
-    /* Calculate total length needed */
-    size_t total_len = 5; /* "caps=" */
-    int count = 0;
-    
-    while (capabilities[count]) {
-        total_len += strlen(capabilities[count]);
-        if (count > 0) total_len++; /* comma */
-        count++;
+    *reused = g_tcp_fd >= 0;
+    if (g_tcp_fd < 0) {
+        g_tcp_fd = tuple_wire_tcp_connect(deadline);
+        if (g_tcp_fd < 0) {
+            return -1;
+        }
+        tuple_stats_add(&g_connection_stats.tcp_connections, 1);
     }
-    total_len++; /* null terminator */
-    
-    char* result = malloc(total_len);
-    if (!result) {
-        return NULL;
+    return g_tcp_fd;
+}
+
+/* Write every query before reading any reply (RFC 7766 pipelining) and
+ * match the replies, which may come in any order, by ID */
+static int tuple_wire_tcp_pipeline(int fd, const uint8_t* const queries[], const size_t query_lens[], int n,
+                                   uint8_t* replies[], size_t reply_lens[], int status[], double deadline) {
+    int pending = 0;
+    for (int q = 0; q < n; q++) {
+        if (status[q] == TUPLEDNS_OK) continue;
+        int sent = tuple_wire_tcp_send_message(fd, queries[q], query_lens[q], deadline);
+        if (sent != TUPLEDNS_OK) {
+            return sent;
+        }
+        tuple_stats_add(&g_connection_stats.tcp_queries, 1);
+        if (pending > 0) {
+            tuple_stats_add(&g_connection_stats.tcp_pipelined, 1);
+        }
+        pending++;
     }
     
-    strcpy(result, "caps=");
-    for (int i = 0; i < count; i++) {
-        if (i > 0) strcat(result, ",");
-        strcat(result, capabilities[i]);
+    while (pending > 0) {
+        uint8_t* data = NULL;
+        size_t len = 0;
+        int received = tuple_wire_tcp_recv_message(fd, &data, &len, deadline);
+        if (received != TUPLEDNS_OK) {
+            return received;
+        }
+        int q = 0;
+        while (q < n && (status[q] == TUPLEDNS_OK || len < 12 ||
+                         tuple_wire_get16(data, 0) != tuple_wire_get16(queries[q], 0))) {
+            q++;
+        }
+        if (q == n) {
+            free(data);
+            continue;
+        }
+        replies[q] = data;
+        reply_lens[q] = len;
+        status[q] = TUPLEDNS_OK;
+        pending--;
     }
-    
-    return result;
+    return TUPLEDNS_OK;
 }
 
-int tupledns_expand_pattern(const char* pattern, char*** query_names, int* query_count) {
-    if (!pattern || !query_names || !query_count) {
-        return -1;
+/* Exchange up to TUPLE_WIRE_MAX_BATCH queries over the pooled connection.
+ * A pooled connection the server dropped in the meantime is replaced once;
+ * any failure closes it so the next exchange starts afresh. */
+static void tuple_wire_tcp_batch_locked(const uint8_t* const queries[], const size_t query_lens[], int n,
+                                        uint8_t* replies[], size_t reply_lens[], int status[], double deadline) {
+    for (int q = 0; q < n; q++) {
+        replies[q] = NULL;
+        status[q] = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
     }
     
-    *query_names = NULL;
-    *query_count = 0;
-    
-    /* If no wildcards, return the pattern as-is */
-    if (!strchr(pattern, '*')) {
-        *query_names = malloc(sizeof(char*));
-        if (!*query_names) return -1;
+    for (int attempt = 0; attempt < 2; attempt++) {
+        int reused = 0;
+        int fd = tuple_wire_tcp_acquire(deadline, &reused);
+        if (fd < 0) {
+            return;
+        }
+        if (reused) {
+            tuple_stats_add(&g_connection_stats.tcp_reused, 1);
+        }
         
-        (*query_names)[0] = strdup(pattern);
-        if (!(*query_names)[0]) {
-            free(*query_names);
-            return -1;
+        int result = tuple_wire_tcp_pipeline(fd, queries, query_lens, n, replies, reply_lens, status, deadline);
+        if (result == TUPLEDNS_OK) {
+            g_tcp_last_used = tuple_now();
+            return;
         }
+        tuple_wire_tcp_drop();
         
-        *query_count = 1;
-        return 0;
+        int progressed = 0;
+        for (int q = 0; q < n; q++) progressed += status[q] == TUPLEDNS_OK;
+        if (!reused || progressed > 0 || result == TUPLEDNS_ERROR_TIMEOUT) {
+            for (int q = 0; q < n; q++) {
+                if (status[q] != TUPLEDNS_OK) status[q] = result;
+            }
+            return;
+        }
+    }
+}
+
+static void tuple_wire_tcp_batch(const uint8_t* const queries[], const size_t query_lens[], int n,
+                                 uint8_t* replies[], size_t reply_lens[], int status[], double deadline) {
+    pthread_mutex_lock(&g_tcp_lock);
+    tuple_wire_tcp_batch_locked(queries, query_lens, n, replies, reply_lens, status, deadline);
+    pthread_mutex_unlock(&g_tcp_lock);
+}
+
+static int tuple_wire_tcp(const uint8_t* query, size_t query_len,
+                          uint8_t** reply, size_t* reply_len, double deadline) {
+    int status;
+    tuple_wire_tcp_batch(&query, &query_len, 1, reply, reply_len, &status, deadline);
+    return status;
+}
+
+/* Send a message to the configured server over UDP, retrying over TCP when truncated */
+static int tuple_wire_exchange(const uint8_t* query, size_t query_len, tuple_dns_msg_t* reply) {
+    if (!tuple_server_configured()) {
+        return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
     }
     
-    /* For wildcard patterns, implement DNS-based discovery */
+    double deadline = tuple_deadline();
+    uint8_t* data = NULL;
+    size_t len = 0;
     
-    /* Extract the .tuple domain for zone enumeration */
-    char* domain_part = strstr(pattern, ".tuple");
-    if (!domain_part) {
-        return -1; /* Invalid pattern */
+    int status = tuple_wire_udp(query, query_len, &data, &len, deadline);
+    if (status == TUPLEDNS_OK && len >= 4 && (tuple_wire_get16(data, 2) & TUPLE_DNS_FLAG_TC)) {
+        tuple_stats_add(&g_connection_stats.truncated, 1);
+        free(data);
+        data = NULL;
+        status = tuple_wire_tcp(query, query_len, &data, &len, deadline);
+    }
+    if (status != TUPLEDNS_OK) {
+        return status;
     }
     
-    /* Attempt DNS zone transfer to enumerate coordinates */
-    char zone_name[256];
-    snprintf(zone_name, sizeof(zone_name), "tuple");
+    status = tuple_wire_parse(data, len, reply);
+    if (status != TUPLEDNS_OK) {
+        tuple_wire_free(reply);
+        return status;
+    }
     
-    char** zone_records = NULL;
-    int record_count = 0;
+    /* A server without EDNS0 rejects the OPT record: ask again without it */
+    uint8_t plain[TUPLE_DNS_QUERY_BUFFER];
+    if ((reply->flags & 0xF) == TUPLE_DNS_RCODE_FORMERR && query_len <= sizeof(plain)) {
+        memcpy(plain, query, query_len);
+        size_t plain_len = tuple_wire_strip_edns(plain, query_len);
+        if (plain_len < query_len) {
+            if (tuple_server_disable_edns()) {
+                tuple_stats_add(&g_connection_stats.edns_fallbacks, 1);
+            }
+            tuple_wire_free(reply);
+            return tuple_wire_exchange(plain, plain_len, reply);
+        }
+    }
+    return TUPLEDNS_OK;
+}
+
+static int tuple_wire_rcode_status(const tuple_dns_msg_t* msg) {
+    int rcode = msg->flags & 0xF;
+    if (rcode == 0) {
+        return TUPLEDNS_OK;
+    }
+    return rcode == TUPLE_DNS_RCODE_NXDOMAIN ? TUPLEDNS_ERROR_NO_RESULTS : TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+}
+
+/* The stats bucket of a question; pattern queries are TXT questions under _q */
+static tupledns_query_type_t tuple_wire_stats_type(const char* name, uint16_t type) {
+    switch (type) {
+    case TUPLE_DNS_TYPE_A:
+        return TUPLEDNS_QUERY_A;
+    case TUPLE_DNS_TYPE_AAAA:
+        return TUPLEDNS_QUERY_AAAA;
+    case TUPLE_DNS_TYPE_SOA:
+        return TUPLEDNS_QUERY_SOA;
+    case TUPLE_DNS_TYPE_AXFR:
+        return TUPLEDNS_QUERY_AXFR;
+    default:
+        return (strncmp(name, TUPLE_QUERY_LABEL ".", 3) == 0 || strstr(name, "." TUPLE_QUERY_LABEL "."))
+            ? TUPLEDNS_QUERY_PATTERN : TUPLEDNS_QUERY_TXT;
+    }
+}
+
+static int tuple_wire_query(const char* name, uint16_t type, tuple_dns_msg_t* reply) {
+    uint8_t query[TUPLE_DNS_QUERY_BUFFER];
+    size_t query_len = tuple_wire_build_query(query, sizeof(query), tuple_wire_next_id(), name, type);
+    if (query_len == 0) {
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
     
-    /* Try to get zone records via AXFR (zone transfer) */
-    int zone_result = tupledns_dns_zone_transfer(zone_name, &zone_records, &record_count);
+    tuple_span_t span;
+    tuple_span_begin(&span, "dns_query");
+    double started = tuple_now();
+    int status = tuple_wire_exchange(query, query_len, reply);
+    if (status == TUPLEDNS_OK) {
+        status = tuple_wire_rcode_status(reply);
+        if (status != TUPLEDNS_OK) {
+            tuple_wire_free(reply);
+        }
+    }
+    tuple_stats_query(tuple_wire_stats_type(name, type), status, tuple_now() - started);
+    tuple_span_end(&span, name, status == TUPLEDNS_OK ? (int64_t)reply->length : 0);
+    return status;
+}
+
+/* Ask up to TUPLE_WIRE_MAX_BATCH questions in parallel under one deadline;
+ * each reply is checked as by tuple_wire_query */
+static void tuple_wire_query_batch(const char* const names[], const uint16_t types[], int n,
+                                   tuple_dns_msg_t replies[], int status[]) {
+    uint8_t queries[TUPLE_WIRE_MAX_BATCH][TUPLE_DNS_QUERY_BUFFER];
+    const uint8_t* query_ptrs[TUPLE_WIRE_MAX_BATCH];
+    size_t query_lens[TUPLE_WIRE_MAX_BATCH];
+    uint8_t* data[TUPLE_WIRE_MAX_BATCH];
+    size_t lens[TUPLE_WIRE_MAX_BATCH];
+    uint16_t id = tuple_wire_next_id();
     
-    if (zone_result == 0 && record_count > 0) {
-        /* Filter zone records by pattern */
-        char** matches = NULL;
-        int match_count = 0;
-        
-        for (int i = 0; i < record_count; i++) {
-            if (tupledns_match_pattern(zone_records[i], pattern)) {
-                matches = realloc(matches, (match_count + 1) * sizeof(char*));
-                if (matches) {
-                    matches[match_count] = strdup(zone_records[i]);
-                    match_count++;
-                }
+    for (int q = 0; q < n; q++) {
+        memset(&replies[q], 0, sizeof(replies[q]));
+        query_ptrs[q] = queries[q];
+        query_lens[q] = tuple_wire_build_query(queries[q], sizeof(queries[q]), (uint16_t)(id + q), names[q], types[q]);
+        if (query_lens[q] == 0 || !tuple_server_configured()) {
+            for (int r = 0; r < n; r++) {
+                status[r] = query_lens[q] == 0 ? TUPLEDNS_ERROR_INVALID_PARAMETER : TUPLEDNS_ERROR_DNS_QUERY_FAILED;
             }
+            return;
         }
-        
-        *query_names = matches;
-        *query_count = match_count;
-        
-        /* Free zone records */
-        tupledns_free_string_array(zone_records, record_count);
-        
-        return 0;
     }
     
-    /* If zone transfer fails, try iterative discovery */
-    /* This implements the hierarchical DNS structure approach */
-    char** candidates = NULL;
-    int candidate_count = 0;
+    tuple_span_t span;
+    tuple_span_begin(&span, "dns_query");
+    double started = tuple_now();
+    double deadline = tuple_deadline();
+    tuple_wire_udp_batch(query_ptrs, query_lens, n, data, lens, status, deadline);
     
-    /* Generate candidate coordinates based on pattern structure */
-    int expand_result = tupledns_generate_pattern_candidates(pattern, &candidates, &candidate_count);
+    /* Truncated answers are asked again together on the pooled TCP connection */
+    const uint8_t* retry_ptrs[TUPLE_WIRE_MAX_BATCH];
+    size_t retry_lens[TUPLE_WIRE_MAX_BATCH];
+    int retry_index[TUPLE_WIRE_MAX_BATCH];
+    int retries = 0;
+    for (int q = 0; q < n; q++) {
+        if (status[q] == TUPLEDNS_OK && lens[q] >= 4 && (tuple_wire_get16(data[q], 2) & TUPLE_DNS_FLAG_TC)) {
+            tuple_stats_add(&g_connection_stats.truncated, 1);
+            free(data[q]);
+            data[q] = NULL;
+            retry_ptrs[retries] = query_ptrs[q];
+            retry_lens[retries] = query_lens[q];
+            retry_index[retries++] = q;
+        }
+    }
+    if (retries > 0) {
+        uint8_t* retry_data[TUPLE_WIRE_MAX_BATCH];
+        size_t retry_data_lens[TUPLE_WIRE_MAX_BATCH];
+        int retry_status[TUPLE_WIRE_MAX_BATCH];
+        tuple_wire_tcp_batch(retry_ptrs, retry_lens, retries, retry_data, retry_data_lens, retry_status, deadline);
+        for (int r = 0; r < retries; r++) {
+            data[retry_index[r]] = retry_data[r];
+            lens[retry_index[r]] = retry_data_lens[r];
+            status[retry_index[r]] = retry_status[r];
+        }
+    }
     
-    if (expand_result == 0 && candidate_count > 0) {
-        /* Test each candidate with DNS lookup */
-        char** valid_names = NULL;
-        int valid_count = 0;
-        
-        for (int i = 0; i < candidate_count; i++) {
-            char* test_ip = NULL;
-            if (tupledns_dns_query_a(candidates[i], &test_ip) == 0 && test_ip) {
-                valid_names = realloc(valid_names, (valid_count + 1) * sizeof(char*));
-                if (valid_names) {
-                    valid_names[valid_count] = strdup(candidates[i]);
-                    valid_count++;
+    for (int q = 0; q < n; q++) {
+        if (status[q] != TUPLEDNS_OK) continue;
+        status[q] = tuple_wire_parse(data[q], lens[q], &replies[q]);
+        if (status[q] == TUPLEDNS_OK && (replies[q].flags & 0xF) == TUPLE_DNS_RCODE_FORMERR) {
+            size_t plain_len = tuple_wire_strip_edns(queries[q], query_lens[q]);
+            if (plain_len < query_lens[q]) {
+                if (tuple_server_disable_edns()) {
+                    tuple_stats_add(&g_connection_stats.edns_fallbacks, 1);
                 }
-                free(test_ip);
+                tuple_wire_free(&replies[q]);
+                status[q] = tuple_wire_exchange(queries[q], plain_len, &replies[q]);
             }
         }
-        
-        tupledns_free_string_array(candidates, candidate_count);
-        
-        *query_names = valid_names;
-        *query_count = valid_count;
-        
-        return 0;
+        if (status[q] == TUPLEDNS_OK) {
+            status[q] = tuple_wire_rcode_status(&replies[q]);
+        }
+        if (status[q] != TUPLEDNS_OK) {
+            tuple_wire_free(&replies[q]);
+        }
     }
-    
-    /* No discovery method worked */
-    return -1;
+    /* Questions asked together share the batch's latency and span */
+    double elapsed = tuple_now() - started;
+    int64_t received = 0;
+    for (int q = 0; q < n; q++) {
+        tuple_stats_query(tuple_wire_stats_type(names[q], types[q]), status[q], elapsed);
+        received += status[q] == TUPLEDNS_OK ? (int64_t)replies[q].length : 0;
+    }
+    tuple_span_end(&span, names[0], received);
 }
 
-int tupledns_dns_zone_transfer(const char* zone, char*** records, int* record_count) {
-    if (!zone || !records || !record_count) {
-        return -1;
+/* Concatenate the character-strings of a TXT rdata into one string */
+static char* tuple_wire_txt_string(const tuple_dns_msg_t* msg, const tuple_dns_rr_t* rr) {
+    const uint8_t* rdata = msg->data + rr->rdata_offset;
+    char* text = malloc((size_t)rr->rdlength + 1);
+    if (!text) {
+        return NULL;
     }
     
-    *records = NULL;
-    *record_count = 0;
-    
-    /* DNS Zone Transfer (AXFR) implementation
-     * This requires access to authoritative DNS servers */
-    
-    /* Try to connect to known DNS servers for .tuple domain */
-    const char* dns_servers[] = {
-        "1.1.1.1",    /* Cloudflare */
-        "8.8.8.8",    /* Google */
-        "8.8.4.4",    /* Google Secondary */
-        NULL
-    };
-    
-    for (int i = 0; dns_servers[i] != NULL; i++) {
-        /* Attempt zone transfer from this server */
-        /* Note: Most public DNS servers don't allow zone transfers for security */
-        
-        struct addrinfo hints, *result;
-        memset(&hints, 0, sizeof(hints));
-        hints.ai_family = AF_INET;
-        hints.ai_socktype = SOCK_STREAM;
-        
-        int status = getaddrinfo(dns_servers[i], "53", &hints, &result);
-        if (status != 0) {
-            continue;
+    size_t out = 0;
+    size_t pos = 0;
+    while (pos < rr->rdlength) {
+        size_t len = rdata[pos++];
+        if (pos + len > rr->rdlength) {
+            len = rr->rdlength - pos;
         }
-        
-        /* In practice, zone transfers require:
-         * 1. DNS server configuration to allow transfers
-         * 2. Proper DNS protocol implementation (not just TCP)
-         * 3. Authentication/authorization
-         */
-        
-        freeaddrinfo(result);
+        memcpy(text + out, rdata + pos, len);
+        out += len;
+        pos += len;
+    }
+    text[out] = '\0';
+    return text;
+}
+
+/* Format an A/AAAA rdata as a newly allocated address string */
+static char* tuple_wire_address_string(const tuple_dns_msg_t* msg, const tuple_dns_rr_t* rr) {
+    int family;
+    if (rr->type == TUPLE_DNS_TYPE_A && rr->rdlength == 4) {
+        family = AF_INET;
+    } else if (rr->type == TUPLE_DNS_TYPE_AAAA && rr->rdlength == 16) {
+        family = AF_INET6;
+    } else {
+        return NULL;
     }
     
-    /* Zone transfer not available - this is expected for public DNS */
-    return -1;
+    char* addr_str = malloc(INET6_ADDRSTRLEN);
+    if (!addr_str) {
+        return NULL;
+    }
+    if (!inet_ntop(family, msg->data + rr->rdata_offset, addr_str, INET6_ADDRSTRLEN)) {
+        free(addr_str);
+        return NULL;
+    }
+    return addr_str;
 }
 
-int tupledns_generate_pattern_candidates(const char* pattern, char*** candidates, int* candidate_count) {
-    if (!pattern || !candidates || !candidate_count) {
+/* Follow the CNAME chain from name through the answer section, leaving the
+ * name it ends at in name; returns the number of links followed */
+static int tuple_wire_chase(const tuple_dns_msg_t* msg, char* name, size_t cap) {
+    int hops = 0;
+    while (hops < TUPLE_CNAME_MAX_CHAIN) {
+        int i = 0;
+        while (i < msg->answer_count &&
+               (msg->answers[i].type != TUPLE_DNS_TYPE_CNAME || strcasecmp(msg->answers[i].name, name) != 0)) {
+            i++;
+        }
+        if (i == msg->answer_count) {
+            break;
+        }
+        size_t off = msg->answers[i].rdata_offset;
+        if (tuple_wire_get_name(msg->data, msg->length, &off, name, cap) != 0) {
+            break;
+        }
+        hops++;
+    }
+    return hops;
+}
+
+/* Append a malloc'd copy of s to a growing string array */
+static int tuple_string_list_push(char*** list, int* count, int* capacity, const char* s) {
+    if (*count == *capacity) {
+        int grown_capacity = *capacity ? *capacity * 2 : 4;
+        char** grown = realloc(*list, grown_capacity * sizeof(char*));
+        if (!grown) {
+            return -1;
+        }
+        *list = grown;
+        *capacity = grown_capacity;
+    }
+    if (!((*list)[*count] = strdup(s))) {
         return -1;
     }
+    (*count)++;
+    return 0;
+}
+
+/* Resolve every A and AAAA address of name, asking for both families in
+ * parallel; the answer combines whatever arrived by the deadline. The CNAME
+ * chain in each answer is followed so an alias costs no query of its own;
+ * only a chain cut short (its target's records missing from the answer) is
+ * continued with a query for the target. canonical receives the name the
+ * chain ends at. IPv4 addresses come first. */
+static int tuple_wire_resolve_addresses(const char* name, char*** addresses, int* address_count,
+                                        char* canonical, size_t cap) {
+    static const uint16_t types[] = { TUPLE_DNS_TYPE_A, TUPLE_DNS_TYPE_AAAA };
+    const char* names[] = { name, name };
+    tuple_dns_msg_t replies[2];
+    int status[2];
+    tuple_wire_query_batch(names, types, 2, replies, status);
     
-    *candidates = NULL;
-    *candidate_count = 0;
-    
-    /* Generate candidate coordinates based on common coordinate patterns */
-    /* This implements smart enumeration based on coordinate space knowledge */
-    
-    char** candidate_list = NULL;
+    char ends[2][TUPLEDNS_MAX_COORDINATE_LENGTH + 3];
+    char** list = NULL;
     int count = 0;
+    int capacity = 0;
+    int result = TUPLEDNS_ERROR_NO_RESULTS;
+    int failed = 0;
     
-    /* Parse pattern to understand coordinate space */
-    if (strstr(pattern, ".music.tuple")) {
-        /* Music coordinate space - generate common patterns */
-        const char* genres[] = {"ambient", "jazz", "electronic", "classical", "rock", NULL};
-        const char* bpms[] = {"60", "80", "100", "120", "140", "160", NULL};
-        const char* locations[] = {"london", "newyork", "berlin", "tokyo", NULL};
-        
-        for (int g = 0; genres[g] != NULL; g++) {
-            for (int b = 0; bpms[b] != NULL; b++) {
-                for (int l = 0; locations[l] != NULL; l++) {
-                    char candidate[256];
-                    snprintf(candidate, sizeof(candidate), "%s.%s.%s.music.tuple", 
-                            genres[g], bpms[b], locations[l]);
-                    
-                    if (tupledns_match_pattern(candidate, pattern)) {
-                        candidate_list = realloc(candidate_list, (count + 1) * sizeof(char*));
-                        if (candidate_list) {
-                            candidate_list[count] = strdup(candidate);
-                            count++;
-                        }
-                    }
-                }
+    for (int t = 0; t < 2; t++) {
+        snprintf(ends[t], sizeof(ends[t]), "%s", name);
+        int hops = 0;
+        int followed = 0;
+        while (status[t] == TUPLEDNS_OK) {
+            followed = tuple_wire_chase(&replies[t], ends[t], sizeof(ends[t]));
+            hops += followed;
+            int found = 0;
+            for (int i = 0; i < replies[t].answer_count && !failed; i++) {
+                if (strcasecmp(replies[t].answers[i].name, ends[t]) != 0) continue;
+                char* addr_str = tuple_wire_address_string(&replies[t], &replies[t].answers[i]);
+                if (!addr_str) continue;
+                failed = tuple_string_list_push(&list, &count, &capacity, addr_str) != 0;
+                free(addr_str);
+                found++;
+            }
+            tuple_wire_free(&replies[t]);
+            if (found > 0 || followed == 0 || hops >= TUPLE_CNAME_MAX_CHAIN || failed) {
+                break;
             }
+            status[t] = tuple_wire_query(ends[t], types[t], &replies[t]);
+        }
+        if (status[t] == TUPLEDNS_OK) {
+            result = TUPLEDNS_OK;
+        } else if (result != TUPLEDNS_OK && status[t] != TUPLEDNS_ERROR_NO_RESULTS) {
+            result = status[t];
         }
     }
-    else if (strstr(pattern, ".spatial.tuple")) {
-        /* Spatial coordinate space */
-        const char* devices[] = {"sensor", "camera", "printer", "light", "thermostat", NULL};
-        const char* rooms[] = {"kitchen", "living-room", "bedroom", "office", "lab", NULL};
-        const char* floors[] = {"floor-1", "floor-2", "floor-3", NULL};
-        const char* buildings[] = {"building-1", "building-2", "building-5", NULL};
+    
+    if (failed || count == 0) {
+        tupledns_free_string_array(list, count);
+        return failed ? TUPLEDNS_ERROR_MEMORY_ALLOCATION
+                      : (result == TUPLEDNS_OK ? TUPLEDNS_ERROR_NO_RESULTS : result);
+    }
+    if (canonical) {
+        snprintf(canonical, cap, "%s", ends[strcasecmp(ends[0], name) != 0 ? 0 : 1]);
+    }
+    *addresses = list;
+    *address_count = count;
+    return TUPLEDNS_OK;
+}
+
+/* Append one update RR with no rdata (RRset/name deletion, RFC 2136 2.5.2-2.5.3) */
+static int tuple_wire_put_delete(uint8_t* buf, size_t cap, size_t* off, const char* name, uint16_t type) {
+    if (tuple_wire_put_name(buf, cap, off, name) != 0 || *off + 10 > cap) {
+        return -1;
+    }
+    tuple_wire_put16(buf, *off, type);
+    tuple_wire_put16(buf, *off + 2, TUPLE_DNS_CLASS_ANY);
+    tuple_wire_put32(buf, *off + 4, 0);
+    tuple_wire_put16(buf, *off + 8, 0);
+    *off += 10;
+    return 0;
+}
+
+/* Append one update RR that adds data (RFC 2136 2.5.1) */
+static int tuple_wire_put_add(uint8_t* buf, size_t cap, size_t* off, const char* name, uint16_t type,
+                              int ttl, const uint8_t* rdata, size_t rdlength) {
+    if (tuple_wire_put_name(buf, cap, off, name) != 0 || *off + 10 + rdlength > cap) {
+        return -1;
+    }
+    tuple_wire_put16(buf, *off, type);
+    tuple_wire_put16(buf, *off + 2, TUPLE_DNS_CLASS_IN);
+    tuple_wire_put32(buf, *off + 4, (uint32_t)(ttl > 0 ? ttl : 0));
+    tuple_wire_put16(buf, *off + 8, (uint16_t)rdlength);
+    memcpy(buf + *off + 10, rdata, rdlength);
+    *off += 10 + rdlength;
+    return 0;
+}
+
+/* Encode text as TXT rdata, splitting into 255-byte character-strings */
+static size_t tuple_wire_txt_rdata(const char* text, uint8_t* out, size_t cap) {
+    size_t len = strlen(text);
+    size_t pos = 0;
+    size_t off = 0;
+    do {
+        size_t chunk = len - pos > 255 ? 255 : len - pos;
+        if (off + chunk + 1 > cap) {
+            return 0;
+        }
+        out[off++] = (uint8_t)chunk;
+        memcpy(out + off, text + pos, chunk);
+        off += chunk;
+        pos += chunk;
+    } while (pos < len);
+    return off;
+}
+
+static int tuple_wire_send_update(const uint8_t* update, size_t len) {
+    tuple_dns_msg_t reply;
+    double started = tuple_now();
+    int status = tuple_wire_exchange(update, len, &reply);
+    if (status == TUPLEDNS_OK) {
+        status = (reply.flags & 0xF) == 0 ? TUPLEDNS_OK : TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        tuple_wire_free(&reply);
+    }
+    tuple_stats_query(TUPLEDNS_QUERY_UPDATE, status, tuple_now() - started);
+    return status;
+}
+
+/* Replace the address and capability records of a coordinate, and point
+ * each alias at it with a CNAME, in one UPDATE */
+static int tuple_wire_update_register(const char* coordinate, const char* ip_address,
+                                      const char* caps_txt, const char* aliases[], int ttl) {
+    uint8_t buf[TUPLE_DNS_UPDATE_BUFFER];
+    uint8_t rdata[TUPLE_DNS_UPDATE_BUFFER / 2];
+    uint16_t address_type = TUPLE_DNS_TYPE_A;
+    size_t address_len = 4;
+    
+    if (inet_pton(AF_INET, ip_address, rdata) != 1) {
+        if (inet_pton(AF_INET6, ip_address, rdata) != 1) {
+            return TUPLEDNS_ERROR_INVALID_PARAMETER;
+        }
+        address_type = TUPLE_DNS_TYPE_AAAA;
+        address_len = 16;
+    }
+    
+    int alias_count = 0;
+    while (aliases && aliases[alias_count]) alias_count++;
+    uint16_t update_count = (uint16_t)((caps_txt ? 6 : 5) + 2 * alias_count);
+    size_t off = tuple_wire_put_header(buf, tuple_wire_next_id(), TUPLE_DNS_OPCODE_UPDATE << 11,
+                                       1, 0, update_count, 0);
+    
+    /* Zone section */
+    if (tuple_wire_put_name(buf, sizeof(buf), &off, TUPLE_DNS_ZONE) != 0) {
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    tuple_wire_put16(buf, off, TUPLE_DNS_TYPE_SOA);
+    tuple_wire_put16(buf, off + 2, TUPLE_DNS_CLASS_IN);
+    off += 4;
+    
+    /* Update section: drop the old RRsets, then add the new ones */
+    if (tuple_wire_put_delete(buf, sizeof(buf), &off, coordinate, TUPLE_DNS_TYPE_CNAME) != 0 ||
+        tuple_wire_put_delete(buf, sizeof(buf), &off, coordinate, TUPLE_DNS_TYPE_A) != 0 ||
+        tuple_wire_put_delete(buf, sizeof(buf), &off, coordinate, TUPLE_DNS_TYPE_AAAA) != 0 ||
+        tuple_wire_put_delete(buf, sizeof(buf), &off, coordinate, TUPLE_DNS_TYPE_TXT) != 0 ||
+        tuple_wire_put_add(buf, sizeof(buf), &off, coordinate, address_type, ttl, rdata, address_len) != 0) {
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    if (caps_txt) {
+        size_t txt_len = tuple_wire_txt_rdata(caps_txt, rdata, sizeof(rdata));
+        if (txt_len == 0 ||
+            tuple_wire_put_add(buf, sizeof(buf), &off, coordinate, TUPLE_DNS_TYPE_TXT, ttl, rdata, txt_len) != 0) {
+            return TUPLEDNS_ERROR_CAPABILITY_PARSE;
+        }
+    }
+    
+    /* An alias owns nothing but its CNAME */
+    size_t target_len = 0;
+    if (alias_count > 0 && tuple_wire_put_name(rdata, sizeof(rdata), &target_len, coordinate) != 0) {
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    for (int a = 0; a < alias_count; a++) {
+        if (tuple_wire_put_delete(buf, sizeof(buf), &off, aliases[a], TUPLE_DNS_TYPE_ANY) != 0 ||
+            tuple_wire_put_add(buf, sizeof(buf), &off, aliases[a], TUPLE_DNS_TYPE_CNAME, ttl,
+                               rdata, target_len) != 0) {
+            return TUPLEDNS_ERROR_INVALID_PARAMETER;
+        }
+    }
+    
+    return tuple_wire_send_update(buf, off);
+}
+
+/* Remove every record owned by a coordinate */
+static int tuple_wire_update_unregister(const char* coordinate) {
+    uint8_t buf[TUPLE_DNS_QUERY_BUFFER * 2];
+    size_t off = tuple_wire_put_header(buf, tuple_wire_next_id(), TUPLE_DNS_OPCODE_UPDATE << 11, 1, 0, 1, 0);
+    
+    if (tuple_wire_put_name(buf, sizeof(buf), &off, TUPLE_DNS_ZONE) != 0) {
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    tuple_wire_put16(buf, off, TUPLE_DNS_TYPE_SOA);
+    tuple_wire_put16(buf, off + 2, TUPLE_DNS_CLASS_IN);
+    off += 4;
+    
+    if (tuple_wire_put_delete(buf, sizeof(buf), &off, coordinate, TUPLE_DNS_TYPE_ANY) != 0) {
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    return tuple_wire_send_update(buf, off);
+}
+
+/* Serial of the zone's SOA, which the server bumps on every change */
+static int tuple_wire_zone_serial(uint32_t* serial) {
+    tuple_dns_msg_t msg;
+    int status = tuple_wire_query(TUPLE_DNS_ZONE, TUPLE_DNS_TYPE_SOA, &msg);
+    if (status != TUPLEDNS_OK) {
+        return status;
+    }
+    status = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+    for (int i = 0; i < msg.answer_count; i++) {
+        const tuple_dns_rr_t* rr = &msg.answers[i];
+        if (rr->type == TUPLE_DNS_TYPE_SOA && rr->rdlength >= 20) {
+            const uint8_t* p = msg.data + rr->rdata_offset + rr->rdlength - 20;
+            *serial = ((uint32_t)p[0] << 24) | ((uint32_t)p[1] << 16) | ((uint32_t)p[2] << 8) | p[3];
+            status = TUPLEDNS_OK;
+            break;
+        }
+    }
+    tuple_wire_free(&msg);
+    return status;
+}
+
+static int tuple_compare_strings(const void* a, const void* b) {
+    return strcmp(*(const char* const*)a, *(const char* const*)b);
+}
+
+/* AXFR the zone from the configured server and collect the owner names of nodes */
+static int tuple_wire_zone_transfer(const char* zone, char*** names, int* name_count) {
+    uint8_t query[TUPLE_DNS_QUERY_BUFFER];
+    size_t query_len = tuple_wire_build_query(query, sizeof(query), tuple_wire_next_id(),
+                                              zone, TUPLE_DNS_TYPE_AXFR);
+    if (query_len == 0) {
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    tuple_span_t span;
+    tuple_span_begin(&span, "dns_query");
+    double started = tuple_now();
+    double deadline = tuple_deadline();
+    int fd = tuple_wire_tcp_connect(deadline);
+    if (fd < 0) {
+        tuple_stats_query(TUPLEDNS_QUERY_AXFR, TUPLEDNS_ERROR_DNS_QUERY_FAILED, tuple_now() - started);
+        tuple_span_end(&span, zone, 0);
+        return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+    }
+    
+    int status = tuple_wire_tcp_send_message(fd, query, query_len, deadline);
+    char** list = NULL;
+    int count = 0;
+    int capacity = 0;
+    int soa_seen = 0;
+    
+    while (status == TUPLEDNS_OK && soa_seen < 2) {
+        uint8_t* data = NULL;
+        size_t len = 0;
+        tuple_dns_msg_t msg;
         
-        for (int d = 0; devices[d] != NULL; d++) {
-            for (int r = 0; rooms[r] != NULL; r++) {
-                for (int f = 0; floors[f] != NULL; f++) {
-                    for (int b = 0; buildings[b] != NULL; b++) {
-                        char candidate[256];
-                        snprintf(candidate, sizeof(candidate), "%s.%s.%s.%s.spatial.tuple",
-                                devices[d], rooms[r], floors[f], buildings[b]);
-                        
-                        if (tupledns_match_pattern(candidate, pattern)) {
-                            candidate_list = realloc(candidate_list, (count + 1) * sizeof(char*));
-                            if (candidate_list) {
-                                candidate_list[count] = strdup(candidate);
-                                count++;
-                            }
-                        }
-                    }
+        status = tuple_wire_tcp_recv_message(fd, &data, &len, deadline);
+        if (status != TUPLEDNS_OK) break;
+        status = tuple_wire_parse(data, len, &msg);
+        if (status == TUPLEDNS_OK) {
+            status = tuple_wire_rcode_status(&msg);
+        }
+        if (status == TUPLEDNS_OK && msg.answer_count == 0) {
+            status = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        }
+        
+        for (int i = 0; status == TUPLEDNS_OK && i < msg.answer_count; i++) {
+            const tuple_dns_rr_t* rr = &msg.answers[i];
+            if (rr->type == TUPLE_DNS_TYPE_SOA) {
+                soa_seen++;
+                continue;
+            }
+            if (rr->type != TUPLE_DNS_TYPE_A && rr->type != TUPLE_DNS_TYPE_AAAA &&
+                rr->type != TUPLE_DNS_TYPE_CNAME) {
+                continue;
+            }
+            if (count == capacity) {
+                int new_capacity = capacity ? capacity * 2 : 64;
+                char** grown = realloc(list, new_capacity * sizeof(char*));
+                if (!grown) {
+                    status = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+                    break;
                 }
+                list = grown;
+                capacity = new_capacity;
+            }
+            list[count] = strdup(rr->name);
+            if (!list[count]) {
+                status = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+                break;
             }
+            count++;
         }
+        tuple_wire_free(&msg);
     }
-    else if (strstr(pattern, ".ai.tuple")) {
-        /* AI agent coordinate space */
-        const char* personalities[] = {"creative", "analytical", "empathetic", "logical", NULL};
-        const char* frequencies[] = {"60", "80", "100", "120", NULL};
-        const char* modes[] = {"collaborative", "autonomous", "interactive", NULL};
-        const char* contexts[] = {"research", "production", "support", NULL};
+    close(fd);
+    tuple_stats_query(TUPLEDNS_QUERY_AXFR, status, tuple_now() - started);
+    tuple_span_end(&span, zone, count);
+    
+    if (status != TUPLEDNS_OK) {
+        tupledns_free_string_array(list, count);
+        return status;
+    }
+    
+    /* Owners with several address records appear more than once */
+    if (count > 1) {
+        qsort(list, count, sizeof(char*), tuple_compare_strings);
+        int unique = 1;
+        for (int i = 1; i < count; i++) {
+            if (strcmp(list[i], list[unique - 1]) == 0) {
+                free(list[i]);
+            } else {
+                list[unique++] = list[i];
+            }
+        }
+        count = unique;
+    }
+    
+    *names = list;
+    *name_count = count;
+    return TUPLEDNS_OK;
+}
+
+/* Copy the value of a "key=value" field from a space-separated TXT string */
+static const char* tuple_txt_field(const char* text, const char* key, size_t* len) {
+    size_t key_len = strlen(key);
+    const char* p = text;
+    while (*p) {
+        if (strncmp(p, key, key_len) == 0 && p[key_len] == '=') {
+            p += key_len + 1;
+            *len = strcspn(p, " ");
+            return p;
+        }
+        p += strcspn(p, " ");
+        p += strspn(p, " ");
+    }
+    return NULL;
+}
+
+/* Build "<offset>._o._q.<pattern>" with each "*" label escaped as "_" */
+static int tuple_wire_pattern_name(char* out, size_t cap, const char* pattern, int offset, int limit,
+                                   const char* required_caps[]) {
+    size_t len = 0;
+    
+    /* Required capabilities go first as value labels closed by "_c" */
+    if (required_caps && required_caps[0]) {
+        for (int c = 0; required_caps[c]; c++) {
+            size_t cap_len = strlen(required_caps[c]);
+            if (cap_len == 0 || cap_len > 63 || strchr(required_caps[c], '.') || len + cap_len + 1 >= cap) {
+                return -1;
+            }
+            for (size_t i = 0; i < cap_len; i++) {
+                out[len++] = (char)tolower((unsigned char)required_caps[c][i]);
+            }
+            out[len++] = '.';
+        }
+        if (len + sizeof(TUPLE_QUERY_CAPS_LABEL) + 1 > cap) {
+            return -1;
+        }
+        memcpy(out + len, TUPLE_QUERY_CAPS_LABEL ".", sizeof(TUPLE_QUERY_CAPS_LABEL));
+        len += sizeof(TUPLE_QUERY_CAPS_LABEL);
+    }
+    
+    /* "<n>._l" asks for at most n matches; servers that ignore it just send more */
+    if (limit != TUPLE_QUERY_UNLIMITED) {
+        int written = snprintf(out + len, cap - len, "%d._l.", limit);
+        if (written < 0 || (size_t)written >= cap - len) {
+            return -1;
+        }
+        len += (size_t)written;
+    }
+    
+    int written = offset > 0 ? snprintf(out + len, cap - len, "%d._o.%s.", offset, TUPLE_QUERY_LABEL)
+                             : snprintf(out + len, cap - len, "%s.", TUPLE_QUERY_LABEL);
+    if (written < 0 || (size_t)written >= cap - len) {
+        return -1;
+    }
+    len += (size_t)written;
+    
+    /* A pattern of just the zone asks across every space */
+    if (strcmp(pattern, TUPLE_DNS_ZONE) == 0 && !(required_caps && required_caps[0])) {
+        return -1;
+    }
+    for (const char* p = pattern; *p; p++) {
+        if (len + 2 > cap) {
+            return -1;
+        }
+        out[len++] = (*p == '*') ? '_' : (char)tolower((unsigned char)*p);
+    }
+    out[len] = '\0';
+    return len > TUPLEDNS_MAX_COORDINATE_LENGTH ? -1 : 0;
+}
+
+/* Ask the configured server (once) which "_q" pattern queries it evaluates */
+static int tuple_server_q_features(void) {
+    pthread_mutex_lock(&g_server_lock);
+    int features = g_server_configured ? g_server_q_support : 0;
+    unsigned generation = g_server_generation;
+    pthread_mutex_unlock(&g_server_lock);
+    if (features >= 0) {
+        return features;
+    }
+    
+    /* Probed unlocked; the answer is kept only if the server is still the one asked */
+    tuple_dns_msg_t msg;
+    features = 0;
+    if (tuple_wire_query(TUPLE_QUERY_LABEL "." TUPLE_DNS_ZONE, TUPLE_DNS_TYPE_TXT, &msg) == TUPLEDNS_OK) {
+        for (int i = 0; i < msg.answer_count; i++) {
+            if (msg.answers[i].type != TUPLE_DNS_TYPE_TXT) continue;
+            char* text = tuple_wire_txt_string(&msg, &msg.answers[i]);
+            if (text && strstr(text, TUPLE_QUERY_FEATURES)) {
+                features |= TUPLE_Q_PATTERNS;
+            }
+            if (text && strstr(text, TUPLE_QUERY_CAPS_FEATURES)) {
+                features |= TUPLE_Q_CAPS;
+            }
+            free(text);
+        }
+        tuple_wire_free(&msg);
+    }
+    if (!(features & TUPLE_Q_PATTERNS)) {
+        features = 0;
+    }
+    pthread_mutex_lock(&g_server_lock);
+    if (g_server_generation == generation) {
+        g_server_q_support = features;
+    }
+    pthread_mutex_unlock(&g_server_lock);
+    return features;
+}
+
+/* Check the caps= list in a TXT string for every required capability without
+ * allocating, stopping at the first one missing */
+static int tuple_caps_contain(const char* text, const char* required_caps[]) {
+    if (!required_caps || !required_caps[0]) {
+        return 1;
+    }
+    const char* caps = text ? strstr(text, "caps=") : NULL;
+    if (!caps) {
+        return 0;
+    }
+    caps += 5;
+    const char* end = caps + strcspn(caps, " ");
+    
+    for (int c = 0; required_caps[c]; c++) {
+        size_t want = strlen(required_caps[c]);
+        int found = 0;
+        for (const char* p = caps; p < end && !found; ) {
+            size_t len = strcspn(p, ", ");
+            found = len == want && memcmp(p, required_caps[c], want) == 0;
+            p += len + 1;
+        }
+        if (!found) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+/* Add a node to the result from one "coord=... addr=... caps=... ttl=..." match
+ * record. Aliases carry "cname=<canonical>" and are collapsed into the node of
+ * their canonical coordinate (nodes from first on are searched once *aliased
+ * is set, i.e. once the result holds any alias). */
+static int tuple_wire_parse_match(const char* text, tupledns_result_t* result, int first, int* aliased) {
+    size_t len = 0;
+    size_t canonical_len = 0;
+    const char* coordinate = tuple_txt_field(text, "coord", &len);
+    const char* canonical = tuple_txt_field(text, "cname", &canonical_len);
+    if (!coordinate) {
+        return -1;
+    }
+    if (canonical || *aliased) {
+        tupledns_node_t* known = canonical ? tuple_result_find_node(result, first, canonical, canonical_len)
+                                           : tuple_result_find_node(result, first, coordinate, len);
+        if (known) {
+            return canonical ? tuple_result_add_alias(result, known, coordinate, len) : 0;
+        }
+    }
+    
+    tupledns_node_t* node = tuple_result_add_node(result);
+    if (!node || !(node->coordinate = canonical ? tuple_arena_strndup(result->arena, canonical, canonical_len)
+                                                : tuple_arena_strndup(result->arena, coordinate, len)) ||
+        (canonical && tuple_result_add_alias(result, node, coordinate, len) != 0)) {
+        if (node) tuple_result_pop_node(result);
+        return -1;
+    }
+    if (canonical) {
+        *aliased = 1;
+    }
+    
+    const char* addresses = tuple_txt_field(text, "addr", &len);
+    if (addresses && tuple_result_parse_addresses(result, node, addresses, strcspn(addresses, " ")) != 0) {
+        tuple_result_pop_node(result);
+        return -1;
+    }
+    
+    const char* ttl = tuple_txt_field(text, "ttl", &len);
+    node->ttl = ttl ? atoi(ttl) : TUPLEDNS_DEFAULT_TTL;
+    node->last_seen = time(NULL);
+    
+    if (tuple_result_parse_caps(result, node, text) != 0) {
+        tuple_result_pop_node(result);
+        return -1;
+    }
+    return 0;
+}
+
+/* Evaluate a wildcard pattern on the server from match *offset, following
+ * "next=" continuations, and add up to limit matches to result. On return
+ * *offset is the server position to resume from, or -1 once every match has
+ * been seen. Required capabilities are sent along when the server filters by
+ * them and checked on each match before it is parsed either way. */
+static int tuple_wire_find_pattern(const char* pattern, const char* required_caps[], int limit, int* offset,
+                                   tupledns_result_t* result, int* queries) {
+    const char** server_caps = (tuple_server_q_features() & TUPLE_Q_CAPS) ? required_caps : NULL;
+    int first = result->node_count;
+    int position = *offset;
+    int status = TUPLEDNS_OK;
+    int aliased = 0;
+    
+    while (position >= 0 && result->node_count - first < limit) {
+        int page_start = position;
+        char name[TUPLEDNS_MAX_COORDINATE_LENGTH + 48];
+        int wanted = limit == TUPLE_QUERY_UNLIMITED ? limit : limit - (result->node_count - first);
+        if (tuple_wire_pattern_name(name, sizeof(name), pattern, position, wanted, server_caps) != 0) {
+            status = TUPLEDNS_ERROR_INVALID_PARAMETER;
+            break;
+        }
         
-        for (int p = 0; personalities[p] != NULL; p++) {
-            for (int f = 0; frequencies[f] != NULL; f++) {
-                for (int m = 0; modes[m] != NULL; m++) {
-                    for (int c = 0; contexts[c] != NULL; c++) {
-                        char candidate[256];
-                        snprintf(candidate, sizeof(candidate), "%s.%s.%s.%s.ai.tuple",
-                                personalities[p], frequencies[f], modes[m], contexts[c]);
-                        
-                        if (tupledns_match_pattern(candidate, pattern)) {
-                            candidate_list = realloc(candidate_list, (count + 1) * sizeof(char*));
-                            if (candidate_list) {
-                                candidate_list[count] = strdup(candidate);
-                                count++;
-                            }
-                        }
-                    }
+        tuple_dns_msg_t msg;
+        status = tuple_wire_query(name, TUPLE_DNS_TYPE_TXT, &msg);
+        (*queries)++;
+        if (status != TUPLEDNS_OK) {
+            position = -1;
+            break;
+        }
+        
+        int next = -1;
+        tuple_span_t parse_span;
+        tuple_span_begin(&parse_span, "txt_parse");
+        for (int i = 0; status == TUPLEDNS_OK && i < msg.answer_count; i++) {
+            if (msg.answers[i].type != TUPLE_DNS_TYPE_TXT) continue;
+            char* text = tuple_wire_txt_string(&msg, &msg.answers[i]);
+            if (!text) {
+                status = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+                break;
+            }
+            if (strncmp(text, "next=", 5) == 0) {
+                next = atoi(text + 5);
+            } else if (result->node_count - first == limit) {
+                /* The server sent more than asked for; resume at this match */
+                next = position;
+                free(text);
+                break;
+            } else {
+                position++;
+                if (tuple_caps_contain(text, required_caps) && strstr(text, "coord=") &&
+                    tuple_wire_parse_match(text, result, first, &aliased) != 0) {
+                    status = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
                 }
             }
+            free(text);
+        }
+        tuple_span_end(&parse_span, name, msg.answer_count);
+        tuple_wire_free(&msg);
+        if (status == TUPLEDNS_OK && next >= 0 && next <= page_start && result->node_count - first < limit) {
+            /* A continuation that does not advance would repeat this page forever */
+            status = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+            break;
+        }
+        position = next;
+    }
+    
+    /* NXDOMAIN just means no (further) matches */
+    if (status != TUPLEDNS_OK && status != TUPLEDNS_ERROR_NO_RESULTS) {
+        result->node_count = first; /* The arena keeps the strings until the result is freed */
+        return status;
+    }
+    *offset = position;
+    return TUPLEDNS_OK;
+}
+
+/* ========================================================================
+ * DNS QUERY FUNCTIONS
+ * ======================================================================== */
+
+/* Resolve every address of hostname; canonical (if given) receives the name
+ * its CNAME chain ends at */
+static int tuple_query_addresses(const char* hostname, char*** addresses, int* address_count,
+                                 char* canonical, size_t cap) {
+    if (!hostname || !addresses || !address_count) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    *addresses = NULL;
+    *address_count = 0;
+    
+    if (tuple_server_configured()) {
+        int status = tuple_wire_resolve_addresses(hostname, addresses, address_count, canonical, cap);
+        if (status != TUPLEDNS_OK) {
+            g_last_error = status;
+        }
+        return status;
+    }
+    
+    /* getaddrinfo looks up both families itself */
+    struct addrinfo hints, *result;
+    memset(&hints, 0, sizeof(hints));
+    hints.ai_family = AF_UNSPEC;
+    hints.ai_socktype = SOCK_STREAM;
+    hints.ai_flags = canonical ? AI_CANONNAME : 0;
+    
+    tuple_span_t span;
+    tuple_span_begin(&span, "dns_query");
+    double started = tuple_now();
+    int status = getaddrinfo(hostname, NULL, &hints, &result);
+    tuple_stats_query(TUPLEDNS_QUERY_SYSTEM,
+                      status == 0 ? TUPLEDNS_OK
+                      : status == EAI_NONAME ? TUPLEDNS_ERROR_NO_RESULTS
+                      : status == EAI_AGAIN ? TUPLEDNS_ERROR_TIMEOUT : TUPLEDNS_ERROR_DNS_QUERY_FAILED,
+                      tuple_now() - started);
+    tuple_span_end(&span, hostname, 0);
+    if (status != 0) {
+        g_last_error = status == EAI_NONAME ? TUPLEDNS_ERROR_NO_RESULTS : TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        return g_last_error;
+    }
+    
+    char** list = NULL;
+    int count = 0;
+    int capacity = 0;
+    status = TUPLEDNS_OK;
+    for (struct addrinfo* ai = result; ai && status == TUPLEDNS_OK; ai = ai->ai_next) {
+        char addr_str[INET6_ADDRSTRLEN];
+        const void* addr_ptr = ai->ai_family == AF_INET
+            ? (const void*)&((struct sockaddr_in*)ai->ai_addr)->sin_addr
+            : (const void*)&((struct sockaddr_in6*)ai->ai_addr)->sin6_addr;
+        if ((ai->ai_family != AF_INET && ai->ai_family != AF_INET6) ||
+            !inet_ntop(ai->ai_family, addr_ptr, addr_str, sizeof(addr_str))) {
+            continue;
+        }
+        int seen = 0;
+        for (int i = 0; i < count && !seen; i++) {
+            seen = strcmp(list[i], addr_str) == 0;
+        }
+        if (!seen && tuple_string_list_push(&list, &count, &capacity, addr_str) != 0) {
+            status = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        }
+    }
+    if (status == TUPLEDNS_OK && count == 0) {
+        status = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+    }
+    if (status == TUPLEDNS_OK && canonical) {
+        snprintf(canonical, cap, "%s", result->ai_canonname ? result->ai_canonname : hostname);
+    }
+    freeaddrinfo(result);
+    
+    if (status != TUPLEDNS_OK) {
+        tupledns_free_string_array(list, count);
+        g_last_error = status;
+        return status;
+    }
+    *addresses = list;
+    *address_count = count;
+    return TUPLEDNS_OK;
+}
+
+int tupledns_dns_query_addresses(const char* hostname, char*** addresses, int* address_count) {
+    return tuple_query_addresses(hostname, addresses, address_count, NULL, 0);
+}
+
+int tupledns_dns_query_a(const char* hostname, char** ip_address) {
+    if (!ip_address) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    char** addresses = NULL;
+    int count = 0;
+    int status = tuple_query_addresses(hostname, &addresses, &count, NULL, 0);
+    if (status != TUPLEDNS_OK) {
+        return status;
+    }
+    
+    /* The first address, preferring IPv4 */
+    *ip_address = addresses[0];
+    for (int i = 1; i < count; i++) {
+        free(addresses[i]);
+    }
+    free(addresses);
+    return TUPLEDNS_OK;
+}
+
+int tupledns_dns_query_txt(const char* hostname, char*** txt_records, int* record_count) {
+    /* Note: This is a simplified implementation. 
+     * In practice, you'd want to use a proper DNS library like ldns or c-ares 
+     * for full TXT record parsing. */
+    
+    if (!hostname || !txt_records || !record_count) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    *txt_records = NULL;
+    *record_count = 0;
+    
+    if (!tuple_server_configured()) {
+        /* No registry server to ask - would need proper DNS library */
+        g_last_error = TUPLEDNS_ERROR_NO_RESULTS;
+        return TUPLEDNS_ERROR_NO_RESULTS;
+    }
+    
+    tuple_dns_msg_t msg;
+    int status = tuple_wire_query(hostname, TUPLE_DNS_TYPE_TXT, &msg);
+    if (status != TUPLEDNS_OK) {
+        g_last_error = status;
+        return status;
+    }
+    
+    char** records = msg.answer_count > 0 ? calloc(msg.answer_count, sizeof(char*)) : NULL;
+    int count = 0;
+    for (int i = 0; records && i < msg.answer_count; i++) {
+        if (msg.answers[i].type != TUPLE_DNS_TYPE_TXT) continue;
+        records[count] = tuple_wire_txt_string(&msg, &msg.answers[i]);
+        if (!records[count]) {
+            tupledns_free_string_array(records, count);
+            tuple_wire_free(&msg);
+            g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+            return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        }
+        count++;
+    }
+    tuple_wire_free(&msg);
+    
+    if (count == 0) {
+        free(records);
+        g_last_error = TUPLEDNS_ERROR_NO_RESULTS;
+        return TUPLEDNS_ERROR_NO_RESULTS;
+    }
+    
+    *txt_records = records;
+    *record_count = count;
+    return TUPLEDNS_OK;
+}
+
+/* ========================================================================
+ * CAPABILITY HANDLING
+ * ======================================================================== */
+
+int tupledns_parse_capabilities(const char* txt_record, char*** capabilities, int* capability_count) {
+    if (!txt_record || !capabilities || !capability_count) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    /* Look for caps= prefix */
+    const char* caps_prefix = "caps=";
+    const char* caps_start = strstr(txt_record, caps_prefix);
+    if (!caps_start) {
+        *capabilities = NULL;
+        *capability_count = 0;
+        return TUPLEDNS_OK;
+    }
+    
+    caps_start += strlen(caps_prefix);
+    
+    /* Find end of capabilities (space or end of string) */
+    const char* caps_end = strchr(caps_start, ' ');
+    if (!caps_end) {
+        caps_end = caps_start + strlen(caps_start);
+    }
+    
+    /* Extract capabilities substring */
+    size_t caps_len = caps_end - caps_start;
+    char* caps_str = malloc(caps_len + 1);
+    if (!caps_str) {
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    }
+    
+    strncpy(caps_str, caps_start, caps_len);
+    caps_str[caps_len] = '\0';
+    
+    /* Split by commas */
+    *capabilities = tupledns_split_string(caps_str, ",", capability_count);
+    free(caps_str);
+    
+    if (!*capabilities) {
+        *capability_count = 0;
+        g_last_error = TUPLEDNS_ERROR_CAPABILITY_PARSE;
+        return TUPLEDNS_ERROR_CAPABILITY_PARSE;
+    }
+    
+    return TUPLEDNS_OK;
+}
+
+char** tupledns_copy_capabilities(const char* capabilities[], int count) {
+    if (!capabilities || count <= 0) {
+        return NULL;
+    }
+    
+    char** result = malloc(count * sizeof(char*));
+    if (!result) {
+        return NULL;
+    }
+    
+    for (int i = 0; i < count; i++) {
+        if (capabilities[i]) {
+            result[i] = strdup(capabilities[i]);
+            if (!result[i]) {
+                tupledns_free_capabilities(result, i);
+                return NULL;
+            }
+        } else {
+            result[i] = NULL;
+        }
+    }
+    
+    return result;
+}
+
+void tupledns_free_capabilities(char** capabilities, int count) {
+    tupledns_free_string_array(capabilities, count);
+}
+
+int tupledns_has_capability(const tupledns_node_t* node, const char* capability) {
+    if (!node || !capability) {
+        return 0;
+    }
+    
+    for (int i = 0; i < node->capability_count; i++) {
+        if (node->capabilities[i] && strcmp(node->capabilities[i], capability) == 0) {
+            return 1;
+        }
+    }
+    
+    return 0;
+}
+
+/* ========================================================================
+ * MEMORY MANAGEMENT
+ * ======================================================================== */
+
+void tupledns_free_node(tupledns_node_t* node) {
+    if (!node) return;
+    
+    free(node->coordinate);
+    if (node->address_count == 0 || node->ip_address != node->ip_addresses[0]) {
+        free(node->ip_address);
+    }
+    tupledns_free_capabilities(node->capabilities, node->capability_count);
+    tupledns_free_string_array(node->aliases, node->alias_count);
+    tupledns_free_string_array(node->ip_addresses, node->address_count);
+    memset(node, 0, sizeof(tupledns_node_t));
+}
+
+void tupledns_free_result(tupledns_result_t* result) {
+    if (!result) return;
+    
+    if (result->arena) {
+        /* Nodes live in the arena; the result shares its first allocation */
+        tuple_arena_free(result->arena);
+        free(result);
+        return;
+    }
+    
+    if (result->nodes) {
+        for (int i = 0; i < result->node_count; i++) {
+            tupledns_free_node(&result->nodes[i]);
+        }
+        free(result->nodes);
+    }
+    
+    free(result->next_cursor);
+    free(result);
+}
+
+/* ========================================================================
+ * DNS REGISTRATION HELPER FUNCTIONS
+ * ======================================================================== */
+
+int tupledns_get_local_ip(char** ip_address) {
+    if (!ip_address) {
+        return -1;
+    }
+    
+    /* Get actual local IP address */
+    int sock = socket(AF_INET, SOCK_DGRAM, 0);
+    if (sock < 0) {
+        *ip_address = strdup("127.0.0.1");
+        return *ip_address ? 0 : -1;
+    }
+    
+    /* Connect to a remote address to determine local interface */
+    struct sockaddr_in serv;
+    memset(&serv, 0, sizeof(serv));
+    serv.sin_family = AF_INET;
+    serv.sin_addr.s_addr = inet_addr("8.8.8.8");
+    serv.sin_port = htons(53);
+    
+    int result = connect(sock, (struct sockaddr*)&serv, sizeof(serv));
+    if (result < 0) {
+        close(sock);
+        *ip_address = strdup("127.0.0.1");
+        return *ip_address ? 0 : -1;
+    }
+    
+    struct sockaddr_in name;
+    socklen_t namelen = sizeof(name);
+    result = getsockname(sock, (struct sockaddr*)&name, &namelen);
+    close(sock);
+    
+    if (result < 0) {
+        *ip_address = strdup("127.0.0.1");
+        return *ip_address ? 0 : -1;
+    }
+    
+    *ip_address = strdup(inet_ntoa(name.sin_addr));
+    return *ip_address ? 0 : -1;
+}
+
+int tupledns_register_dns_record(const char* name, const char* type, const char* value, int ttl) {
+    if (!name || !type || !value) {
+        return -1;
+    }
+    
+    /* This would interface with DNS server APIs or dynamic DNS services
+     * For testing/development, we log the registration intent */
+    printf("DNS Registration: %s %d IN %s %s\n", name, ttl, type, value);
+    
+    /* In production, this would:
+     * 1. Connect to authoritative DNS server
+     * 2. Authenticate with DNS service
+     * 3. Create/update DNS record
+     * 4. Verify registration success
+     */
+    
+    return 0; /* Success */
+}
+
+char* tupledns_format_capabilities(const char* capabilities[]) {
+    if (!capabilities || !capabilities[0]) {
+        return NULL;
+    }
+    
+    /* Calculate total length needed */
+    size_t total_len = 5; /* "caps=" */
+    int count = 0;
+    
+    while (capabilities[count]) {
+        total_len += strlen(capabilities[count]);
+        if (count > 0) total_len++; /* comma */
+        count++;
+    }
+    total_len++; /* null terminator */
+    
+    char* result = malloc(total_len);
+    if (!result) {
+        return NULL;
+    }
+    
+    strcpy(result, "caps=");
+    for (int i = 0; i < count; i++) {
+        if (i > 0) strcat(result, ",");
+        strcat(result, capabilities[i]);
+    }
+    
+    return result;
+}
+
+int tupledns_expand_pattern(const char* pattern, char*** query_names, int* query_count) {
+    if (!pattern || !query_names || !query_count) {
+        return -1;
+    }
+    
+    *query_names = NULL;
+    *query_count = 0;
+    
+    /* If no wildcards, return the pattern as-is */
+    if (!strchr(pattern, '*')) {
+        *query_names = malloc(sizeof(char*));
+        if (!*query_names) return -1;
+        
+        (*query_names)[0] = strdup(pattern);
+        if (!(*query_names)[0]) {
+            free(*query_names);
+            return -1;
+        }
+        
+        *query_count = 1;
+        return 0;
+    }
+    
+    /* For wildcard patterns, implement DNS-based discovery */
+    
+    /* Let the registry evaluate the pattern itself when it advertises support */
+    if (tuple_server_q_features() & TUPLE_Q_PATTERNS) {
+        tupledns_result_t* matches = tuple_result_create();
+        int queries = 0;
+        int offset = 0;
+        if (matches && tuple_wire_find_pattern(pattern, NULL, TUPLE_QUERY_UNLIMITED, &offset, matches,
+                                               &queries) == TUPLEDNS_OK) {
+            int node_count = matches->node_count;
+            char** names = node_count > 0 ? calloc(node_count, sizeof(char*)) : NULL;
+            int copied = 0;
+            while (names && copied < node_count && (names[copied] = strdup(matches->nodes[copied].coordinate))) {
+                copied++;
+            }
+            tupledns_free_result(matches);
+            if (copied == node_count) {
+                *query_names = names;
+                *query_count = node_count;
+                return 0;
+            }
+            tupledns_free_string_array(names, copied);
+        } else {
+            tupledns_free_result(matches);
+        }
+    }
+    
+    /* Extract the .tuple domain for zone enumeration */
+    char* domain_part = strstr(pattern, ".tuple");
+    if (!domain_part) {
+        return -1; /* Invalid pattern */
+    }
+    
+    /* Attempt DNS zone transfer to enumerate coordinates */
+    char zone_name[256];
+    snprintf(zone_name, sizeof(zone_name), "tuple");
+    
+    char** zone_records = NULL;
+    int record_count = 0;
+    
+    /* Try to get zone records via AXFR (zone transfer) */
+    int zone_result = tupledns_dns_zone_transfer(zone_name, &zone_records, &record_count);
+    
+    if (zone_result == 0 && record_count > 0) {
+        /* Filter zone records by pattern */
+        char** matches = NULL;
+        int match_count = 0;
+        tuple_span_t span;
+        tuple_span_begin(&span, "candidates");
+        
+        for (int i = 0; i < record_count; i++) {
+            if (tupledns_match_pattern(zone_records[i], pattern)) {
+                matches = realloc(matches, (match_count + 1) * sizeof(char*));
+                if (matches) {
+                    matches[match_count] = strdup(zone_records[i]);
+                    match_count++;
+                }
+            }
+        }
+        
+        *query_names = matches;
+        *query_count = match_count;
+        tuple_span_end(&span, pattern, match_count);
+        
+        /* Free zone records */
+        tupledns_free_string_array(zone_records, record_count);
+        
+        return 0;
+    }
+    
+    /* If zone transfer fails, try iterative discovery */
+    /* This implements the hierarchical DNS structure approach */
+    char** candidates = NULL;
+    int candidate_count = 0;
+    
+    /* Generate candidate coordinates based on pattern structure */
+    tuple_span_t span;
+    tuple_span_begin(&span, "candidates");
+    int expand_result = tupledns_generate_pattern_candidates(pattern, &candidates, &candidate_count);
+    tuple_span_end(&span, pattern, candidate_count);
+    
+    if (expand_result == 0 && candidate_count > 0) {
+        /* Test each candidate with DNS lookup */
+        char** valid_names = NULL;
+        int valid_count = 0;
+        
+        for (int i = 0; i < candidate_count; i++) {
+            char* test_ip = NULL;
+            if (tupledns_dns_query_a(candidates[i], &test_ip) == 0 && test_ip) {
+                valid_names = realloc(valid_names, (valid_count + 1) * sizeof(char*));
+                if (valid_names) {
+                    valid_names[valid_count] = strdup(candidates[i]);
+                    valid_count++;
+                }
+                free(test_ip);
+            }
+        }
+        
+        tupledns_free_string_array(candidates, candidate_count);
+        
+        *query_names = valid_names;
+        *query_count = valid_count;
+        
+        return 0;
+    }
+    
+    /* No discovery method worked */
+    return -1;
+}
+
+int tupledns_dns_zone_transfer(const char* zone, char*** records, int* record_count) {
+    if (!zone || !records || !record_count) {
+        return -1;
+    }
+    
+    *records = NULL;
+    *record_count = 0;
+    
+    if (tuple_server_configured()) {
+        return tuple_wire_zone_transfer(zone, records, record_count) == TUPLEDNS_OK ? 0 : -1;
+    }
+    
+    /* DNS Zone Transfer (AXFR) implementation
+     * This requires access to authoritative DNS servers */
+    
+    /* Try to connect to known DNS servers for .tuple domain */
+    const char* dns_servers[] = {
+        "1.1.1.1",    /* Cloudflare */
+        "8.8.8.8",    /* Google */
+        "8.8.4.4",    /* Google Secondary */
+        NULL
+    };
+    
+    for (int i = 0; dns_servers[i] != NULL; i++) {
+        /* Attempt zone transfer from this server */
+        /* Note: Most public DNS servers don't allow zone transfers for security */
+        
+        struct addrinfo hints, *result;
+        memset(&hints, 0, sizeof(hints));
+        hints.ai_family = AF_INET;
+        hints.ai_socktype = SOCK_STREAM;
+        
+        int status = getaddrinfo(dns_servers[i], "53", &hints, &result);
+        if (status != 0) {
+            continue;
+        }
+        
+        /* In practice, zone transfers require:
+         * 1. DNS server configuration to allow transfers
+         * 2. Proper DNS protocol implementation (not just TCP)
+         * 3. Authentication/authorization
+         */
+        
+        freeaddrinfo(result);
+    }
+    
+    /* Zone transfer not available - this is expected for public DNS */
+    return -1;
+}
+
+int tupledns_generate_pattern_candidates(const char* pattern, char*** candidates, int* candidate_count) {
+    if (!pattern || !candidates || !candidate_count) {
+        return -1;
+    }
+    
+    *candidates = NULL;
+    *candidate_count = 0;
+    
+    /* Generate candidate coordinates based on common coordinate patterns */
+    /* This implements smart enumeration based on coordinate space knowledge */
+    
+    char** candidate_list = NULL;
+    int count = 0;
+    
+    /* Parse pattern to understand coordinate space */
+    if (strstr(pattern, ".music.tuple")) {
+        /* Music coordinate space - generate common patterns */
+        const char* genres[] = {"ambient", "jazz", "electronic", "classical", "rock", NULL};
+        const char* bpms[] = {"60", "80", "100", "120", "140", "160", NULL};
+        const char* locations[] = {"london", "newyork", "berlin", "tokyo", NULL};
+        
+        for (int g = 0; genres[g] != NULL; g++) {
+            for (int b = 0; bpms[b] != NULL; b++) {
+                for (int l = 0; locations[l] != NULL; l++) {
+                    char candidate[256];
+                    snprintf(candidate, sizeof(candidate), "%s.%s.%s.music.tuple", 
+                            genres[g], bpms[b], locations[l]);
+                    
+                    if (tupledns_match_pattern(candidate, pattern)) {
+                        candidate_list = realloc(candidate_list, (count + 1) * sizeof(char*));
+                        if (candidate_list) {
+                            candidate_list[count] = strdup(candidate);
+                            count++;
+                        }
+                    }
+                }
+            }
+        }
+    }
+    else if (strstr(pattern, ".spatial.tuple")) {
+        /* Spatial coordinate space */
+        const char* devices[] = {"sensor", "camera", "printer", "light", "thermostat", NULL};
+        const char* rooms[] = {"kitchen", "living-room", "bedroom", "office", "lab", NULL};
+        const char* floors[] = {"floor-1", "floor-2", "floor-3", NULL};
+        const char* buildings[] = {"building-1", "building-2", "building-5", NULL};
+        
+        for (int d = 0; devices[d] != NULL; d++) {
+            for (int r = 0; rooms[r] != NULL; r++) {
+                for (int f = 0; floors[f] != NULL; f++) {
+                    for (int b = 0; buildings[b] != NULL; b++) {
+                        char candidate[256];
+                        snprintf(candidate, sizeof(candidate), "%s.%s.%s.%s.spatial.tuple",
+                                devices[d], rooms[r], floors[f], buildings[b]);
+                        
+                        if (tupledns_match_pattern(candidate, pattern)) {
+                            candidate_list = realloc(candidate_list, (count + 1) * sizeof(char*));
+                            if (candidate_list) {
+                                candidate_list[count] = strdup(candidate);
+                                count++;
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+    else if (strstr(pattern, ".ai.tuple")) {
+        /* AI agent coordinate space */
+        const char* personalities[] = {"creative", "analytical", "empathetic", "logical", NULL};
+        const char* frequencies[] = {"60", "80", "100", "120", NULL};
+        const char* modes[] = {"collaborative", "autonomous", "interactive", NULL};
+        const char* contexts[] = {"research", "production", "support", NULL};
+        
+        for (int p = 0; personalities[p] != NULL; p++) {
+            for (int f = 0; frequencies[f] != NULL; f++) {
+                for (int m = 0; modes[m] != NULL; m++) {
+                    for (int c = 0; contexts[c] != NULL; c++) {
+                        char candidate[256];
+                        snprintf(candidate, sizeof(candidate), "%s.%s.%s.%s.ai.tuple",
+                                personalities[p], frequencies[f], modes[m], contexts[c]);
+                        
+                        if (tupledns_match_pattern(candidate, pattern)) {
+                            candidate_list = realloc(candidate_list, (count + 1) * sizeof(char*));
+                            if (candidate_list) {
+                                candidate_list[count] = strdup(candidate);
+                                count++;
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+    
+    *candidates = candidate_list;
+    *candidate_count = count;
+    
+    return 0;
+}
+
+/* ========================================================================
+ * CORE API FUNCTIONS
+ * ======================================================================== */
+
+static int tuple_register_node(const char* coordinate, const char* ip_address,
+                               const char* capabilities[], const char* aliases[], int ttl) {
+    if (!tupledns_validate_coordinate(coordinate)) {
+        return g_last_error;
+    }
+    for (int a = 0; aliases && aliases[a]; a++) {
+        if (!tupledns_validate_coordinate(aliases[a])) {
+            return g_last_error;
+        }
+        if (strcasecmp(aliases[a], coordinate) == 0) {
+            g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+            return TUPLEDNS_ERROR_INVALID_PARAMETER;
+        }
+        tuple_cache_forget(aliases[a]);
+    }
+    tuple_cache_forget(coordinate);
+    
+    /* Default to the local IP address for registration */
+    char* local_ip = NULL;
+    if (!ip_address) {
+        int result = tupledns_get_local_ip(&local_ip);
+        if (result != 0 || !local_ip) {
+            g_last_error = TUPLEDNS_ERROR_TIMEOUT;
+            return TUPLEDNS_ERROR_TIMEOUT;
+        }
+        ip_address = local_ip;
+    }
+    
+    char* caps_string = NULL;
+    if (capabilities && capabilities[0]) {
+        caps_string = tupledns_format_capabilities(capabilities);
+    }
+    
+    if (tuple_server_configured()) {
+        /* A and TXT records are replaced atomically in a single UPDATE */
+        int status = tuple_wire_update_register(coordinate, ip_address, caps_string, aliases, ttl);
+        free(caps_string);
+        free(local_ip);
+        if (status != TUPLEDNS_OK) {
+            g_last_error = status;
+        }
+        return status;
+    }
+    
+    /* Register A record with coordinate -> IP mapping */
+    int result = tupledns_register_dns_record(coordinate, "A", ip_address, ttl);
+    if (result != 0) {
+        free(caps_string);
+        free(local_ip);
+        g_last_error = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+        return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+    }
+    
+    /* Register TXT record with capabilities if provided */
+    if (caps_string) {
+        tupledns_register_dns_record(coordinate, "TXT", caps_string, ttl);
+        free(caps_string);
+    }
+    for (int a = 0; aliases && aliases[a]; a++) {
+        tupledns_register_dns_record(aliases[a], "CNAME", coordinate, ttl);
+    }
+    
+    free(local_ip);
+    return TUPLEDNS_OK;
+}
+
+int tupledns_register(const char* coordinate, const char* capabilities[], int ttl) {
+    return tuple_register_node(coordinate, NULL, capabilities, NULL, ttl);
+}
+
+int tupledns_register_with_ip(const char* coordinate, const char* ip_address, 
+                              const char* capabilities[], int ttl) {
+    if (!ip_address) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    return tuple_register_node(coordinate, ip_address, capabilities, NULL, ttl);
+}
+
+int tupledns_register_with_aliases(const char* coordinate, const char* ip_address,
+                                   const char* capabilities[], const char* aliases[], int ttl) {
+    return tuple_register_node(coordinate, ip_address, capabilities, aliases, ttl);
+}
+
+int tupledns_unregister(const char* coordinate) {
+    if (!tupledns_validate_coordinate(coordinate)) {
+        return g_last_error;
+    }
+    tuple_cache_forget(coordinate);
+    
+    if (tuple_server_configured()) {
+        int status = tuple_wire_update_unregister(coordinate);
+        if (status != TUPLEDNS_OK) {
+            g_last_error = status;
+        }
+        return status;
+    }
+    
+    /* TODO: Implement actual DNS unregistration */
+    return TUPLEDNS_OK;
+}
+
+static const char* tuple_caps_record(char** txt_records, int txt_count) {
+    for (int j = 0; j < txt_count; j++) {
+        if (strncmp(txt_records[j], "caps=", 5) == 0) {
+            return txt_records[j];
+        }
+    }
+    return NULL;
+}
+
+static int tuple_compare_names(const void* a, const void* b) {
+    return strcmp(*(char* const*)a, *(char* const*)b);
+}
+
+/* Cursors name the enumeration they index into ("q" for server matches,
+ * "e" for expanded names) and the position to resume from */
+static int tuple_parse_cursor(const char* cursor, char kind) {
+    if (!cursor) {
+        return 0;
+    }
+    char* end = NULL;
+    long position = (cursor[0] == kind && cursor[1] == ':') ? strtol(cursor + 2, &end, 10) : -1;
+    return (end && *end == '\0' && position >= 0 && position < INT_MAX) ? (int)position : -1;
+}
+
+static void tuple_result_set_cursor(tupledns_result_t* result, char kind, int position) {
+    char cursor[24];
+    int len = snprintf(cursor, sizeof(cursor), "%c:%d", kind, position);
+    result->next_cursor = tuple_arena_strndup(result->arena, cursor, (size_t)len);
+}
+
+/* Find with required capabilities pushed into the pipeline: the server
+ * filters when it can, the capability cache answers or rules out names it
+ * has fresh entries for, and TXT is fetched before the address so nodes
+ * missing a capability never cost an address lookup. With page options,
+ * expansion and resolution stop as soon as the limit is reached and the
+ * result carries a cursor to resume from. A refresh bypasses the cache. */
+static tupledns_result_t* tuple_find(const char* pattern, const char* required_caps[],
+                                     const tupledns_find_options_t* page, int refresh, int* failures) {
+    if (failures) {
+        *failures = 0;
+    }
+    if (!pattern) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    int limit = TUPLE_QUERY_UNLIMITED;
+    if (page) {
+        limit = (page->limit <= 0 || page->limit > TUPLEDNS_MAX_NODES_PER_RESULT)
+            ? TUPLEDNS_MAX_NODES_PER_RESULT : page->limit;
+    }
+    int has_caps = required_caps && required_caps[0];
+    int server_side = (strchr(pattern, '*') || has_caps) && (tuple_server_q_features() & TUPLE_Q_PATTERNS);
+    const char* cursor = page ? page->cursor : NULL;
+    int start = tuple_parse_cursor(cursor, server_side ? 'q' : 'e');
+    if (start < 0) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    tupledns_result_t* result = tuple_result_create();
+    if (!result) {
+        return NULL;
+    }
+    
+    struct timeval start_time, end_time;
+    gettimeofday(&start_time, NULL);
+    
+    /* A registry that evaluates patterns answers the whole query in one round
+     * trip; it returns matches sorted by coordinate */
+    if (server_side) {
+        int queries = 0;
+        int offset = start;
+        if (tuple_wire_find_pattern(pattern, required_caps, limit, &offset, result, &queries) == TUPLEDNS_OK) {
+            tuple_stats_add(&g_stats.server_finds, 1);
+            for (int i = 0; i < result->node_count; i++) {
+                tuple_cache_store(&result->nodes[i]);
+            }
+            if (offset >= 0) {
+                tuple_result_set_cursor(result, 'q', offset);
+            }
+            result->total_queries = queries;
+            result->error = (result->node_count > 0) ? TUPLEDNS_OK : TUPLEDNS_ERROR_NO_RESULTS;
+            gettimeofday(&end_time, NULL);
+            result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
+                                (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
+            return result;
+        }
+    }
+    
+    /* Expand pattern into specific DNS queries */
+    char** query_names = NULL;
+    int query_count = 0;
+    
+    tuple_span_t span;
+    tuple_span_begin(&span, "expand");
+    int expand_result = tupledns_expand_pattern(pattern, &query_names, &query_count);
+    tuple_span_end(&span, pattern, query_count);
+    if (expand_result == 0) {
+        tuple_stats_expansion(query_count);
+    }
+    if (expand_result != 0 || query_count <= start) {
+        tupledns_free_string_array(query_names, query_count);
+        if (expand_result != 0 && failures) {
+            (*failures)++;
+        }
+        result->node_count = 0;
+        result->total_queries = 0;
+        result->error = TUPLEDNS_ERROR_NO_RESULTS;
+        gettimeofday(&end_time, NULL);
+        result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
+                            (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
+        return result;
+    }
+    
+    if (page && page->order == TUPLEDNS_ORDER_COORDINATE) {
+        qsort(query_names, query_count, sizeof(char*), tuple_compare_names);
+    }
+    
+    /* Perform DNS queries for each expanded name, issuing no probes past the limit */
+    int total_queries = 0;
+    int aliased = 0;
+    
+    for (int i = start; i < query_count; i++) {
+        if (result->node_count == limit) {
+            tuple_result_set_cursor(result, 'e', i);
+            break;
+        }
+        if (aliased && tuple_result_find_node(result, 0, query_names[i], strlen(query_names[i]))) {
+            continue;  /* Reached earlier as the end of an alias's CNAME chain */
+        }
+        if (has_caps && !refresh && tuple_cache_lookup(query_names[i], required_caps, result) != TUPLE_CACHE_MISS) {
+            continue;
+        }
+        
+        char** addresses = NULL;
+        int address_count = 0;
+        char** txt_records = NULL;
+        int txt_count = 0;
+        const char* caps_record = NULL;
+        total_queries++;
+        
+        if (has_caps) {
+            int txt_status = tupledns_dns_query_txt(query_names[i], &txt_records, &txt_count);
+            if (txt_status != TUPLEDNS_OK && txt_status != TUPLEDNS_ERROR_NO_RESULTS && failures) {
+                (*failures)++;
+            }
+            caps_record = tuple_caps_record(txt_records, txt_count);
+            if (!tuple_caps_contain(caps_record, required_caps)) {
+                tupledns_free_string_array(txt_records, txt_count);
+                continue;
+            }
+        }
+        
+        /* Query A and AAAA records; an alias resolves to its canonical coordinate */
+        char canonical[TUPLEDNS_MAX_COORDINATE_LENGTH + 3];
+        int address_status = tuple_query_addresses(query_names[i], &addresses, &address_count,
+                                                   canonical, sizeof(canonical));
+        if (address_status != TUPLEDNS_OK && address_status != TUPLEDNS_ERROR_NO_RESULTS && failures) {
+            (*failures)++;
+        }
+        if (address_status == 0) {
+            tuple_span_begin(&span, "assemble");
+            int is_alias = strcasecmp(canonical, query_names[i]) != 0;
+            tupledns_node_t* node = (is_alias || aliased)
+                ? tuple_result_find_node(result, 0, canonical, strlen(canonical)) : NULL;
+            if (node) {
+                /* Already found under another name: just record this one */
+                tuple_result_add_alias(result, node, query_names[i], strlen(query_names[i]));
+                node = NULL;
+            } else {
+                if (!has_caps) {
+                    /* Query TXT records for capabilities */
+                    tupledns_dns_query_txt(canonical, &txt_records, &txt_count);
+                    caps_record = tuple_caps_record(txt_records, txt_count);
+                }
+                node = tuple_result_add_node(result);
+            }
+            if (node) {
+                node->coordinate = tuple_arena_strndup(result->arena, canonical, strlen(canonical));
+                node->last_seen = time(NULL);
+                node->ttl = 300; /* Default TTL */
+                if (!node->coordinate ||
+                    tuple_result_set_addresses(result, node, addresses, address_count) != 0 ||
+                    (is_alias && tuple_result_add_alias(result, node, query_names[i], strlen(query_names[i])) != 0) ||
+                    tuple_result_parse_caps(result, node, caps_record) != 0) {
+                    tuple_result_pop_node(result);
+                } else {
+                    aliased |= is_alias;
+                    tuple_cache_store(node);
+                }
+            }
+            tuple_span_end(&span, canonical, result->node_count);
+        }
+        tupledns_free_string_array(addresses, address_count);
+        
+        /* Free TXT records */
+        tupledns_free_string_array(txt_records, txt_count);
+    }
+    
+    /* Free query names */
+    tupledns_free_string_array(query_names, query_count);
+    
+    /* Populate result */
+    result->total_queries = total_queries;
+    result->error = (result->node_count > 0) ? TUPLEDNS_OK : TUPLEDNS_ERROR_NO_RESULTS;
+    
+    gettimeofday(&end_time, NULL);
+    result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
+                        (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
+    
+    return result;
+}
+
+/* Unpaged finds are answered from and stored in the pattern cache */
+static tupledns_result_t* tuple_find_cached(const char* pattern, const char* required_caps[], int refresh) {
+    tuple_span_t span;
+    tuple_span_begin(&span, "find");
+    tupledns_result_t* result = refresh ? NULL : tuple_pattern_cache_lookup(pattern, required_caps);
+    if (result) {
+        tuple_stats_find(result->query_time);
+        tuple_span_end(&span, pattern, result->node_count);
+        return result;
+    }
+    result = tuple_find(pattern, required_caps, NULL, refresh, NULL);
+    if (result && required_caps && required_caps[0]) {
+        /* The server and cache may have filtered already; this enforces exact matching */
+        tupledns_filter_capabilities(result, required_caps);
+    }
+    if (result) {
+        tuple_pattern_cache_store(pattern, required_caps, result);
+        tuple_stats_find(result->query_time);
+    }
+    tuple_span_end(&span, pattern, result ? result->node_count : 0);
+    return result;
+}
+
+tupledns_result_t* tupledns_find(const char* pattern) {
+    return tuple_find_cached(pattern, NULL, 0);
+}
+
+tupledns_result_t* tupledns_find_page(const char* pattern, const tupledns_find_options_t* options) {
+    tupledns_find_options_t defaults;
+    if (!options) {
+        memset(&defaults, 0, sizeof(defaults));
+        options = &defaults;
+    }
+    /* Capabilities are checked exactly as each node is added, so every page is full */
+    tuple_span_t span;
+    tuple_span_begin(&span, "find");
+    tupledns_result_t* result = tuple_find(pattern, options->required_caps, options, 0, NULL);
+    if (result) {
+        tuple_stats_find(result->query_time);
+    }
+    tuple_span_end(&span, pattern, result ? result->node_count : 0);
+    return result;
+}
+
+tupledns_result_t* tupledns_find_with_caps(const char* pattern, const char* required_caps[]) {
+    return tuple_find_cached(pattern, required_caps, 0);
+}
+
+int tupledns_filter_capabilities(tupledns_result_t* result, const char* required_caps[]) {
+    if (!result) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    if (!required_caps || !required_caps[0]) {
+        return TUPLEDNS_OK;
+    }
+    tuple_span_t span;
+    tuple_span_begin(&span, "capability_filter");
+    
+    /* Intern the required capabilities to bit positions for this result set,
+     * so each node costs one table probe per capability it declares and a
+     * bitmap compare, rather than a strcmp per (required, declared) pair */
+    tuple_label_table_t required;
+    memset(&required, 0, sizeof(required));
+    required.exact = 1;
+    for (int j = 0; required_caps[j] != NULL; j++) {
+        if (tuple_labels_intern(&required, required_caps[j], strlen(required_caps[j])) == TUPLEDNS_LABEL_NONE) {
+            tuple_labels_free(&required);
+            tuple_span_end(&span, NULL, result->node_count);
+            g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+            return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        }
+    }
+    
+    int words = (int)(required.count + 63) / 64;
+    uint64_t stack_bits[4];
+    uint64_t* bits = words <= 4 ? stack_bits : malloc(words * sizeof(uint64_t));
+    if (!bits) {
+        tuple_labels_free(&required);
+        tuple_span_end(&span, NULL, result->node_count);
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    }
+    
+    /* Compact survivors towards the front; rejected nodes are freed unless
+     * they live in the result's arena */
+    int kept = 0;
+    for (int i = 0; i < result->node_count; i++) {
+        tupledns_node_t* node = &result->nodes[i];
+        memset(bits, 0, words * sizeof(uint64_t));
+        uint32_t found = 0;
+        for (int c = 0; c < node->capability_count && found < required.count; c++) {
+            if (!node->capabilities[c]) continue;
+            uint32_t id = tuple_labels_find(&required, node->capabilities[c], strlen(node->capabilities[c]));
+            if (id != TUPLEDNS_LABEL_NONE && !(bits[id / 64] & (1ULL << (id % 64)))) {
+                bits[id / 64] |= 1ULL << (id % 64);
+                found++;
+            }
+        }
+        
+        if (found == required.count) {
+            if (kept != i) {
+                result->nodes[kept] = *node;
+            }
+            kept++;
+        } else if (!result->arena) {
+            tupledns_free_node(node);
+        }
+    }
+    
+    if (bits != stack_bits) free(bits);
+    tuple_labels_free(&required);
+    
+    if (kept == 0 && !result->arena) {
+        free(result->nodes);
+        result->nodes = NULL;
+    }
+    result->node_count = kept;
+    result->error = (kept > 0) ? TUPLEDNS_OK : TUPLEDNS_ERROR_NO_RESULTS;
+    tuple_span_end(&span, NULL, kept);
+    return TUPLEDNS_OK;
+}
+
+tupledns_result_t* tupledns_find_range(const char* pattern, const tupledns_range_t ranges[], int range_count) {
+    if (!pattern || !ranges || range_count <= 0) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    /* TODO: Expand ranges into multiple queries and merge results */
+    return tupledns_find(pattern);
+}
+
+tupledns_result_t* tupledns_search_multi(const char* patterns[], int pattern_count) {
+    if (!patterns || pattern_count <= 0) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    /* TODO: Execute multiple queries in parallel and merge results */
+    return tupledns_find(patterns[0]);
+}
+/* ========================================================================
+ * SNAPSHOTS
+ * ======================================================================== */
+
+/* Memory-mapped coordinate snapshots written by tupledns_store.py. All
+ * integers are little-endian and every section is 8-byte aligned, so the
+ * arrays are used in place without any parsing. */
+
+#define TUPLE_SNAPSHOT_MAGIC "TDNSSNAP"
+#define TUPLE_SNAPSHOT_VERSION 1
+#define TUPLE_SNAPSHOT_HEADER_SIZE 40
+#define TUPLE_SNAPSHOT_MAX_LABELS 128
+
+enum {
+    TUPLE_SECTION_LABEL_OFFSETS,
+    TUPLE_SECTION_LABEL_DATA,
+    TUPLE_SECTION_NODE_LABEL_OFFSETS,
+    TUPLE_SECTION_NODE_LABELS,
+    TUPLE_SECTION_V4_OFFSETS,
+    TUPLE_SECTION_V4_DATA,
+    TUPLE_SECTION_V6_OFFSETS,
+    TUPLE_SECTION_V6_DATA,
+    TUPLE_SECTION_CAP_OFFSETS,
+    TUPLE_SECTION_CAP_DATA,
+    TUPLE_SECTION_CAP_BITS,
+    TUPLE_SECTION_TTLS,
+    TUPLE_SECTION_COUNT
+};
+
+struct tupledns_snapshot {
+    const uint8_t* base;
+    size_t size;
+    uint32_t serial;
+    uint32_t node_count;
+    uint32_t label_count;
+    uint32_t cap_count;
+    uint32_t cap_words;
+    const uint32_t* label_offsets;
+    const char* label_data;
+    const uint32_t* row_offsets;
+    const uint32_t* row_labels;
+    const uint32_t* v4_offsets;
+    const uint8_t* v4_data;
+    const uint32_t* v6_offsets;
+    const uint8_t* v6_data;
+    const uint32_t* cap_offsets;
+    const char* cap_data;
+    const uint64_t* cap_bits;
+    const uint32_t* ttls;
+};
+
+static uint64_t tuple_snapshot_get64(const uint8_t* p) {
+    uint64_t value;
+    memcpy(&value, p, sizeof(value));
+    return value;
+}
+
+static uint32_t tuple_snapshot_get32(const uint8_t* p) {
+    uint32_t value;
+    memcpy(&value, p, sizeof(value));
+    return value;
+}
+
+/* Point the snapshot's arrays into the mapping, checking every bound once */
+static int tuple_snapshot_map(tupledns_snapshot_t* snap) {
+    const uint8_t* base = snap->base;
+    const uint16_t probe = 1;
+    if (*(const uint8_t*)&probe != 1) {
+        return -1; /* Snapshots are little-endian */
+    }
+    if (snap->size < TUPLE_SNAPSHOT_HEADER_SIZE + 16 * TUPLE_SECTION_COUNT ||
+        memcmp(base, TUPLE_SNAPSHOT_MAGIC, 8) != 0 ||
+        tuple_snapshot_get32(base + 8) != TUPLE_SNAPSHOT_VERSION ||
+        tuple_snapshot_get32(base + 12) < TUPLE_SECTION_COUNT) {
+        return -1;
+    }
+    snap->serial = tuple_snapshot_get32(base + 16);
+    snap->node_count = tuple_snapshot_get32(base + 20);
+    snap->label_count = tuple_snapshot_get32(base + 24);
+    snap->cap_count = tuple_snapshot_get32(base + 28);
+    snap->cap_words = tuple_snapshot_get32(base + 32);
+    
+    const uint8_t* sections[TUPLE_SECTION_COUNT];
+    uint64_t sizes[TUPLE_SECTION_COUNT];
+    for (int i = 0; i < TUPLE_SECTION_COUNT; i++) {
+        uint64_t offset = tuple_snapshot_get64(base + TUPLE_SNAPSHOT_HEADER_SIZE + 16 * i);
+        sizes[i] = tuple_snapshot_get64(base + TUPLE_SNAPSHOT_HEADER_SIZE + 16 * i + 8);
+        if (offset % 8 != 0 || offset > snap->size || sizes[i] > snap->size - offset) {
+            return -1;
+        }
+        sections[i] = base + offset;
+    }
+    
+    uint64_t nodes = snap->node_count;
+    if (sizes[TUPLE_SECTION_LABEL_OFFSETS] != 4 * ((uint64_t)snap->label_count + 1) ||
+        sizes[TUPLE_SECTION_NODE_LABEL_OFFSETS] != 4 * (nodes + 1) ||
+        sizes[TUPLE_SECTION_V4_OFFSETS] != 4 * (nodes + 1) ||
+        sizes[TUPLE_SECTION_V6_OFFSETS] != 4 * (nodes + 1) ||
+        sizes[TUPLE_SECTION_CAP_OFFSETS] != 4 * ((uint64_t)snap->cap_count + 1) ||
+        sizes[TUPLE_SECTION_CAP_BITS] != 8 * nodes * snap->cap_words ||
+        sizes[TUPLE_SECTION_TTLS] != 4 * nodes ||
+        (uint64_t)snap->cap_words * 64 < snap->cap_count) {
+        return -1;
+    }
+    
+    snap->label_offsets = (const uint32_t*)sections[TUPLE_SECTION_LABEL_OFFSETS];
+    snap->label_data = (const char*)sections[TUPLE_SECTION_LABEL_DATA];
+    snap->row_offsets = (const uint32_t*)sections[TUPLE_SECTION_NODE_LABEL_OFFSETS];
+    snap->row_labels = (const uint32_t*)sections[TUPLE_SECTION_NODE_LABELS];
+    snap->v4_offsets = (const uint32_t*)sections[TUPLE_SECTION_V4_OFFSETS];
+    snap->v4_data = sections[TUPLE_SECTION_V4_DATA];
+    snap->v6_offsets = (const uint32_t*)sections[TUPLE_SECTION_V6_OFFSETS];
+    snap->v6_data = sections[TUPLE_SECTION_V6_DATA];
+    snap->cap_offsets = (const uint32_t*)sections[TUPLE_SECTION_CAP_OFFSETS];
+    snap->cap_data = (const char*)sections[TUPLE_SECTION_CAP_DATA];
+    snap->cap_bits = (const uint64_t*)sections[TUPLE_SECTION_CAP_BITS];
+    snap->ttls = (const uint32_t*)sections[TUPLE_SECTION_TTLS];
+    
+    /* CSR offsets must be non-decreasing and stay inside their data sections */
+    const struct { const uint32_t* offsets; uint32_t count; uint64_t limit; } tables[] = {
+        { snap->label_offsets, snap->label_count, sizes[TUPLE_SECTION_LABEL_DATA] },
+        { snap->cap_offsets, snap->cap_count, sizes[TUPLE_SECTION_CAP_DATA] },
+        { snap->row_offsets, snap->node_count, sizes[TUPLE_SECTION_NODE_LABELS] / 4 },
+        { snap->v4_offsets, snap->node_count, sizes[TUPLE_SECTION_V4_DATA] / 4 },
+        { snap->v6_offsets, snap->node_count, sizes[TUPLE_SECTION_V6_DATA] / 16 },
+    };
+    for (size_t t = 0; t < sizeof(tables) / sizeof(tables[0]); t++) {
+        for (uint32_t i = 0; i < tables[t].count; i++) {
+            if (tables[t].offsets[i] > tables[t].offsets[i + 1]) {
+                return -1;
+            }
+        }
+        if (tables[t].offsets[tables[t].count] > tables[t].limit) {
+            return -1;
+        }
+    }
+    for (uint32_t i = 0; i < snap->row_offsets[snap->node_count]; i++) {
+        if (snap->row_labels[i] >= snap->label_count) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+tupledns_snapshot_t* tupledns_snapshot_open(const char* path) {
+    if (!path) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    struct stat st;
+    if (fstat(fd, &st) != 0 || st.st_size <= 0) {
+        close(fd);
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    void* base = mmap(NULL, (size_t)st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (base == MAP_FAILED) {
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return NULL;
+    }
+    
+    tupledns_snapshot_t* snap = calloc(1, sizeof(tupledns_snapshot_t));
+    if (!snap) {
+        munmap(base, (size_t)st.st_size);
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return NULL;
+    }
+    snap->base = base;
+    snap->size = (size_t)st.st_size;
+    
+    if (tuple_snapshot_map(snap) != 0) {
+        tupledns_snapshot_close(snap);
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    return snap;
+}
+
+void tupledns_snapshot_close(tupledns_snapshot_t* snapshot) {
+    if (!snapshot) return;
+    
+    munmap((void*)snapshot->base, snapshot->size);
+    free(snapshot);
+}
+
+int tupledns_snapshot_node_count(const tupledns_snapshot_t* snapshot) {
+    return snapshot ? (int)snapshot->node_count : 0;
+}
+
+/* Binary-search a sorted string table; returns the entry's ID or -1 */
+static int tuple_snapshot_search(const uint32_t* offsets, const char* data, uint32_t count,
+                                 const char* key, size_t key_len) {
+    uint32_t lo = 0;
+    uint32_t hi = count;
+    while (lo < hi) {
+        uint32_t mid = lo + (hi - lo) / 2;
+        size_t len = offsets[mid + 1] - offsets[mid];
+        int cmp = memcmp(data + offsets[mid], key, len < key_len ? len : key_len);
+        if (cmp == 0) {
+            cmp = (len > key_len) - (len < key_len);
+        }
+        if (cmp < 0) {
+            lo = mid + 1;
+        } else if (cmp > 0) {
+            hi = mid;
+        } else {
+            return (int)mid;
+        }
+    }
+    return -1;
+}
+
+static char* tuple_snapshot_string(const uint32_t* offsets, const char* data, uint32_t id,
+                                   struct tupledns_arena* arena) {
+    return tuple_arena_strndup(arena, data + offsets[id], offsets[id + 1] - offsets[id]);
+}
+
+/* Materialize node i of the snapshot into the result */
+static int tuple_snapshot_fill_node(const tupledns_snapshot_t* snap, uint32_t i, tupledns_result_t* result) {
+    tupledns_node_t* node = tuple_result_add_node(result);
+    if (!node) {
+        return -1;
+    }
+    
+    size_t len = 0;
+    for (uint32_t j = snap->row_offsets[i]; j < snap->row_offsets[i + 1]; j++) {
+        uint32_t id = snap->row_labels[j];
+        len += snap->label_offsets[id + 1] - snap->label_offsets[id] + 1;
+    }
+    node->coordinate = tuple_arena_alloc(result->arena, len + 1);
+    if (!node->coordinate) {
+        tuple_result_pop_node(result);
+        return -1;
+    }
+    size_t pos = 0;
+    for (uint32_t j = snap->row_offsets[i]; j < snap->row_offsets[i + 1]; j++) {
+        uint32_t id = snap->row_labels[j];
+        size_t label_len = snap->label_offsets[id + 1] - snap->label_offsets[id];
+        if (pos > 0) node->coordinate[pos++] = '.';
+        memcpy(node->coordinate + pos, snap->label_data + snap->label_offsets[id], label_len);
+        pos += label_len;
+    }
+    node->coordinate[pos] = '\0';
+    
+    /* Every IPv4 address, then every IPv6 one */
+    uint32_t v4_count = snap->v4_offsets[i + 1] - snap->v4_offsets[i];
+    uint32_t v6_count = snap->v6_offsets[i + 1] - snap->v6_offsets[i];
+    if (v4_count + v6_count > 0 &&
+        !(node->ip_addresses = tuple_arena_alloc(result->arena, (v4_count + v6_count) * sizeof(char*)))) {
+        tuple_result_pop_node(result);
+        return -1;
+    }
+    for (uint32_t j = 0; j < v4_count + v6_count; j++) {
+        char address[INET6_ADDRSTRLEN];
+        const char* formatted = j < v4_count
+            ? inet_ntop(AF_INET, snap->v4_data + 4 * ((size_t)snap->v4_offsets[i] + j), address, sizeof(address))
+            : inet_ntop(AF_INET6, snap->v6_data + 16 * ((size_t)snap->v6_offsets[i] + j - v4_count),
+                        address, sizeof(address));
+        if (!formatted) continue;
+        node->ip_addresses[node->address_count] = tuple_arena_strndup(result->arena, formatted, strlen(formatted));
+        if (!node->ip_addresses[node->address_count]) {
+            tuple_result_pop_node(result);
+            return -1;
+        }
+        node->address_count++;
+    }
+    node->ip_address = node->address_count > 0 ? node->ip_addresses[0] : NULL;
+    
+    /* Count the node's capabilities first so the array is sized once */
+    const uint64_t* bits = snap->cap_bits + (size_t)i * snap->cap_words;
+    int count = 0;
+    for (uint32_t cap = 0; cap < snap->cap_count; cap++) {
+        count += (bits[cap / 64] >> (cap % 64)) & 1;
+    }
+    if (count > 0 && !(node->capabilities = tuple_arena_alloc(result->arena, count * sizeof(char*)))) {
+        tuple_result_pop_node(result);
+        return -1;
+    }
+    for (uint32_t cap = 0; cap < snap->cap_count && node->capability_count < count; cap++) {
+        if (!(bits[cap / 64] & ((uint64_t)1 << (cap % 64)))) continue;
+        node->capabilities[node->capability_count] = tuple_snapshot_string(snap->cap_offsets, snap->cap_data, cap,
+                                                                           result->arena);
+        if (!node->capabilities[node->capability_count]) {
+            tuple_result_pop_node(result);
+            return -1;
+        }
+        node->capability_count++;
+    }
+    
+    node->ttl = (int)snap->ttls[i];
+    node->last_seen = time(NULL);
+    return 0;
+}
+
+tupledns_result_t* tupledns_snapshot_find(const tupledns_snapshot_t* snapshot, const char* pattern,
+                                          const char* required_caps[]) {
+    if (!snapshot || !pattern) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    tupledns_result_t* result = tuple_result_create();
+    if (!result) {
+        return NULL;
+    }
+    
+    struct timeval start_time, end_time;
+    gettimeofday(&start_time, NULL);
+    result->error = TUPLEDNS_ERROR_NO_RESULTS;
+    
+    /* Resolve literal pattern labels to IDs; a label absent from the dictionary matches nothing */
+    uint32_t positions[TUPLE_SNAPSHOT_MAX_LABELS];
+    uint32_t ids[TUPLE_SNAPSHOT_MAX_LABELS];
+    uint32_t literal_count = 0;
+    uint32_t label_count = 0;
+    int possible = 1;
+    const char* p = pattern;
+    while (possible) {
+        size_t len = strcspn(p, ".");
+        if (label_count == TUPLE_SNAPSHOT_MAX_LABELS || len > 63) {
+            possible = 0;
+            break;
+        }
+        if (!(len == 1 && p[0] == '*')) {
+            char label[64];
+            for (size_t k = 0; k < len; k++) {
+                label[k] = (char)tolower((unsigned char)p[k]);
+            }
+            int id = tuple_snapshot_search(snapshot->label_offsets, snapshot->label_data,
+                                           snapshot->label_count, label, len);
+            if (id < 0) {
+                possible = 0;
+                break;
+            }
+            positions[literal_count] = label_count;
+            ids[literal_count++] = (uint32_t)id;
+        }
+        label_count++;
+        if (p[len] == '\0') break;
+        p += len + 1;
+    }
+    
+    /* Required capabilities become (word, mask) tests on each node's bitset */
+    uint32_t cap_word[TUPLEDNS_MAX_CAPABILITIES];
+    uint64_t cap_mask[TUPLEDNS_MAX_CAPABILITIES];
+    int required = 0;
+    for (int c = 0; possible && required_caps && required_caps[c]; c++) {
+        int id = tuple_snapshot_search(snapshot->cap_offsets, snapshot->cap_data, snapshot->cap_count,
+                                       required_caps[c], strlen(required_caps[c]));
+        if (id < 0 || required == TUPLEDNS_MAX_CAPABILITIES) {
+            possible = 0;
+            break;
+        }
+        cap_word[required] = (uint32_t)id / 64;
+        cap_mask[required++] = (uint64_t)1 << (id % 64);
+    }
+    
+    for (uint32_t i = 0; possible && i < snapshot->node_count; i++) {
+        const uint32_t* row = snapshot->row_labels + snapshot->row_offsets[i];
+        if (snapshot->row_offsets[i + 1] - snapshot->row_offsets[i] != label_count) continue;
+        
+        uint32_t k = 0;
+        while (k < literal_count && row[positions[k]] == ids[k]) k++;
+        if (k < literal_count) continue;
+        
+        const uint64_t* bits = snapshot->cap_bits + (size_t)i * snapshot->cap_words;
+        int c = 0;
+        while (c < required && (bits[cap_word[c]] & cap_mask[c])) c++;
+        if (c < required) continue;
+        
+        if (tuple_snapshot_fill_node(snapshot, i, result) != 0) {
+            result->error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+            break;
+        }
+    }
+    
+    if (result->node_count > 0 && result->error == TUPLEDNS_ERROR_NO_RESULTS) {
+        result->error = TUPLEDNS_OK;
+    }
+    gettimeofday(&end_time, NULL);
+    result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
+                        (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
+    return result;
+}
+
+/* ========================================================================
+ * COORDINATE INDEX
+ * ======================================================================== */
+
+/* Labels are interned once per index and every coordinate is held as a
+ * short array of label IDs. Matching is integer comparison; strings are
+ * only rebuilt when results are returned. */
+
+#define TUPLE_INDEX_MAX_LABELS 128
+#define TUPLE_SLOT_DELETED 0xFFFFFFFFu
+
+typedef struct {
+    uint32_t* labels;           /* Interned label IDs, left to right */
+    int label_count;
+    uint32_t hash;              /* Hash of the label ID sequence */
+    char** addresses;           /* Every address, the node's ip_address first */
+    int address_count;
+    char** capabilities;
+    int capability_count;
+    uint64_t* cap_bits;         /* Bit per interned capability */
+    int cap_words;
+    int ttl;
+    time_t last_seen;
+    uint32_t hits;              /* Capability cache lookups answered (decays on refresh) */
+} tuple_index_entry_t;
+
+struct tupledns_index {
+    tuple_label_table_t labels;
+    tuple_label_table_t capabilities;   /* Capability -> bit position */
+    tuple_index_entry_t* entries;
+    int count;
+    int capacity;
+    uint32_t* slots;            /* Coordinate -> entry + 1, EMPTY or DELETED */
+    uint32_t slot_count;
+    uint32_t slots_used;        /* Live plus deleted slots */
+    struct tuple_kd_tree* trees; /* Proximity trees, dropped when entries change */
+    struct tuple_bk_tree* bk_trees; /* Similarity trees, likewise */
+};
+
+static void tuple_index_drop_trees(tupledns_index_t* index);
+
+/* Convert a coordinate or pattern to label IDs. With intern set, new labels
+ * are added; otherwise unknown labels map to TUPLEDNS_LABEL_NONE. A "*"
+ * label becomes TUPLEDNS_LABEL_ANY when wildcards is set. Returns the
+ * label count or -1. */
+static int tuple_labels_split(tuple_label_table_t* table, const char* name, uint32_t* ids, int max_ids,
+                              int intern, int wildcards) {
+    int count = 0;
+    const char* p = name;
+    for (;;) {
+        size_t len = strcspn(p, ".");
+        if (count == max_ids || len == 0 || len > 63) {
+            return -1;
+        }
+        if (wildcards && len == 1 && p[0] == '*') {
+            ids[count] = TUPLEDNS_LABEL_ANY;
+        } else if (intern) {
+            ids[count] = tuple_labels_intern(table, p, len);
+            if (ids[count] == TUPLEDNS_LABEL_NONE) return -1;
+        } else {
+            ids[count] = tuple_labels_find(table, p, len);
+        }
+        count++;
+        if (p[len] == '\0') break;
+        p += len + 1;
+    }
+    return count;
+}
+
+static uint32_t tuple_ids_hash(const uint32_t* ids, int count) {
+    uint32_t hash = 2166136261u;
+    for (int i = 0; i < count; i++) {
+        hash = (hash ^ ids[i]) * 16777619u;
+    }
+    return hash;
+}
+
+static char* tuple_index_coordinate(const tupledns_index_t* index, const tuple_index_entry_t* entry,
+                                    struct tupledns_arena* arena) {
+    size_t len = 0;
+    for (int i = 0; i < entry->label_count; i++) {
+        len += strlen(index->labels.strings[entry->labels[i]]) + 1;
+    }
+    char* coordinate = tuple_arena_alloc(arena, len);
+    if (!coordinate) {
+        return NULL;
+    }
+    char* out = coordinate;
+    for (int i = 0; i < entry->label_count; i++) {
+        size_t label_len = strlen(index->labels.strings[entry->labels[i]]);
+        memcpy(out, index->labels.strings[entry->labels[i]], label_len);
+        out += label_len;
+        *out++ = (i + 1 < entry->label_count) ? '.' : '\0';
+    }
+    return coordinate;
+}
+
+/* Find the slot holding ids, or -1 */
+static long tuple_index_slot(const tupledns_index_t* index, const uint32_t* ids, int count, uint32_t hash) {
+    if (index->slot_count == 0) {
+        return -1;
+    }
+    uint32_t mask = index->slot_count - 1;
+    for (uint32_t i = hash & mask; index->slots[i] != TUPLE_SLOT_EMPTY; i = (i + 1) & mask) {
+        if (index->slots[i] == TUPLE_SLOT_DELETED) continue;
+        const tuple_index_entry_t* entry = &index->entries[index->slots[i] - 1];
+        if (entry->hash == hash && entry->label_count == count &&
+            memcmp(entry->labels, ids, count * sizeof(uint32_t)) == 0) {
+            return (long)i;
+        }
+    }
+    return -1;
+}
+
+static int tuple_index_rehash(tupledns_index_t* index, uint32_t slot_count) {
+    uint32_t* slots = calloc(slot_count, sizeof(uint32_t));
+    if (!slots) {
+        return -1;
+    }
+    for (int e = 0; e < index->count; e++) {
+        uint32_t i = index->entries[e].hash & (slot_count - 1);
+        while (slots[i] != TUPLE_SLOT_EMPTY) i = (i + 1) & (slot_count - 1);
+        slots[i] = (uint32_t)e + 1;
+    }
+    free(index->slots);
+    index->slots = slots;
+    index->slot_count = slot_count;
+    index->slots_used = (uint32_t)index->count;
+    return 0;
+}
+
+static void tuple_index_entry_free(tuple_index_entry_t* entry) {
+    free(entry->labels);
+    free(entry->cap_bits);
+    tupledns_free_string_array(entry->addresses, entry->address_count);
+    tupledns_free_capabilities(entry->capabilities, entry->capability_count);
+    memset(entry, 0, sizeof(*entry));
+}
+
+/* Intern an entry's capabilities and set its bits */
+static int tuple_index_entry_set_caps(tupledns_index_t* index, tuple_index_entry_t* entry) {
+    uint32_t highest = 0;
+    int count = 0;
+    for (int i = 0; i < entry->capability_count; i++) {
+        if (!entry->capabilities[i]) continue;
+        uint32_t id = tuple_labels_intern(&index->capabilities, entry->capabilities[i],
+                                          strlen(entry->capabilities[i]));
+        if (id == TUPLEDNS_LABEL_NONE) return -1;
+        if (id > highest) highest = id;
+        count++;
+    }
+    if (count == 0) {
+        return 0;
+    }
+    
+    entry->cap_words = (int)(highest / 64) + 1;
+    entry->cap_bits = calloc(entry->cap_words, sizeof(uint64_t));
+    if (!entry->cap_bits) {
+        return -1;
+    }
+    for (int i = 0; i < entry->capability_count; i++) {
+        if (!entry->capabilities[i]) continue;
+        uint32_t id = tuple_labels_find(&index->capabilities, entry->capabilities[i],
+                                        strlen(entry->capabilities[i]));
+        entry->cap_bits[id / 64] |= 1ULL << (id % 64);
+    }
+    return 0;
+}
+
+tupledns_index_t* tupledns_index_create(void) {
+    tupledns_index_t* index = calloc(1, sizeof(tupledns_index_t));
+    if (!index) {
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return NULL;
+    }
+    index->capabilities.exact = 1;  /* Same semantics as tupledns_has_capability */
+    return index;
+}
+
+void tupledns_index_destroy(tupledns_index_t* index) {
+    if (!index) return;
+    
+    for (int i = 0; i < index->count; i++) {
+        tuple_index_entry_free(&index->entries[i]);
+    }
+    free(index->entries);
+    free(index->slots);
+    tuple_index_drop_trees(index);
+    tuple_labels_free(&index->labels);
+    tuple_labels_free(&index->capabilities);
+    free(index);
+}
+
+int tupledns_index_count(const tupledns_index_t* index) {
+    return index ? index->count : 0;
+}
+
+int tupledns_index_add(tupledns_index_t* index, const tupledns_node_t* node) {
+    if (!index || !node || !node->coordinate) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    uint32_t ids[TUPLE_INDEX_MAX_LABELS];
+    int count = tuple_labels_split(&index->labels, node->coordinate, ids, TUPLE_INDEX_MAX_LABELS, 1, 0);
+    if (count < 0) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_COORDINATE;
+        return TUPLEDNS_ERROR_INVALID_COORDINATE;
+    }
+    
+    tuple_index_entry_t entry;
+    memset(&entry, 0, sizeof(entry));
+    entry.label_count = count;
+    entry.hash = tuple_ids_hash(ids, count);
+    entry.labels = malloc(count * sizeof(uint32_t));
+    if (node->address_count > 0) {
+        entry.address_count = node->address_count;
+        entry.addresses = tupledns_copy_capabilities((const char**)node->ip_addresses, node->address_count);
+    } else if (node->ip_address) {
+        entry.address_count = 1;
+        entry.addresses = tupledns_copy_capabilities((const char**)&node->ip_address, 1);
+    }
+    entry.capabilities = node->capability_count > 0 ?
+        tupledns_copy_capabilities((const char**)node->capabilities, node->capability_count) : NULL;
+    entry.capability_count = entry.capabilities ? node->capability_count : 0;
+    entry.ttl = node->ttl;
+    entry.last_seen = node->last_seen;
+    if (!entry.labels || (entry.address_count > 0 && !entry.addresses) ||
+        (node->capability_count > 0 && !entry.capabilities) ||
+        tuple_index_entry_set_caps(index, &entry) != 0) {
+        tuple_index_entry_free(&entry);
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    }
+    memcpy(entry.labels, ids, count * sizeof(uint32_t));
+    
+    /* Re-adding a coordinate replaces its entry */
+    long slot = tuple_index_slot(index, ids, count, entry.hash);
+    if (slot >= 0) {
+        tuple_index_entry_t* existing = &index->entries[index->slots[slot] - 1];
+        entry.hits = existing->hits / 2;
+        tuple_index_entry_free(existing);
+        *existing = entry;
+        return TUPLEDNS_OK;
+    }
+    
+    if ((index->slots_used + 1) * 4 > index->slot_count * 3) {
+        uint32_t slot_count = index->slot_count ? index->slot_count : 64;
+        while ((uint32_t)(index->count + 1) * 2 > slot_count) slot_count *= 2;
+        if (tuple_index_rehash(index, slot_count) != 0) {
+            tuple_index_entry_free(&entry);
+            g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+            return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        }
+    }
+    if (index->count == index->capacity) {
+        int capacity = index->capacity ? index->capacity * 2 : 64;
+        tuple_index_entry_t* grown = realloc(index->entries, capacity * sizeof(tuple_index_entry_t));
+        if (!grown) {
+            tuple_index_entry_free(&entry);
+            g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+            return TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        }
+        index->entries = grown;
+        index->capacity = capacity;
+    }
+    
+    tuple_index_drop_trees(index);
+    index->entries[index->count] = entry;
+    uint32_t mask = index->slot_count - 1;
+    uint32_t i = entry.hash & mask;
+    while (index->slots[i] != TUPLE_SLOT_EMPTY && index->slots[i] != TUPLE_SLOT_DELETED) i = (i + 1) & mask;
+    if (index->slots[i] == TUPLE_SLOT_EMPTY) index->slots_used++;
+    index->slots[i] = (uint32_t)++index->count;
+    return TUPLEDNS_OK;
+}
+
+int tupledns_index_add_result(tupledns_index_t* index, const tupledns_result_t* result) {
+    if (!index || !result) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    for (int i = 0; i < result->node_count; i++) {
+        int status = tupledns_index_add(index, &result->nodes[i]);
+        if (status != TUPLEDNS_OK) {
+            return status;
+        }
+    }
+    return TUPLEDNS_OK;
+}
+
+int tupledns_index_remove(tupledns_index_t* index, const char* coordinate) {
+    if (!index || !coordinate) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+    }
+    
+    uint32_t ids[TUPLE_INDEX_MAX_LABELS];
+    int count = tuple_labels_split(&index->labels, coordinate, ids, TUPLE_INDEX_MAX_LABELS, 0, 0);
+    long slot = count > 0 ? tuple_index_slot(index, ids, count, tuple_ids_hash(ids, count)) : -1;
+    if (slot < 0) {
+        return TUPLEDNS_ERROR_NO_RESULTS;
+    }
+    
+    /* Move the last entry into the hole so entries stay dense */
+    tuple_index_drop_trees(index);
+    uint32_t removed = index->slots[slot] - 1;
+    index->slots[slot] = TUPLE_SLOT_DELETED;
+    tuple_index_entry_free(&index->entries[removed]);
+    uint32_t last = (uint32_t)--index->count;
+    if (removed != last) {
+        tuple_index_entry_t* moved = &index->entries[last];
+        long moved_slot = tuple_index_slot(index, moved->labels, moved->label_count, moved->hash);
+        index->entries[removed] = *moved;
+        index->slots[moved_slot] = removed + 1;
+    }
+    return TUPLEDNS_OK;
+}
+
+uint32_t tupledns_index_label_id(const tupledns_index_t* index, const char* label) {
+    if (!index || !label) {
+        return TUPLEDNS_LABEL_NONE;
+    }
+    return tuple_labels_find(&index->labels, label, strlen(label));
+}
+
+const char* tupledns_index_label(const tupledns_index_t* index, uint32_t id) {
+    if (!index || id >= index->labels.count) {
+        return NULL;
+    }
+    return index->labels.strings[id];
+}
+
+/* Resolve required capabilities to (word, mask) pairs. Returns the number of
+ * words, or -1 if a capability was never interned (nothing can match). */
+static int tuple_cap_masks(const tuple_label_table_t* table, const char* required_caps[],
+                           uint32_t* cap_word, uint64_t* cap_mask) {
+    int words = 0;
+    for (int c = 0; required_caps && required_caps[c]; c++) {
+        uint32_t id = tuple_labels_find(table, required_caps[c], strlen(required_caps[c]));
+        if (id == TUPLEDNS_LABEL_NONE) {
+            return -1;
+        }
+        int w = 0;
+        while (w < words && cap_word[w] != id / 64) w++;
+        if (w == words) {
+            if (words == TUPLEDNS_MAX_CAPABILITIES) return -1;
+            cap_word[words] = id / 64;
+            cap_mask[words++] = 0;
+        }
+        cap_mask[w] |= 1ULL << (id % 64);
+    }
+    return words;
+}
+
+static int tuple_index_entry_matches(const tuple_index_entry_t* entry, const uint32_t* ids, int count) {
+    if (entry->label_count != count) {
+        return 0;
+    }
+    for (int i = 0; i < count; i++) {
+        if (ids[i] != TUPLEDNS_LABEL_ANY && ids[i] != entry->labels[i]) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+/* Copy an entry out to a result node, rebuilding the coordinate string */
+static int tuple_index_fill_node(const tupledns_index_t* index, const tuple_index_entry_t* entry,
+                                 tupledns_result_t* result) {
+    tupledns_node_t* node = tuple_result_add_node(result);
+    if (!node) {
+        return -1;
+    }
+    node->coordinate = tuple_index_coordinate(index, entry, result->arena);
+    node->ttl = entry->ttl;
+    node->last_seen = entry->last_seen;
+    if (!node->coordinate ||
+        tuple_result_set_addresses(result, node, entry->addresses, entry->address_count) != 0 ||
+        tuple_result_set_caps(result, node, entry->capabilities, entry->capability_count) != 0) {
+        tuple_result_pop_node(result);
+        return -1;
+    }
+    return 0;
+}
+
+tupledns_result_t* tupledns_index_find(const tupledns_index_t* index, const char* pattern) {
+    return tupledns_index_find_with_caps(index, pattern, NULL);
+}
+
+tupledns_result_t* tupledns_index_find_with_caps(const tupledns_index_t* index, const char* pattern,
+                                                 const char* required_caps[]) {
+    if (!index || !pattern) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    tupledns_result_t* result = tuple_result_create();
+    if (!result) {
+        return NULL;
+    }
+    
+    struct timeval start_time, end_time;
+    gettimeofday(&start_time, NULL);
+    result->error = TUPLEDNS_ERROR_NO_RESULTS;
+    
+    uint32_t ids[TUPLE_INDEX_MAX_LABELS];
+    int count = tuple_labels_split((tuple_label_table_t*)&index->labels, pattern, ids,
+                                   TUPLE_INDEX_MAX_LABELS, 0, 1);
+    int possible = count > 0;
+    for (int i = 0; possible && i < count; i++) {
+        if (ids[i] == TUPLEDNS_LABEL_NONE) possible = 0; /* Label never indexed */
+    }
+    
+    /* Required capabilities become one mask per bitset word */
+    uint32_t cap_word[TUPLEDNS_MAX_CAPABILITIES];
+    uint64_t cap_mask[TUPLEDNS_MAX_CAPABILITIES];
+    int words = tuple_cap_masks(&index->capabilities, required_caps, cap_word, cap_mask);
+    if (words < 0) possible = 0;
+    
+    for (int e = 0; possible && e < index->count; e++) {
+        const tuple_index_entry_t* entry = &index->entries[e];
+        if (!tuple_index_entry_matches(entry, ids, count)) continue;
+        
+        int has_all_caps = 1;
+        for (int w = 0; w < words && has_all_caps; w++) {
+            has_all_caps = (int)cap_word[w] < entry->cap_words &&
+                           (entry->cap_bits[cap_word[w]] & cap_mask[w]) == cap_mask[w];
+        }
+        if (!has_all_caps) continue;
+        
+        if (tuple_index_fill_node(index, entry, result) != 0) {
+            result->error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+            break;
+        }
+    }
+    
+    if (result->node_count > 0 && result->error == TUPLEDNS_ERROR_NO_RESULTS) {
+        result->error = TUPLEDNS_OK;
+    }
+    gettimeofday(&end_time, NULL);
+    result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
+                        (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
+    return result;
+}
+
+/* ========================================================================
+ * PROXIMITY SEARCH
+ * ======================================================================== */
+
+/* Numeric labels ("120", "2.5", "floor-1") are dimensions. A k-d tree is built
+ * on demand for each (label count, space, numeric positions) asked about and
+ * kept until an entry is added or removed, so nearest-neighbour and radius
+ * queries visit O(log n) nodes plus the matches. */
+
+#define TUPLE_KD_MAX_DIMS 8
+
+typedef struct tuple_kd_tree {
+    struct tuple_kd_tree* next;
+    int label_count;
+    uint32_t space;             /* Label ID of the space type */
+    int dims;
+    int positions[TUPLE_KD_MAX_DIMS];   /* Label positions measured */
+    int count;
+    uint32_t* entries;          /* Entry of each point, in tree order */
+    double* points;             /* count x dims coordinates, in tree order */
+} tuple_kd_tree_t;
+
+typedef struct {
+    double distance;            /* Squared */
+    uint32_t entry;
+} tuple_kd_hit_t;
+
+/* Parse an optionally signed decimal ("120", "-3", "2.5") spanning all of s */
+static int tuple_decimal(const char* s, size_t len, double* value) {
+    size_t i = (len > 0 && s[0] == '-') ? 1 : 0;
+    size_t digits = 0;
+    while (i < len && isdigit((unsigned char)s[i])) { i++; digits++; }
+    if (digits > 0 && i < len && s[i] == '.') {
+        i++;
+        digits = 0;
+        while (i < len && isdigit((unsigned char)s[i])) { i++; digits++; }
+    }
+    if (digits == 0 || i != len || len >= 64) {
+        return 0;
+    }
+    char number[64];
+    memcpy(number, s, len);
+    number[len] = '\0';
+    *value = strtod(number, NULL);
+    return 1;
+}
+
+/* Split a label into a prefix and a trailing decimal number: "120" -> ("", 120),
+ * "floor-1" -> ("floor-", 1), "level--2" -> ("level-", -2). Returns 0 if not numeric. */
+static int tuple_label_number(const char* label, size_t len, size_t* prefix_len, double* value) {
+    if (tuple_decimal(label, len, value)) {
+        *prefix_len = 0;
+        return 1;
+    }
+    for (size_t j = 1; j + 1 < len; j++) {
+        if (label[j] == '-' && tuple_decimal(label + j + 1, len - j - 1, value)) {
+            *prefix_len = j + 1;
+            return 1;
+        }
+    }
+    return 0;
+}
+
+static void tuple_kd_free(tuple_kd_tree_t* tree) {
+    free(tree->entries);
+    free(tree->points);
+    free(tree);
+}
+
+static void tuple_kd_swap(tuple_kd_tree_t* tree, int a, int b) {
+    uint32_t entry = tree->entries[a];
+    tree->entries[a] = tree->entries[b];
+    tree->entries[b] = entry;
+    for (int d = 0; d < tree->dims; d++) {
+        double v = tree->points[a * tree->dims + d];
+        tree->points[a * tree->dims + d] = tree->points[b * tree->dims + d];
+        tree->points[b * tree->dims + d] = v;
+    }
+}
+
+/* Arrange points [lo, hi) so the median on the depth's axis sits in the
+ * middle with smaller values before it, then recurse on both halves */
+static void tuple_kd_build(tuple_kd_tree_t* tree, int lo, int hi, int depth) {
+    if (hi - lo <= 1) {
+        return;
+    }
+    int axis = depth % tree->dims;
+    int mid = lo + (hi - lo) / 2;
+    int left = lo, right = hi - 1;
+    while (left < right) {
+        double pivot = tree->points[((left + right) / 2) * tree->dims + axis];
+        int i = left, j = right;
+        while (i <= j) {
+            while (tree->points[i * tree->dims + axis] < pivot) i++;
+            while (tree->points[j * tree->dims + axis] > pivot) j--;
+            if (i <= j) {
+                tuple_kd_swap(tree, i, j);
+                i++;
+                j--;
+            }
+        }
+        if (mid <= j) right = j;
+        else if (mid >= i) left = i;
+        else break;
+    }
+    tuple_kd_build(tree, lo, mid, depth + 1);
+    tuple_kd_build(tree, mid + 1, hi, depth + 1);
+}
+
+static tuple_kd_tree_t* tuple_kd_tree_for(tupledns_index_t* index, int label_count, uint32_t space,
+                                          const int* positions, int dims) {
+    for (tuple_kd_tree_t* tree = index->trees; tree; tree = tree->next) {
+        if (tree->label_count == label_count && tree->space == space && tree->dims == dims &&
+            memcmp(tree->positions, positions, dims * sizeof(int)) == 0) {
+            return tree;
+        }
+    }
+    
+    tuple_kd_tree_t* tree = calloc(1, sizeof(tuple_kd_tree_t));
+    if (!tree) {
+        return NULL;
+    }
+    tree->label_count = label_count;
+    tree->space = space;
+    tree->dims = dims;
+    memcpy(tree->positions, positions, dims * sizeof(int));
+    tree->entries = malloc((index->count ? index->count : 1) * sizeof(uint32_t));
+    tree->points = malloc((index->count ? index->count : 1) * dims * sizeof(double));
+    if (!tree->entries || !tree->points) {
+        tuple_kd_free(tree);
+        return NULL;
+    }
+    
+    for (int e = 0; e < index->count; e++) {
+        const tuple_index_entry_t* entry = &index->entries[e];
+        if (entry->label_count != label_count || entry->labels[label_count - 2] != space) continue;
+        int d = 0;
+        for (; d < dims; d++) {
+            const char* label = index->labels.strings[entry->labels[positions[d]]];
+            size_t prefix_len;
+            if (!tuple_label_number(label, strlen(label), &prefix_len,
+                                    &tree->points[tree->count * dims + d])) break;
+        }
+        if (d == dims) {
+            tree->entries[tree->count++] = (uint32_t)e;
+        }
+    }
+    tuple_kd_build(tree, 0, tree->count, 0);
+    tree->next = index->trees;
+    index->trees = tree;
+    return tree;
+}
+
+typedef struct {
+    const tupledns_index_t* index;
+    const tuple_kd_tree_t* tree;
+    const uint32_t* ids;        /* Target labels; ANY where free or measured */
+    int label_count;
+    const char* const* prefixes;
+    const size_t* prefix_lens;
+    double target[TUPLE_KD_MAX_DIMS];
+    double radius;              /* Squared, or -1 for unbounded */
+    int k;                      /* 0 for unbounded */
+    const uint32_t* cap_word;
+    const uint64_t* cap_mask;
+    int cap_words;
+    tuple_kd_hit_t* hits;       /* Max-heap on distance when k is set */
+    int hit_count;
+    int hit_capacity;
+    int failed;
+} tuple_kd_search_t;
+
+static int tuple_kd_accepts(const tuple_kd_search_t* search, const tuple_index_entry_t* entry) {
+    if (!tuple_index_entry_matches(entry, search->ids, search->label_count)) {
+        return 0;
+    }
+    for (int d = 0; search->tree && d < search->tree->dims; d++) {
+        const char* label = search->index->labels.strings[entry->labels[search->tree->positions[d]]];
+        size_t prefix_len;
+        double value;
+        tuple_label_number(label, strlen(label), &prefix_len, &value);
+        if (prefix_len != search->prefix_lens[d] ||
+            strncasecmp(label, search->prefixes[d], prefix_len) != 0) {
+            return 0;
+        }
+    }
+    for (int w = 0; w < search->cap_words; w++) {
+        if ((int)search->cap_word[w] >= entry->cap_words ||
+            (entry->cap_bits[search->cap_word[w]] & search->cap_mask[w]) != search->cap_mask[w]) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static void tuple_kd_heap_down(tuple_kd_hit_t* heap, int count, int i) {
+    for (;;) {
+        int largest = i, l = 2 * i + 1, r = 2 * i + 2;
+        if (l < count && heap[l].distance > heap[largest].distance) largest = l;
+        if (r < count && heap[r].distance > heap[largest].distance) largest = r;
+        if (largest == i) return;
+        tuple_kd_hit_t t = heap[i]; heap[i] = heap[largest]; heap[largest] = t;
+        i = largest;
+    }
+}
+
+static void tuple_kd_offer(tuple_kd_search_t* search, double distance, uint32_t entry) {
+    if (search->k > 0 && search->hit_count == search->k) {
+        if (distance >= search->hits[0].distance) return;
+        search->hits[0].distance = distance;
+        search->hits[0].entry = entry;
+        tuple_kd_heap_down(search->hits, search->hit_count, 0);
+        return;
+    }
+    if (search->hit_count == search->hit_capacity) {
+        int capacity = search->hit_capacity ? search->hit_capacity * 2 : 64;
+        tuple_kd_hit_t* grown = realloc(search->hits, capacity * sizeof(tuple_kd_hit_t));
+        if (!grown) {
+            search->failed = 1;
+            return;
+        }
+        search->hits = grown;
+        search->hit_capacity = capacity;
+    }
+    int i = search->hit_count++;
+    search->hits[i].distance = distance;
+    search->hits[i].entry = entry;
+    if (search->k > 0) {
+        /* Sift up */
+        while (i > 0 && search->hits[(i - 1) / 2].distance < search->hits[i].distance) {
+            tuple_kd_hit_t t = search->hits[i];
+            search->hits[i] = search->hits[(i - 1) / 2];
+            search->hits[(i - 1) / 2] = t;
+            i = (i - 1) / 2;
+        }
+    }
+}
+
+/* Squared distance beyond which nothing more can be accepted */
+static double tuple_kd_bound(const tuple_kd_search_t* search) {
+    if (search->k > 0 && search->hit_count == search->k) {
+        double worst = search->hits[0].distance;
+        return (search->radius >= 0 && search->radius < worst) ? search->radius : worst;
+    }
+    return search->radius;
+}
+
+static void tuple_kd_search(tuple_kd_search_t* search, int lo, int hi, int depth) {
+    if (lo >= hi || search->failed) {
+        return;
+    }
+    const tuple_kd_tree_t* tree = search->tree;
+    int mid = lo + (hi - lo) / 2;
+    const double* point = &tree->points[mid * tree->dims];
+    
+    double distance = 0;
+    for (int d = 0; d < tree->dims; d++) {
+        double delta = point[d] - search->target[d];
+        distance += delta * delta;
+    }
+    double bound = tuple_kd_bound(search);
+    if ((bound < 0 || distance <= bound) &&
+        tuple_kd_accepts(search, &search->index->entries[tree->entries[mid]])) {
+        tuple_kd_offer(search, distance, tree->entries[mid]);
+    }
+    
+    int axis = depth % tree->dims;
+    double delta = search->target[axis] - point[axis];
+    int near_lo = delta < 0 ? lo : mid + 1, near_hi = delta < 0 ? mid : hi;
+    int far_lo = delta < 0 ? mid + 1 : lo, far_hi = delta < 0 ? hi : mid;
+    tuple_kd_search(search, near_lo, near_hi, depth + 1);
+    bound = tuple_kd_bound(search);
+    if (bound < 0 || delta * delta <= bound) {
+        tuple_kd_search(search, far_lo, far_hi, depth + 1);
+    }
+}
+
+static int tuple_kd_compare_hits(const void* a, const void* b) {
+    const tuple_kd_hit_t* x = a;
+    const tuple_kd_hit_t* y = b;
+    if (x->distance != y->distance) return x->distance < y->distance ? -1 : 1;
+    return x->entry < y->entry ? -1 : (x->entry > y->entry);
+}
+
+tupledns_result_t* tupledns_index_find_nearby(const tupledns_index_t* index, const char* coordinate,
+                                              double radius, int k, const char* required_caps[]) {
+    if (!index || !coordinate || k < 0) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    /* Numeric target labels are measured; "*" and the rest must match exactly */
+    uint32_t ids[TUPLE_INDEX_MAX_LABELS];
+    int count = tuple_labels_split((tuple_label_table_t*)&index->labels, coordinate, ids,
+                                   TUPLE_INDEX_MAX_LABELS, 0, 1);
+    if (count < 2) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_COORDINATE;
+        return NULL;
+    }
+    tuple_kd_search_t search;
+    memset(&search, 0, sizeof(search));
+    int positions[TUPLE_KD_MAX_DIMS];
+    const char* prefixes[TUPLE_KD_MAX_DIMS];
+    size_t prefix_lens[TUPLE_KD_MAX_DIMS];
+    int dims = 0;
+    const char* p = coordinate;
+    for (int i = 0; i < count; i++) {
+        size_t len = strcspn(p, ".");
+        double value;
+        if (i < count - 2 && !(len == 1 && p[0] == '*') &&
+            tuple_label_number(p, len, &prefix_lens[dims < TUPLE_KD_MAX_DIMS ? dims : 0], &value)) {
+            if (dims == TUPLE_KD_MAX_DIMS) {
+                g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+                return NULL;
+            }
+            positions[dims] = i;
+            prefixes[dims] = p;
+            search.target[dims++] = value;
+            ids[i] = TUPLEDNS_LABEL_ANY;
+        }
+        p += len + 1;
+    }
+    
+    tupledns_result_t* result = tuple_result_create();
+    if (!result) {
+        return NULL;
+    }
+    struct timeval start_time, end_time;
+    gettimeofday(&start_time, NULL);
+    result->error = TUPLEDNS_ERROR_NO_RESULTS;
+    
+    uint32_t cap_word[TUPLEDNS_MAX_CAPABILITIES];
+    uint64_t cap_mask[TUPLEDNS_MAX_CAPABILITIES];
+    int words = tuple_cap_masks(&index->capabilities, required_caps, cap_word, cap_mask);
+    int possible = words >= 0 && ids[count - 2] != TUPLEDNS_LABEL_NONE && ids[count - 2] != TUPLEDNS_LABEL_ANY;
+    for (int i = 0; possible && i < count; i++) {
+        if (ids[i] == TUPLEDNS_LABEL_NONE) possible = 0; /* Label never indexed */
+    }
+    
+    search.index = index;
+    search.ids = ids;
+    search.label_count = count;
+    search.prefixes = prefixes;
+    search.prefix_lens = prefix_lens;
+    search.radius = radius >= 0 ? radius * radius : -1;
+    search.k = k;
+    search.cap_word = cap_word;
+    search.cap_mask = cap_mask;
+    search.cap_words = words;
+    
+    if (possible && dims == 0) {
+        /* Nothing to measure: every match is at distance zero */
+        for (int e = 0; e < index->count && !search.failed && (k == 0 || search.hit_count < k); e++) {
+            if (tuple_kd_accepts(&search, &index->entries[e])) {
+                tuple_kd_offer(&search, 0, (uint32_t)e);
+            }
+        }
+    } else if (possible) {
+        search.tree = tuple_kd_tree_for((tupledns_index_t*)index, count, ids[count - 2], positions, dims);
+        if (search.tree) {
+            tuple_kd_search(&search, 0, search.tree->count, 0);
+        } else {
+            search.failed = 1;
+        }
+    }
+    
+    qsort(search.hits, search.hit_count, sizeof(tuple_kd_hit_t), tuple_kd_compare_hits);
+    for (int h = 0; h < search.hit_count; h++) {
+        if (tuple_index_fill_node(index, &index->entries[search.hits[h].entry], result) != 0) {
+            search.failed = 1;
+            break;
+        }
+    }
+    free(search.hits);
+    
+    if (search.failed) {
+        result->error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    } else if (result->node_count > 0) {
+        result->error = TUPLEDNS_OK;
+    }
+    gettimeofday(&end_time, NULL);
+    result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
+                        (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
+    return result;
+}
+
+/* ========================================================================
+ * SIMILARITY SEARCH
+ * ======================================================================== */
+
+/* Categorical labels are compared by edit distance (Levenshtein, summed over
+ * labels) or, with weights, by a weighted count of differing positions. Both
+ * are metrics, so coordinates of one shape are arranged in a BK-tree and a
+ * query only descends into children whose edge distance is within the search
+ * radius of its own distance. Trees are cached like the proximity trees. */
+
+#define TUPLE_BK_MAX_LABELS 64
+
+typedef struct {
+    uint32_t entry;
+    int edge;                   /* Distance to the parent */
+    int first_child;            /* -1 if none */
+    int next_sibling;           /* -1 if none */
+} tuple_bk_node_t;
+
+typedef struct tuple_bk_tree {
+    struct tuple_bk_tree* next;
+    int label_count;
+    uint32_t space;
+    uint64_t ignored;           /* Positions left out of the metric ("*" in the target) */
+    int weighted;
+    int weights[TUPLE_BK_MAX_LABELS];
+    int count;
+    tuple_bk_node_t* nodes;     /* nodes[0] is the root */
+} tuple_bk_tree_t;
+
+static void tuple_bk_free(tuple_bk_tree_t* tree) {
+    free(tree->nodes);
+    free(tree);
+}
+
+static void tuple_index_drop_trees(tupledns_index_t* index) {
+    while (index->trees) {
+        tuple_kd_tree_t* next = index->trees->next;
+        tuple_kd_free(index->trees);
+        index->trees = next;
+    }
+    while (index->bk_trees) {
+        tuple_bk_tree_t* next = index->bk_trees->next;
+        tuple_bk_free(index->bk_trees);
+        index->bk_trees = next;
+    }
+}
+
+static int tuple_edit_distance(const char* a, const char* b) {
+    size_t la = strlen(a), lb = strlen(b);
+    int row[TUPLEDNS_MAX_COORDINATE_LENGTH + 1];
+    if (lb > la) {
+        const char* t = a; a = b; b = t;
+        size_t tl = la; la = lb; lb = tl;
+    }
+    if (lb > TUPLEDNS_MAX_COORDINATE_LENGTH) lb = TUPLEDNS_MAX_COORDINATE_LENGTH;  /* Longer than any DNS name */
+    for (size_t j = 0; j <= lb; j++) row[j] = (int)j;
+    for (size_t i = 1; i <= la; i++) {
+        int diagonal = row[0];
+        row[0] = (int)i;
+        for (size_t j = 1; j <= lb; j++) {
+            int above = row[j];
+            int cost = tolower((unsigned char)a[i - 1]) != tolower((unsigned char)b[j - 1]);
+            int best = diagonal + cost;
+            if (above + 1 < best) best = above + 1;
+            if (row[j - 1] + 1 < best) best = row[j - 1] + 1;
+            row[j] = best;
+            diagonal = above;
+        }
+    }
+    return row[lb];
+}
+
+static int tuple_bk_distance(const tuple_bk_tree_t* tree, const char* const* a, const char* const* b) {
+    int distance = 0;
+    for (int i = 0; i < tree->label_count; i++) {
+        if ((tree->ignored >> i) & 1 || a[i] == b[i]) continue;
+        if (tree->weighted) {
+            distance += strcasecmp(a[i], b[i]) != 0 ? tree->weights[i] : 0;
+        } else {
+            distance += tuple_edit_distance(a[i], b[i]);
+        }
+    }
+    return distance;
+}
+
+static void tuple_bk_labels(const tupledns_index_t* index, uint32_t entry, const char** labels) {
+    const tuple_index_entry_t* e = &index->entries[entry];
+    for (int i = 0; i < e->label_count; i++) {
+        labels[i] = index->labels.strings[e->labels[i]];
+    }
+}
+
+static tuple_bk_tree_t* tuple_bk_tree_for(tupledns_index_t* index, int label_count, uint32_t space,
+                                          uint64_t ignored, const int* weights) {
+    for (tuple_bk_tree_t* tree = index->bk_trees; tree; tree = tree->next) {
+        if (tree->label_count == label_count && tree->space == space && tree->ignored == ignored &&
+            tree->weighted == (weights != NULL) &&
+            (!weights || memcmp(tree->weights, weights, label_count * sizeof(int)) == 0)) {
+            return tree;
+        }
+    }
+    
+    tuple_bk_tree_t* tree = calloc(1, sizeof(tuple_bk_tree_t));
+    if (!tree || !(tree->nodes = malloc((index->count ? index->count : 1) * sizeof(tuple_bk_node_t)))) {
+        free(tree);
+        return NULL;
+    }
+    tree->label_count = label_count;
+    tree->space = space;
+    tree->ignored = ignored;
+    tree->weighted = weights != NULL;
+    if (weights) {
+        memcpy(tree->weights, weights, label_count * sizeof(int));
+    }
+    
+    const char* labels[TUPLE_BK_MAX_LABELS];
+    const char* other[TUPLE_BK_MAX_LABELS];
+    for (int e = 0; e < index->count; e++) {
+        const tuple_index_entry_t* entry = &index->entries[e];
+        if (entry->label_count != label_count || entry->labels[label_count - 2] != space) continue;
+        tuple_bk_node_t* node = &tree->nodes[tree->count];
+        node->entry = (uint32_t)e;
+        node->first_child = node->next_sibling = -1;
+        node->edge = 0;
+        if (tree->count++ == 0) continue;
+        
+        /* Walk down edges of equal distance until a free slot is found */
+        tuple_bk_labels(index, (uint32_t)e, labels);
+        int at = 0;
+        for (;;) {
+            tuple_bk_labels(index, tree->nodes[at].entry, other);
+            int distance = tuple_bk_distance(tree, labels, other);
+            int child = tree->nodes[at].first_child;
+            while (child >= 0 && tree->nodes[child].edge != distance) child = tree->nodes[child].next_sibling;
+            if (child < 0) {
+                node->edge = distance;
+                node->next_sibling = tree->nodes[at].first_child;
+                tree->nodes[at].first_child = tree->count - 1;
+                break;
+            }
+            at = child;
+        }
+    }
+    tree->next = index->bk_trees;
+    index->bk_trees = tree;
+    return tree;
+}
+
+tupledns_result_t* tupledns_index_find_similar(const tupledns_index_t* index, const char* coordinate,
+                                               int max_distance, const int* weights,
+                                               const char* required_caps[]) {
+    if (!index || !coordinate || max_distance < 0) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+        return NULL;
+    }
+    
+    /* Target labels are compared as strings: they need not be indexed */
+    char buffer[TUPLEDNS_MAX_COORDINATE_LENGTH + 1];
+    const char* target[TUPLE_BK_MAX_LABELS];
+    uint64_t ignored = 0;
+    int count = 0;
+    size_t total = strlen(coordinate);
+    if (total > TUPLEDNS_MAX_COORDINATE_LENGTH) {
+        g_last_error = TUPLEDNS_ERROR_INVALID_COORDINATE;
+        return NULL;
+    }
+    for (size_t i = 0; i <= total; i++) {
+        buffer[i] = (char)tolower((unsigned char)coordinate[i]);
+    }
+    for (char* p = buffer; ; ) {
+        size_t len = strcspn(p, ".");
+        if (count == TUPLE_BK_MAX_LABELS || len == 0) {
+            g_last_error = TUPLEDNS_ERROR_INVALID_COORDINATE;
+            return NULL;
+        }
+        if (len == 1 && p[0] == '*') ignored |= (uint64_t)1 << count;
+        target[count++] = p;
+        if (p[len] == '\0') break;
+        p[len] = '\0';
+        p += len + 1;
+    }
+    for (int i = 0; weights && i < count; i++) {
+        if (weights[i] < 0) {
+            g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+            return NULL;
+        }
+    }
+    
+    tupledns_result_t* result = tuple_result_create();
+    if (!result) {
+        return NULL;
+    }
+    struct timeval start_time, end_time;
+    gettimeofday(&start_time, NULL);
+    result->error = TUPLEDNS_ERROR_NO_RESULTS;
+    
+    /* The space is matched exactly, never approximately */
+    uint32_t space = count >= 2 ? tuple_labels_find(&index->labels, target[count - 2], strlen(target[count - 2]))
+                                : TUPLEDNS_LABEL_NONE;
+    uint32_t cap_word[TUPLEDNS_MAX_CAPABILITIES];
+    uint64_t cap_mask[TUPLEDNS_MAX_CAPABILITIES];
+    int words = tuple_cap_masks(&index->capabilities, required_caps, cap_word, cap_mask);
+    tuple_bk_tree_t* tree = NULL;
+    int failed = 0;
+    if (space != TUPLEDNS_LABEL_NONE && words >= 0 && index->count > 0) {
+        tree = tuple_bk_tree_for((tupledns_index_t*)index, count, space, ignored, weights);
+        failed = tree == NULL;
+    }
+    
+    tuple_kd_hit_t* hits = NULL;
+    int hit_count = 0;
+    int* stack = tree && tree->count > 0 ? malloc(tree->count * sizeof(int)) : NULL;
+    if (tree && tree->count > 0 && !stack) failed = 1;
+    int depth = 0;
+    if (stack) stack[depth++] = 0;
+    const char* labels[TUPLE_BK_MAX_LABELS];
+    while (depth > 0 && !failed) {
+        const tuple_bk_node_t* node = &tree->nodes[stack[--depth]];
+        tuple_bk_labels(index, node->entry, labels);
+        int distance = tuple_bk_distance(tree, target, labels);
+        
+        const tuple_index_entry_t* entry = &index->entries[node->entry];
+        int has_all_caps = distance <= max_distance;
+        for (int w = 0; w < words && has_all_caps; w++) {
+            has_all_caps = (int)cap_word[w] < entry->cap_words &&
+                           (entry->cap_bits[cap_word[w]] & cap_mask[w]) == cap_mask[w];
+        }
+        if (has_all_caps) {
+            if ((hit_count & (hit_count - 1)) == 0) {
+                tuple_kd_hit_t* grown = realloc(hits, (hit_count ? hit_count * 2 : 1) * sizeof(tuple_kd_hit_t));
+                if (!grown) {
+                    failed = 1;
+                    break;
+                }
+                hits = grown;
+            }
+            hits[hit_count].distance = distance;
+            hits[hit_count++].entry = node->entry;
+        }
+        
+        /* Triangle inequality: only edges within max_distance of distance can hold matches */
+        for (int child = node->first_child; child >= 0; child = tree->nodes[child].next_sibling) {
+            int edge = tree->nodes[child].edge;
+            if (edge >= distance - max_distance && edge <= distance + max_distance) {
+                stack[depth++] = child;
+            }
+        }
+    }
+    free(stack);
+    
+    qsort(hits, hit_count, sizeof(tuple_kd_hit_t), tuple_kd_compare_hits);
+    for (int h = 0; h < hit_count && !failed; h++) {
+        if (tuple_index_fill_node(index, &index->entries[hits[h].entry], result) != 0) {
+            failed = 1;
+        }
+    }
+    free(hits);
+    
+    if (failed) {
+        result->error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    } else if (result->node_count > 0) {
+        result->error = TUPLEDNS_OK;
+    }
+    gettimeofday(&end_time, NULL);
+    result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
+                        (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
+    return result;
+}
+
+/* ========================================================================
+ * CAPABILITY CACHE
+ * ======================================================================== */
+
+/* Nodes resolved by find are kept in a coordinate index for up to their TTL
+ * (capped by cache_ttl), so later capability finds can skip names whose
+ * capabilities are already known. With serve_stale set, an expired node is
+ * still answered (marked stale) for that many seconds while a background
+ * thread re-resolves it; a name is queued for refresh at most once.
+ * Entries also count the lookups they answer: once an entry is hot it is
+ * queued on the same thread before it expires, within the last tenth of its
+ * TTL, at most prefetch_budget times per second. Hit counts halve on every
+ * refresh, so names that cool down stop being prefetched. */
+
+static char** g_refresh_queue = NULL;
+static int g_refresh_count = 0;
+static int g_refresh_capacity = 0;
+static int g_refresh_running = 0;
+static int g_refresh_joinable = 0;      /* g_refresh_thread started and not yet joined */
+static pthread_t g_refresh_thread;
+static double g_prefetch_tokens = 0;
+static double g_prefetch_refilled = 0;
+
+static void tuple_cache_reset_locked(void) {
+    tupledns_index_destroy(g_capability_cache);
+    g_capability_cache = NULL;
+    tuple_pattern_cache_reset_locked();
+}
+
+static void tuple_cache_reset(void) {
+    pthread_mutex_lock(&g_cache_lock);
+    tuple_cache_reset_locked();
+    pthread_mutex_unlock(&g_cache_lock);
+}
+
+static void tuple_cache_store(const tupledns_node_t* node) {
+    tupledns_config_t config = tuple_config();
+    if (!config.enable_caching || config.cache_ttl <= 0 || !node->coordinate) {
+        return;
+    }
+    pthread_mutex_lock(&g_cache_lock);
+    if (g_capability_cache && g_capability_cache->count >= TUPLE_CACHE_MAX_ENTRIES) {
+        tuple_cache_reset_locked();
+    }
+    if (!g_capability_cache) {
+        g_capability_cache = tupledns_index_create();
+    }
+    if (g_capability_cache) {
+        tupledns_node_t copy = *node;
+        if (copy.last_seen == 0) {
+            copy.last_seen = time(NULL);
+        }
+        tupledns_index_add(g_capability_cache, &copy);
+    }
+    pthread_mutex_unlock(&g_cache_lock);
+}
+
+static void tuple_cache_forget(const char* coordinate) {
+    pthread_mutex_lock(&g_cache_lock);
+    if (g_capability_cache) {
+        tupledns_index_remove(g_capability_cache, coordinate);
+    }
+    tuple_pattern_cache_forget_locked(coordinate);
+    pthread_mutex_unlock(&g_cache_lock);
+}
+
+/* Re-resolve queued names one at a time until the queue is empty */
+static void* tuple_cache_refresh_worker(void* arg) {
+    (void)arg;
+    pthread_mutex_lock(&g_cache_lock);
+    while (g_refresh_count > 0) {
+        char* name = g_refresh_queue[0];
+        memmove(g_refresh_queue, g_refresh_queue + 1, (g_refresh_count - 1) * sizeof(char*));
+        g_refresh_count--;
+        pthread_mutex_unlock(&g_cache_lock);
+        
+        /* An exact name expands to itself, and the find caches what it resolves.
+         * Unanswered names stay stale until their window closes. */
+        if (strchr(name, '\t')) {
+            tuple_pattern_cache_refresh(name);
+        } else {
+            tupledns_free_result(tuple_find(name, NULL, NULL, 1, NULL));
+        }
+        free(name);
+        pthread_mutex_lock(&g_cache_lock);
+    }
+    g_refresh_running = 0;
+    pthread_mutex_unlock(&g_cache_lock);
+    return NULL;
+}
+
+/* Token bucket of prefetch_budget refreshes per second, burst of one second */
+static int tuple_cache_prefetch_allowed(void) {
+    double budget = tuple_config().prefetch_budget;
+    double now = tuple_now();
+    g_prefetch_tokens += (now - g_prefetch_refilled) * budget;
+    if (g_prefetch_tokens > budget) {
+        g_prefetch_tokens = budget;
+    }
+    g_prefetch_refilled = now;
+    if (g_prefetch_tokens < 1) {
+        return 0;
+    }
+    g_prefetch_tokens -= 1;
+    return 1;
+}
+
+/* Whether a fresh entry is hot and close enough to expiry to prefetch */
+static int tuple_cache_prefetch_due(uint32_t hits, time_t expires, int ttl, time_t now) {
+    return tuple_config().prefetch_budget > 0 && hits >= TUPLE_CACHE_HOT_HITS &&
+           expires - now <= (ttl + TUPLE_CACHE_PREFETCH_WINDOW - 1) / TUPLE_CACHE_PREFETCH_WINDOW;
+}
+
+/* Queue a name for background refresh unless it is already queued; prefetches
+ * also need a budget token. Called with g_cache_lock held. */
+static void tuple_cache_schedule_refresh(const char* coordinate, int prefetch) {
+    for (int i = 0; i < g_refresh_count; i++) {
+        if (strcasecmp(g_refresh_queue[i], coordinate) == 0) {
+            return;
+        }
+    }
+    if (prefetch && !tuple_cache_prefetch_allowed()) {
+        return;
+    }
+    if (tuple_string_list_push(&g_refresh_queue, &g_refresh_count, &g_refresh_capacity, coordinate) != 0) {
+        return;
+    }
+    tuple_stats_add(prefetch ? &g_stats.prefetches : &g_stats.refreshes, 1);
+    if (!g_refresh_running) {
+        /* Any previous worker has already left the loop: reap it first */
+        if (g_refresh_joinable) {
+            pthread_join(g_refresh_thread, NULL);
+        }
+        g_refresh_joinable = pthread_create(&g_refresh_thread, NULL, tuple_cache_refresh_worker, NULL) == 0;
+        g_refresh_running = g_refresh_joinable;
+    }
+}
+
+/* Drop pending refreshes and wait for the worker to finish its current name */
+static void tuple_cache_stop_refresh(void) {
+    pthread_mutex_lock(&g_cache_lock);
+    tupledns_free_string_array(g_refresh_queue, g_refresh_count);
+    g_refresh_queue = NULL;
+    g_refresh_count = 0;
+    g_refresh_capacity = 0;
+    int joinable = g_refresh_joinable;
+    g_refresh_joinable = 0;
+    pthread_mutex_unlock(&g_cache_lock);
+    if (joinable) {
+        pthread_join(g_refresh_thread, NULL);
+    }
+}
+
+static int tuple_cache_lookup_locked(const char* coordinate, const char* required_caps[],
+                                     tupledns_result_t* result) {
+    tupledns_index_t* index = g_capability_cache;
+    if (!index) {
+        return TUPLE_CACHE_MISS;
+    }
+    
+    uint32_t ids[TUPLE_INDEX_MAX_LABELS];
+    int count = tuple_labels_split(&index->labels, coordinate, ids, TUPLE_INDEX_MAX_LABELS, 0, 0);
+    long slot = count > 0 ? tuple_index_slot(index, ids, count, tuple_ids_hash(ids, count)) : -1;
+    if (slot < 0) {
+        return TUPLE_CACHE_MISS;
+    }
+    
+    tuple_index_entry_t* entry = &index->entries[index->slots[slot] - 1];
+    tupledns_config_t config = tuple_config();
+    int ttl = entry->ttl < config.cache_ttl ? entry->ttl : config.cache_ttl;
+    time_t expires = entry->last_seen + ttl;
+    time_t now = time(NULL);
+    int stale = expires <= now;
+    if (stale && (config.serve_stale <= 0 || expires + config.serve_stale <= now)) {
+        return TUPLE_CACHE_MISS;
+    }
+    if (entry->hits < UINT32_MAX) {
+        entry->hits++;
+    }
+    if (stale) {
+        tuple_cache_schedule_refresh(coordinate, 0);
+    } else if (tuple_cache_prefetch_due(entry->hits, expires, ttl, now)) {
+        tuple_cache_schedule_refresh(coordinate, 1);
+    }
+    
+    uint32_t cap_word[TUPLEDNS_MAX_CAPABILITIES];
+    uint64_t cap_mask[TUPLEDNS_MAX_CAPABILITIES];
+    int words = tuple_cap_masks(&index->capabilities, required_caps, cap_word, cap_mask);
+    if (words < 0) {
+        return TUPLE_CACHE_LACKS;
+    }
+    for (int w = 0; w < words; w++) {
+        if ((int)cap_word[w] >= entry->cap_words ||
+            (entry->cap_bits[cap_word[w]] & cap_mask[w]) != cap_mask[w]) {
+            return TUPLE_CACHE_LACKS;
         }
     }
-    
-    *candidates = candidate_list;
-    *candidate_count = count;
-    
-    return 0;
+    if (tuple_index_fill_node(index, entry, result) != 0) {
+        return TUPLE_CACHE_MISS;
+    }
+    result->nodes[result->node_count - 1].stale = stale;
+    return TUPLE_CACHE_HIT;
+}
+
+static int tuple_cache_lookup(const char* coordinate, const char* required_caps[], tupledns_result_t* result) {
+    pthread_mutex_lock(&g_cache_lock);
+    int status = tuple_cache_lookup_locked(coordinate, required_caps, result);
+    pthread_mutex_unlock(&g_cache_lock);
+    tuple_stats_add(status == TUPLE_CACHE_MISS ? &g_stats.cache_misses : &g_stats.cache_hits, 1);
+    if (status == TUPLE_CACHE_HIT && result->nodes[result->node_count - 1].stale) {
+        tuple_stats_add(&g_stats.cache_stale_hits, 1);
+    }
+    return status;
 }
 
 /* ========================================================================
- * CORE API FUNCTIONS
+ * PATTERN CACHE
  * ======================================================================== */
 
-int tupledns_register(const char* coordinate, const char* capabilities[], int ttl) {
-    if (!tupledns_validate_coordinate(coordinate)) {
-        return g_last_error;
+/* Whole unpaged find results, keyed by the case-folded pattern and the sorted
+ * required capabilities. A find is answered from its own entry or from any
+ * entry that subsumes it: as many labels, each cached label "*" or equal,
+ * and no capability the find does not also require. The cached nodes are
+ * then filtered locally. Narrowing needs every match to have been
+ * enumerated, so it only uses results from a registry server. An entry
+ * expires with its shortest-lived node and is prefetched like a cached node
+ * when hot. Registering or unregistering a name drops just the entries whose
+ * pattern matches it or whose result holds it. */
+
+#define TUPLE_PATTERN_CACHE_MAX 256
+
+typedef struct {
+    char* key;                  /* Pattern, a tab, then the capabilities comma-separated */
+    char* pattern;              /* Pattern part of key */
+    tupledns_result_t* result;
+    time_t expires;
+    int ttl;
+    int complete;               /* Every match was enumerated, so narrower finds may filter it */
+    uint32_t hits;
+} tuple_pattern_entry_t;
+
+static tuple_pattern_entry_t* g_pattern_cache = NULL;
+static int g_pattern_count = 0;
+static int g_pattern_capacity = 0;
+
+/* Cache key of a find, or NULL when it cannot be cached */
+static char* tuple_pattern_key(const char* pattern, const char* required_caps[]) {
+    const char* caps[TUPLEDNS_MAX_CAPABILITIES];
+    int count = 0;
+    size_t len = strlen(pattern);
+    if (len == 0 || len > TUPLEDNS_MAX_COORDINATE_LENGTH || strchr(pattern, '\t')) {
+        return NULL;
     }
-    
-    /* Get local IP address for registration */
-    char* local_ip = NULL;
-    int result = tupledns_get_local_ip(&local_ip);
-    if (result != 0 || !local_ip) {
-        g_last_error = TUPLEDNS_ERROR_TIMEOUT;
-        return TUPLEDNS_ERROR_TIMEOUT;
+    size_t size = len + 2;
+    for (int i = 0; required_caps && required_caps[i]; i++) {
+        if (count == TUPLEDNS_MAX_CAPABILITIES || !required_caps[i][0] ||
+            strpbrk(required_caps[i], ",\t")) {
+            return NULL;
+        }
+        caps[count++] = required_caps[i];
+        size += strlen(required_caps[i]) + 1;
     }
+    qsort(caps, count, sizeof(char*), tuple_compare_names);
     
-    /* Register A record with coordinate -> IP mapping */
-    result = tupledns_register_dns_record(coordinate, "A", local_ip, ttl);
-    if (result != 0) {
-        free(local_ip);
-        g_last_error = TUPLEDNS_ERROR_DNS_QUERY_FAILED;
-        return TUPLEDNS_ERROR_DNS_QUERY_FAILED;
+    char* key = malloc(size);
+    if (!key) {
+        return NULL;
     }
-    
-    /* Register TXT record with capabilities if provided */
-    if (capabilities && capabilities[0]) {
-        char* caps_string = tupledns_format_capabilities(capabilities);
-        if (caps_string) {
-            tupledns_register_dns_record(coordinate, "TXT", caps_string, ttl);
-            free(caps_string);
+    char* p = key;
+    for (size_t i = 0; i < len; i++) {
+        *p++ = (char)tolower((unsigned char)pattern[i]);
+    }
+    *p++ = '\t';
+    for (int i = 0; i < count; i++) {
+        if (i > 0 && strcmp(caps[i], caps[i - 1]) == 0) continue;
+        if (p[-1] != '\t') *p++ = ',';
+        size_t n = strlen(caps[i]);
+        memcpy(p, caps[i], n);
+        p += n;
+    }
+    *p = '\0';
+    return key;
+}
+
+/* Whether every name matching pattern also matches general; both are
+ * case-folded and end at a tab or NUL */
+static int tuple_pattern_subsumes(const char* general, const char* pattern) {
+    for (;;) {
+        size_t glen = strcspn(general, ".\t");
+        size_t plen = strcspn(pattern, ".\t");
+        if (!(glen == 1 && general[0] == '*') && (glen != plen || memcmp(general, pattern, glen) != 0)) {
+            return 0;
+        }
+        general += glen;
+        pattern += plen;
+        if (*general != '.' || *pattern != '.') {
+            return *general != '.' && *pattern != '.';
         }
+        general++;
+        pattern++;
     }
-    
-    free(local_ip);
-    return TUPLEDNS_OK;
 }
 
-int tupledns_register_with_ip(const char* coordinate, const char* ip_address, 
-                              const char* capabilities[], int ttl) {
-    if (!ip_address) {
-        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
-        return TUPLEDNS_ERROR_INVALID_PARAMETER;
+/* Whether every capability in the comma-separated sub appears in list */
+static int tuple_caps_subset(const char* sub, const char* list) {
+    while (*sub) {
+        size_t len = strcspn(sub, ",");
+        int found = 0;
+        for (const char* p = list; *p && !found; ) {
+            size_t plen = strcspn(p, ",");
+            found = plen == len && memcmp(p, sub, len) == 0;
+            p += plen + (p[plen] == ',');
+        }
+        if (!found) {
+            return 0;
+        }
+        sub += len + (sub[len] == ',');
     }
-    
-    return tupledns_register(coordinate, capabilities, ttl);
+    return 1;
 }
 
-int tupledns_unregister(const char* coordinate) {
-    if (!tupledns_validate_coordinate(coordinate)) {
-        return g_last_error;
+/* Copy the nodes of source matching pattern and required_caps (everything
+ * when pattern is NULL) into a new result, with the aliases that match */
+static tupledns_result_t* tuple_pattern_cache_filter(const tupledns_result_t* source, const char* pattern,
+                                                     const char* required_caps[]) {
+    tupledns_result_t* result = tuple_result_create();
+    if (!result) {
+        return NULL;
     }
-    
-    /* TODO: Implement actual DNS unregistration */
-    return TUPLEDNS_OK;
+    for (int i = 0; i < source->node_count; i++) {
+        const tupledns_node_t* src = &source->nodes[i];
+        int matches = !pattern || tupledns_match_pattern(src->coordinate, pattern);
+        for (int a = 0; !matches && a < src->alias_count; a++) {
+            matches = tupledns_match_pattern(src->aliases[a], pattern);
+        }
+        for (int c = 0; matches && required_caps && required_caps[c]; c++) {
+            matches = tupledns_has_capability(src, required_caps[c]);
+        }
+        if (!matches) {
+            continue;
+        }
+        
+        tupledns_node_t* node = tuple_result_add_node(result);
+        if (!node ||
+            !(node->coordinate = tuple_arena_strndup(result->arena, src->coordinate, strlen(src->coordinate))) ||
+            tuple_result_set_addresses(result, node, src->ip_addresses, src->address_count) != 0 ||
+            tuple_result_set_caps(result, node, src->capabilities, src->capability_count) != 0) {
+            tupledns_free_result(result);
+            g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+            return NULL;
+        }
+        node->ttl = src->ttl;
+        node->last_seen = src->last_seen;
+        for (int a = 0; a < src->alias_count; a++) {
+            if ((!pattern || tupledns_match_pattern(src->aliases[a], pattern)) &&
+                tuple_result_add_alias(result, node, src->aliases[a], strlen(src->aliases[a])) != 0) {
+                tupledns_free_result(result);
+                g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+                return NULL;
+            }
+        }
+    }
+    result->error = (result->node_count > 0) ? TUPLEDNS_OK : TUPLEDNS_ERROR_NO_RESULTS;
+    return result;
 }
 
-tupledns_result_t* tupledns_find(const char* pattern) {
-    if (!pattern) {
-        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
+static void tuple_pattern_entry_free(tuple_pattern_entry_t* entry) {
+    free(entry->key);
+    free(entry->pattern);
+    tupledns_free_result(entry->result);
+}
+
+/* Swap the last entry into position i; called with g_cache_lock held */
+static void tuple_pattern_cache_remove_locked(int i) {
+    tuple_pattern_entry_free(&g_pattern_cache[i]);
+    g_pattern_cache[i] = g_pattern_cache[--g_pattern_count];
+}
+
+static void tuple_pattern_cache_reset_locked(void) {
+    for (int i = 0; i < g_pattern_count; i++) {
+        tuple_pattern_entry_free(&g_pattern_cache[i]);
+    }
+    free(g_pattern_cache);
+    g_pattern_cache = NULL;
+    g_pattern_count = 0;
+    g_pattern_capacity = 0;
+}
+
+static tupledns_result_t* tuple_pattern_cache_lookup(const char* pattern, const char* required_caps[]) {
+    tupledns_config_t config = tuple_config();
+    if (!pattern || !config.enable_caching || config.cache_ttl <= 0) {
         return NULL;
     }
-    
-    tupledns_result_t* result = calloc(1, sizeof(tupledns_result_t));
-    if (!result) {
-        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+    char* key = tuple_pattern_key(pattern, required_caps);
+    if (!key) {
         return NULL;
     }
+    const char* key_caps = strchr(key, '\t') + 1;
     
     struct timeval start_time, end_time;
     gettimeofday(&start_time, NULL);
+    tupledns_result_t* result = NULL;
     
-    /* Expand pattern into specific DNS queries */
-    char** query_names = NULL;
-    int query_count = 0;
+    pthread_mutex_lock(&g_cache_lock);
+    time_t now = time(NULL);
+    time_t grace = config.serve_stale > 0 ? config.serve_stale : 0;
+    tuple_pattern_entry_t* best = NULL;
+    int exact = 0;
+    for (int i = 0; i < g_pattern_count; i++) {
+        tuple_pattern_entry_t* entry = &g_pattern_cache[i];
+        if (entry->expires + grace <= now) {
+            tuple_pattern_cache_remove_locked(i--);
+            continue;
+        }
+        if (strcmp(entry->key, key) == 0) {
+            best = entry;
+            exact = 1;
+            break;
+        }
+        /* Of the entries that subsume the find, filter the smallest, fresh before stale */
+        int fresher = best && (entry->expires > now) != (best->expires > now);
+        if (entry->complete && tuple_pattern_subsumes(entry->pattern, key) &&
+            tuple_caps_subset(entry->key + strlen(entry->pattern) + 1, key_caps) &&
+            (!best || (fresher ? entry->expires > now : entry->result->node_count < best->result->node_count))) {
+            best = entry;
+        }
+    }
+    if (best) {
+        result = exact ? tuple_pattern_cache_filter(best->result, NULL, NULL)
+                       : tuple_pattern_cache_filter(best->result, pattern, required_caps);
+        if (result) {
+            if (best->hits < UINT32_MAX) {
+                best->hits++;
+            }
+            /* Past its TTL within serve_stale: answer now and re-resolve behind it */
+            if (best->expires <= now) {
+                for (int n = 0; n < result->node_count; n++) {
+                    result->nodes[n].stale = 1;
+                }
+                tuple_cache_schedule_refresh(best->key, 0);
+            } else if (tuple_cache_prefetch_due(best->hits, best->expires, best->ttl, now)) {
+                tuple_cache_schedule_refresh(best->key, 1);
+            }
+        }
+    }
+    pthread_mutex_unlock(&g_cache_lock);
+    free(key);
+    tuple_stats_add(result ? &g_stats.pattern_cache_hits : &g_stats.pattern_cache_misses, 1);
     
-    int expand_result = tupledns_expand_pattern(pattern, &query_names, &query_count);
-    if (expand_result != 0 || query_count == 0) {
-        result->nodes = NULL;
-        result->node_count = 0;
-        result->total_queries = 0;
-        result->error = TUPLEDNS_ERROR_NO_RESULTS;
+    if (result) {
         gettimeofday(&end_time, NULL);
         result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
                             (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
-        return result;
+    }
+    return result;
+}
+
+/* Keep a complete, fresh result; stale or paged results are not cached */
+static void tuple_pattern_cache_store(const char* pattern, const char* required_caps[],
+                                      const tupledns_result_t* result) {
+    tupledns_config_t config = tuple_config();
+    if (!pattern || !config.enable_caching || config.cache_ttl <= 0 ||
+        result->node_count == 0 || result->next_cursor) {
+        return;
+    }
+    time_t now = time(NULL);
+    time_t expires = 0;
+    int ttl = config.cache_ttl;
+    for (int i = 0; i < result->node_count; i++) {
+        const tupledns_node_t* node = &result->nodes[i];
+        if (node->stale) {
+            return;
+        }
+        int node_ttl = node->ttl < config.cache_ttl ? node->ttl : config.cache_ttl;
+        time_t node_expires = (node->last_seen ? node->last_seen : now) + node_ttl;
+        if (i == 0 || node_expires < expires) expires = node_expires;
+        if (node_ttl < ttl) ttl = node_ttl;
+    }
+    if (expires <= now) {
+        return;
     }
     
-    /* Perform DNS queries for each expanded name */
-    tupledns_node_t* nodes = NULL;
-    int node_count = 0;
-    int total_queries = 0;
+    char* key = tuple_pattern_key(pattern, required_caps);
+    char* key_pattern = key ? strndup(key, strcspn(key, "\t")) : NULL;
+    tupledns_result_t* copy = key_pattern ? tuple_pattern_cache_filter(result, NULL, NULL) : NULL;
+    if (!copy) {
+        free(key);
+        free(key_pattern);
+        return;
+    }
     
-    for (int i = 0; i < query_count; i++) {
-        char* ip_address = NULL;
-        char** txt_records = NULL;
-        int txt_count = 0;
-        
-        /* Query A record */
-        if (tupledns_dns_query_a(query_names[i], &ip_address) == 0 && ip_address) {
-            /* Query TXT records for capabilities */
-            tupledns_dns_query_txt(query_names[i], &txt_records, &txt_count);
-            
-            /* Create node entry */
-            nodes = realloc(nodes, (node_count + 1) * sizeof(tupledns_node_t));
-            if (nodes) {
-                tupledns_node_t* node = &nodes[node_count];
-                node->coordinate = strdup(query_names[i]);
-                node->ip_address = ip_address;
-                node->last_seen = time(NULL);
-                node->ttl = 300; /* Default TTL */
-                
-                /* Parse capabilities from TXT records */
-                node->capabilities = NULL;
-                node->capability_count = 0;
-                
-                for (int j = 0; j < txt_count; j++) {
-                    if (strncmp(txt_records[j], "caps=", 5) == 0) {
-                        tupledns_parse_capabilities(txt_records[j], &node->capabilities, &node->capability_count);
-                        break;
-                    }
-                }
-                
-                node_count++;
+    pthread_mutex_lock(&g_cache_lock);
+    tuple_pattern_entry_t* entry = NULL;
+    uint32_t hits = 0;
+    for (int i = 0; i < g_pattern_count && !entry; i++) {
+        if (strcmp(g_pattern_cache[i].key, key) == 0) {
+            entry = &g_pattern_cache[i];
+            hits = entry->hits / 2;
+            tuple_pattern_entry_free(entry);
+        }
+    }
+    if (!entry && g_pattern_count == TUPLE_PATTERN_CACHE_MAX) {
+        /* Make room by dropping the coldest entry */
+        int coldest = 0;
+        for (int i = 1; i < g_pattern_count; i++) {
+            if (g_pattern_cache[i].hits < g_pattern_cache[coldest].hits) coldest = i;
+        }
+        tuple_pattern_cache_remove_locked(coldest);
+    }
+    if (!entry && g_pattern_count == g_pattern_capacity) {
+        int capacity = g_pattern_capacity ? g_pattern_capacity * 2 : 16;
+        tuple_pattern_entry_t* grown = realloc(g_pattern_cache, capacity * sizeof(tuple_pattern_entry_t));
+        if (!grown) {
+            pthread_mutex_unlock(&g_cache_lock);
+            free(key);
+            free(key_pattern);
+            tupledns_free_result(copy);
+            return;
+        }
+        g_pattern_cache = grown;
+        g_pattern_capacity = capacity;
+    }
+    if (!entry) {
+        entry = &g_pattern_cache[g_pattern_count++];
+    }
+    entry->key = key;
+    entry->pattern = key_pattern;
+    entry->result = copy;
+    entry->expires = expires;
+    entry->ttl = ttl;
+    entry->complete = tuple_server_configured();
+    entry->hits = hits;
+    pthread_mutex_unlock(&g_cache_lock);
+}
+
+/* Drop the entries a change to name could affect; called with g_cache_lock held */
+static void tuple_pattern_cache_forget_locked(const char* name) {
+    for (int i = 0; i < g_pattern_count; i++) {
+        const tuple_pattern_entry_t* entry = &g_pattern_cache[i];
+        /* The pattern "tuple" searches every space */
+        int affected = strcmp(entry->pattern, "tuple") == 0 || tupledns_match_pattern(name, entry->pattern);
+        for (int n = 0; !affected && n < entry->result->node_count; n++) {
+            const tupledns_node_t* node = &entry->result->nodes[n];
+            affected = strcasecmp(node->coordinate, name) == 0;
+            for (int a = 0; !affected && a < node->alias_count; a++) {
+                affected = strcasecmp(node->aliases[a], name) == 0;
             }
-            
-            /* Free TXT records */
-            tupledns_free_string_array(txt_records, txt_count);
-        } else {
-            free(ip_address);
         }
-        
-        total_queries++;
+        if (affected) {
+            tuple_pattern_cache_remove_locked(i--);
+        }
+    }
+}
+
+/* Re-run the find a queued key stands for, replacing its entry */
+static void tuple_pattern_cache_refresh(const char* key) {
+    const char* caps[TUPLEDNS_MAX_CAPABILITIES + 1];
+    int count = 0;
+    char* pattern = strdup(key);
+    if (!pattern) {
+        return;
+    }
+    char* list = strchr(pattern, '\t');
+    *list++ = '\0';
+    while (*list && count < TUPLEDNS_MAX_CAPABILITIES) {
+        caps[count++] = list;
+        list += strcspn(list, ",");
+        if (*list) *list++ = '\0';
+    }
+    caps[count] = NULL;
+    tupledns_free_result(tuple_find_cached(pattern, caps, 1));
+    free(pattern);
+}
+
+/* ========================================================================
+ * WATCHES
+ * ======================================================================== */
+
+/* Each watch owns a thread that polls every interval. With a registry server
+ * a poll costs one SOA query unless the serial moved; then the pattern is
+ * re-run bypassing the caches, the result is diffed against the last one by
+ * coordinate, and only the differences are delivered. Names that changed are
+ * dropped from both caches, and the new result is cached. A poll that
+ * cannot reach the server is retried at the next interval without events.
+ * Every live watch is on g_watches, so tupledns_set_server() can stop the
+ * threads while the server globals change and tupledns_cleanup() can stop
+ * them for good; the handle stays valid until tupledns_unwatch(). */
+
+struct tupledns_watch {
+    char* pattern;
+    char** caps;                /* NULL-terminated copy of required_caps, or NULL */
+    int cap_count;
+    double interval;
+    tupledns_watch_callback_t callback;
+    void* user_data;
+    tupledns_result_t* nodes;   /* Last delivered nodes, NULL before the first poll */
+    uint32_t serial;
+    int have_serial;            /* serial belongs to the server now configured */
+    pthread_t thread;
+    pthread_mutex_t lock;
+    pthread_cond_t wake;
+    int stopping;
+    int running;                /* thread started and not yet joined */
+    struct tupledns_watch* next;  /* On g_watches */
+};
+
+static int tuple_compare_node_ptrs(const void* a, const void* b) {
+    return strcasecmp((*(const tupledns_node_t* const*)a)->coordinate,
+                      (*(const tupledns_node_t* const*)b)->coordinate);
+}
+
+/* Whether two string lists hold the same strings, in any order */
+static int tuple_strings_same(char* const* a, int a_count, char* const* b, int b_count) {
+    if (a_count != b_count) {
+        return 0;
+    }
+    for (int i = 0; i < a_count; i++) {
+        int found = 0;
+        for (int j = 0; j < b_count && !found; j++) {
+            found = strcmp(a[i], b[j]) == 0;
+        }
+        if (!found) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static int tuple_node_same(const tupledns_node_t* a, const tupledns_node_t* b) {
+    return a->ttl == b->ttl &&
+           tuple_strings_same(a->ip_addresses, a->address_count, b->ip_addresses, b->address_count) &&
+           tuple_strings_same(a->capabilities, a->capability_count, b->capabilities, b->capability_count) &&
+           tuple_strings_same(a->aliases, a->alias_count, b->aliases, b->alias_count);
+}
+
+static void tuple_watch_forget(const tupledns_watch_t* watch, const tupledns_node_t* node) {
+    if (!watch->nodes) {
+        return;  /* The first result says nothing about what changed */
+    }
+    tuple_cache_forget(node->coordinate);
+    for (int a = 0; a < node->alias_count; a++) {
+        tuple_cache_forget(node->aliases[a]);
+    }
+}
+
+/* Resolve the pattern afresh; NULL when the server could not be asked */
+static tupledns_result_t* tuple_watch_find(const tupledns_watch_t* watch) {
+    const char** caps = (const char**)watch->caps;
+    tupledns_result_t* result;
+    if ((strchr(watch->pattern, '*') || watch->cap_count > 0) && (tuple_server_q_features() & TUPLE_Q_PATTERNS)) {
+        int queries = 0;
+        int offset = 0;
+        result = tuple_result_create();
+        if (result && tuple_wire_find_pattern(watch->pattern, caps, TUPLE_QUERY_UNLIMITED, &offset,
+                                              result, &queries) != TUPLEDNS_OK) {
+            tupledns_free_result(result);
+            return NULL;
+        }
+    } else {
+        /* A name that timed out is unknown, not gone: only a clean poll
+         * (NXDOMAIN included) may report removals */
+        int failures = 0;
+        result = tuple_find(watch->pattern, caps, NULL, 1, &failures);
+        if (result && failures > 0) {
+            tupledns_free_result(result);
+            return NULL;
+        }
+    }
+    if (result && watch->cap_count > 0) {
+        tupledns_filter_capabilities(result, caps);
     }
-    
-    /* Free query names */
-    tupledns_free_string_array(query_names, query_count);
-    
-    /* Populate result */
-    result->nodes = nodes;
-    result->node_count = node_count;
-    result->total_queries = total_queries;
-    result->error = (node_count > 0) ? TUPLEDNS_OK : TUPLEDNS_ERROR_NO_RESULTS;
-    
-    gettimeofday(&end_time, NULL);
-    result->query_time = (end_time.tv_sec - start_time.tv_sec) + 
-                        (end_time.tv_usec - start_time.tv_usec) / 1000000.0;
-    
     return result;
 }
 
-tupledns_result_t* tupledns_find_with_caps(const char* pattern, const char* required_caps[]) {
-    tupledns_result_t* result = tupledns_find(pattern);
-    if (!result || !required_caps || !required_caps[0]) {
-        return result;
+/* Deliver the differences from the last result and keep current in its place */
+static void tuple_watch_deliver(tupledns_watch_t* watch, tupledns_result_t* current) {
+    int old_count = watch->nodes ? watch->nodes->node_count : 0;
+    int new_count = current->node_count;
+    const tupledns_node_t** nodes = malloc((old_count + new_count + 1) * sizeof(tupledns_node_t*));
+    if (!nodes) {
+        tupledns_free_result(current);
+        return;
     }
+    const tupledns_node_t** old_nodes = nodes;
+    const tupledns_node_t** new_nodes = nodes + old_count;
+    for (int i = 0; i < old_count; i++) old_nodes[i] = &watch->nodes->nodes[i];
+    for (int i = 0; i < new_count; i++) new_nodes[i] = &current->nodes[i];
+    qsort(old_nodes, old_count, sizeof(tupledns_node_t*), tuple_compare_node_ptrs);
+    qsort(new_nodes, new_count, sizeof(tupledns_node_t*), tuple_compare_node_ptrs);
     
-    /* Filter results by required capabilities */
-    tupledns_node_t* filtered_nodes = NULL;
-    int filtered_count = 0;
-    
-    for (int i = 0; i < result->node_count; i++) {
-        tupledns_node_t* node = &result->nodes[i];
-        int has_all_caps = 1;
-        
-        /* Check if node has all required capabilities */
-        for (int j = 0; required_caps[j] != NULL; j++) {
-            if (!tupledns_has_capability(node, required_caps[j])) {
-                has_all_caps = 0;
-                break;
-            }
-        }
-        
-        if (has_all_caps) {
-            /* Add to filtered results */
-            filtered_nodes = realloc(filtered_nodes, (filtered_count + 1) * sizeof(tupledns_node_t));
-            if (filtered_nodes) {
-                /* Copy node data */
-                tupledns_node_t* filtered_node = &filtered_nodes[filtered_count];
-                filtered_node->coordinate = strdup(node->coordinate);
-                filtered_node->ip_address = strdup(node->ip_address);
-                filtered_node->ttl = node->ttl;
-                filtered_node->last_seen = node->last_seen;
-                
-                /* Copy capabilities */
-                filtered_node->capability_count = node->capability_count;
-                filtered_node->capabilities = tupledns_copy_capabilities((const char**)node->capabilities, node->capability_count);
-                
-                filtered_count++;
+    int i = 0;
+    int j = 0;
+    while (i < old_count || j < new_count) {
+        int order = i == old_count ? 1 : j == new_count ? -1
+                  : strcasecmp(old_nodes[i]->coordinate, new_nodes[j]->coordinate);
+        if (order < 0) {
+            tuple_watch_forget(watch, old_nodes[i]);
+            watch->callback(TUPLEDNS_WATCH_REMOVED, old_nodes[i++], watch->user_data);
+        } else if (order > 0) {
+            tuple_watch_forget(watch, new_nodes[j]);
+            watch->callback(TUPLEDNS_WATCH_ADDED, new_nodes[j++], watch->user_data);
+        } else {
+            if (!tuple_node_same(old_nodes[i], new_nodes[j])) {
+                tuple_watch_forget(watch, old_nodes[i]);
+                tuple_watch_forget(watch, new_nodes[j]);
+                watch->callback(TUPLEDNS_WATCH_CHANGED, new_nodes[j], watch->user_data);
             }
+            i++;
+            j++;
         }
     }
+    free(nodes);
     
-    /* Replace original results with filtered results */
-    if (result->nodes) {
-        for (int i = 0; i < result->node_count; i++) {
-            tupledns_free_node(&result->nodes[i]);
+    for (int n = 0; n < new_count; n++) {
+        tuple_cache_store(&current->nodes[n]);
+    }
+    tuple_pattern_cache_store(watch->pattern, (const char**)watch->caps, current);
+    tupledns_free_result(watch->nodes);
+    watch->nodes = current;
+}
+
+static void tuple_watch_poll(tupledns_watch_t* watch) {
+    uint32_t serial = 0;
+    if (tuple_server_configured()) {
+        if (tuple_wire_zone_serial(&serial) != TUPLEDNS_OK) {
+            return;
+        }
+        if (watch->nodes && watch->have_serial && serial == watch->serial) {
+            return;
         }
-        free(result->nodes);
     }
-    
-    result->nodes = filtered_nodes;
-    result->node_count = filtered_count;
-    result->error = (filtered_count > 0) ? TUPLEDNS_OK : TUPLEDNS_ERROR_NO_RESULTS;
-    
-    return result;
+    /* The serial is read first, so a change racing the find is seen next time */
+    tupledns_result_t* current = tuple_watch_find(watch);
+    if (current) {
+        watch->serial = serial;
+        watch->have_serial = 1;
+        tuple_watch_deliver(watch, current);
+    }
 }
 
-tupledns_result_t* tupledns_find_range(const char* pattern, const tupledns_range_t ranges[], int range_count) {
-    if (!pattern || !ranges || range_count <= 0) {
-        g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
-        return NULL;
+static void* tuple_watch_worker(void* arg) {
+    tupledns_watch_t* watch = arg;
+    pthread_mutex_lock(&watch->lock);
+    while (!watch->stopping) {
+        pthread_mutex_unlock(&watch->lock);
+        tuple_watch_poll(watch);
+        pthread_mutex_lock(&watch->lock);
+        
+        struct timespec until;
+        clock_gettime(CLOCK_REALTIME, &until);
+        double wake = until.tv_sec + until.tv_nsec / 1e9 + watch->interval;
+        until.tv_sec = (time_t)wake;
+        until.tv_nsec = (long)((wake - (double)until.tv_sec) * 1e9);
+        int waited = 0;
+        while (!watch->stopping && waited != ETIMEDOUT) {
+            waited = pthread_cond_timedwait(&watch->wake, &watch->lock, &until);
+        }
     }
-    
-    /* TODO: Expand ranges into multiple queries and merge results */
-    return tupledns_find(pattern);
+    pthread_mutex_unlock(&watch->lock);
+    return NULL;
 }
 
-tupledns_result_t* tupledns_search_multi(const char* patterns[], int pattern_count) {
-    if (!patterns || pattern_count <= 0) {
+static void tuple_watch_start(tupledns_watch_t* watch) {
+    watch->stopping = 0;
+    watch->running = pthread_create(&watch->thread, NULL, tuple_watch_worker, watch) == 0;
+}
+
+/* Stop the thread, waiting for a poll in progress to finish */
+static void tuple_watch_stop(tupledns_watch_t* watch) {
+    pthread_mutex_lock(&watch->lock);
+    watch->stopping = 1;
+    pthread_cond_signal(&watch->wake);
+    pthread_mutex_unlock(&watch->lock);
+    if (watch->running) {
+        pthread_join(watch->thread, NULL);
+        watch->running = 0;
+    }
+}
+
+/* Stop every watch thread; g_watch_lock is held until tuple_watches_resume() */
+static void tuple_watches_pause(void) {
+    pthread_mutex_lock(&g_watch_lock);
+    for (tupledns_watch_t* watch = g_watches; watch; watch = watch->next) {
+        tuple_watch_stop(watch);
+    }
+}
+
+/* Restart the threads paused by tuple_watches_pause(), or leave them stopped */
+static void tuple_watches_resume(int restart) {
+    for (tupledns_watch_t* watch = g_watches; restart && watch; watch = watch->next) {
+        watch->have_serial = 0;
+        tuple_watch_start(watch);
+    }
+    pthread_mutex_unlock(&g_watch_lock);
+}
+
+static void tuple_watch_free(tupledns_watch_t* watch) {
+    free(watch->pattern);
+    tupledns_free_string_array(watch->caps, watch->cap_count);
+    tupledns_free_result(watch->nodes);
+    free(watch);
+}
+
+tupledns_watch_t* tupledns_watch(const char* pattern, const char* required_caps[], double interval,
+                                 tupledns_watch_callback_t callback, void* user_data) {
+    if (!pattern || !callback) {
         g_last_error = TUPLEDNS_ERROR_INVALID_PARAMETER;
         return NULL;
     }
+    tupledns_watch_t* watch = calloc(1, sizeof(tupledns_watch_t));
+    if (!watch) {
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return NULL;
+    }
+    watch->interval = interval > 0 ? interval : TUPLEDNS_DEFAULT_WATCH_INTERVAL;
+    watch->callback = callback;
+    watch->user_data = user_data;
+    watch->pattern = strdup(pattern);
+    int ok = watch->pattern != NULL;
     
-    /* TODO: Execute multiple queries in parallel and merge results */
-    return tupledns_find(patterns[0]);
-}
\ No newline at end of file
+    while (required_caps && required_caps[watch->cap_count]) watch->cap_count++;
+    if (ok && watch->cap_count > 0) {
+        watch->caps = calloc(watch->cap_count + 1, sizeof(char*));
+        ok = watch->caps != NULL;
+        for (int i = 0; ok && i < watch->cap_count; i++) {
+            ok = (watch->caps[i] = strdup(required_caps[i])) != NULL;
+        }
+    }
+    if (!ok) {
+        tuple_watch_free(watch);
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return NULL;
+    }
+    
+    pthread_mutex_init(&watch->lock, NULL);
+    pthread_cond_init(&watch->wake, NULL);
+    pthread_mutex_lock(&g_watch_lock);
+    tuple_watch_start(watch);
+    if (watch->running) {
+        watch->next = g_watches;
+        g_watches = watch;
+    }
+    pthread_mutex_unlock(&g_watch_lock);
+    if (!watch->running) {
+        pthread_mutex_destroy(&watch->lock);
+        pthread_cond_destroy(&watch->wake);
+        tuple_watch_free(watch);
+        g_last_error = TUPLEDNS_ERROR_MEMORY_ALLOCATION;
+        return NULL;
+    }
+    return watch;
+}
+
+/* Stop the watch, waiting for a poll in progress to finish */
+void tupledns_unwatch(tupledns_watch_t* watch) {
+    if (!watch) {
+        return;
+    }
+    pthread_mutex_lock(&g_watch_lock);
+    for (tupledns_watch_t** link = &g_watches; *link; link = &(*link)->next) {
+        if (*link == watch) {
+            *link = watch->next;
+            break;
+        }
+    }
+    tuple_watch_stop(watch);
+    pthread_mutex_unlock(&g_watch_lock);
+    pthread_mutex_destroy(&watch->lock);
+    pthread_cond_destroy(&watch->wake);
+    tuple_watch_free(watch);
+}
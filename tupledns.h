@@ -16,6 +16,7 @@ extern "C" {
 #endif
 
 #include <stddef.h>
+#include <stdint.h>
 #include <time.h>
 
 /* API Version */
@@ -30,6 +31,7 @@ extern "C" {
 #define TUPLEDNS_MAX_NODES_PER_RESULT 256   /* Max nodes in single result */
 #define TUPLEDNS_DEFAULT_TTL 300            /* Default TTL in seconds */
 #define TUPLEDNS_DEFAULT_TIMEOUT 5.0        /* Default query timeout */
+#define TUPLEDNS_DEFAULT_PORT 53            /* Default registry server port */
 
 /* Error Codes */
 typedef enum {
@@ -51,17 +53,39 @@ typedef struct {
     int capability_count;      /* Number of capabilities */
     int ttl;                   /* Time to live */
     time_t last_seen;          /* Last discovery time */
+    char** aliases;            /* Other coordinates (CNAMEs) this node is known by */
+    int alias_count;           /* Number of aliases */
+    char** ip_addresses;       /* Every IPv4/IPv6 address, IPv4 first; ip_address is the first */
+    int address_count;         /* Number of addresses */
+    int stale;                 /* Served from cache past its TTL (serve_stale) */
 } tupledns_node_t;
 
 /* Query Result Structure */
+struct tupledns_arena;
 typedef struct {
     tupledns_node_t* nodes;    /* Array of discovered nodes */
     int node_count;            /* Number of nodes found */
     int total_queries;         /* DNS queries performed */
     double query_time;         /* Total query time (seconds) */
     tupledns_error_t error;    /* Error code if any */
+    char* next_cursor;         /* Cursor for the following page, NULL when complete */
+    struct tupledns_arena* arena; /* Owns nodes and their strings when set (internal) */
 } tupledns_result_t;
 
+/* Result Ordering */
+typedef enum {
+    TUPLEDNS_ORDER_NONE = 0,        /* As the source enumerates them */
+    TUPLEDNS_ORDER_COORDINATE = 1   /* Sorted by coordinate */
+} tupledns_order_t;
+
+/* Paged Find Options */
+typedef struct {
+    int limit;                  /* Max nodes; 0 means TUPLEDNS_MAX_NODES_PER_RESULT, the ceiling */
+    const char* cursor;         /* next_cursor of the previous page, NULL for the first */
+    tupledns_order_t order;     /* Result ordering */
+    const char** required_caps; /* NULL-terminated required capabilities, may be NULL */
+} tupledns_find_options_t;
+
 /* Range Structure for range queries */
 typedef struct {
     char* dimension;           /* Dimension name (e.g., "bpm") */
@@ -75,6 +99,8 @@ typedef struct {
     int max_concurrent;       /* Max concurrent DNS queries */
     int enable_caching;       /* Enable DNS response caching */
     int cache_ttl;           /* Cache TTL override */
+    int serve_stale;         /* Seconds past expiry a cached node is still served (0 = off) */
+    int prefetch_budget;     /* Hot cached nodes refreshed before expiry per second (0 = off) */
 } tupledns_config_t;
 
 /* Library Initialization */
@@ -85,20 +111,45 @@ void tupledns_cleanup(void);
 int tupledns_register(const char* coordinate, const char* capabilities[], int ttl);
 int tupledns_register_with_ip(const char* coordinate, const char* ip_address, 
                               const char* capabilities[], int ttl);
+int tupledns_register_with_aliases(const char* coordinate, const char* ip_address,
+                                   const char* capabilities[], const char* aliases[], int ttl);
 int tupledns_unregister(const char* coordinate);
 
 /* Discovery Functions */
 tupledns_result_t* tupledns_find(const char* pattern);
 tupledns_result_t* tupledns_find_with_caps(const char* pattern, const char* required_caps[]);
+tupledns_result_t* tupledns_find_page(const char* pattern, const tupledns_find_options_t* options);
 tupledns_result_t* tupledns_find_range(const char* pattern, const tupledns_range_t ranges[], int range_count);
 tupledns_result_t* tupledns_search_multi(const char* patterns[], int pattern_count);
 
+/* Watches: the callback receives every node matching pattern (and required_caps)
+ * as ADDED, then only the nodes added, removed or changed since. With a registry
+ * server the zone's SOA serial is checked every interval seconds and the
+ * pattern is re-run only when it moves; otherwise the pattern is re-run each
+ * interval. Callbacks run on the watch's own thread, and the node is only
+ * valid during the call. Do not unwatch, set the server or clean up from inside
+ * the callback. tupledns_set_server() restarts live watches against the new
+ * server; tupledns_cleanup() stops them, and each must still be unwatched. */
+#define TUPLEDNS_DEFAULT_WATCH_INTERVAL 1.0
+typedef enum {
+    TUPLEDNS_WATCH_ADDED = 0,
+    TUPLEDNS_WATCH_REMOVED = 1,
+    TUPLEDNS_WATCH_CHANGED = 2      /* Addresses, capabilities, aliases or TTL differ */
+} tupledns_watch_event_t;
+typedef void (*tupledns_watch_callback_t)(tupledns_watch_event_t event, const tupledns_node_t* node,
+                                          void* user_data);
+typedef struct tupledns_watch tupledns_watch_t;
+tupledns_watch_t* tupledns_watch(const char* pattern, const char* required_caps[], double interval,
+                                 tupledns_watch_callback_t callback, void* user_data);
+void tupledns_unwatch(tupledns_watch_t* watch);
+
 /* Utility Functions */
 int tupledns_validate_coordinate(const char* coordinate);
 char* tupledns_encode_coordinate(const char* space_type, const char* values[], int value_count);
 int tupledns_decode_coordinate(const char* coordinate, char** space_type, char*** values, int* value_count);
 int tupledns_match_pattern(const char* coordinate, const char* pattern);
 int tupledns_has_capability(const tupledns_node_t* node, const char* capability);
+int tupledns_filter_capabilities(tupledns_result_t* result, const char* required_caps[]);
 
 /* Memory Management */
 void tupledns_free_result(tupledns_result_t* result);
@@ -108,13 +159,147 @@ void tupledns_free_capabilities(char** capabilities, int count);
 
 /* Error Handling */
 const char* tupledns_error_string(tupledns_error_t error);
-tupledns_error_t tupledns_get_last_error(void);
+tupledns_error_t tupledns_get_last_error(void);   /* Of the calling thread */
 
 /* Configuration Helpers */
 tupledns_config_t tupledns_default_config(void);
 int tupledns_set_config(const tupledns_config_t* config);
 tupledns_config_t tupledns_get_config(void);
 
+/* Registry Server (also settable via TUPLEDNS_SERVER=host[:port]).
+ * When set, queries and registrations speak DNS directly to this server. */
+int tupledns_set_server(const char* address, int port);
+
+/* Transport counters for the registry server. Queries advertise a 1232-byte
+ * EDNS0 UDP payload; truncated answers are retried over one pooled TCP
+ * connection that pipelines queries and is closed after idling. */
+typedef struct {
+    uint64_t udp_queries;          /* Queries sent over UDP */
+    uint64_t truncated;            /* UDP answers with TC set */
+    uint64_t tcp_queries;          /* Queries sent over TCP */
+    uint64_t tcp_connections;      /* TCP connections opened */
+    uint64_t tcp_reused;           /* Exchanges on an already open connection */
+    uint64_t tcp_pipelined;        /* Queries written while others were outstanding */
+    uint64_t tcp_idle_evictions;   /* Pooled connections closed after idling */
+    uint64_t edns_fallbacks;       /* Queries repeated without EDNS0 after FORMERR */
+} tupledns_connection_stats_t;
+void tupledns_get_connection_stats(tupledns_connection_stats_t* stats);
+void tupledns_reset_connection_stats(void);
+
+/* Library-wide counters since start or the last tupledns_reset_stats(), read
+ * as one consistent snapshot. Latency histograms have log2 buckets of
+ * microseconds: bucket 0 counts latencies under 1us, bucket i those in
+ * [2^(i-1), 2^i) us, and the last bucket everything slower. */
+#define TUPLEDNS_STATS_LATENCY_BUCKETS 24
+typedef enum {
+    TUPLEDNS_QUERY_A = 0,
+    TUPLEDNS_QUERY_AAAA = 1,
+    TUPLEDNS_QUERY_TXT = 2,
+    TUPLEDNS_QUERY_SOA = 3,
+    TUPLEDNS_QUERY_AXFR = 4,
+    TUPLEDNS_QUERY_PATTERN = 5,     /* Server-side pattern evaluation (_q) */
+    TUPLEDNS_QUERY_UPDATE = 6,      /* Dynamic updates */
+    TUPLEDNS_QUERY_SYSTEM = 7,      /* System resolver lookups (no registry server) */
+    TUPLEDNS_QUERY_TYPE_COUNT = 8
+} tupledns_query_type_t;
+typedef enum {
+    TUPLEDNS_OUTCOME_OK = 0,
+    TUPLEDNS_OUTCOME_NO_RESULTS = 1, /* NXDOMAIN */
+    TUPLEDNS_OUTCOME_ERROR = 2,
+    TUPLEDNS_OUTCOME_TIMEOUT = 3,
+    TUPLEDNS_OUTCOME_COUNT = 4
+} tupledns_query_outcome_t;
+typedef struct {
+    uint64_t queries[TUPLEDNS_QUERY_TYPE_COUNT][TUPLEDNS_OUTCOME_COUNT];
+    uint64_t query_latency[TUPLEDNS_STATS_LATENCY_BUCKETS];
+    uint64_t bytes_sent;           /* DNS messages written, retransmissions included */
+    uint64_t bytes_received;
+    uint64_t finds;                /* Pattern finds (find, find_with_caps, find_page) */
+    uint64_t find_latency[TUPLEDNS_STATS_LATENCY_BUCKETS];
+    uint64_t server_finds;         /* Finds the registry evaluated in one query */
+    uint64_t expansions;           /* Finds expanded into candidate names locally */
+    uint64_t expanded_names;       /* Candidate names those expansions produced */
+    uint64_t max_expansion;        /* Largest single expansion */
+    uint64_t cache_hits;           /* Capability cache answered a name */
+    uint64_t cache_misses;
+    uint64_t cache_stale_hits;     /* Hits served past their TTL (serve_stale) */
+    uint64_t pattern_cache_hits;
+    uint64_t pattern_cache_misses;
+    uint64_t refreshes;            /* Stale entries queued for background refresh */
+    uint64_t prefetches;           /* Hot entries queued before expiry */
+    uint64_t allocations;          /* Result blocks and arena chunks allocated */
+    uint64_t allocated_bytes;
+    tupledns_connection_stats_t connection;
+} tupledns_stats_t;
+void tupledns_get_stats(tupledns_stats_t* stats);
+void tupledns_reset_stats(void);   /* Also resets the connection stats */
+
+/* Tracing: spans for the phases of a find ("find", "expand", "candidates",
+ * "dns_query", "txt_parse", "capability_filter", "assemble"), delivered to a
+ * callback or written to a file as Chrome trace JSON or folded stacks.
+ * TUPLEDNS_TRACE=[chrome:|folded:]path enables file output at init. Spans
+ * end on the thread that ran the phase, background refreshes included.
+ * The callback runs under the tracing lock and must not call the library. */
+typedef enum {
+    TUPLEDNS_TRACE_CHROME = 0,      /* chrome://tracing / Perfetto JSON */
+    TUPLEDNS_TRACE_FOLDED = 1       /* "find;expand;dns_query <self us>" lines for flame graphs */
+} tupledns_trace_format_t;
+typedef struct {
+    const char* name;               /* Phase */
+    const char* detail;             /* Pattern, query name or coordinate; may be NULL */
+    double start;                   /* Seconds since the epoch */
+    double duration;                /* Seconds */
+    double self_time;               /* duration minus the spans nested in it */
+    int64_t size;                   /* Names, bytes, records or nodes, depending on the phase */
+    int depth;                      /* Enclosing spans; 0 for an outermost span */
+    const char* const* stack;       /* Their names, outermost first */
+    int thread;                     /* Small per-thread number */
+} tupledns_span_t;
+typedef void (*tupledns_trace_callback_t)(const tupledns_span_t* span, void* user_data);
+int tupledns_trace_set_callback(tupledns_trace_callback_t callback, void* user_data);
+int tupledns_trace_to_file(const char* path, tupledns_trace_format_t format);
+void tupledns_trace_stop(void);    /* Also called by tupledns_cleanup() */
+
+/* Snapshots: memory-mapped coordinate sets written by tupledns_store.py,
+ * queried in place without contacting any server */
+typedef struct tupledns_snapshot tupledns_snapshot_t;
+tupledns_snapshot_t* tupledns_snapshot_open(const char* path);
+void tupledns_snapshot_close(tupledns_snapshot_t* snapshot);
+int tupledns_snapshot_node_count(const tupledns_snapshot_t* snapshot);
+tupledns_result_t* tupledns_snapshot_find(const tupledns_snapshot_t* snapshot, const char* pattern,
+                                          const char* required_caps[]);
+
+/* In-Memory Coordinate Index: labels are interned (case-folded) to uint32
+ * IDs and coordinates stored as ID arrays; strings are rebuilt only for results */
+typedef struct tupledns_index tupledns_index_t;
+#define TUPLEDNS_LABEL_NONE 0xFFFFFFFFu   /* Label not in the index */
+#define TUPLEDNS_LABEL_ANY 0xFFFFFFFEu    /* "*" in a pattern */
+tupledns_index_t* tupledns_index_create(void);
+void tupledns_index_destroy(tupledns_index_t* index);
+int tupledns_index_add(tupledns_index_t* index, const tupledns_node_t* node);
+int tupledns_index_add_result(tupledns_index_t* index, const tupledns_result_t* result);
+int tupledns_index_remove(tupledns_index_t* index, const char* coordinate);
+int tupledns_index_count(const tupledns_index_t* index);
+tupledns_result_t* tupledns_index_find(const tupledns_index_t* index, const char* pattern);
+tupledns_result_t* tupledns_index_find_with_caps(const tupledns_index_t* index, const char* pattern,
+                                                 const char* required_caps[]);
+uint32_t tupledns_index_label_id(const tupledns_index_t* index, const char* label);
+const char* tupledns_index_label(const tupledns_index_t* index, uint32_t id);
+
+/* Proximity search: numeric labels of coordinate ("120", "floor-1") are the
+ * centre, other labels must match ("*" matches anything). Nodes within radius
+ * (negative for any distance), at most k of them (0 for all), nearest first. */
+tupledns_result_t* tupledns_index_find_nearby(const tupledns_index_t* index, const char* coordinate,
+                                              double radius, int k, const char* required_caps[]);
+
+/* Similarity search: nodes of the same space whose labels are within
+ * max_distance of coordinate's, nearest first ("*" labels are ignored).
+ * Distance is the summed edit distance of the labels, or with weights (one
+ * per label of coordinate) the summed weights of the labels that differ. */
+tupledns_result_t* tupledns_index_find_similar(const tupledns_index_t* index, const char* coordinate,
+                                               int max_distance, const int* weights,
+                                               const char* required_caps[]);
+
 /* String Utilities */
 char* tupledns_join_strings(const char* strings[], int count, const char* separator);
 char** tupledns_split_string(const char* str, const char* separator, int* count);
@@ -122,6 +307,7 @@ void tupledns_free_string_array(char** strings, int count);
 
 /* DNS Helper Functions (Internal, exposed for testing) */
 int tupledns_dns_query_a(const char* hostname, char** ip_address);
+int tupledns_dns_query_addresses(const char* hostname, char*** addresses, int* address_count);
 int tupledns_dns_query_txt(const char* hostname, char*** txt_records, int* record_count);
 int tupledns_parse_capabilities(const char* txt_record, char*** capabilities, int* capability_count);
 
@@ -3,11 +3,17 @@ TupleDNS Python Bindings
 Python wrapper for the TupleDNS C library
 """
 
+import asyncio
 import ctypes
 import ctypes.util
 import os
-from typing import List, Dict, Optional, Tuple, Any
-from dataclasses import dataclass
+import queue
+import re
+import threading
+import time
+import weakref
+from typing import Callable, List, Dict, Iterator, Optional, Tuple, Any
+from dataclasses import dataclass, field
 from enum import IntEnum
 
 # Load the TupleDNS C library
@@ -37,6 +43,15 @@ class TupleDNSError(IntEnum):
     NO_RESULTS = -6
     CAPABILITY_PARSE = -7
 
+class TupleOrder(IntEnum):
+    NONE = 0
+    COORDINATE = 1
+
+class TupleWatchEventType(IntEnum):
+    ADDED = 0
+    REMOVED = 1
+    CHANGED = 2
+
 class TupleDNSException(Exception):
     def __init__(self, error_code: int, message: str = None):
         self.error_code = error_code
@@ -50,6 +65,25 @@ class TupleNode:
     capabilities: List[str]
     ttl: int
     last_seen: int
+    aliases: List[str] = field(default_factory=list)  # Other coordinates it is known by
+    ip_addresses: List[str] = field(default_factory=list)  # Every A/AAAA address, ip_address first
+    stale: bool = False  # Served from cache past its TTL (serve_stale)
+
+@dataclass
+class TupleWatchEvent:
+    type: TupleWatchEventType
+    node: TupleNode
+
+@dataclass
+class TupleSpan:
+    name: str  # Phase: find, expand, candidates, dns_query, txt_parse, capability_filter, assemble
+    detail: str
+    start: float
+    duration: float
+    self_time: float
+    size: int
+    stack: List[str]  # Enclosing phases, outermost first
+    thread: int
 
 @dataclass
 class TupleRange:
@@ -63,12 +97,120 @@ class TupleResult:
     total_queries: int
     query_time: float
     error: int
+    next_cursor: Optional[str] = None
+
+class _CNode(ctypes.Structure):
+    _fields_ = [
+        ("coordinate", ctypes.c_char_p),
+        ("ip_address", ctypes.c_char_p),
+        ("capabilities", ctypes.POINTER(ctypes.c_char_p)),
+        ("capability_count", ctypes.c_int),
+        ("ttl", ctypes.c_int),
+        ("last_seen", ctypes.c_long),
+        ("aliases", ctypes.POINTER(ctypes.c_char_p)),
+        ("alias_count", ctypes.c_int),
+        ("ip_addresses", ctypes.POINTER(ctypes.c_char_p)),
+        ("address_count", ctypes.c_int),
+        ("stale", ctypes.c_int),
+    ]
+
+class _CResult(ctypes.Structure):
+    _fields_ = [
+        ("nodes", ctypes.POINTER(_CNode)),
+        ("node_count", ctypes.c_int),
+        ("total_queries", ctypes.c_int),
+        ("query_time", ctypes.c_double),
+        ("error", ctypes.c_int),
+        ("next_cursor", ctypes.c_char_p),
+        ("arena", ctypes.c_void_p),
+    ]
+
+class _CFindOptions(ctypes.Structure):
+    _fields_ = [
+        ("limit", ctypes.c_int),
+        ("cursor", ctypes.c_char_p),
+        ("order", ctypes.c_int),
+        ("required_caps", ctypes.POINTER(ctypes.c_char_p)),
+    ]
+
+class _CConfig(ctypes.Structure):
+    _fields_ = [
+        ("timeout", ctypes.c_double),
+        ("max_concurrent", ctypes.c_int),
+        ("enable_caching", ctypes.c_int),
+        ("cache_ttl", ctypes.c_int),
+        ("serve_stale", ctypes.c_int),
+        ("prefetch_budget", ctypes.c_int),
+    ]
+
+class _CConnectionStats(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_uint64) for name in (
+        "udp_queries", "truncated", "tcp_queries", "tcp_connections",
+        "tcp_reused", "tcp_pipelined", "tcp_idle_evictions", "edns_fallbacks")]
+
+# Index order of tupledns_query_type_t and tupledns_query_outcome_t
+_QUERY_TYPES = ("a", "aaaa", "txt", "soa", "axfr", "pattern", "update", "system")
+_QUERY_OUTCOMES = ("ok", "no_results", "error", "timeout")
+_LATENCY_BUCKETS = 24
+
+class _CStats(ctypes.Structure):
+    _fields_ = [
+        ("queries", (ctypes.c_uint64 * len(_QUERY_OUTCOMES)) * len(_QUERY_TYPES)),
+        ("query_latency", ctypes.c_uint64 * _LATENCY_BUCKETS),
+        ("bytes_sent", ctypes.c_uint64),
+        ("bytes_received", ctypes.c_uint64),
+        ("finds", ctypes.c_uint64),
+        ("find_latency", ctypes.c_uint64 * _LATENCY_BUCKETS),
+    ] + [(name, ctypes.c_uint64) for name in (
+        "server_finds", "expansions", "expanded_names", "max_expansion",
+        "cache_hits", "cache_misses", "cache_stale_hits", "pattern_cache_hits", "pattern_cache_misses",
+        "refreshes", "prefetches", "allocations", "allocated_bytes")] + [
+        ("connection", _CConnectionStats),
+    ]
+
+_WATCH_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_int, ctypes.POINTER(_CNode), ctypes.c_void_p)
+_RUNNING_WATCHES: Dict[int, Any] = {}  # C watch handle -> callback, kept alive until unwatched
+
+class _CSpan(ctypes.Structure):
+    _fields_ = [
+        ("name", ctypes.c_char_p),
+        ("detail", ctypes.c_char_p),
+        ("start", ctypes.c_double),
+        ("duration", ctypes.c_double),
+        ("self_time", ctypes.c_double),
+        ("size", ctypes.c_int64),
+        ("depth", ctypes.c_int),
+        ("stack", ctypes.POINTER(ctypes.c_char_p)),
+        ("thread", ctypes.c_int),
+    ]
+
+_TRACE_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.POINTER(_CSpan), ctypes.c_void_p)
+_TRACE_FORMATS = {"chrome": 0, "folded": 1}
+
+# Labels measured by proximity search: "120", "2.5", "floor-1"
+_NUMERIC_LABEL = re.compile(r'^(?:.+?-)?-?\d+(?:\.\d+)?$')
+_SPACE_INDEX_LIMIT = 64   # Discovered spaces kept indexed per TupleDNS instance
+
+def _decode(value: Optional[bytes]) -> str:
+    return value.decode('utf-8') if value else ""
+
+def _convert_node(c_node: _CNode) -> TupleNode:
+    return TupleNode(
+        coordinate=_decode(c_node.coordinate),
+        ip_address=_decode(c_node.ip_address),
+        capabilities=[_decode(c_node.capabilities[j]) for j in range(c_node.capability_count)],
+        ttl=c_node.ttl,
+        last_seen=c_node.last_seen,
+        aliases=[_decode(c_node.aliases[j]) for j in range(c_node.alias_count)],
+        ip_addresses=[_decode(c_node.ip_addresses[j]) for j in range(c_node.address_count)],
+        stale=bool(c_node.stale)
+    )
 
 class TupleDNS:
     """Main TupleDNS interface"""
     
-    def __init__(self, lib_path: str = None):
-        """Initialize TupleDNS library"""
+    def __init__(self, lib_path: str = None, server: Optional[Tuple[str, int]] = None):
+        """Initialize TupleDNS library, optionally pointing it at a registry server"""
         if lib_path is None:
             lib_path = _find_library()
         
@@ -77,11 +219,15 @@ class TupleDNS:
         
         self._lib = ctypes.CDLL(lib_path)
         self._setup_function_signatures()
+        self._space_indexes: Dict[str, Tuple['TupleIndex', float]] = {}  # pattern -> (index, expires)
         
         # Initialize the library with default config
         result = self._lib.tupledns_init(None)
         if result != TupleDNSError.OK:
             raise TupleDNSException(result, "Failed to initialize TupleDNS")
+        
+        if server is not None:
+            self.set_server(*server)
     
     def _setup_function_signatures(self):
         """Setup ctypes function signatures for the C library"""
@@ -98,14 +244,109 @@ class TupleDNS:
         self._lib.tupledns_register.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_char_p), ctypes.c_int]
         self._lib.tupledns_register.restype = ctypes.c_int
         
+        # tupledns_register_with_ip
+        self._lib.tupledns_register_with_ip.argtypes = [ctypes.c_char_p, ctypes.c_char_p,
+                                                        ctypes.POINTER(ctypes.c_char_p), ctypes.c_int]
+        self._lib.tupledns_register_with_ip.restype = ctypes.c_int
+        
+        # tupledns_register_with_aliases
+        self._lib.tupledns_register_with_aliases.argtypes = [ctypes.c_char_p, ctypes.c_char_p,
+                                                             ctypes.POINTER(ctypes.c_char_p),
+                                                             ctypes.POINTER(ctypes.c_char_p), ctypes.c_int]
+        self._lib.tupledns_register_with_aliases.restype = ctypes.c_int
+        
+        # tupledns_unregister
+        self._lib.tupledns_unregister.argtypes = [ctypes.c_char_p]
+        self._lib.tupledns_unregister.restype = ctypes.c_int
+        
+        # tupledns_set_server
+        self._lib.tupledns_set_server.argtypes = [ctypes.c_char_p, ctypes.c_int]
+        self._lib.tupledns_set_server.restype = ctypes.c_int
+        
+        # tupledns_get_config / tupledns_set_config
+        self._lib.tupledns_get_config.argtypes = []
+        self._lib.tupledns_get_config.restype = _CConfig
+        self._lib.tupledns_set_config.argtypes = [ctypes.POINTER(_CConfig)]
+        self._lib.tupledns_set_config.restype = ctypes.c_int
+        
+        # tupledns_get_connection_stats / tupledns_reset_connection_stats
+        self._lib.tupledns_get_connection_stats.argtypes = [ctypes.POINTER(_CConnectionStats)]
+        self._lib.tupledns_get_connection_stats.restype = None
+        self._lib.tupledns_reset_connection_stats.argtypes = []
+        self._lib.tupledns_reset_connection_stats.restype = None
+        
+        # tupledns_get_stats / tupledns_reset_stats
+        self._lib.tupledns_get_stats.argtypes = [ctypes.POINTER(_CStats)]
+        self._lib.tupledns_get_stats.restype = None
+        self._lib.tupledns_reset_stats.argtypes = []
+        self._lib.tupledns_reset_stats.restype = None
+        
+        # tupledns_trace_set_callback / tupledns_trace_to_file / tupledns_trace_stop
+        self._lib.tupledns_trace_set_callback.argtypes = [_TRACE_CALLBACK, ctypes.c_void_p]
+        self._lib.tupledns_trace_set_callback.restype = ctypes.c_int
+        self._lib.tupledns_trace_to_file.argtypes = [ctypes.c_char_p, ctypes.c_int]
+        self._lib.tupledns_trace_to_file.restype = ctypes.c_int
+        self._lib.tupledns_trace_stop.argtypes = []
+        self._lib.tupledns_trace_stop.restype = None
+        
         # tupledns_find
         self._lib.tupledns_find.argtypes = [ctypes.c_char_p]
-        self._lib.tupledns_find.restype = ctypes.c_void_p
+        self._lib.tupledns_find.restype = ctypes.POINTER(_CResult)
+        
+        # tupledns_find_with_caps
+        self._lib.tupledns_find_with_caps.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_char_p)]
+        self._lib.tupledns_find_with_caps.restype = ctypes.POINTER(_CResult)
+        self._lib.tupledns_find_page.argtypes = [ctypes.c_char_p, ctypes.POINTER(_CFindOptions)]
+        self._lib.tupledns_find_page.restype = ctypes.POINTER(_CResult)
+        
+        # tupledns_watch / tupledns_unwatch
+        self._lib.tupledns_watch.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_char_p), ctypes.c_double,
+                                             _WATCH_CALLBACK, ctypes.c_void_p]
+        self._lib.tupledns_watch.restype = ctypes.c_void_p
+        self._lib.tupledns_unwatch.argtypes = [ctypes.c_void_p]
+        self._lib.tupledns_unwatch.restype = None
         
         # tupledns_free_result
-        self._lib.tupledns_free_result.argtypes = [ctypes.c_void_p]
+        self._lib.tupledns_free_result.argtypes = [ctypes.POINTER(_CResult)]
         self._lib.tupledns_free_result.restype = None
         
+        # snapshots
+        self._lib.tupledns_snapshot_open.argtypes = [ctypes.c_char_p]
+        self._lib.tupledns_snapshot_open.restype = ctypes.c_void_p
+        self._lib.tupledns_snapshot_close.argtypes = [ctypes.c_void_p]
+        self._lib.tupledns_snapshot_close.restype = None
+        self._lib.tupledns_snapshot_node_count.argtypes = [ctypes.c_void_p]
+        self._lib.tupledns_snapshot_node_count.restype = ctypes.c_int
+        self._lib.tupledns_snapshot_find.argtypes = [ctypes.c_void_p, ctypes.c_char_p,
+                                                     ctypes.POINTER(ctypes.c_char_p)]
+        self._lib.tupledns_snapshot_find.restype = ctypes.POINTER(_CResult)
+        
+        # coordinate index
+        self._lib.tupledns_index_create.argtypes = []
+        self._lib.tupledns_index_create.restype = ctypes.c_void_p
+        self._lib.tupledns_index_destroy.argtypes = [ctypes.c_void_p]
+        self._lib.tupledns_index_destroy.restype = None
+        self._lib.tupledns_index_add.argtypes = [ctypes.c_void_p, ctypes.POINTER(_CNode)]
+        self._lib.tupledns_index_add.restype = ctypes.c_int
+        self._lib.tupledns_index_remove.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        self._lib.tupledns_index_remove.restype = ctypes.c_int
+        self._lib.tupledns_index_count.argtypes = [ctypes.c_void_p]
+        self._lib.tupledns_index_count.restype = ctypes.c_int
+        self._lib.tupledns_index_find_with_caps.argtypes = [ctypes.c_void_p, ctypes.c_char_p,
+                                                            ctypes.POINTER(ctypes.c_char_p)]
+        self._lib.tupledns_index_find_with_caps.restype = ctypes.POINTER(_CResult)
+        self._lib.tupledns_index_find_nearby.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_double,
+                                                         ctypes.c_int, ctypes.POINTER(ctypes.c_char_p)]
+        self._lib.tupledns_index_find_nearby.restype = ctypes.POINTER(_CResult)
+        self._lib.tupledns_index_find_similar.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int,
+                                                          ctypes.POINTER(ctypes.c_int),
+                                                          ctypes.POINTER(ctypes.c_char_p)]
+        self._lib.tupledns_index_find_similar.restype = ctypes.POINTER(_CResult)
+        self._lib.tupledns_index_label_id.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        self._lib.tupledns_index_label_id.restype = ctypes.c_uint32
+        self._lib.tupledns_index_label.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        self._lib.tupledns_index_label.restype = ctypes.c_char_p
+        
         # tupledns_validate_coordinate
         self._lib.tupledns_validate_coordinate.argtypes = [ctypes.c_char_p]
         self._lib.tupledns_validate_coordinate.restype = ctypes.c_int
@@ -113,52 +354,183 @@ class TupleDNS:
         # tupledns_error_string
         self._lib.tupledns_error_string.argtypes = [ctypes.c_int]
         self._lib.tupledns_error_string.restype = ctypes.c_char_p
+        self._lib.tupledns_get_last_error.argtypes = []
+        self._lib.tupledns_get_last_error.restype = ctypes.c_int
     
-    def register(self, coordinate: str, capabilities: List[str] = None, ttl: int = 300) -> None:
-        """Register a node at the given tuple coordinate"""
-        if not self.validate_coordinate(coordinate):
-            raise TupleDNSException(TupleDNSError.INVALID_COORDINATE, f"Invalid coordinate: {coordinate}")
-        
-        # Convert capabilities to C array
-        cap_array = None
-        if capabilities:
-            cap_array = (ctypes.c_char_p * (len(capabilities) + 1))()
-            for i, cap in enumerate(capabilities):
-                cap_array[i] = cap.encode('utf-8')
-            cap_array[len(capabilities)] = None
-        
-        result = self._lib.tupledns_register(
-            coordinate.encode('utf-8'),
-            cap_array,
-            ttl
-        )
-        
+    def set_server(self, address: Optional[str], port: int = 53) -> None:
+        """Send queries and registrations to the given registry server (None to unset)"""
+        self._forget_spaces()
+        result = self._lib.tupledns_set_server(address.encode('utf-8') if address else None, port)
+        self._check(result)
+    
+    def configure(self, **options: Any) -> Dict[str, Any]:
+        """Update library options (timeout, max_concurrent, enable_caching, cache_ttl,
+        serve_stale, prefetch_budget); returns the resulting configuration"""
+        config = self._lib.tupledns_get_config()
+        for name, value in options.items():
+            if name not in dict(_CConfig._fields_):
+                raise TupleDNSException(TupleDNSError.INVALID_PARAMETER, f"Unknown option: {name}")
+            setattr(config, name, value)
+        if options:
+            self._check(self._lib.tupledns_set_config(ctypes.byref(config)))
+        return {name: getattr(config, name) for name, _ in _CConfig._fields_}
+    
+    def connection_stats(self, reset: bool = False) -> Dict[str, int]:
+        """Transport counters for the registry server (UDP, truncation, pooled TCP)"""
+        stats = _CConnectionStats()
+        self._lib.tupledns_get_connection_stats(ctypes.byref(stats))
+        if reset:
+            self._lib.tupledns_reset_connection_stats()
+        return {name: getattr(stats, name) for name, _ in _CConnectionStats._fields_}
+    
+    def stats(self, reset: bool = False) -> Dict[str, Any]:
+        """Library-wide counters as a dict: queries[type][outcome], latency
+        histograms (log2 microsecond buckets), bytes, finds, expansion fan-out,
+        cache hits and misses, allocations and the connection stats"""
+        stats = _CStats()
+        self._lib.tupledns_get_stats(ctypes.byref(stats))
+        if reset:
+            self._lib.tupledns_reset_stats()
+        snapshot: Dict[str, Any] = {
+            "queries": {qtype: dict(zip(_QUERY_OUTCOMES, stats.queries[i]))
+                        for i, qtype in enumerate(_QUERY_TYPES)},
+        }
+        snapshot["timeouts"] = sum(outcomes["timeout"] for outcomes in snapshot["queries"].values())
+        for name, ctype in _CStats._fields_[1:]:
+            if name == "connection":
+                snapshot[name] = {n: getattr(stats.connection, n) for n, _ in _CConnectionStats._fields_}
+            elif issubclass(ctype, ctypes.Array):
+                snapshot[name] = list(getattr(stats, name))
+            else:
+                snapshot[name] = getattr(stats, name)
+        return snapshot
+    
+    def trace(self, callback: Callable[[TupleSpan], None]) -> None:
+        """Call callback with a TupleSpan as each phase of a find ends, on the
+        thread that ran it, until stop_trace()"""
+        def on_span(c_span, _user_data):
+            span = c_span.contents
+            callback(TupleSpan(
+                name=_decode(span.name),
+                detail=_decode(span.detail),
+                start=span.start,
+                duration=span.duration,
+                self_time=span.self_time,
+                size=span.size,
+                stack=[_decode(span.stack[i]) for i in range(span.depth)],
+                thread=span.thread
+            ))
+        self._trace_callback = _TRACE_CALLBACK(on_span)  # Kept alive while tracing
+        self._check(self._lib.tupledns_trace_set_callback(self._trace_callback, None))
+    
+    def trace_to_file(self, path: str, format: str = "chrome") -> None:
+        """Write spans to path as Chrome trace JSON ("chrome") or folded
+        stacks for flame graphs ("folded") until stop_trace()"""
+        if format not in _TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format: {format}")
+        self._check(self._lib.tupledns_trace_to_file(path.encode('utf-8'), _TRACE_FORMATS[format]))
+    
+    def stop_trace(self) -> None:
+        """Stop tracing and close any trace file"""
+        self._lib.tupledns_trace_stop()
+        self._trace_callback = None
+    
+    def _check(self, result: int) -> None:
         if result != TupleDNSError.OK:
             error_msg = self._lib.tupledns_error_string(result).decode('utf-8')
             raise TupleDNSException(result, error_msg)
     
-    def find(self, pattern: str) -> TupleResult:
-        """Find nodes matching the given pattern"""
-        result_ptr = self._lib.tupledns_find(pattern.encode('utf-8'))
+    @staticmethod
+    def _string_array(strings: Optional[List[str]]):
+        """Convert a list of strings to a NULL-terminated C array"""
+        if not strings:
+            return None
+        array = (ctypes.c_char_p * (len(strings) + 1))()
+        for i, value in enumerate(strings):
+            array[i] = value.encode('utf-8')
+        array[len(strings)] = None
+        return array
+    
+    def register(self, coordinate: str, capabilities: List[str] = None, ttl: int = 300,
+                 ip_address: Optional[str] = None, aliases: List[str] = None) -> None:
+        """Register a node at the given tuple coordinate, published as CNAMEs
+        under any alias coordinates (typically in other spaces)"""
+        if not self.validate_coordinate(coordinate):
+            raise TupleDNSException(TupleDNSError.INVALID_COORDINATE, f"Invalid coordinate: {coordinate}")
+        
+        cap_array = self._string_array(capabilities)
+        if aliases:
+            result = self._lib.tupledns_register_with_aliases(
+                coordinate.encode('utf-8'), ip_address.encode('utf-8') if ip_address is not None else None,
+                cap_array, self._string_array(aliases), ttl)
+        elif ip_address is not None:
+            result = self._lib.tupledns_register_with_ip(
+                coordinate.encode('utf-8'), ip_address.encode('utf-8'), cap_array, ttl)
+        else:
+            result = self._lib.tupledns_register(coordinate.encode('utf-8'), cap_array, ttl)
+        self._forget_spaces()
+        self._check(result)
+    
+    def unregister(self, coordinate: str) -> None:
+        """Remove the registration at the given coordinate"""
+        self._forget_spaces()
+        self._check(self._lib.tupledns_unregister(coordinate.encode('utf-8')))
+    
+    def _convert_result(self, result_ptr) -> TupleResult:
+        """Copy a C result into Python objects and free it"""
         if not result_ptr:
             raise TupleDNSException(TupleDNSError.NO_RESULTS, "No results found")
         
         try:
-            # For now, return empty result since C implementation is not complete
-            result = TupleResult(
-                nodes=[],
-                total_queries=1,
-                query_time=0.0,
-                error=TupleDNSError.NO_RESULTS
+            c_result = result_ptr.contents
+            nodes = [_convert_node(c_result.nodes[i]) for i in range(c_result.node_count)]
+            return TupleResult(
+                nodes=nodes,
+                total_queries=c_result.total_queries,
+                query_time=c_result.query_time,
+                error=c_result.error,
+                next_cursor=c_result.next_cursor.decode('utf-8') if c_result.next_cursor else None
             )
-            return result
         finally:
             self._lib.tupledns_free_result(result_ptr)
     
+    def find(self, pattern: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+             order: TupleOrder = TupleOrder.NONE,
+             required_capabilities: Optional[List[str]] = None) -> TupleResult:
+        """Find nodes matching the given pattern.
+        
+        With limit, cursor or order, at most limit nodes (capped at 256) are
+        resolved and result.next_cursor continues from where this page stopped.
+        """
+        if limit is None and cursor is None and order == TupleOrder.NONE:
+            if required_capabilities:
+                return self.find_with_capabilities(pattern, required_capabilities)
+            return self._convert_result(self._lib.tupledns_find(pattern.encode('utf-8')))
+        
+        caps = self._string_array(required_capabilities)
+        options = _CFindOptions(limit or 0, cursor.encode('utf-8') if cursor else None, int(order), caps)
+        result_ptr = self._lib.tupledns_find_page(pattern.encode('utf-8'), ctypes.byref(options))
+        if not result_ptr:
+            self._check(self._lib.tupledns_get_last_error() or TupleDNSError.INVALID_PARAMETER)
+        return self._convert_result(result_ptr)
+    
+    def find_pages(self, pattern: str, page_size: Optional[int] = None,
+                   order: TupleOrder = TupleOrder.NONE,
+                   required_capabilities: Optional[List[str]] = None) -> Iterator[TupleResult]:
+        """Yield successive result pages, resolving each only when it is requested"""
+        cursor = None
+        while True:
+            page = self.find(pattern, limit=page_size or 0, cursor=cursor, order=order,
+                             required_capabilities=required_capabilities)
+            yield page
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+    
     def find_with_capabilities(self, pattern: str, required_capabilities: List[str]) -> TupleResult:
         """Find nodes matching pattern and having required capabilities"""
-        # For now, delegate to find() since capability filtering is not implemented
-        return self.find(pattern)
+        caps = self._string_array(required_capabilities)
+        return self._convert_result(self._lib.tupledns_find_with_caps(pattern.encode('utf-8'), caps))
     
     def find_range(self, pattern: str, ranges: Dict[str, Tuple[int, int]]) -> TupleResult:
         """Find nodes within specified ranges"""
@@ -177,13 +549,103 @@ class TupleDNS:
         # For now, just search the first pattern
         return self.find(patterns[0])
     
+    def find_nearby(self, coordinate: str, capabilities: List[str] = None, radius: Optional[float] = None,
+                    k: Optional[int] = None) -> TupleResult:
+        """Find nodes in coordinate's space nearest to it over its numeric labels.
+        
+        Candidates are discovered with the numeric labels wildcarded, then
+        ranked through a k-d tree in a coordinate index kept for that pattern
+        until its nodes' TTLs run out.
+        """
+        labels = coordinate.split('.')
+        pattern = '.'.join('*' if i < len(labels) - 2 and _NUMERIC_LABEL.match(label) else label
+                           for i, label in enumerate(labels))
+        index, candidates = self._space_index(pattern)
+        result = index.find_nearby(coordinate, radius, k, capabilities)
+        if candidates is not None:
+            result.total_queries = candidates.total_queries
+            result.query_time += candidates.query_time
+        return result
+    
+    def find_similar(self, coordinate: str, max_distance: int = 1, weights: List[int] = None,
+                     capabilities: List[str] = None) -> TupleResult:
+        """Find nodes in coordinate's space whose labels are within max_distance of it.
+        
+        The space is discovered with every value label wildcarded, then
+        searched through a BK-tree in the coordinate index kept for it.
+        """
+        labels = coordinate.split('.')
+        pattern = '.'.join(['*'] * (len(labels) - 2) + labels[-2:])
+        index, candidates = self._space_index(pattern)
+        result = index.find_similar(coordinate, max_distance, weights, capabilities)
+        if candidates is not None:
+            result.total_queries = candidates.total_queries
+            result.query_time += candidates.query_time
+        return result
+    
+    def open_snapshot(self, path: str) -> 'TupleSnapshot':
+        """Memory-map a snapshot written by tupledns_store.py"""
+        handle = self._lib.tupledns_snapshot_open(path.encode('utf-8'))
+        if not handle:
+            raise TupleDNSException(TupleDNSError.INVALID_PARAMETER, f"Cannot open snapshot: {path}")
+        return TupleSnapshot(self, handle)
+    
+    def _space_index(self, pattern: str) -> Tuple['TupleIndex', Optional[TupleResult]]:
+        """Index of every node matching pattern, with the discovery result when
+        it had to be rebuilt (None when reused).
+        
+        Kept until the shortest node TTL (capped by cache_ttl) runs out, so the
+        k-d and BK-trees the index builds are reused across calls.
+        """
+        cached = self._space_indexes.get(pattern)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0], None
+        
+        candidates = self.find(pattern)
+        index = self.create_index()
+        for node in candidates.nodes:
+            index.add(node)
+        # Like the C pattern cache, an empty space is not kept: it is asked again next time
+        config = self._lib.tupledns_get_config()
+        lifetime = 0
+        if candidates.nodes and config.enable_caching:
+            lifetime = min([node.ttl for node in candidates.nodes] + [config.cache_ttl])
+        if cached is not None:
+            cached[0].close()
+        self._space_indexes.pop(pattern, None)
+        self._space_indexes[pattern] = (index, time.monotonic() + lifetime)
+        while len(self._space_indexes) > _SPACE_INDEX_LIMIT:
+            oldest = next(iter(self._space_indexes))
+            self._space_indexes.pop(oldest)[0].close()
+        return index, candidates
+    
+    def _forget_spaces(self) -> None:
+        """Drop the indexed spaces, to be rediscovered on next use"""
+        for index, _ in self._space_indexes.values():
+            index.close()
+        self._space_indexes.clear()
+    
+    def create_index(self) -> 'TupleIndex':
+        """Create an in-memory coordinate index with interned labels"""
+        handle = self._lib.tupledns_index_create()
+        if not handle:
+            raise TupleDNSException(TupleDNSError.MEMORY_ALLOCATION, "Cannot create index")
+        return TupleIndex(self, handle)
+    
     def validate_coordinate(self, coordinate: str) -> bool:
         """Validate a tuple coordinate format"""
         result = self._lib.tupledns_validate_coordinate(coordinate.encode('utf-8'))
         return result == 1
     
+    def watch(self, pattern: str, required_capabilities: Optional[List[str]] = None,
+              interval: float = 1.0) -> 'TupleWatch':
+        """Watch the nodes matching pattern: an async iterator of TupleWatchEvent,
+        starting with every current node as ADDED and then only the changes"""
+        return TupleWatch(self, pattern, required_capabilities, interval)
+    
     def cleanup(self):
         """Cleanup TupleDNS resources"""
+        self._forget_spaces()
         self._lib.tupledns_cleanup()
     
     def __enter__(self):
@@ -192,28 +654,236 @@ class TupleDNS:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.cleanup()
 
+class _WatchSink:
+    """Receives a C watch's events on its thread. Holds no reference to the
+    TupleWatch, so an unclosed watch can still be collected and stopped."""
+    
+    def __init__(self):
+        self.events: 'queue.SimpleQueue[TupleWatchEvent]' = queue.SimpleQueue()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.ready: Optional[asyncio.Event] = None
+        self.thread: Optional[int] = None
+    
+    def __call__(self, event: int, c_node, user_data) -> None:
+        # Runs on the watch thread; the node is copied before the call returns
+        self.thread = threading.get_ident()
+        self.events.put(TupleWatchEvent(TupleWatchEventType(event), _convert_node(c_node.contents)))
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.ready.set)
+
+def _unwatch(lib, handle: int, callback) -> None:
+    """Unwatch handle, releasing its callback once the C thread has stopped"""
+    lib.tupledns_unwatch(handle)
+    if _RUNNING_WATCHES.get(handle) is callback:
+        del _RUNNING_WATCHES[handle]
+
+def _stop_watch(lib, handle: int, callback, sink: _WatchSink) -> None:
+    if sink.thread == threading.get_ident():
+        # Collected on the watch thread itself, which cannot join itself
+        threading.Thread(target=_unwatch, args=(lib, handle, callback), daemon=True).start()
+    else:
+        _unwatch(lib, handle, callback)
+
+class TupleWatch:
+    """Changes to the nodes matching a pattern, delivered by a C watch thread.
+    
+    Iterate with ``async for``; close() (or leaving ``async with``) stops the
+    watch and ends the iteration once the events already received are consumed.
+    A watch collected without close() is stopped then.
+    """
+    
+    def __init__(self, dns: TupleDNS, pattern: str, required_capabilities: Optional[List[str]], interval: float):
+        self._dns = dns
+        self._sink = _WatchSink()
+        callback = _WATCH_CALLBACK(self._sink)
+        caps = dns._string_array(required_capabilities)
+        self._handle = dns._lib.tupledns_watch(pattern.encode('utf-8'), caps, interval, callback, None)
+        if not self._handle:
+            dns._check(dns._lib.tupledns_get_last_error() or TupleDNSError.INVALID_PARAMETER)
+        _RUNNING_WATCHES[self._handle] = callback
+        self._stop = weakref.finalize(self, _stop_watch, dns._lib, self._handle, callback, self._sink)
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self) -> TupleWatchEvent:
+        sink = self._sink
+        if sink.loop is None:
+            sink.ready = asyncio.Event()
+            sink.loop = asyncio.get_running_loop()
+        while True:
+            try:
+                return sink.events.get_nowait()
+            except queue.Empty:
+                if not self._handle:
+                    raise StopAsyncIteration
+            sink.ready.clear()
+            if sink.events.empty():
+                await sink.ready.wait()
+    
+    def close(self):
+        if self._handle:
+            self._stop()
+            self._handle = None
+            if self._sink.ready is not None:
+                self._sink.ready.set()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class TupleSnapshot:
+    """A memory-mapped snapshot queried in place by the C library"""
+    
+    def __init__(self, dns: TupleDNS, handle: int):
+        self._dns = dns
+        self._handle = handle
+    
+    def __len__(self) -> int:
+        return self._dns._lib.tupledns_snapshot_node_count(self._handle)
+    
+    def find(self, pattern: str, required_capabilities: List[str] = None) -> TupleResult:
+        """Find snapshot nodes matching pattern and having all required capabilities"""
+        if not self._handle:
+            raise TupleDNSException(TupleDNSError.INVALID_PARAMETER, "Snapshot is closed")
+        caps = self._dns._string_array(required_capabilities)
+        return self._dns._convert_result(
+            self._dns._lib.tupledns_snapshot_find(self._handle, pattern.encode('utf-8'), caps))
+    
+    def close(self):
+        if self._handle:
+            self._dns._lib.tupledns_snapshot_close(self._handle)
+            self._handle = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class TupleIndex:
+    """An in-memory coordinate index held by the C library"""
+    
+    LABEL_NONE = 0xFFFFFFFF
+    
+    def __init__(self, dns: TupleDNS, handle: int):
+        self._dns = dns
+        self._handle = handle
+    
+    def __len__(self) -> int:
+        return self._dns._lib.tupledns_index_count(self._handle)
+    
+    def _live(self):
+        if not self._handle:
+            raise TupleDNSException(TupleDNSError.INVALID_PARAMETER, "Index is closed")
+        return self._handle
+    
+    def add(self, node: TupleNode) -> None:
+        """Add a node, replacing any node at the same coordinate"""
+        caps = [cap.encode('utf-8') for cap in node.capabilities]
+        c_caps = (ctypes.c_char_p * max(len(caps), 1))(*caps)
+        addresses = [address.encode('utf-8') for address in node.ip_addresses]
+        c_addresses = (ctypes.c_char_p * max(len(addresses), 1))(*addresses)
+        c_node = _CNode(
+            coordinate=node.coordinate.encode('utf-8'),
+            ip_address=node.ip_address.encode('utf-8') if node.ip_address else None,
+            capabilities=c_caps,
+            capability_count=len(caps),
+            ttl=node.ttl,
+            last_seen=node.last_seen,
+            ip_addresses=c_addresses,
+            address_count=len(addresses))
+        self._dns._check(self._dns._lib.tupledns_index_add(self._live(), ctypes.byref(c_node)))
+    
+    def remove(self, coordinate: str) -> bool:
+        """Remove a coordinate; returns False if it was not indexed"""
+        return self._dns._lib.tupledns_index_remove(self._live(), coordinate.encode('utf-8')) == TupleDNSError.OK
+    
+    def find(self, pattern: str, required_capabilities: List[str] = None) -> TupleResult:
+        """Find indexed nodes matching pattern and having all required capabilities"""
+        caps = self._dns._string_array(required_capabilities)
+        return self._dns._convert_result(
+            self._dns._lib.tupledns_index_find_with_caps(self._live(), pattern.encode('utf-8'), caps))
+    
+    def find_nearby(self, coordinate: str, radius: Optional[float] = None, k: Optional[int] = None,
+                    required_capabilities: List[str] = None) -> TupleResult:
+        """Nodes nearest to coordinate over its numeric labels, nearest first.
+        
+        Non-numeric labels must match ("*" matches anything); radius and k
+        bound the distance and count.
+        """
+        caps = self._dns._string_array(required_capabilities)
+        result_ptr = self._dns._lib.tupledns_index_find_nearby(
+            self._live(), coordinate.encode('utf-8'), -1.0 if radius is None else float(radius), k or 0, caps)
+        if not result_ptr:
+            self._dns._check(self._dns._lib.tupledns_get_last_error() or TupleDNSError.INVALID_PARAMETER)
+        return self._dns._convert_result(result_ptr)
+    
+    def find_similar(self, coordinate: str, max_distance: int = 1, weights: List[int] = None,
+                     required_capabilities: List[str] = None) -> TupleResult:
+        """Nodes of coordinate's space within max_distance of it, nearest first.
+        
+        Distance is the summed edit distance of the labels or, with weights
+        (one per label), the summed weights of differing labels. "*" labels
+        are ignored.
+        """
+        if weights is not None and len(weights) != len(coordinate.split('.')):
+            raise TupleDNSException(TupleDNSError.INVALID_PARAMETER, "One weight per label is required")
+        weight_array = (ctypes.c_int * len(weights))(*weights) if weights is not None else None
+        caps = self._dns._string_array(required_capabilities)
+        result_ptr = self._dns._lib.tupledns_index_find_similar(
+            self._live(), coordinate.encode('utf-8'), max_distance, weight_array, caps)
+        if not result_ptr:
+            self._dns._check(self._dns._lib.tupledns_get_last_error() or TupleDNSError.INVALID_PARAMETER)
+        return self._dns._convert_result(result_ptr)
+    
+    def label_id(self, label: str) -> Optional[int]:
+        """Interned ID of a label (case-insensitive), or None if unseen"""
+        label_id = self._dns._lib.tupledns_index_label_id(self._live(), label.encode('utf-8'))
+        return None if label_id == self.LABEL_NONE else label_id
+    
+    def label(self, label_id: int) -> Optional[str]:
+        """Label string for an interned ID"""
+        label = self._dns._lib.tupledns_index_label(self._live(), label_id)
+        return label.decode('utf-8') if label is not None else None
+    
+    def close(self):
+        if self._handle:
+            self._dns._lib.tupledns_index_destroy(self._handle)
+            self._handle = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
 # Convenience functions
-def register(coordinate: str, capabilities: List[str] = None, ttl: int = 300) -> None:
+def register(coordinate: str, capabilities: List[str] = None, ttl: int = 300,
+             aliases: List[str] = None) -> None:
     """Register a node (convenience function)"""
     with TupleDNS() as dns:
-        dns.register(coordinate, capabilities, ttl)
+        dns.register(coordinate, capabilities, ttl, aliases=aliases)
 
-def find(pattern: str) -> TupleResult:
+def find(pattern: str, limit: Optional[int] = None) -> TupleResult:
     """Find nodes (convenience function)"""
     with TupleDNS() as dns:
-        return dns.find(pattern)
-
-def find_nearby(coordinate: str, capabilities: List[str] = None, radius: str = "1") -> TupleResult:
-    """Find nearby nodes (convenience function for spatial coordinates)"""
-    # This would implement spatial range queries
-    # For now, use basic pattern matching
-    parts = coordinate.split('.')
-    if len(parts) >= 2:
-        # Create a wildcard pattern for nearby search
-        pattern = '.'.join(parts[:-1]) + '.*'
-        return find(pattern)
-    else:
-        return find(coordinate)
+        return dns.find(pattern, limit=limit)
+
+def find_nearby(coordinate: str, capabilities: List[str] = None, radius: Optional[float] = None,
+                k: Optional[int] = None) -> TupleResult:
+    """Find the nodes nearest to a coordinate over its numeric dimensions (convenience function)"""
+    with TupleDNS() as dns:
+        return dns.find_nearby(coordinate, capabilities, radius, k)
+
+def find_similar(coordinate: str, max_distance: int = 1, weights: List[int] = None,
+                 capabilities: List[str] = None) -> TupleResult:
+    """Find the nodes whose labels nearly match a coordinate's (convenience function)"""
+    with TupleDNS() as dns:
+        return dns.find_similar(coordinate, max_distance, weights, capabilities)
 
 # Example usage and testing
 if __name__ == "__main__":
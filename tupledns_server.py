@@ -0,0 +1,1659 @@
+#!/usr/bin/env python3
+"""
+TupleDNS Authoritative Server
+
+Asyncio UDP/TCP authoritative server for the .tuple zone. Answers
+A/AAAA/TXT/CNAME queries from an in-memory coordinate index, accepts
+RFC 2136 dynamic updates and serves AXFR/IXFR zone transfers. Runs both
+as a production registry and as the local stand-in the C and Python
+clients test against.
+"""
+
+import argparse
+import asyncio
+import gc
+import ipaddress
+import socket
+import struct
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_PORT = 5353
+DEFAULT_TTL = 300
+DEFAULT_UDP_PAYLOAD = 1232
+CLASSIC_UDP_PAYLOAD = 512
+MAX_CNAME_CHAIN = 8
+TRANSFER_CHUNK_SIZE = 16384
+
+# Server-side pattern evaluation: TXT <options>._q.<escaped-pattern>.tuple,
+# where "_" stands in for a "*" label and each option is a run of value
+# labels closed by an "_<key>" label.
+QUERY_LABEL = "_q"
+WILDCARD_LABEL = "_"
+QUERY_FEATURES = "tupledns-q=1"
+CAPABILITY_QUERY_FEATURES = "tupledns-q-caps=1"
+VIEW_QUERY_FEATURES = "tupledns-q-views=1"
+MAX_PATTERN_RESPONSE = 60000
+DEFAULT_MAX_VIEWS = 1024
+
+CLASS_IN = 1
+CLASS_NONE = 254
+CLASS_ANY = 255
+
+FLAG_QR = 0x8000
+FLAG_AA = 0x0400
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+
+
+class RRType(IntEnum):
+    A = 1
+    NS = 2
+    CNAME = 5
+    SOA = 6
+    TXT = 16
+    AAAA = 28
+    OPT = 41
+    IXFR = 251
+    AXFR = 252
+    ANY = 255
+
+
+class Opcode(IntEnum):
+    QUERY = 0
+    NOTIFY = 4
+    UPDATE = 5
+
+
+class Rcode(IntEnum):
+    NOERROR = 0
+    FORMERR = 1
+    SERVFAIL = 2
+    NXDOMAIN = 3
+    NOTIMP = 4
+    REFUSED = 5
+    YXDOMAIN = 6
+    YXRRSET = 7
+    NXRRSET = 8
+    NOTAUTH = 9
+    NOTZONE = 10
+
+
+class DNSFormatError(Exception):
+    """Raised when a DNS message cannot be decoded or encoded"""
+
+
+# ========================================================================
+# WIRE FORMAT
+# ========================================================================
+
+@dataclass
+class Question:
+    name: str
+    rtype: int
+    rclass: int = CLASS_IN
+
+
+@dataclass
+class ResourceRecord:
+    name: str
+    rtype: int
+    rclass: int
+    ttl: int
+    rdata: bytes
+
+
+@dataclass
+class Message:
+    id: int = 0
+    flags: int = 0
+    questions: List[Question] = field(default_factory=list)
+    answers: List[ResourceRecord] = field(default_factory=list)
+    authority: List[ResourceRecord] = field(default_factory=list)
+    additional: List[ResourceRecord] = field(default_factory=list)
+
+    @property
+    def opcode(self) -> int:
+        return (self.flags >> 11) & 0xF
+
+    @property
+    def rcode(self) -> int:
+        return self.flags & 0xF
+
+    @rcode.setter
+    def rcode(self, value: int) -> None:
+        self.flags = (self.flags & ~0xF) | (int(value) & 0xF)
+
+    def edns_payload(self) -> Optional[int]:
+        """Return the advertised EDNS0 UDP payload size, if any"""
+        for rr in self.additional:
+            if rr.rtype == RRType.OPT:
+                return max(rr.rclass, CLASSIC_UDP_PAYLOAD)
+        return None
+
+    def to_wire(self, max_size: Optional[int] = None) -> bytes:
+        """Encode the message, truncating (TC) if it exceeds max_size"""
+        wire = self._encode(self.flags, self.answers, self.authority, self.additional)
+        if max_size is not None and len(wire) > max_size:
+            opt = [rr for rr in self.additional if rr.rtype == RRType.OPT]
+            wire = self._encode(self.flags | FLAG_TC, [], [], opt)
+        return wire
+
+    def _encode(self, flags, answers, authority, additional) -> bytes:
+        buf = bytearray(struct.pack('!HHHHHH', self.id, flags, len(self.questions),
+                                    len(answers), len(authority), len(additional)))
+        offsets: Dict[str, int] = {}
+        for q in self.questions:
+            encode_name(q.name, buf, offsets)
+            buf += struct.pack('!HH', q.rtype, q.rclass)
+        for section in (answers, authority, additional):
+            for rr in section:
+                encode_rr(rr, buf, offsets)
+        return bytes(buf)
+
+    @classmethod
+    def from_wire(cls, data: bytes) -> 'Message':
+        if len(data) < 12:
+            raise DNSFormatError("Message shorter than header")
+        msg_id, flags, qd, an, ns, ar = struct.unpack_from('!HHHHHH', data, 0)
+        msg = cls(id=msg_id, flags=flags)
+        offset = 12
+        for _ in range(qd):
+            name, offset = decode_name(data, offset)
+            if offset + 4 > len(data):
+                raise DNSFormatError("Truncated question")
+            rtype, rclass = struct.unpack_from('!HH', data, offset)
+            offset += 4
+            msg.questions.append(Question(name, rtype, rclass))
+        for section, count in ((msg.answers, an), (msg.authority, ns), (msg.additional, ar)):
+            for _ in range(count):
+                rr, offset = decode_rr(data, offset)
+                section.append(rr)
+        return msg
+
+
+def encode_name(name: str, buf: bytearray, offsets: Optional[Dict[str, int]] = None) -> None:
+    """Append a domain name to buf, compressing against previously written names"""
+    labels = name.split('.') if name else []
+    for i in range(len(labels)):
+        if offsets is not None:
+            suffix = '.'.join(labels[i:]).lower()
+            pointer = offsets.get(suffix)
+            if pointer is not None:
+                buf += struct.pack('!H', 0xC000 | pointer)
+                return
+            if len(buf) < 0x4000:
+                offsets[suffix] = len(buf)
+        raw = labels[i].encode('latin-1')
+        if not raw or len(raw) > 63:
+            raise DNSFormatError(f"Invalid label in {name!r}")
+        buf.append(len(raw))
+        buf += raw
+    buf.append(0)
+
+
+def decode_name(data: bytes, offset: int) -> Tuple[str, int]:
+    """Decode a possibly compressed name, returning it and the next offset"""
+    labels = []
+    end = None
+    hops = 0
+    while True:
+        if offset >= len(data):
+            raise DNSFormatError("Name runs past end of message")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise DNSFormatError("Truncated compression pointer")
+            if end is None:
+                end = offset + 2
+            hops += 1
+            if hops > 64:
+                raise DNSFormatError("Compression loop")
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        if length & 0xC0:
+            raise DNSFormatError("Unsupported label type")
+        offset += 1
+        if length == 0:
+            break
+        if offset + length > len(data):
+            raise DNSFormatError("Label runs past end of message")
+        labels.append(data[offset:offset + length].decode('latin-1'))
+        offset += length
+    return '.'.join(labels), (end if end is not None else offset)
+
+
+def name_to_wire(name: str) -> bytes:
+    buf = bytearray()
+    encode_name(name, buf)
+    return bytes(buf)
+
+
+def encode_rr(rr: ResourceRecord, buf: bytearray, offsets: Optional[Dict[str, int]] = None) -> None:
+    encode_name(rr.name, buf, offsets)
+    buf += struct.pack('!HHIH', rr.rtype, rr.rclass, rr.ttl & 0xFFFFFFFF, len(rr.rdata))
+    buf += rr.rdata
+
+
+def decode_rr(data: bytes, offset: int) -> Tuple[ResourceRecord, int]:
+    name, offset = decode_name(data, offset)
+    if offset + 10 > len(data):
+        raise DNSFormatError("Truncated resource record")
+    rtype, rclass, ttl, rdlength = struct.unpack_from('!HHIH', data, offset)
+    offset += 10
+    if offset + rdlength > len(data):
+        raise DNSFormatError("Truncated rdata")
+    rdata = data[offset:offset + rdlength]
+    # Expand compressed names inside rdata so records are position independent
+    if rdlength and rtype in (RRType.CNAME, RRType.NS):
+        target, _ = decode_name(data, offset)
+        rdata = name_to_wire(target)
+    elif rdlength and rtype == RRType.SOA:
+        mname, pos = decode_name(data, offset)
+        rname, pos = decode_name(data, pos)
+        rdata = name_to_wire(mname) + name_to_wire(rname) + data[pos:pos + 20]
+    return ResourceRecord(name, rtype, rclass, ttl, bytes(rdata)), offset + rdlength
+
+
+def address_rdata(address: str) -> Tuple[int, bytes]:
+    """Return (rtype, rdata) for an IPv4 or IPv6 address string"""
+    ip = ipaddress.ip_address(address)
+    return (RRType.A if ip.version == 4 else RRType.AAAA), ip.packed
+
+
+def txt_rdata(*strings: str) -> bytes:
+    buf = bytearray()
+    for s in strings:
+        raw = s.encode('utf-8')
+        while True:
+            chunk, raw = raw[:255], raw[255:]
+            buf.append(len(chunk))
+            buf += chunk
+            if not raw:
+                break
+    return bytes(buf)
+
+
+def txt_strings(rdata: bytes) -> List[str]:
+    strings = []
+    offset = 0
+    while offset < len(rdata):
+        length = rdata[offset]
+        strings.append(rdata[offset + 1:offset + 1 + length].decode('utf-8', 'replace'))
+        offset += 1 + length
+    return strings
+
+
+def rdata_valid(rtype: int, rdata: bytes) -> bool:
+    """Whether rdata is well formed for the record types the index interprets"""
+    if rtype == RRType.A:
+        return len(rdata) == 4
+    if rtype == RRType.AAAA:
+        return len(rdata) == 16
+    if rtype in (RRType.CNAME, RRType.NS):
+        try:
+            return decode_name(rdata, 0)[1] == len(rdata)
+        except DNSFormatError:
+            return False
+    return True
+
+
+def rdata_to_text(rtype: int, rdata: bytes) -> str:
+    if rtype in (RRType.A, RRType.AAAA):
+        return str(ipaddress.ip_address(rdata))
+    if rtype in (RRType.CNAME, RRType.NS):
+        return decode_name(rdata, 0)[0]
+    if rtype == RRType.TXT:
+        return ''.join(txt_strings(rdata))
+    return rdata.hex()
+
+
+def encode_pattern_query(pattern: str, **options: List[str]) -> str:
+    """Build the query name asking the server to evaluate pattern"""
+    labels = []
+    for key, values in options.items():
+        labels.extend(str(value).lower() for value in values)
+        labels.append("_" + key)
+    labels.append(QUERY_LABEL)
+    labels.extend(WILDCARD_LABEL if label == "*" else label.lower() for label in pattern.split('.'))
+    return '.'.join(labels)
+
+
+def parse_pattern_query(name: str) -> Optional[Tuple[str, Dict[str, List[str]]]]:
+    """Split a pattern query name into (pattern, options); None if it is not one"""
+    labels = name.lower().split('.')
+    if QUERY_LABEL not in labels:
+        return None
+    position = labels.index(QUERY_LABEL)
+    options: Dict[str, List[str]] = {}
+    values: List[str] = []
+    for label in labels[:position]:
+        if label.startswith('_'):
+            options[label[1:]] = values
+            values = []
+        else:
+            values.append(label)
+    if values:
+        raise DNSFormatError("Option values without a key label")
+    pattern = '.'.join('*' if label == WILDCARD_LABEL else label for label in labels[position + 1:])
+    return pattern, options
+
+
+def format_match(node: 'Node') -> str:
+    """Render one pattern match as the TXT payload clients parse"""
+    parts = [f"coord={node.coordinate}"]
+    if node.addresses:
+        parts.append("addr=" + ",".join(node.addresses))
+    if node.capabilities:
+        parts.append("caps=" + ",".join(node.capabilities))
+    parts.append(f"ttl={node.ttl}")
+    if node.target is not None:
+        # Lets clients collapse an alias and its canonical node into one
+        parts.append(f"cname={node.target}")
+    return " ".join(parts)
+
+
+def parse_capabilities(text: str) -> List[str]:
+    """Extract the caps= list from a TXT string, mirroring tupledns_parse_capabilities"""
+    start = text.find('caps=')
+    if start < 0:
+        return []
+    value = text[start + 5:].split(' ', 1)[0]
+    return [cap for cap in value.split(',') if cap]
+
+
+# ========================================================================
+# CAPABILITY BITMAPS
+# ========================================================================
+
+ARRAY_CONTAINER_MAX = 4096
+BITMAP_CONTAINER_BYTES = 8192
+
+
+def _bitmap_values(bits: int) -> Iterator[int]:
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class RoaringBitmap:
+    """Compressed set of 32-bit IDs split into 64K chunks.
+
+    Each chunk is a sorted array('H') while it holds at most 4096 values and
+    an 8 KB bitmap beyond that, so sparse and dense ID ranges both stay small
+    and intersect chunk by chunk.
+    """
+
+    __slots__ = ('_containers', '_counts')
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._containers: Dict[int, object] = {}
+        self._counts: Dict[int, int] = {}    # Cardinality of bitmap containers
+        for value in values:
+            self.add(value)
+
+    def add(self, value: int) -> None:
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            self._containers[high] = array('H', (low,))
+        elif type(container) is bytearray:
+            bit = 1 << (low & 7)
+            if not container[low >> 3] & bit:
+                container[low >> 3] |= bit
+                self._counts[high] += 1
+        elif low > container[-1] and len(container) < ARRAY_CONTAINER_MAX:
+            container.append(low)    # IDs mostly arrive in ascending order
+        else:
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                return
+            if len(container) < ARRAY_CONTAINER_MAX:
+                container.insert(i, low)
+                return
+            bitmap = bytearray(BITMAP_CONTAINER_BYTES)
+            for v in container:
+                bitmap[v >> 3] |= 1 << (v & 7)
+            bitmap[low >> 3] |= 1 << (low & 7)
+            self._containers[high] = bitmap
+            self._counts[high] = len(container) + 1
+
+    def discard(self, value: int) -> None:
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            return
+        if type(container) is bytearray:
+            bit = 1 << (low & 7)
+            if not container[low >> 3] & bit:
+                return
+            container[low >> 3] &= ~bit
+            self._counts[high] -= 1
+            if self._counts[high] <= ARRAY_CONTAINER_MAX:
+                del self._counts[high]
+                self._containers[high] = array('H', _bitmap_values(int.from_bytes(container, 'little')))
+            return
+        i = bisect_left(container, low)
+        if i < len(container) and container[i] == low:
+            del container[i]
+            if not container:
+                del self._containers[high]
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if type(container) is bytearray:
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __len__(self) -> int:
+        return sum(self._counts[high] if type(c) is bytearray else len(c)
+                   for high, c in self._containers.items())
+
+    def __bool__(self) -> bool:
+        return bool(self._containers)
+
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self._containers):
+            base = high << 16
+            container = self._containers[high]
+            if type(container) is bytearray:
+                container = _bitmap_values(int.from_bytes(container, 'little'))
+            for low in container:
+                yield base | low
+
+    def __and__(self, other: 'RoaringBitmap') -> 'RoaringBitmap':
+        result = RoaringBitmap()
+        for high, a in self._containers.items():
+            b = other._containers.get(high)
+            if b is None:
+                continue
+            a_bitmap, b_bitmap = type(a) is bytearray, type(b) is bytearray
+            if a_bitmap and b_bitmap:
+                bits = int.from_bytes(a, 'little') & int.from_bytes(b, 'little')
+                count = bin(bits).count('1')
+                if count > ARRAY_CONTAINER_MAX:
+                    result._containers[high] = bytearray(bits.to_bytes(BITMAP_CONTAINER_BYTES, 'little'))
+                    result._counts[high] = count
+                    continue
+                values = array('H', _bitmap_values(bits))
+            elif a_bitmap or b_bitmap:
+                bitmap, values = (a, b) if a_bitmap else (b, a)
+                values = array('H', (v for v in values if bitmap[v >> 3] & (1 << (v & 7))))
+            else:
+                values = array('H', sorted(set(a).intersection(b)))
+            if values:
+                result._containers[high] = values
+        return result
+
+    @staticmethod
+    def intersection(bitmaps: List['RoaringBitmap']) -> 'RoaringBitmap':
+        """Intersect bitmaps smallest first, stopping as soon as the result is empty"""
+        ordered = sorted(bitmaps, key=len)
+        result = ordered[0]
+        for bitmap in ordered[1:]:
+            if not result:
+                break
+            result = result & bitmap
+        return result
+
+
+# ========================================================================
+# COORDINATE INDEX
+# ========================================================================
+
+# Plain-int keys for the hot rrset lookups in CoordinateIndex._refresh_node
+_ADDRESS_FAMILIES = ((int(RRType.A), socket.AF_INET), (int(RRType.AAAA), socket.AF_INET6))
+_CNAME = int(RRType.CNAME)
+_TXT = int(RRType.TXT)
+_NO_CAPABILITIES: frozenset = frozenset()
+
+
+class RRset:
+    __slots__ = ('ttl', 'rdatas')
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.rdatas: List[bytes] = []
+
+
+@dataclass
+class Node:
+    """Structured view of a registered coordinate"""
+    coordinate: str
+    addresses: List[str]
+    capabilities: List[str]
+    ttl: int
+    target: Optional[str] = None
+
+
+@dataclass
+class ChangeSet:
+    """Concrete records removed and added by one zone update"""
+    serial_from: int
+    serial_to: int
+    deleted: List[ResourceRecord]
+    added: List[ResourceRecord]
+
+
+def _copy_rrset(rrset: RRset) -> RRset:
+    copy = RRset(rrset.ttl)
+    copy.rdatas = list(rrset.rdatas)
+    return copy
+
+
+class ZoneTransaction:
+    """Collects the edits of one update on copies of the rrsets it touches;
+    swapped into the index on exit of CoordinateIndex.update()"""
+
+    def __init__(self, index: 'CoordinateIndex'):
+        self._index = index
+        self.deleted: List[ResourceRecord] = []
+        self.added: List[ResourceRecord] = []
+        self.touched: set = set()
+        self.staged: Dict[str, Optional[Dict[int, RRset]]] = {}
+
+    def rrsets(self, name: str) -> Optional[Dict[int, RRset]]:
+        """The rrsets of name as this transaction leaves them (None if none)"""
+        if name not in self.staged:
+            current = self._index._rrsets.get(name)
+            self.staged[name] = None if current is None else {
+                rtype: _copy_rrset(rrset) for rtype, rrset in current.items()}
+        return self.staged[name]
+
+    def add(self, name: str, rtype: int, ttl: int, rdata: bytes) -> None:
+        index = self._index
+        name = name.lower()
+        if name == index.origin and rtype in (RRType.SOA, RRType.NS):
+            return
+        rrsets = self.rrsets(name)
+        if rrsets:
+            # CNAME and other data cannot coexist at one name (RFC 2136 3.4.2.2)
+            if rtype == RRType.CNAME and any(t != RRType.CNAME for t in rrsets):
+                return
+            if rtype != RRType.CNAME and RRType.CNAME in rrsets:
+                return
+            if rtype == RRType.CNAME and rdata not in rrsets[RRType.CNAME].rdatas:
+                # A name has at most one CNAME; a new target replaces the old one
+                self.delete_rrset(name, RRType.CNAME)
+                rrsets = self.staged[name]
+        if rrsets is None:
+            rrsets = self.staged[name] = {}
+        rrset = rrsets.get(rtype)
+        if rrset is None:
+            rrset = rrsets[rtype] = RRset(ttl)
+        rrset.ttl = ttl
+        if rdata in rrset.rdatas:
+            return
+        rrset.rdatas.append(rdata)
+        self.added.append(ResourceRecord(name, rtype, CLASS_IN, ttl, rdata))
+        self.touched.add(name)
+
+    def delete_rr(self, name: str, rtype: int, rdata: bytes) -> None:
+        name = name.lower()
+        if name == self._index.origin and rtype in (RRType.SOA, RRType.NS):
+            return
+        rrsets = self.rrsets(name)
+        if not rrsets or rtype not in rrsets:
+            return
+        rrset = rrsets[rtype]
+        if rdata not in rrset.rdatas:
+            return
+        rrset.rdatas.remove(rdata)
+        self.deleted.append(ResourceRecord(name, rtype, CLASS_IN, rrset.ttl, rdata))
+        self.touched.add(name)
+        if not rrset.rdatas:
+            del rrsets[rtype]
+            if not rrsets:
+                self.staged[name] = None
+
+    def delete_rrset(self, name: str, rtype: int) -> None:
+        rrsets = self.rrsets(name.lower())
+        if rrsets and rtype in rrsets:
+            for rdata in list(rrsets[rtype].rdatas):
+                self.delete_rr(name, rtype, rdata)
+
+    def delete_name(self, name: str) -> None:
+        rrsets = self.rrsets(name.lower())
+        if rrsets:
+            for rtype in list(rrsets):
+                self.delete_rrset(name, rtype)
+
+
+class CoordinateIndex:
+    """In-memory record store for the .tuple zone with a per-coordinate node view"""
+
+    def __init__(self, origin: str = "tuple", journal_size: int = 4096):
+        self.origin = origin.lower().rstrip('.')
+        self.serial = 1
+        self._rrsets: Dict[str, Dict[int, RRset]] = {}
+        self._descendants: Dict[str, int] = {}
+        self._nodes: Dict[str, Node] = {}
+        self._by_length: Dict[int, set] = {}
+        self._by_label: Dict[Tuple[int, str], set] = {}
+        # Dense coordinate IDs for the capability bitmaps; freed IDs are reused
+        self._ids: Dict[str, int] = {}
+        self._names: List[Optional[str]] = []
+        self._free_ids: List[int] = []
+        self._by_capability: Dict[str, RoaringBitmap] = {}
+        self._indexed_capabilities: Dict[str, frozenset] = {}
+        self._aliases: Dict[str, set] = {}     # CNAME target -> alias names
+        self._journal: deque = deque(maxlen=journal_size)
+        self._listeners: List[Callable[[ChangeSet], None]] = []
+        apex = self._rrsets[self.origin] = {}
+        apex[RRType.NS] = RRset(DEFAULT_TTL)
+        apex[RRType.NS].rdatas.append(name_to_wire(f"ns.{self.origin}"))
+        apex[RRType.SOA] = RRset(DEFAULT_TTL)
+        self._refresh_soa()
+
+    # -- zone structure --------------------------------------------------
+
+    def in_zone(self, name: str) -> bool:
+        name = name.lower()
+        return name == self.origin or name.endswith('.' + self.origin)
+
+    def _add_ancestors(self, name: str) -> None:
+        descendants = self._descendants
+        dot = name.find('.')
+        while dot >= 0 and name != self.origin:
+            name = name[dot + 1:]
+            descendants[name] = descendants.get(name, 0) + 1
+            dot = name.find('.')
+
+    def _remove_ancestors(self, name: str) -> None:
+        while '.' in name and name != self.origin:
+            name = name.split('.', 1)[1]
+            count = self._descendants.get(name, 0) - 1
+            if count > 0:
+                self._descendants[name] = count
+            else:
+                self._descendants.pop(name, None)
+
+    def _refresh_soa(self) -> None:
+        soa = self._rrsets[self.origin][RRType.SOA]
+        soa.rdatas = [name_to_wire(f"ns.{self.origin}") +
+                      name_to_wire(f"hostmaster.{self.origin}") +
+                      struct.pack('!IIIII', self.serial, 3600, 600, 86400, 60)]
+
+    def soa_record(self) -> ResourceRecord:
+        soa = self._rrsets[self.origin][RRType.SOA]
+        return ResourceRecord(self.origin, RRType.SOA, CLASS_IN, soa.ttl, soa.rdatas[0])
+
+    # -- updates ---------------------------------------------------------
+
+    def add_listener(self, listener: Callable[[ChangeSet], None]) -> None:
+        """Call listener with every ChangeSet committed to the index"""
+        self._listeners.append(listener)
+
+    def update(self) -> '_UpdateContext':
+        """Context manager grouping edits into one serial increment"""
+        return _UpdateContext(self)
+
+    def _commit(self, txn: ZoneTransaction) -> Optional[ChangeSet]:
+        if not txn.deleted and not txn.added:
+            return None
+        # Build every node view first: a record that cannot be interpreted
+        # raises here, before the zone has changed
+        nodes = {name: self._build_node(name, txn.staged[name]) for name in txn.touched}
+        for name in txn.touched:
+            rrsets = txn.staged[name]
+            if rrsets:
+                if name not in self._rrsets:
+                    self._add_ancestors(name)
+                self._rrsets[name] = rrsets
+            elif self._rrsets.pop(name, None) is not None:
+                self._remove_ancestors(name)
+        for name, node in nodes.items():
+            self._install_node(name, node)
+        old = self.serial
+        self.serial = (self.serial + 1) & 0xFFFFFFFF or 1
+        self._refresh_soa()
+        change = ChangeSet(old, self.serial, txn.deleted, txn.added)
+        self._journal.append(change)
+        for listener in self._listeners:
+            listener(change)
+        return change
+
+    def register(self, coordinate: str, addresses: List[str],
+                 capabilities: Optional[List[str]] = None, ttl: int = DEFAULT_TTL) -> None:
+        """Replace the address and capability records of a coordinate"""
+        with self.update() as txn:
+            txn.delete_rrset(coordinate, RRType.CNAME)
+            txn.delete_rrset(coordinate, RRType.A)
+            txn.delete_rrset(coordinate, RRType.AAAA)
+            txn.delete_rrset(coordinate, RRType.TXT)
+            for address in addresses:
+                rtype, rdata = address_rdata(address)
+                txn.add(coordinate, rtype, ttl, rdata)
+            if capabilities:
+                txn.add(coordinate, RRType.TXT, ttl, txt_rdata("caps=" + ",".join(capabilities)))
+
+    def alias(self, alias: str, target: str, ttl: int = DEFAULT_TTL) -> None:
+        """Publish alias as a CNAME for target"""
+        with self.update() as txn:
+            txn.delete_name(alias)
+            txn.add(alias, RRType.CNAME, ttl, name_to_wire(target.lower()))
+
+    def unregister(self, coordinate: str) -> bool:
+        with self.update() as txn:
+            txn.delete_name(coordinate)
+        return bool(txn.deleted)
+
+    def load(self, entries: Iterable[Tuple[str, Dict[int, RRset]]], serial: int) -> None:
+        """Install stored rrsets directly, bypassing transactions, journal and listeners"""
+        for name, rrsets in entries:
+            if name == self.origin or not self.in_zone(name):
+                continue
+            if name not in self._rrsets:
+                self._add_ancestors(name)
+            self._rrsets[name] = rrsets
+            self._refresh_node(name)
+        self.serial = serial
+        self._refresh_soa()
+
+    # -- lookups ---------------------------------------------------------
+
+    def rrsets(self, name: str) -> Optional[Dict[int, RRset]]:
+        return self._rrsets.get(name.lower())
+
+    def name_exists(self, name: str) -> bool:
+        name = name.lower()
+        return name in self._rrsets or name in self._descendants
+
+    def node(self, coordinate: str) -> Optional[Node]:
+        return self._nodes.get(coordinate.lower())
+
+    def nodes(self) -> Iterator[Node]:
+        return iter(self._nodes.values())
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def match(self, pattern: str) -> List[Node]:
+        """Return the nodes matching a wildcard pattern, sorted by coordinate"""
+        matches = self._pattern_names(pattern.lower().split('.'))
+        return [self.resolve(self._nodes[name]) for name in sorted(matches)]
+
+    def _pattern_names(self, labels: List[str]) -> set:
+        candidates = self._by_length.get(len(labels))
+        if not candidates:
+            return set()
+        # Intersect the per-position postings of every literal label, smallest first
+        postings = []
+        for position, label in enumerate(labels):
+            if label != '*':
+                names = self._by_label.get((position, label))
+                if not names:
+                    return set()
+                postings.append(names)
+        if not postings:
+            return candidates
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:]) if len(postings) > 1 else postings[0]
+
+    def with_capabilities(self, capabilities: Iterable[str], pattern: Optional[str] = None) -> List[Node]:
+        """Return nodes offering every capability (case-insensitive), optionally
+        restricted to a wildcard pattern, sorted by coordinate"""
+        bitmaps = []
+        for capability in capabilities:
+            bitmap = self._by_capability.get(capability.lower())
+            if not bitmap:
+                return []
+            bitmaps.append(bitmap)
+        if not bitmaps:
+            return self.match(pattern) if pattern else [self.resolve(n) for _, n in sorted(self._nodes.items())]
+
+        ids = RoaringBitmap.intersection(bitmaps)
+        if pattern is None:
+            names = [self._names[i] for i in ids]
+        else:
+            labels = pattern.lower().split('.')
+            candidates = self._pattern_names(labels)
+            if len(candidates) <= len(ids):
+                names = [name for name in candidates if self._ids[name] in ids]
+            else:
+                names = [name for name in (self._names[i] for i in ids) if name in candidates]
+        return [self.resolve(self._nodes[name]) for name in sorted(names)]
+
+    def aliases(self, name: str) -> frozenset:
+        """Names whose CNAME points directly at name"""
+        return frozenset(self._aliases.get(name.lower(), ()))
+
+    def capability_count(self, capability: str) -> int:
+        """Number of coordinates offering a capability"""
+        bitmap = self._by_capability.get(capability.lower())
+        return len(bitmap) if bitmap else 0
+
+    def resolve(self, node: Node) -> Node:
+        """Fill in an alias node's addresses and capabilities from the end of
+        its CNAME chain, which becomes its target"""
+        current = node
+        for _ in range(MAX_CNAME_CHAIN):
+            if current.target is None:
+                break
+            target = self._nodes.get(current.target)
+            if target is None:
+                break
+            current = target
+        if current is node:
+            return node
+        return Node(node.coordinate, current.addresses, current.capabilities, node.ttl, current.coordinate)
+
+    def _refresh_node(self, name: str) -> None:
+        self._install_node(name, self._build_node(name, self._rrsets.get(name)))
+
+    def _build_node(self, name: str, rrsets: Optional[Dict[int, RRset]]) -> Optional[Node]:
+        """Node view of rrsets, or None if name is not a coordinate"""
+        if not rrsets or name == self.origin:
+            return None
+        addresses = []
+        ttl = DEFAULT_TTL
+        for rtype, family in _ADDRESS_FAMILIES:
+            rrset = rrsets.get(rtype)
+            if rrset:
+                ttl = rrset.ttl
+                addresses.extend(socket.inet_ntop(family, rd) for rd in rrset.rdatas)
+        target = None
+        cname = rrsets.get(_CNAME)
+        if cname and cname.rdatas:
+            target = decode_name(cname.rdatas[0], 0)[0]
+            ttl = cname.ttl
+        capabilities: List[str] = []
+        txt = rrsets.get(_TXT)
+        if txt:
+            for rdata in txt.rdatas:
+                capabilities.extend(parse_capabilities(''.join(txt_strings(rdata))))
+        if not addresses and target is None and not capabilities:
+            return None
+        return Node(name, addresses, capabilities, ttl, target)
+
+    def _install_node(self, name: str, node: Optional[Node]) -> None:
+        if node is None:
+            self._drop_node(name)
+            return
+        target = node.target
+        old = self._nodes.get(name)
+        if old is None:
+            labels = name.split('.')
+            self._by_length.setdefault(len(labels), set()).add(name)
+            for position, label in enumerate(labels):
+                self._by_label.setdefault((position, label), set()).add(name)
+            if self._free_ids:
+                self._ids[name] = coordinate_id = self._free_ids.pop()
+                self._names[coordinate_id] = name
+            else:
+                self._ids[name] = len(self._names)
+                self._names.append(name)
+        elif old.target != target and old.target is not None:
+            self._discard(self._aliases, old.target, name)
+        if target is not None:
+            self._aliases.setdefault(target, set()).add(name)
+        self._nodes[name] = node
+        self._index_capabilities(name)
+
+    def _drop_node(self, name: str) -> None:
+        node = self._nodes.pop(name, None)
+        if node is None:
+            return
+        labels = name.split('.')
+        self._discard(self._by_length, len(labels), name)
+        for position, label in enumerate(labels):
+            self._discard(self._by_label, (position, label), name)
+        if node.target is not None:
+            self._discard(self._aliases, node.target, name)
+        self._index_capabilities(name)
+        coordinate_id = self._ids.pop(name)
+        self._names[coordinate_id] = None
+        self._free_ids.append(coordinate_id)
+
+    def _index_capabilities(self, name: str, depth: int = 0) -> None:
+        """Bring name's capability bitmap entries in line with its resolved
+        capabilities, then follow the change to any aliases of it"""
+        node = self._nodes.get(name)
+        if node is None:
+            new = _NO_CAPABILITIES
+        elif node.target is not None:
+            new = frozenset(c.lower() for c in self.resolve(node).capabilities)
+        else:
+            new = frozenset(map(str.lower, node.capabilities)) if node.capabilities else _NO_CAPABILITIES
+        old = self._indexed_capabilities.get(name, _NO_CAPABILITIES)
+        if new == old:
+            return
+        coordinate_id = self._ids[name]
+        by_capability = self._by_capability
+        for capability in old - new:
+            bitmap = by_capability[capability]
+            bitmap.discard(coordinate_id)
+            if not bitmap:
+                del by_capability[capability]
+        for capability in (new - old if old else new):
+            bitmap = by_capability.get(capability)
+            if bitmap is None:
+                bitmap = by_capability[capability] = RoaringBitmap()
+            bitmap.add(coordinate_id)
+        if new:
+            self._indexed_capabilities[name] = new
+        else:
+            del self._indexed_capabilities[name]
+        aliases = self._aliases.get(name)
+        if aliases and depth < MAX_CNAME_CHAIN:
+            for alias in list(aliases):
+                self._index_capabilities(alias, depth + 1)
+
+    @staticmethod
+    def _discard(postings: dict, key, name: str) -> None:
+        names = postings.get(key)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del postings[key]
+
+    def zone_rrsets(self) -> Iterator[Tuple[str, Dict[int, RRset]]]:
+        """Yield (name, rrsets) for every name below the apex"""
+        for name, rrsets in self._rrsets.items():
+            if name != self.origin:
+                yield name, rrsets
+
+    def records(self) -> Iterator[ResourceRecord]:
+        """Yield every record in the zone, apex SOA first"""
+        yield self.soa_record()
+        for name, rrsets in self._rrsets.items():
+            for rtype, rrset in rrsets.items():
+                if name == self.origin and rtype == RRType.SOA:
+                    continue
+                for rdata in rrset.rdatas:
+                    yield ResourceRecord(name, rtype, CLASS_IN, rrset.ttl, rdata)
+
+    def changes_since(self, serial: int) -> Optional[List[ChangeSet]]:
+        """Return the journal entries after serial, or None if not covered"""
+        if serial == self.serial:
+            return []
+        changes = []
+        found = False
+        for change in self._journal:
+            if change.serial_from == serial:
+                found = True
+            if found:
+                changes.append(change)
+        return changes if found else None
+
+
+class _UpdateContext:
+    def __init__(self, index: CoordinateIndex):
+        self._index = index
+        self._txn = ZoneTransaction(index)
+        self.change: Optional[ChangeSet] = None
+
+    def __enter__(self) -> ZoneTransaction:
+        return self._txn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.change = self._index._commit(self._txn)
+
+
+# ========================================================================
+# MATERIALIZED VIEWS
+# ========================================================================
+
+class MaterializedView:
+    """Standing result of one pattern query, kept current by ViewRegistry.
+    version is the zone serial of the last change to the result."""
+
+    def __init__(self, pattern: Optional[str], capabilities: frozenset):
+        self.pattern = pattern
+        self.capabilities = capabilities
+        self.version = 0
+        self._labels = pattern.split('.') if pattern is not None else None
+        self._names: List[str] = []
+        self._rows: Dict[str, Tuple[int, bytes]] = {}
+        self._answers: Optional[List[Tuple[int, bytes]]] = None
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def covers(self, name: str) -> bool:
+        """True if name matches the view's pattern, ignoring capabilities"""
+        if self._labels is None:
+            return True
+        labels = name.split('.')
+        return len(labels) == len(self._labels) and all(
+            want == '*' or want == label for want, label in zip(self._labels, labels))
+
+    def rows(self) -> List[Tuple[int, bytes]]:
+        """(ttl, TXT rdata) of every match, sorted by coordinate"""
+        if self._answers is None:
+            self._answers = [self._rows[name] for name in self._names]
+        return self._answers
+
+    def _put(self, name: str, row: Tuple[int, bytes]) -> bool:
+        old = self._rows.get(name)
+        if old == row:
+            return False
+        if old is None:
+            self._names.insert(bisect_left(self._names, name), name)
+        self._rows[name] = row
+        self._answers = None
+        return True
+
+    def _remove(self, name: str) -> bool:
+        if self._rows.pop(name, None) is None:
+            return False
+        del self._names[bisect_left(self._names, name)]
+        self._answers = None
+        return True
+
+
+class ViewRegistry:
+    """Materialized views of standing pattern queries. Every committed change
+    re-checks only the names it touched (and their aliases) against each
+    view, so reads cost O(result) with no matching work."""
+
+    def __init__(self, index: CoordinateIndex, limit: int = DEFAULT_MAX_VIEWS):
+        self.index = index
+        self.limit = limit
+        self._views: 'OrderedDict[Tuple[Optional[str], frozenset], MaterializedView]' = OrderedDict()
+        self._serial = index.serial
+        index.add_listener(self._apply)
+
+    def __len__(self) -> int:
+        return len(self._views)
+
+    def _key(self, pattern: str, capabilities: Optional[Iterable[str]]) -> Tuple[Optional[str], frozenset]:
+        capabilities = frozenset(c.lower() for c in capabilities or ())
+        pattern = pattern.lower()
+        # A bare "tuple" pattern with capabilities asks across every space
+        return (None if capabilities and pattern == self.index.origin else pattern), capabilities
+
+    def get(self, pattern: str, capabilities: Optional[Iterable[str]] = None) -> Optional[MaterializedView]:
+        """The view of a pattern query, or None if nobody registered it"""
+        self._sync()
+        key = self._key(pattern, capabilities)
+        view = self._views.get(key)
+        if view is not None:
+            self._views.move_to_end(key)
+        return view
+
+    def open(self, pattern: str, capabilities: Optional[Iterable[str]] = None) -> Optional[MaterializedView]:
+        """Register a standing query (or return its view); the least recently
+        read view is dropped beyond limit. None when views are disabled."""
+        view = self.get(pattern, capabilities)
+        if view is not None or self.limit <= 0:
+            return view
+        key = self._key(pattern, capabilities)
+        while len(self._views) >= self.limit:
+            self._views.popitem(last=False)
+        view = self._views[key] = MaterializedView(*key)
+        self._populate(view)
+        return view
+
+    def close(self, pattern: str, capabilities: Optional[Iterable[str]] = None) -> bool:
+        return self._views.pop(self._key(pattern, capabilities), None) is not None
+
+    def _populate(self, view: MaterializedView) -> None:
+        index = self.index
+        if view.capabilities:
+            nodes = index.with_capabilities(view.capabilities, view.pattern)
+        else:
+            nodes = index.match(view.pattern)
+        for node in nodes:
+            view._put(node.coordinate, (node.ttl, txt_rdata(format_match(node))))
+        view.version = index.serial
+
+    def _sync(self) -> None:
+        # CoordinateIndex.load() installs records without notifying listeners
+        if self._serial != self.index.serial:
+            self._serial = self.index.serial
+            for key in list(self._views):
+                view = self._views[key] = MaterializedView(*key)
+                self._populate(view)
+
+    def _apply(self, change: ChangeSet) -> None:
+        self._serial = change.serial_to
+        if not self._views:
+            return
+        names = {rr.name for rr in change.deleted}
+        names.update(rr.name for rr in change.added)
+        # Aliases resolve through their targets, so they change with them
+        frontier = list(names)
+        for _ in range(MAX_CNAME_CHAIN):
+            frontier = [alias for name in frontier for alias in self.index.aliases(name) if alias not in names]
+            if not frontier:
+                break
+            names.update(frontier)
+
+        rows: Dict[str, Optional[Tuple[Tuple[int, bytes], frozenset]]] = {}
+        for view in self._views.values():
+            changed = False
+            for name in names:
+                if not view.covers(name):
+                    continue
+                if name not in rows:
+                    node = self.index.node(name)
+                    if node is None:
+                        rows[name] = None
+                    else:
+                        node = self.index.resolve(node)
+                        rows[name] = ((node.ttl, txt_rdata(format_match(node))),
+                                      frozenset(c.lower() for c in node.capabilities))
+                entry = rows[name]
+                if entry is not None and view.capabilities <= entry[1]:
+                    changed |= view._put(name, entry[0])
+                else:
+                    changed |= view._remove(name)
+            if changed:
+                view.version = change.serial_to
+
+
+# ========================================================================
+# SERVER
+# ========================================================================
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: 'TupleDNSServer'):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        for reply in self.server.handle(data, addr, tcp=False):
+            self.transport.sendto(reply, addr)
+
+
+class TupleDNSServer:
+    """Authoritative DNS server for the .tuple zone"""
+
+    def __init__(self, index: Optional[CoordinateIndex] = None, host: str = "127.0.0.1",
+                 port: int = DEFAULT_PORT, allow_update: Tuple[str, ...] = ("127.0.0.0/8", "::1/128"),
+                 udp_payload: int = DEFAULT_UDP_PAYLOAD, tcp_idle_timeout: float = 30.0,
+                 pattern_queries: bool = True, max_views: int = DEFAULT_MAX_VIEWS):
+        self.index = index if index is not None else CoordinateIndex()
+        self.views = ViewRegistry(self.index, max_views)
+        self.host = host
+        self.port = port
+        self.pattern_queries = pattern_queries
+        self.udp_payload = udp_payload
+        self.tcp_idle_timeout = tcp_idle_timeout
+        self.allow_update = [ipaddress.ip_network(net) for net in allow_update]
+        self.stats = {"queries": 0, "updates": 0, "transfers": 0, "cache_hits": 0, "errors": 0}
+        self._udp_transport = None
+        self._tcp_server = None
+        self._cache: Dict[Tuple[bytes, bool], bytes] = {}
+        self._cache_serial = self.index.serial
+        self._cache_limit = 65536
+
+    # -- lifecycle -------------------------------------------------------
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._udp_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _UDPProtocol(self), local_addr=(self.host, self.port))
+        # Bind TCP to the same port UDP ended up on (port 0 picks one)
+        self.port = self._udp_transport.get_extra_info('sockname')[1]
+        self._tcp_server = await asyncio.start_server(self._handle_tcp, self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._udp_transport:
+            self._udp_transport.close()
+            self._udp_transport = None
+        if self._tcp_server:
+            self._tcp_server.close()
+            await self._tcp_server.wait_closed()
+            self._tcp_server = None
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._tcp_server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                header = await asyncio.wait_for(reader.readexactly(2), self.tcp_idle_timeout)
+                (length,) = struct.unpack('!H', header)
+                data = await reader.readexactly(length)
+                for reply in self.handle(data, peer, tcp=True):
+                    writer.write(struct.pack('!H', len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # -- dispatch --------------------------------------------------------
+
+    def handle(self, data: bytes, addr, tcp: bool = False) -> List[bytes]:
+        """Answer one wire-format request; returns zero or more reply messages"""
+        if self._cache_serial != self.index.serial:
+            self._cache.clear()
+            self._cache_serial = self.index.serial
+        key = (data[2:], tcp)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.stats["queries"] += 1
+            self.stats["cache_hits"] += 1
+            return [data[:2] + cached]
+
+        try:
+            request = Message.from_wire(data)
+        except DNSFormatError:
+            self.stats["errors"] += 1
+            if len(data) < 12:
+                return []
+            reply = Message(id=struct.unpack_from('!H', data)[0],
+                            flags=FLAG_QR | (struct.unpack_from('!H', data, 2)[0] & 0x7800))
+            reply.rcode = Rcode.FORMERR
+            return [reply.to_wire()]
+
+        if request.flags & FLAG_QR:
+            return []
+        if request.opcode == Opcode.UPDATE:
+            self.stats["updates"] += 1
+            return [self._handle_update(request, addr).to_wire()]
+        if request.opcode != Opcode.QUERY or len(request.questions) != 1:
+            reply = self._reply(request)
+            reply.rcode = Rcode.NOTIMP if request.opcode != Opcode.QUERY else Rcode.FORMERR
+            return [reply.to_wire()]
+
+        question = request.questions[0]
+        if question.rtype in (RRType.AXFR, RRType.IXFR):
+            self.stats["transfers"] += 1
+            return self._handle_transfer(request, tcp)
+
+        self.stats["queries"] += 1
+        reply = self._answer(request)
+        wire = reply.to_wire(None if tcp else self._udp_limit(request))
+        if len(self._cache) >= self._cache_limit:
+            self._cache.clear()
+        self._cache[key] = wire[2:]
+        return [wire]
+
+    def _reply(self, request: Message) -> Message:
+        reply = Message(id=request.id,
+                        flags=FLAG_QR | FLAG_AA | (request.flags & (0x7800 | FLAG_RD)),
+                        questions=list(request.questions))
+        payload = request.edns_payload()
+        if payload is not None:
+            reply.additional.append(ResourceRecord("", RRType.OPT, self.udp_payload, 0, b""))
+        return reply
+
+    def _udp_limit(self, request: Message) -> int:
+        payload = request.edns_payload()
+        if payload is None:
+            return CLASSIC_UDP_PAYLOAD
+        return min(payload, self.udp_payload)
+
+    # -- queries ---------------------------------------------------------
+
+    def _answer(self, request: Message) -> Message:
+        reply = self._reply(request)
+        question = request.questions[0]
+        if question.rclass not in (CLASS_IN, CLASS_ANY) or not self.index.in_zone(question.name):
+            reply.flags &= ~FLAG_AA
+            reply.rcode = Rcode.REFUSED
+            return reply
+        if self.pattern_queries and question.rtype in (RRType.TXT, RRType.ANY):
+            try:
+                parsed = parse_pattern_query(question.name)
+            except DNSFormatError:
+                reply.rcode = Rcode.FORMERR
+                return reply
+            if parsed is not None:
+                self._answer_pattern(question.name, parsed[0], parsed[1], reply)
+                return reply
+        self._resolve(question.name, question.rtype, reply)
+        return reply
+
+    def _answer_pattern(self, owner: str, pattern: str, options: Dict[str, List[str]],
+                        reply: Message) -> None:
+        """Evaluate a wildcard pattern against the index in a single response"""
+        capabilities = options.get("c")
+        if pattern == self.index.origin and not capabilities:
+            features = [QUERY_FEATURES, CAPABILITY_QUERY_FEATURES]
+            if self.views.limit > 0:
+                features.append(VIEW_QUERY_FEATURES)
+            for feature in features:
+                reply.answers.append(ResourceRecord(owner, RRType.TXT, CLASS_IN, DEFAULT_TTL,
+                                                    txt_rdata(feature)))
+            return
+        if not self.index.in_zone(pattern):
+            reply.rcode = Rcode.REFUSED
+            return
+        try:
+            offset = max(0, int(options.get("o", ["0"])[0]))
+            limit = int(options["l"][0]) if "l" in options else None
+        except (ValueError, IndexError):
+            reply.rcode = Rcode.FORMERR
+            return
+        if limit is not None and limit <= 0:
+            reply.rcode = Rcode.FORMERR
+            return
+
+        # A "_v" option registers the query as a standing view; "<version>._v"
+        # returns only the version record while the view is unchanged
+        known_version = options.get("v")
+        if known_version is not None:
+            view = self.views.open(pattern, capabilities)
+        else:
+            view = self.views.get(pattern, capabilities)
+        if view is not None:
+            if known_version is not None:
+                reply.answers.append(ResourceRecord(owner, RRType.TXT, CLASS_IN, 0,
+                                                    txt_rdata(f"version={view.version}")))
+                if known_version == [str(view.version)]:
+                    return
+            rows = view.rows()
+            if not rows:
+                self._add_negative_soa(reply)
+                return
+            self._add_matches(owner, len(rows), rows.__getitem__, offset, limit, reply)
+            return
+
+        if capabilities:
+            # A bare "tuple" pattern asks across every space
+            matches = self.index.with_capabilities(capabilities,
+                                                   None if pattern == self.index.origin else pattern)
+        else:
+            matches = self.index.match(pattern)
+        if not matches:
+            self._add_negative_soa(reply)
+            return
+        self._add_matches(owner, len(matches),
+                          lambda position: (matches[position].ttl, txt_rdata(format_match(matches[position]))),
+                          offset, limit, reply)
+
+    def _add_matches(self, owner: str, count: int, row: Callable[[int], Tuple[int, bytes]],
+                     offset: int, limit: Optional[int], reply: Message) -> None:
+        """Append the (ttl, rdata) rows offset..offset+limit, closed by next=<n> if cut short"""
+        size = 0
+        end = count if limit is None else min(count, offset + limit)
+        for position in range(offset, end):
+            ttl, rdata = row(position)
+            size += len(rdata) + 12
+            if size > MAX_PATTERN_RESPONSE:
+                # Too many matches for one message; the client continues from here
+                reply.answers.append(ResourceRecord(owner, RRType.TXT, CLASS_IN, 0,
+                                                    txt_rdata(f"next={position}")))
+                return
+            reply.answers.append(ResourceRecord(owner, RRType.TXT, CLASS_IN, ttl, rdata))
+        if end < count:
+            reply.answers.append(ResourceRecord(owner, RRType.TXT, CLASS_IN, 0, txt_rdata(f"next={end}")))
+
+    def _resolve(self, name: str, rtype: int, reply: Message) -> None:
+        owner = name
+        for _ in range(MAX_CNAME_CHAIN):
+            rrsets = self.index.rrsets(owner)
+            if rrsets is None:
+                if not self.index.name_exists(owner):
+                    reply.rcode = Rcode.NXDOMAIN
+                self._add_negative_soa(reply)
+                return
+            if rtype == RRType.ANY:
+                for t, rrset in rrsets.items():
+                    self._add_rrset(reply.answers, owner, t, rrset)
+                return
+            rrset = rrsets.get(rtype)
+            if rrset is not None:
+                self._add_rrset(reply.answers, owner, rtype, rrset)
+                return
+            cname = rrsets.get(RRType.CNAME)
+            if cname is None:
+                self._add_negative_soa(reply)
+                return
+            self._add_rrset(reply.answers, owner, RRType.CNAME, cname)
+            owner = decode_name(cname.rdatas[0], 0)[0]
+            if not self.index.in_zone(owner):
+                return
+
+    @staticmethod
+    def _add_rrset(section: List[ResourceRecord], owner: str, rtype: int, rrset: RRset) -> None:
+        for rdata in rrset.rdatas:
+            section.append(ResourceRecord(owner, rtype, CLASS_IN, rrset.ttl, rdata))
+
+    def _add_negative_soa(self, reply: Message) -> None:
+        soa = self.index.soa_record()
+        minimum = struct.unpack('!I', soa.rdata[-4:])[0]
+        soa.ttl = min(soa.ttl, minimum)
+        reply.authority.append(soa)
+
+    # -- zone transfers --------------------------------------------------
+
+    def _handle_transfer(self, request: Message, tcp: bool) -> List[bytes]:
+        question = request.questions[0]
+        reply = self._reply(request)
+        if question.name.lower() != self.index.origin:
+            reply.rcode = Rcode.NOTAUTH
+            return [reply.to_wire()]
+        soa = self.index.soa_record()
+
+        if question.rtype == RRType.IXFR:
+            client_serial = None
+            for rr in request.authority:
+                if rr.rtype == RRType.SOA and len(rr.rdata) >= 20:
+                    client_serial = struct.unpack('!I', rr.rdata[-20:-16])[0]
+            changes = self.index.changes_since(client_serial) if client_serial is not None else None
+            if changes == [] or (not tcp):
+                # Up to date, or UDP: a lone SOA tells the client to retry over TCP
+                reply.answers.append(soa)
+                return [reply.to_wire()]
+            if changes is not None:
+                records = [soa]
+                for change in changes:
+                    records.append(self._soa_with_serial(soa, change.serial_from))
+                    records.extend(change.deleted)
+                    records.append(self._soa_with_serial(soa, change.serial_to))
+                    records.extend(change.added)
+                records.append(soa)
+                return self._transfer_messages(request, records)
+
+        if not tcp:
+            reply.flags |= FLAG_TC
+            return [reply.to_wire()]
+        records = list(self.index.records())
+        records.append(soa)
+        return self._transfer_messages(request, records)
+
+    @staticmethod
+    def _soa_with_serial(soa: ResourceRecord, serial: int) -> ResourceRecord:
+        rdata = soa.rdata[:-20] + struct.pack('!I', serial) + soa.rdata[-16:]
+        return ResourceRecord(soa.name, soa.rtype, soa.rclass, soa.ttl, rdata)
+
+    def _transfer_messages(self, request: Message, records: List[ResourceRecord]) -> List[bytes]:
+        messages = []
+        chunk: List[ResourceRecord] = []
+        size = 0
+        for rr in records:
+            chunk.append(rr)
+            size += len(rr.name) + len(rr.rdata) + 12
+            if size >= TRANSFER_CHUNK_SIZE:
+                messages.append(self._transfer_message(request, chunk, first=not messages))
+                chunk, size = [], 0
+        if chunk or not messages:
+            messages.append(self._transfer_message(request, chunk, first=not messages))
+        return messages
+
+    def _transfer_message(self, request: Message, records: List[ResourceRecord], first: bool) -> bytes:
+        reply = self._reply(request)
+        if not first:
+            reply.questions = []
+        reply.answers = records
+        return reply.to_wire()
+
+    # -- dynamic update (RFC 2136) ---------------------------------------
+
+    def _update_allowed(self, addr) -> bool:
+        if not addr:
+            return False
+        try:
+            ip = ipaddress.ip_address(addr[0].split('%', 1)[0])
+        except ValueError:
+            return False
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        return any(ip in net for net in self.allow_update if net.version == ip.version)
+
+    def _handle_update(self, request: Message, addr) -> Message:
+        reply = Message(id=request.id, flags=FLAG_QR | (request.flags & 0x7800),
+                        questions=list(request.questions))
+        if not self._update_allowed(addr):
+            reply.rcode = Rcode.REFUSED
+            return reply
+        if len(request.questions) != 1 or request.questions[0].rtype != RRType.SOA:
+            reply.rcode = Rcode.FORMERR
+            return reply
+        if request.questions[0].name.lower() != self.index.origin:
+            reply.rcode = Rcode.NOTAUTH
+            return reply
+
+        rcode = self._check_prerequisites(request.answers)
+        if rcode == Rcode.NOERROR:
+            rcode = self._check_updates(request.authority)
+        if rcode != Rcode.NOERROR:
+            reply.rcode = rcode
+            return reply
+
+        try:
+            with self.index.update() as txn:
+                for rr in request.authority:
+                    if rr.rclass == CLASS_ANY:
+                        if rr.rtype == RRType.ANY:
+                            txn.delete_name(rr.name)
+                        else:
+                            txn.delete_rrset(rr.name, rr.rtype)
+                    elif rr.rclass == CLASS_NONE:
+                        txn.delete_rr(rr.name, rr.rtype, rr.rdata)
+                    else:
+                        txn.add(rr.name, rr.rtype, rr.ttl, rr.rdata)
+        except (ValueError, DNSFormatError):
+            # The transaction is discarded whole; the zone is unchanged
+            reply.rcode = Rcode.SERVFAIL
+        return reply
+
+    def _check_prerequisites(self, prerequisites: List[ResourceRecord]) -> int:
+        required: Dict[Tuple[str, int], List[bytes]] = {}
+        for rr in prerequisites:
+            if not self.index.in_zone(rr.name):
+                return Rcode.NOTZONE
+            rrsets = self.index.rrsets(rr.name) or {}
+            if rr.rclass == CLASS_ANY:
+                if rr.ttl != 0 or rr.rdata:
+                    return Rcode.FORMERR
+                if rr.rtype == RRType.ANY:
+                    if not rrsets:
+                        return Rcode.NXDOMAIN
+                elif rr.rtype not in rrsets:
+                    return Rcode.NXRRSET
+            elif rr.rclass == CLASS_NONE:
+                if rr.ttl != 0 or rr.rdata:
+                    return Rcode.FORMERR
+                if rr.rtype == RRType.ANY:
+                    if rrsets:
+                        return Rcode.YXDOMAIN
+                elif rr.rtype in rrsets:
+                    return Rcode.YXRRSET
+            elif rr.rclass == CLASS_IN:
+                required.setdefault((rr.name.lower(), rr.rtype), []).append(rr.rdata)
+            else:
+                return Rcode.FORMERR
+        for (name, rtype), rdatas in required.items():
+            rrset = (self.index.rrsets(name) or {}).get(rtype)
+            if rrset is None or sorted(rrset.rdatas) != sorted(set(rdatas)):
+                return Rcode.NXRRSET
+        return Rcode.NOERROR
+
+    def _check_updates(self, updates: List[ResourceRecord]) -> int:
+        for rr in updates:
+            if not self.index.in_zone(rr.name):
+                return Rcode.NOTZONE
+            if rr.rclass == CLASS_IN:
+                if rr.rtype in (RRType.ANY, RRType.AXFR, RRType.IXFR, RRType.OPT):
+                    return Rcode.FORMERR
+                if not rdata_valid(rr.rtype, rr.rdata):
+                    return Rcode.FORMERR
+            elif rr.rclass == CLASS_ANY:
+                if rr.ttl != 0 or rr.rdata:
+                    return Rcode.FORMERR
+            elif rr.rclass == CLASS_NONE:
+                if rr.ttl != 0 or rr.rtype == RRType.ANY:
+                    return Rcode.FORMERR
+            else:
+                return Rcode.FORMERR
+        return Rcode.NOERROR
+
+
+# ========================================================================
+# COMMAND LINE
+# ========================================================================
+
+DEMO_REGISTRATIONS = [
+    ("ambient.120.experimental.music.tuple", "192.168.1.100", ["midi", "real-time", "generative"]),
+    ("jazz.140.4-4.bb-major.music.tuple", "192.168.1.101", ["midi", "live-recording", "improvisation"]),
+    ("coffee-maker.kitchen.floor-1.building-5.spatial.tuple", "192.168.1.50", ["brew", "schedule", "iot"]),
+]
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="TupleDNS authoritative server for the .tuple zone")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind (default: 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT,
+                        help=f"UDP/TCP port (default: {DEFAULT_PORT})")
+    parser.add_argument("--allow-update", action="append", metavar="CIDR",
+                        help="Network allowed to send dynamic updates (repeatable, default: loopback)")
+    parser.add_argument("--no-pattern-queries", action="store_true",
+                        help="Do not evaluate _q wildcard queries (clients fall back to AXFR)")
+    parser.add_argument("--max-views", type=int, default=DEFAULT_MAX_VIEWS, metavar="N",
+                        help=f"Standing pattern queries kept as views (default: {DEFAULT_MAX_VIEWS}, 0 disables)")
+    parser.add_argument("--log", metavar="PATH",
+                        help="Persist registrations to this append-only log and reload them on start")
+    parser.add_argument("--snapshot", metavar="PATH",
+                        help="Warm-start the zone from a snapshot written by tupledns_store.py")
+    parser.add_argument("--demo", action="store_true", help="Seed the zone with example registrations")
+    args = parser.parse_args(argv)
+
+    server = TupleDNSServer(host=args.host, port=args.port,
+                            allow_update=tuple(args.allow_update or ("127.0.0.0/8", "::1/128")),
+                            pattern_queries=not args.no_pattern_queries, max_views=args.max_views)
+    if args.snapshot:
+        from tupledns_store import Snapshot
+        with Snapshot(args.snapshot) as snapshot:
+            snapshot.load_into(server.index)
+    log = None
+    if args.log:
+        from tupledns_store import RegistrationLog
+        log = RegistrationLog(args.log)
+        log.load(server.index)
+    if args.demo:
+        for coordinate, address, capabilities in DEMO_REGISTRATIONS:
+            server.index.register(coordinate, [address], capabilities)
+    if args.snapshot or args.log:
+        # The loaded index lives as long as the process: keep the cycle collector off it
+        gc.freeze()
+    await server.start()
+    print(f"TupleDNS server authoritative for .{server.index.origin} on {server.host}:{server.port} "
+          f"({len(server.index)} registrations)")
+    try:
+        await server._tcp_server.serve_forever()
+    finally:
+        await server.stop()
+        if log is not None:
+            log.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
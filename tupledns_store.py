@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""
+TupleDNS Registry Storage
+
+Durable storage for the registry server's coordinate index. Every
+committed zone change is appended to a checksummed log; on startup the
+log is memory-mapped and the latest state of each name is installed
+directly into the index. Compaction rewrites the log with one record per
+live name. Snapshots are a compact, memory-mappable image of the whole
+coordinate set that both this module and the C library query in place.
+"""
+
+import argparse
+import gc
+import mmap
+import os
+import socket
+import struct
+import sys
+import zlib
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tupledns_server import (ChangeSet, CoordinateIndex, Node, RRset, RRType, address_rdata,
+                             txt_rdata)
+
+LOG_MAGIC = b"TDNSLOG\x01"
+
+OP_PUT = 1
+OP_DELETE = 2
+
+_RECORD_HEADER = struct.Struct('<II')   # payload length, crc32(payload)
+_ENTRY_HEADER = struct.Struct('<BIH')   # op, serial, name length
+_RRSET_HEADER = struct.Struct('<HIH')   # rtype, ttl, rdata count
+_RDATA_HEADER = struct.Struct('<H')     # rdata length
+
+
+class LogCorruptError(Exception):
+    """Raised when a registration log has an invalid header"""
+
+
+# ========================================================================
+# RECORD CODEC
+# ========================================================================
+
+def encode_entry(op: int, serial: int, name: str, rrsets: Optional[Dict[int, RRset]] = None) -> bytes:
+    """Encode one log record: the full rrsets of a name (PUT) or its removal (DELETE)"""
+    raw_name = name.encode('latin-1')
+    payload = bytearray(_ENTRY_HEADER.pack(op, serial, len(raw_name)))
+    payload += raw_name
+    if op == OP_PUT:
+        payload += struct.pack('<H', len(rrsets))
+        for rtype, rrset in rrsets.items():
+            payload += _RRSET_HEADER.pack(rtype, rrset.ttl, len(rrset.rdatas))
+            for rdata in rrset.rdatas:
+                payload += _RDATA_HEADER.pack(len(rdata))
+                payload += rdata
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_rrsets(buf, offset: int) -> Dict[int, RRset]:
+    """Decode the rrsets of a PUT payload starting at offset"""
+    (count,) = struct.unpack_from('<H', buf, offset)
+    offset += 2
+    rrsets: Dict[int, RRset] = {}
+    for _ in range(count):
+        rtype, ttl, rdata_count = _RRSET_HEADER.unpack_from(buf, offset)
+        offset += _RRSET_HEADER.size
+        rrset = rrsets[rtype] = RRset(ttl)
+        for _ in range(rdata_count):
+            (length,) = _RDATA_HEADER.unpack_from(buf, offset)
+            offset += _RDATA_HEADER.size
+            rrset.rdatas.append(bytes(buf[offset:offset + length]))
+            offset += length
+    return rrsets
+
+
+def scan_log(buf) -> Iterator[Tuple[int, int, int, str, int]]:
+    """Yield (record end, op, serial, name, rrset offset) for each valid record
+
+    Stops at the first torn or corrupt record; its offset is the end of
+    the usable log.
+    """
+    if bytes(buf[:len(LOG_MAGIC)]) != LOG_MAGIC:
+        raise LogCorruptError("Not a TupleDNS registration log")
+    offset = len(LOG_MAGIC)
+    end = len(buf)
+    while offset + _RECORD_HEADER.size <= end:
+        length, crc = _RECORD_HEADER.unpack_from(buf, offset)
+        start = offset + _RECORD_HEADER.size
+        if length < _ENTRY_HEADER.size or start + length > end:
+            return
+        payload = memoryview(buf)[start:start + length]
+        try:
+            if zlib.crc32(payload) != crc:
+                return
+            op, serial, name_len = _ENTRY_HEADER.unpack_from(payload, 0)
+            name = bytes(payload[_ENTRY_HEADER.size:_ENTRY_HEADER.size + name_len]).decode('latin-1')
+        finally:
+            payload.release()
+        offset = start + length
+        yield offset, op, serial, name, start + _ENTRY_HEADER.size + name_len
+
+
+# ========================================================================
+# REGISTRATION LOG
+# ========================================================================
+
+class RegistrationLog:
+    """Append-only, checksummed log of an index's committed changes"""
+
+    def __init__(self, path: str, sync: bool = False, compact_min_bytes: int = 1 << 20,
+                 compact_ratio: float = 2.0):
+        self.path = path
+        self.sync = sync
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self.index: Optional[CoordinateIndex] = None
+        self.records = 0
+        self._file = None
+        self._size = 0
+
+    # -- startup ---------------------------------------------------------
+
+    def load(self, index: CoordinateIndex) -> int:
+        """Rebuild index from the log and start recording its changes; returns names loaded"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, 'wb') as f:
+                f.write(LOG_MAGIC)
+        # The load allocates millions of acyclic objects; collecting during it only costs time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            loaded, records = self._load(index)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.records = records
+        self._attach(index)
+        return loaded
+
+    def _load(self, index: CoordinateIndex) -> Tuple[int, int]:
+        with open(self.path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                # Only the last record for each name matters; decode just those
+                latest: Dict[str, int] = {}
+                serial = index.serial
+                end = len(LOG_MAGIC)
+                records = 0
+                for end, op, serial, name, rrset_offset in scan_log(buf):
+                    if op == OP_PUT:
+                        latest[name] = rrset_offset
+                    else:
+                        latest.pop(name, None)
+                    records += 1
+                index.load(((name, decode_rrsets(buf, rrset_offset)) for name, rrset_offset in latest.items()),
+                           serial)
+                loaded = len(latest)
+            if end < size:
+                # Drop a torn tail left by a crash mid-append
+                f.truncate(end)
+                size = end
+        self._size = size
+        return loaded, records
+
+    def _attach(self, index: CoordinateIndex) -> None:
+        self.index = index
+        self._file = open(self.path, 'ab')
+        index.add_listener(self.record)
+
+    # -- appends ---------------------------------------------------------
+
+    def record(self, change: ChangeSet) -> None:
+        """Append the new state of every name touched by change"""
+        names = {rr.name for rr in change.deleted}
+        names.update(rr.name for rr in change.added)
+        for name in sorted(names):
+            rrsets = self.index.rrsets(name)
+            if rrsets:
+                self._append(encode_entry(OP_PUT, change.serial_to, name, rrsets))
+            else:
+                self._append(encode_entry(OP_DELETE, change.serial_to, name))
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        self.maybe_compact()
+
+    def _append(self, data: bytes) -> None:
+        self._file.write(data)
+        self._size += len(data)
+        self.records += 1
+
+    # -- compaction ------------------------------------------------------
+
+    def maybe_compact(self) -> bool:
+        """Compact once superseded records outweigh live ones"""
+        if self._size < self.compact_min_bytes:
+            return False
+        if self.records < self.compact_ratio * max(len(self.index), 1):
+            return False
+        self.compact()
+        return True
+
+    def compact(self) -> None:
+        """Rewrite the log with one PUT per live name, atomically replacing it"""
+        index = self.index
+        tmp_path = self.path + ".compact"
+        records = 0
+        with open(tmp_path, 'wb') as f:
+            f.write(LOG_MAGIC)
+            for name, rrsets in index.zone_rrsets():
+                f.write(encode_entry(OP_PUT, index.serial, name, rrsets))
+                records += 1
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'ab')
+        self._size = size
+        self.records = records
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# ========================================================================
+# SNAPSHOTS
+# ========================================================================
+#
+# Little-endian, every section 8-byte aligned:
+#   header     magic, version, section count, serial, node/label/cap counts,
+#              64-bit words per capability bitset
+#   sections   (offset, size) table followed by the sections below
+# Labels and capabilities are sorted string tables (offsets + bytes), so
+# readers binary-search them in place. Nodes are sorted by coordinate; each
+# is a row of label IDs (CSR), rows of packed IPv4/IPv6 addresses (CSR), a
+# capability bitset and a TTL. Aliases are stored resolved.
+
+SNAPSHOT_MAGIC = b"TDNSSNAP"
+SNAPSHOT_VERSION = 1
+
+(SECTION_LABEL_OFFSETS, SECTION_LABEL_DATA, SECTION_NODE_LABEL_OFFSETS, SECTION_NODE_LABELS,
+ SECTION_V4_OFFSETS, SECTION_V4_DATA, SECTION_V6_OFFSETS, SECTION_V6_DATA,
+ SECTION_CAP_OFFSETS, SECTION_CAP_DATA, SECTION_CAP_BITS, SECTION_TTLS) = range(12)
+SECTION_COUNT = 12
+
+_SNAPSHOT_HEADER = struct.Struct('<8sIIIIIII4x')
+_SECTION = struct.Struct('<QQ')
+
+
+class SnapshotFormatError(Exception):
+    """Raised when a snapshot file is malformed"""
+
+
+def _string_table(strings: List[str]) -> Tuple[bytes, bytes]:
+    offsets = array('I', [0])
+    data = bytearray()
+    for s in strings:
+        data += s.encode('utf-8')
+        offsets.append(len(data))
+    return _le(offsets), bytes(data)
+
+
+def _le(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_snapshot(index: CoordinateIndex, path: str) -> int:
+    """Write the index's nodes as a memory-mappable snapshot; returns the node count"""
+    nodes = [index.resolve(node) for node in sorted(index.nodes(), key=lambda n: n.coordinate)]
+    labels = sorted({label for node in nodes for label in node.coordinate.split('.')})
+    caps = sorted({cap for node in nodes for cap in node.capabilities})
+    label_ids = {label: i for i, label in enumerate(labels)}
+    cap_ids = {cap: i for i, cap in enumerate(caps)}
+    cap_words = (len(caps) + 63) // 64
+
+    row_offsets, row_labels = array('I', [0]), array('I')
+    v4_offsets, v6_offsets = array('I', [0]), array('I', [0])
+    v4_data, v6_data = bytearray(), bytearray()
+    cap_bits = array('Q', bytes(8 * cap_words * len(nodes)))
+    ttls = array('I')
+    for i, node in enumerate(nodes):
+        row_labels.extend(label_ids[label] for label in node.coordinate.split('.'))
+        row_offsets.append(len(row_labels))
+        for address in node.addresses:
+            if ':' in address:
+                v6_data += socket.inet_pton(socket.AF_INET6, address)
+            else:
+                v4_data += socket.inet_pton(socket.AF_INET, address)
+        v4_offsets.append(len(v4_data) // 4)
+        v6_offsets.append(len(v6_data) // 16)
+        for cap in node.capabilities:
+            bit = cap_ids[cap]
+            cap_bits[i * cap_words + bit // 64] |= 1 << (bit % 64)
+        ttls.append(node.ttl & 0xFFFFFFFF)
+
+    sections = [b''] * SECTION_COUNT
+    sections[SECTION_LABEL_OFFSETS], sections[SECTION_LABEL_DATA] = _string_table(labels)
+    sections[SECTION_NODE_LABEL_OFFSETS] = _le(row_offsets)
+    sections[SECTION_NODE_LABELS] = _le(row_labels)
+    sections[SECTION_V4_OFFSETS], sections[SECTION_V4_DATA] = _le(v4_offsets), bytes(v4_data)
+    sections[SECTION_V6_OFFSETS], sections[SECTION_V6_DATA] = _le(v6_offsets), bytes(v6_data)
+    sections[SECTION_CAP_OFFSETS], sections[SECTION_CAP_DATA] = _string_table(caps)
+    sections[SECTION_CAP_BITS] = _le(cap_bits)
+    sections[SECTION_TTLS] = _le(ttls)
+
+    header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SECTION_COUNT, index.serial,
+                                   len(nodes), len(labels), len(caps), cap_words)
+    offset = len(header) + _SECTION.size * SECTION_COUNT
+    table = bytearray()
+    for section in sections:
+        offset = (offset + 7) & ~7
+        table += _SECTION.pack(offset, len(section))
+        offset += len(section)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(table)
+        for section in sections:
+            f.write(bytes(-f.tell() % 8))
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(nodes)
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot queried in place"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views: List[memoryview] = []
+        try:
+            self._map_sections()
+        except (struct.error, TypeError, ValueError) as e:
+            self.close()
+            raise SnapshotFormatError(str(e)) from e
+
+    def _section(self, section: int, fmt: Optional[str] = None) -> memoryview:
+        view = self._sections[section]
+        if fmt is not None:
+            view = view.cast(fmt)
+            self._views.append(view)
+        return view
+
+    def _map_sections(self) -> None:
+        buf = self._mmap
+        (magic, version, section_count, self.serial, self.node_count, self.label_count,
+         self.cap_count, self.cap_words) = _SNAPSHOT_HEADER.unpack_from(buf, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or section_count < SECTION_COUNT:
+            raise ValueError("Not a TupleDNS snapshot")
+        if sys.byteorder == 'big':
+            raise ValueError("Snapshots are little-endian")
+        self._view = memoryview(buf)
+        self._views.append(self._view)
+        self._sections = []
+        for i in range(SECTION_COUNT):
+            offset, size = _SECTION.unpack_from(buf, _SNAPSHOT_HEADER.size + i * _SECTION.size)
+            if offset % 8 or offset + size > len(buf):
+                raise ValueError(f"Section {i} out of bounds")
+            self._sections.append(self._view[offset:offset + size])
+            self._views.append(self._sections[-1])
+        self._label_offsets = self._section(SECTION_LABEL_OFFSETS, 'I')
+        self._label_data = self._section(SECTION_LABEL_DATA)
+        self._row_offsets = self._section(SECTION_NODE_LABEL_OFFSETS, 'I')
+        self._row_labels = self._section(SECTION_NODE_LABELS, 'I')
+        self._v4_offsets = self._section(SECTION_V4_OFFSETS, 'I')
+        self._v4_data = self._section(SECTION_V4_DATA)
+        self._v6_offsets = self._section(SECTION_V6_OFFSETS, 'I')
+        self._v6_data = self._section(SECTION_V6_DATA)
+        self._cap_offsets = self._section(SECTION_CAP_OFFSETS, 'I')
+        self._cap_data = self._section(SECTION_CAP_DATA)
+        self._cap_bits = self._section(SECTION_CAP_BITS, 'Q')
+        self._ttls = self._section(SECTION_TTLS, 'I')
+        if (len(self._label_offsets) != self.label_count + 1 or len(self._row_offsets) != self.node_count + 1
+                or len(self._cap_offsets) != self.cap_count + 1 or len(self._ttls) != self.node_count
+                or len(self._cap_bits) != self.node_count * self.cap_words):
+            raise ValueError("Section sizes do not match header counts")
+
+    def close(self) -> None:
+        # Views must be released (newest first) before the mapping can close
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.node_count
+
+    # -- dictionaries ----------------------------------------------------
+
+    @staticmethod
+    def _search(offsets, data, key: bytes) -> int:
+        lo, hi = 0, len(offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = data[offsets[mid]:offsets[mid + 1]].tobytes()
+            if value < key:
+                lo = mid + 1
+            elif value > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def label_id(self, label: str) -> int:
+        """Return the ID of label, or -1 if no coordinate uses it"""
+        return self._search(self._label_offsets, self._label_data, label.lower().encode('utf-8'))
+
+    def label(self, label_id: int) -> str:
+        o = self._label_offsets
+        return self._label_data[o[label_id]:o[label_id + 1]].tobytes().decode('utf-8')
+
+    def capability_id(self, capability: str) -> int:
+        return self._search(self._cap_offsets, self._cap_data, capability.encode('utf-8'))
+
+    def capability(self, cap_id: int) -> str:
+        o = self._cap_offsets
+        return self._cap_data[o[cap_id]:o[cap_id + 1]].tobytes().decode('utf-8')
+
+    # -- nodes -----------------------------------------------------------
+
+    def coordinate(self, i: int) -> str:
+        labels = self._row_labels[self._row_offsets[i]:self._row_offsets[i + 1]]
+        return '.'.join(self.label(label_id) for label_id in labels)
+
+    def addresses(self, i: int) -> List[str]:
+        v4 = [socket.inet_ntop(socket.AF_INET, self._v4_data[4 * j:4 * j + 4])
+              for j in range(self._v4_offsets[i], self._v4_offsets[i + 1])]
+        v6 = [socket.inet_ntop(socket.AF_INET6, self._v6_data[16 * j:16 * j + 16])
+              for j in range(self._v6_offsets[i], self._v6_offsets[i + 1])]
+        return v4 + v6
+
+    def capabilities(self, i: int) -> List[str]:
+        caps = []
+        base = i * self.cap_words
+        for word in range(self.cap_words):
+            bits = self._cap_bits[base + word]
+            while bits:
+                low = bits & -bits
+                caps.append(self.capability(word * 64 + low.bit_length() - 1))
+                bits ^= low
+        return caps
+
+    def node(self, i: int) -> Node:
+        return Node(self.coordinate(i), self.addresses(i), self.capabilities(i), self._ttls[i])
+
+    def nodes(self) -> Iterator[Node]:
+        return (self.node(i) for i in range(self.node_count))
+
+    def find(self, pattern: str, capabilities: Optional[List[str]] = None) -> List[Node]:
+        """Match a wildcard pattern (and required capabilities) against the snapshot"""
+        literals = []
+        labels = pattern.lower().split('.')
+        for position, label in enumerate(labels):
+            if label != '*':
+                label_id = self.label_id(label)
+                if label_id < 0:
+                    return []
+                literals.append((position, label_id))
+        required = []
+        for cap in capabilities or ():
+            cap_id = self.capability_id(cap)
+            if cap_id < 0:
+                return []
+            required.append((cap_id // 64, 1 << (cap_id % 64)))
+
+        rows, row_labels, bits, words = self._row_offsets, self._row_labels, self._cap_bits, self.cap_words
+        matches = []
+        for i in range(self.node_count):
+            start = rows[i]
+            if rows[i + 1] - start != len(labels):
+                continue
+            if any(row_labels[start + position] != label_id for position, label_id in literals):
+                continue
+            if any(not bits[i * words + word] & mask for word, mask in required):
+                continue
+            matches.append(self.node(i))
+        return matches
+
+    def load_into(self, index: CoordinateIndex) -> int:
+        """Warm-start an index from the snapshot; returns the node count"""
+        index.load((_node_rrsets(node) for node in self.nodes()), self.serial)
+        return self.node_count
+
+
+def _node_rrsets(node: Node) -> Tuple[str, Dict[int, RRset]]:
+    rrsets: Dict[int, RRset] = {}
+    for address in node.addresses:
+        rtype, rdata = address_rdata(address)
+        rrsets.setdefault(rtype, RRset(node.ttl)).rdatas.append(rdata)
+    if node.capabilities:
+        rrsets[RRType.TXT] = RRset(node.ttl)
+        rrsets[RRType.TXT].rdatas.append(txt_rdata("caps=" + ",".join(node.capabilities)))
+    return node.coordinate, rrsets
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="TupleDNS registry storage tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    snapshot = commands.add_parser("snapshot", help="Write a snapshot of a registration log")
+    snapshot.add_argument("log", help="Registration log to read")
+    snapshot.add_argument("output", help="Snapshot file to write")
+    compact = commands.add_parser("compact", help="Compact a registration log in place")
+    compact.add_argument("log", help="Registration log to compact")
+    args = parser.parse_args(argv)
+
+    index = CoordinateIndex()
+    log = RegistrationLog(args.log)
+    log.load(index)
+    try:
+        if args.command == "snapshot":
+            count = write_snapshot(index, args.output)
+            print(f"Wrote {count} nodes at serial {index.serial} to {args.output}")
+        else:
+            log.compact()
+            print(f"Compacted {args.log} to {log.records} records")
+    finally:
+        log.close()
+
+
+if __name__ == "__main__":
+    main()